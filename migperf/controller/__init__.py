@@ -3,6 +3,19 @@ Author: Li Yuanming
 Email: yuanmingleee@gmail.com
 Date: Feb 13, 2022
 """
-from .mig_controller import MIGController
+from .async_mig_controller import AsyncMIGController
+from .backend import (
+    FakeBackend, MIGBackend, NVMLBackend, NvidiaSMIBackend, SimulatedNvidiaSMIBackend, get_default_backend,
+    set_default_backend,
+)
+from .events import EventRecorder, add_event_hook, remove_event_hook
+from .layout import GPUInstanceSpec, MIGLayout
+from .mig_controller import MIGController, MIGTransaction
+from .planner import PlacementPlan, plan_placement
+from .simulator import MIGSimulator
 
-__all__ = ['MIGController']
+__all__ = [
+    'AsyncMIGController', 'EventRecorder', 'FakeBackend', 'GPUInstanceSpec', 'MIGBackend', 'MIGController', 'MIGLayout',
+    'MIGSimulator', 'MIGTransaction', 'NVMLBackend', 'NvidiaSMIBackend', 'PlacementPlan', 'SimulatedNvidiaSMIBackend',
+    'add_event_hook', 'get_default_backend', 'plan_placement', 'remove_event_hook', 'set_default_backend',
+]
@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Asyncio-native MIG controller. The :code:`nvidia-smi` commands run as asyncio subprocesses, so that an event
+loop (e.g., the Sanic server, DCGM collection, load generation) is never blocked by the reconfiguration.
+"""
+import asyncio
+import functools
+import subprocess
+from typing import Dict, List, Optional, Union
+
+from .backend import MIGBackend, NvidiaSMIBackend, get_default_backend
+from .events import timed_command
+from .inventory import get_device_inventory
+from .layout import MIGLayout
+from .mig_controller import MIGController, instrumented, mutating
+from .planner import build_profile_placements
+
+
+async def run_command(
+        cmd: List[str], input: bytes = None, env: dict = None, timeout: Optional[float] = None,
+        capture_output: bool = True,
+):
+    """Execute a command in a subprocess without blocking the event loop.
+
+    The subprocess is killed if the command times out, or if the awaiting task is cancelled. A :code:`command`
+    event is emitted, see :mod:`migperf.controller.events`.
+
+    Args:
+        cmd (list of str): The command.
+        input (bytes, optional): Data sent to the stdin of the subprocess.
+        env (dict, optional): Environment variables of the subprocess. Default to inherit the current ones.
+        timeout (float, optional): Timeout in seconds. Default to wait forever.
+        capture_output (bool, optional): Capture the stdout. Otherwise, it is discarded. Default to `True`.
+    Returns:
+        tuple: The exit code and the output of the command.
+    Raises:
+        asyncio.TimeoutError: If the command does not finish within :code:`timeout`.
+    """
+    with timed_command(cmd) as event:
+        p = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE if capture_output else subprocess.DEVNULL,
+            env=env,
+        )
+        try:
+            output, _ = await asyncio.wait_for(p.communicate(input), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            if p.returncode is None:
+                p.kill()
+                await p.wait()
+            raise
+        event['exit_code'] = p.returncode
+    return p.returncode, (output or b'').decode('utf-8')
+
+
+class AsyncMIGController(object):
+    """Asyncio-native MIG controller. The coroutines have the same arguments and return the same records as
+    their counterparts in :class:`MIGController`.
+
+    The operations that the backend executes with :code:`nvidia-smi` are run as asyncio subprocesses, using the
+    command builders and output parsers of :class:`NvidiaSMIBackend`. The other operations (e.g., the in-process
+    queries of :class:`NVMLBackend`, or any operation of :class:`FakeBackend`) are run in the default executor.
+    The profile tables are served by the device inventory shared with the synchronous controllers, which caches
+    them per GPU model, and loads them in the default executor on a miss.
+
+    Args:
+        backend (MIGBackend, optional): The backend to query and configure the GPU devices. Default to the
+            shared backend given by :func:`get_default_backend`.
+        timeout (float, optional): Timeout in seconds of every :code:`nvidia-smi` command. :code:`None` to wait
+            forever. Default to 60.
+
+    Examples:
+        >>> mig_controller = AsyncMIGController()
+        >>> await mig_controller.reconcile(0, '2x2g.20gb,3g.40gb')
+    """
+
+    def __init__(self, backend: MIGBackend = None, timeout: Optional[float] = 60.):
+        self.backend = backend or get_default_backend()
+        self.timeout = timeout
+        self.inventory = get_device_inventory(self.backend)
+        # no transactions on the asyncio controller, see :meth:`MIGController.transaction`
+        self._transactions = list()
+        self._gpu_locks: Dict[int, asyncio.Lock] = dict()
+
+    def _runs_command(self, method: str):
+        """Whether the backend operation is the plain :code:`nvidia-smi` implementation."""
+        backend_cls = type(self.backend)
+        return (
+            isinstance(self.backend, NvidiaSMIBackend) and backend_cls.run is NvidiaSMIBackend.run
+            and getattr(backend_cls, method) is getattr(NvidiaSMIBackend, method)
+        )
+
+    async def _run(self, cmd: List[str]):
+        return await run_command(cmd, timeout=self.timeout)
+
+    async def _in_executor(self, method: str, *args, target=None):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(getattr(target or self.backend, method), *args))
+
+    @mutating
+    async def enable_mig(self, gpu_id: int = None):
+        """sudo nvidia-smi -i ${gpu_id} -mig 1"""
+        if not self._runs_command('enable_mig'):
+            return await self._in_executor('enable_mig', gpu_id)
+        return (await self._run(self.backend.enable_mig_command(gpu_id)))[0]
+
+    @mutating
+    async def disable_mig(self, gpu_id: int = None):
+        """sudo nvidia-smi -i ${gpu_id} -mig 0"""
+        if not self._runs_command('disable_mig'):
+            return await self._in_executor('disable_mig', gpu_id)
+        return (await self._run(self.backend.disable_mig_command(gpu_id)))[0]
+
+    @instrumented
+    async def check_mig_status(self, gpu_id: int = None):
+        """nvidia-smi --query-gpu=mig.mode.current,mig.mode.pending --format=csv,noheader"""
+        if not self._runs_command('check_mig_status'):
+            return await self._in_executor('check_mig_status', gpu_id)
+        _, output = await self._run(self.backend.check_mig_status_command())
+        return self.backend.parse_mig_status(output, gpu_id)
+
+    @mutating
+    async def create_gpu_instance(
+            self, gi_profiles: Union[str, List[str]], gpu_id: int = None, create_ci: bool = False
+    ):
+        """sudo nvidia-smi mig -i ${gpu_id} -cgi ${gi_profiles}, see :meth:`MIGController.create_gpu_instance`."""
+        if isinstance(gi_profiles, list):
+            gi_profiles = ','.join(gi_profiles)
+        if not self._runs_command('create_gpu_instance'):
+            return await self._in_executor('create_gpu_instance', gi_profiles, gpu_id, create_ci)
+        cmd = self.backend.create_gpu_instance_command(gi_profiles, gpu_id, create_ci)
+        return self.backend.parse_create_gpu_instance((await self._run(cmd))[1], cmd)
+
+    @mutating
+    async def create_compute_instance(
+            self, ci_profiles: Union[str, List[str]] = None, gpu_id: int = None, gi_id: Union[int, List[int]] = None
+    ):
+        """sudo nvidia-smi mig -i ${gpu_id} -gi ${gi_id} -cci ${ci_profiles}, see
+        :meth:`MIGController.create_compute_instance`.
+        """
+        if isinstance(ci_profiles, list):
+            ci_profiles = ','.join(ci_profiles)
+        if isinstance(gi_id, list):
+            gi_id = ','.join(map(str, gi_id))
+        if not self._runs_command('create_compute_instance'):
+            return await self._in_executor('create_compute_instance', ci_profiles, gpu_id, gi_id)
+        cmd = self.backend.create_compute_instance_command(ci_profiles, gpu_id, gi_id)
+        return self.backend.parse_create_compute_instance((await self._run(cmd))[1], cmd)
+
+    @instrumented
+    async def check_gpu_instance_status(self, gpu_id: int = None):
+        """sudo nvidia-smi mig -lgi -i ${gpu_id}"""
+        if not self._runs_command('check_gpu_instance_status'):
+            return await self._in_executor('check_gpu_instance_status', gpu_id)
+        _, output = await self._run(self.backend.check_gpu_instance_status_command(gpu_id))
+        return self.backend.parse_gpu_instance_status(output)
+
+    @instrumented
+    async def check_compute_instance_status(self, gpu_id: int = None, gi_id: int = None):
+        """sudo nvidia-smi mig -lci -i ${gpu_id} -gi ${gi_id}"""
+        if not self._runs_command('check_compute_instance_status'):
+            return await self._in_executor('check_compute_instance_status', gpu_id, gi_id)
+        _, output = await self._run(self.backend.check_compute_instance_status_command(gpu_id, gi_id))
+        return self.backend.parse_compute_instance_status(output)
+
+    @mutating
+    async def destroy_gpu_instance(self, gpu_id: int = None, gi_ids: Union[int, List[int]] = None):
+        """sudo nvidia-smi mig -dgi -gi ${gi_id} -i ${gpu_id}"""
+        if isinstance(gi_ids, list):
+            gi_ids = ','.join(map(str, gi_ids))
+        if not self._runs_command('destroy_gpu_instance'):
+            return await self._in_executor('destroy_gpu_instance', gpu_id, gi_ids)
+        return (await self._run(self.backend.destroy_gpu_instance_command(gpu_id, gi_ids)))[0]
+
+    @mutating
+    async def destroy_compute_instance(
+            self, gpu_id: int = None, gi_id: Union[int, List[int]] = None, ci_ids: Union[int, List[int]] = None
+    ):
+        """sudo nvidia-smi mig -dci -gi ${gi_id} -ci ${ci_ids} -i ${gpu_id}"""
+        if isinstance(ci_ids, list):
+            ci_ids = ','.join(map(str, ci_ids))
+        if isinstance(gi_id, list):
+            gi_id = ','.join(map(str, gi_id))
+        if not self._runs_command('destroy_compute_instance'):
+            return await self._in_executor('destroy_compute_instance', gpu_id, gi_id, ci_ids)
+        return (await self._run(self.backend.destroy_compute_instance_command(gpu_id, gi_id, ci_ids)))[0]
+
+    @instrumented
+    async def list_gpu_instance_profiles(self, gpu_id: int = None):
+        """sudo nvidia-smi mig -lgip -i ${gpu_id}, see :meth:`MIGController.list_gpu_instance_profiles`."""
+        return await self._in_executor('gpu_instance_profiles', gpu_id, target=self.inventory)
+
+    @instrumented
+    async def list_gpu_instance_possible_placements(self, gpu_id: int = None):
+        """sudo nvidia-smi mig -lgipp -i ${gpu_id}, see :meth:`MIGController.list_gpu_instance_possible_placements`.
+        """
+        return await self._in_executor('gpu_instance_possible_placements', gpu_id, target=self.inventory)
+
+    @instrumented
+    async def list_compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None):
+        """sudo nvidia-smi mig -lcip -i ${gpu_id} -gi ${gi_id}, see
+        :meth:`MIGController.list_compute_instance_profiles`.
+        """
+        return await self._in_executor('compute_instance_profiles', gpu_id, gi_id, target=self.inventory)
+
+    @instrumented
+    async def list_devices(self):
+        """List GPUs and their MIG devices, see :meth:`MIGBackend.list_devices`."""
+        if not self._runs_command('list_devices'):
+            return await self._in_executor('list_devices')
+        device_list_cmd, device_table_cmd = self.backend.list_devices_commands()
+        (_, device_list_output), (_, device_table_output) = await asyncio.gather(
+            self._run(device_list_cmd), self._run(device_table_cmd),
+        )
+        return self.backend.parse_devices(device_list_output, device_table_output)
+
+    async def _get_profile_placements_or_none(self, gpu_id: int):
+        try:
+            gi_profiles, gi_placements = await asyncio.gather(
+                self.list_gpu_instance_profiles(gpu_id), self.list_gpu_instance_possible_placements(gpu_id),
+            )
+        except NotImplementedError:
+            # the backend cannot list the placement rules, leave the placement to the driver
+            return None
+        return build_profile_placements(gi_profiles, gi_placements)
+
+    def _gpu_lock(self, gpu_id: int):
+        # created lazily, so that the lock is bound to the running event loop
+        if gpu_id not in self._gpu_locks:
+            self._gpu_locks[gpu_id] = asyncio.Lock()
+        return self._gpu_locks[gpu_id]
+
+    async def reconcile(self, gpu_id: int, layout: Union[MIGLayout, str, List[str]], dry_run: bool = False):
+        """Bring the MIG partition of a GPU to the desired layout, see :meth:`MIGController.reconcile`.
+        Concurrent reconciliations of the same GPU are serialized, those of different GPUs run concurrently.
+        """
+        layout = MIGController._to_layout(layout)
+        async with self._gpu_lock(gpu_id):
+            return await self._run_steps(MIGController._reconcile_steps(gpu_id, layout, dry_run))
+
+    async def _run_steps(self, steps):
+        """Drive a generator of controller calls (see :meth:`MIGController._reconcile_steps`), awaiting the calls
+        of each step concurrently.
+        """
+        results = None
+        while True:
+            try:
+                calls = steps.send(results)
+            except StopIteration as stop:
+                return stop.value
+            results = await asyncio.gather(*(getattr(self, method)(**kwargs) for method, kwargs in calls))
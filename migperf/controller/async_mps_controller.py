@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Asyncio-native MPS wrapper to enable and disable MPS, see :mod:`migperf.controller.mps_controller`.
+"""
+from typing import List, Optional, Union
+
+from .async_mig_controller import run_command
+from .events import timed
+from .mps_controller import _mps_gpu_id, mps_env
+
+
+async def enable_mps(gpu_ids: Union[int, List[int]] = None, timeout: Optional[float] = 60.):
+    """nvidia-cuda-mps-control -d
+
+    Raises:
+        asyncio.TimeoutError: If the command does not finish within :code:`timeout` seconds.
+    """
+    with timed('operation', 'enable_mps', gpu_id=_mps_gpu_id(gpu_ids), arguments={'gpu_ids': gpu_ids}):
+        await run_command(
+            ['nvidia-cuda-mps-control', '-d'], env=mps_env(gpu_ids), timeout=timeout, capture_output=False,
+        )
+    return True
+
+
+async def check_mps_status(timeout: Optional[float] = 60.):
+    """pidof nvidia-cuda-mps-control"""
+    with timed('operation', 'check_mps_status', arguments={}):
+        return_code, _ = await run_command(
+            ['pidof', 'nvidia-cuda-mps-control'], timeout=timeout, capture_output=False,
+        )
+    return return_code == 0
+
+
+async def disable_mps(gpu_ids: Union[int, List[int]] = None, timeout: Optional[float] = 60.):
+    """echo quit | nvidia-cuda-mps-control
+
+    Raises:
+        asyncio.TimeoutError: If the command does not finish within :code:`timeout` seconds.
+    """
+    with timed('operation', 'disable_mps', gpu_id=_mps_gpu_id(gpu_ids), arguments={'gpu_ids': gpu_ids}):
+        await run_command(
+            ['nvidia-cuda-mps-control'], input=b'quit', env=mps_env(gpu_ids), timeout=timeout, capture_output=False,
+        )
+    return True
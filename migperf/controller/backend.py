@@ -0,0 +1,822 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Backends used by :class:`MIGController` to query and configure MIG-enabled GPU devices.
+
+- :class:`NvidiaSMIBackend`: executes :code:`nvidia-smi` and parses its output.
+- :class:`NVMLBackend`: queries devices in-process through NVML (:code:`pynvml`), falls back to
+  :code:`nvidia-smi` for the mutating operations and for the queries NVML refuses.
+- :class:`FakeBackend`: in-memory GPUs for tests.
+"""
+import functools
+import math
+import os
+import re
+import subprocess
+import time
+from ctypes import byref, c_uint
+from threading import RLock
+from typing import Dict, List, Optional, Union
+
+from .events import timed_command
+from .simulator import MIGSimulator, SimulatorError, get_gpu_model
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+class MIGBackend(object):
+    """Interface of MIG backends. The returned records have the same structure as documented in
+    :class:`MIGController`.
+    """
+    name = None
+
+    def enable_mig(self, gpu_id: int = None) -> int:
+        raise NotImplementedError()
+
+    def disable_mig(self, gpu_id: int = None) -> int:
+        raise NotImplementedError()
+
+    def check_mig_status(self, gpu_id: int = None):
+        raise NotImplementedError()
+
+    def create_gpu_instance(self, gi_profiles: str, gpu_id: int = None, create_ci: bool = False) -> List[dict]:
+        raise NotImplementedError()
+
+    def create_compute_instance(self, ci_profiles: str = None, gpu_id: int = None, gi_id: str = None) -> List[dict]:
+        raise NotImplementedError()
+
+    def check_gpu_instance_status(self, gpu_id: int = None) -> List[dict]:
+        raise NotImplementedError()
+
+    def check_compute_instance_status(self, gpu_id: int = None, gi_id: int = None) -> List[dict]:
+        raise NotImplementedError()
+
+    def destroy_gpu_instance(self, gpu_id: int = None, gi_ids: str = None) -> int:
+        raise NotImplementedError()
+
+    def destroy_compute_instance(self, gpu_id: int = None, gi_id: str = None, ci_ids: str = None) -> int:
+        raise NotImplementedError()
+
+    def list_gpu_instance_profiles(self, gpu_id: int = None) -> List[dict]:
+        """List the GPU instance profiles supported by the GPUs.
+
+        Returns: list of dict.
+            Example: [{'gpu_id': 0, 'name': 'MIG 1g.10gb', 'profile_id': 19, 'instances_free': 7,
+                'instances_total': 7, 'memory_gib': 9.5, 'p2p': False, 'sm': 14, 'dec': 0, 'enc': 0, 'ce': 1,
+                'jpeg': 0, 'ofa': 0}]
+        """
+        raise NotImplementedError()
+
+    def list_gpu_instance_possible_placements(self, gpu_id: int = None) -> List[dict]:
+        """List the possible placements of every GPU instance profile.
+
+        Returns: list of dict.
+            Example: [{'gpu_id': 0, 'profile_id': 14, 'placements': [{'start': 0, 'size': 2},
+                {'start': 2, 'size': 2}, {'start': 4, 'size': 2}]}]
+        """
+        raise NotImplementedError()
+
+    def list_compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None) -> List[dict]:
+        """List the compute instance profiles supported by the GPU instances.
+
+        Returns: list of dict.
+            Example: [{'gpu_id': 0, 'gi_id': 1, 'name': 'MIG 1c.3g.40gb', 'profile_id': 0, 'default': False,
+                'instances_free': 3, 'instances_total': 3, 'sm': 14, 'dec': 2, 'enc': 0, 'ofa': 0, 'ce': 3,
+                'jpeg': 0}]
+        """
+        raise NotImplementedError()
+
+    def list_devices(self) -> List[dict]:
+        """List GPUs and their MIG devices.
+
+        Returns: list of dict.
+            Example: [{'gpu_id': 0, 'name': 'NVIDIA A30', 'uuid': 'GPU-bd8c3d28-...', 'mig_devices': [
+                {'gpu_id': 0, 'mig_device_id': 0, 'gi_id': 1, 'ci_id': 0, 'name': 'MIG 2g.12gb',
+                 'uuid': 'MIG-6dd9381e-...'}]}]
+        """
+        raise NotImplementedError()
+
+
+class NvidiaSMIBackend(MIGBackend):
+    """Backend executing :code:`nvidia-smi` commands. Each operation is split into a command builder
+    (:code:`*_command`) and an output parser (:code:`parse_*`) so that they can be shared with other executors.
+
+    Args:
+        executable (str, optional): The :code:`nvidia-smi` executable. Default to :code:`nvidia-smi`.
+        sudo (bool, optional): Prefix the privileged commands with :code:`sudo`. Default to `True`.
+    """
+    name = 'nvidia-smi'
+
+    CREATE_GI_PATTERN = re.compile(r'.+GPU instance ID\s+(\d+).+\s+(\d+).+(MIG\s+\d+g\.\d+gb(?:\+me)?)\s+\(ID\s+(\d+)')
+    CREATE_CI_PATTERN = re.compile(
+        r'.+compute instance ID\s+(\d+).+\s(\d+).+\s(\d+).+'
+        r'(MIG\s+\d+g\.\d+gb(?:\+me)?|MIG\s+\d+c\.\d+g\.\d+gb)\s+\(ID\s+(\d+)'
+    )
+    GI_STATUS_PATTERN = re.compile(r'\|\s+(\d+)\s+(MIG\s+\d+g\.\d+gb(?:\+me)?)\s+(\d+)\s+(\d+)\s+(\d+)\:(\d+)')
+    CI_STATUS_PATTERN = re.compile(
+        r'\|\s+(\d+)\s+(\d+)\s+(MIG\s+\d+g\.\d+gb(?:\+me)?|MIG\s+\d+c\.\d+g\.\d+gb)\s+(\d+)\s+(\d+)\s+(\d+)\:(\d+)'
+    )
+    # E.g.: |   0  MIG 1g.10gb       19     7/7        9.50       No     14     0     0   |
+    #       |                                                             1     0     0   |
+    GI_PROFILE_PATTERN = re.compile(
+        r'\|\s+(\d+)\s+(MIG\s+\S+)\s+(\d+)\s+(\d+)/(\d+)\s+([\d.]+)\s+(\w+)\s+(\d+)\s+(\d+)\s+(\d+)\s+\|'
+    )
+    GI_PROFILE_EXTRA_PATTERN = re.compile(r'\|\s+(\d+)\s+(\d+)\s+(\d+)\s+\|')
+    # E.g.: GPU  0 Profile ID 19 Placements: {0,1,2,3,4,5,6}:1
+    GI_PLACEMENT_PATTERN = re.compile(r'GPU\s+(\d+)\s+Profile ID\s+(\d+)\s+Placements?\s*:\s*\{([\d,\s]*)\}:(\d+)')
+    # E.g.: |   0      1       MIG 1c.3g.40gb       0      3/3           14        2     0     0   |
+    #       |                                                                      3     0          |
+    CI_PROFILE_PATTERN = re.compile(
+        r'\|\s+(\d+)\s+(\d+)\s+(MIG\s+\S+)\s+(\d+)(\*?)\s+(\d+)/(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+\|'
+    )
+    CI_PROFILE_EXTRA_PATTERN = re.compile(r'\|\s+(\d+)\s+(\d+)\s+\|')
+    # E.g.: GPU 0: NVIDIA A30 (UUID: GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f)
+    GPU_LIST_PATTERN = re.compile(r'GPU\s+(\d+):\s+(.+?)\s+\(UUID:\s+(\S+)\)')
+    # E.g.:   MIG 1g.6gb      Device  1: (UUID: MIG-6dd9381e-80bd-5581-9702-563ef12adf3a)
+    MIG_DEVICE_LIST_PATTERN = re.compile(r'\s+(MIG\s+\S+)\s+Device\s+(\d+):\s+\(UUID:\s+(\S+)\)')
+    # E.g.: |  0    1   0   0  |      6MiB / 40192MiB | 42      0 |  3   0    2    0    0 |
+    MIG_DEVICE_TABLE_PATTERN = re.compile(r'\|\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+\|')
+
+    def __init__(self, executable: str = 'nvidia-smi', sudo: bool = True):
+        self.executable = executable
+        self.sudo = sudo
+
+    def _command(self, *args, privileged: bool = False):
+        cmd = [self.executable, *args]
+        if privileged and self.sudo:
+            cmd.insert(0, 'sudo')
+        return cmd
+
+    def run(self, cmd: List[str]):
+        """Execute a command and return its exit code and output. A :code:`command` event is emitted."""
+        with timed_command(cmd) as event:
+            p = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf-8')
+            output, _ = p.communicate()
+            event['exit_code'] = p.returncode
+        return p.returncode, output
+
+    def enable_mig_command(self, gpu_id: int = None):
+        cmd = self._command('-mig', '1', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    def enable_mig(self, gpu_id: int = None):
+        return self.run(self.enable_mig_command(gpu_id))[0]
+
+    def disable_mig_command(self, gpu_id: int = None):
+        cmd = self._command('-mig', '0', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    def disable_mig(self, gpu_id: int = None):
+        return self.run(self.disable_mig_command(gpu_id))[0]
+
+    def check_mig_status_command(self):
+        return self._command('--query-gpu=mig.mode.current,mig.mode.pending', '--format=csv,noheader')
+
+    @staticmethod
+    def parse_mig_status(output: str, gpu_id: int = None):
+        mig_status_list = list()
+        for line in output.splitlines():
+            current_state, pending_state = line.split(', ')
+            current_state, pending_state = (
+                current_state == 'Enabled'), (pending_state == 'Enabled')
+            mig_status_list.append((current_state, pending_state))
+        # select the intereted GPU ID
+        if gpu_id is not None:
+            return mig_status_list[gpu_id]
+        else:
+            return mig_status_list
+
+    def check_mig_status(self, gpu_id: int = None):
+        return self.parse_mig_status(self.run(self.check_mig_status_command())[1], gpu_id)
+
+    def create_gpu_instance_command(self, gi_profiles: str, gpu_id: int = None, create_ci: bool = False):
+        cmd = self._command('mig', '-i', str(gpu_id), '-cgi', gi_profiles, privileged=True)
+        if create_ci:
+            # Also create the corresponding compute Instances (CI)
+            cmd.append('-C')
+        return cmd
+
+    @classmethod
+    def parse_create_gpu_instance(cls, output: str, cmd: List[str]):
+        # Check if there are something failed
+        if 'Failed' in output or 'No' in output:
+            raise ValueError(
+                f'Failed to create GPU instance when executing the command: {" ".join(cmd)}\n'
+                f'{output}'
+            )
+
+        gi_status_list = list()
+        for line in output.splitlines():
+            match_groups = cls.CREATE_GI_PATTERN.match(line)
+            if match_groups is not None:
+                gi_id, g_id, name, profile_id = match_groups.groups()
+                gi_status_list.append({
+                    'gpu_id': int(g_id), 'name': name, 'profile_id': int(profile_id), 'gi_id': int(gi_id),
+                })
+
+        return gi_status_list
+
+    def create_gpu_instance(self, gi_profiles: str, gpu_id: int = None, create_ci: bool = False):
+        cmd = self.create_gpu_instance_command(gi_profiles, gpu_id, create_ci)
+        return self.parse_create_gpu_instance(self.run(cmd)[1], cmd)
+
+    def create_compute_instance_command(self, ci_profiles: str = None, gpu_id: int = None, gi_id: str = None):
+        cmd = self._command('mig', '-cci', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        if gi_id is not None:
+            cmd.extend(['-gi', str(gi_id)])
+        if ci_profiles is not None:
+            cmd.append(ci_profiles)
+        return cmd
+
+    @classmethod
+    def parse_create_compute_instance(cls, output: str, cmd: List[str]):
+        # Check if there are something failed
+        if 'Failed' in output or 'No' in output:
+            raise ValueError(
+                f'Failed to create compute instance when executing the command: {" ".join(cmd)}\n'
+                f'{output}'
+            )
+
+        ci_status_list = list()
+        for line in output.splitlines():
+            match_groups = cls.CREATE_CI_PATTERN.match(line)
+            if match_groups is not None:
+                ci_id, g_id, gi_id, name, profile_id = match_groups.groups()
+                ci_status_list.append({
+                    'gpu_id': int(g_id), 'gi_id': int(gi_id), 'name': name, 'ci_id': int(ci_id),
+                    'profile_id': int(profile_id),
+                })
+
+        return ci_status_list
+
+    def create_compute_instance(self, ci_profiles: str = None, gpu_id: int = None, gi_id: str = None):
+        cmd = self.create_compute_instance_command(ci_profiles, gpu_id, gi_id)
+        return self.parse_create_compute_instance(self.run(cmd)[1], cmd)
+
+    def check_gpu_instance_status_command(self, gpu_id: int = None):
+        cmd = self._command('mig', '-lgi', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    @classmethod
+    def parse_gpu_instance_status(cls, output: str):
+        gi_status_list = list()
+        for line in output.splitlines():
+            match_groups = cls.GI_STATUS_PATTERN.match(line)
+            if match_groups:
+                g_id, name, profile_id, gi_id, placement_start, placement_size = match_groups.groups()
+                gi_status_list.append({
+                    'gpu_id': int(g_id), 'name': name, 'profile_id': int(profile_id), 'gi_id': int(gi_id),
+                    'placement': {'start': int(placement_start), 'size': int(placement_size)}
+                })
+
+        return gi_status_list
+
+    def check_gpu_instance_status(self, gpu_id: int = None):
+        return self.parse_gpu_instance_status(self.run(self.check_gpu_instance_status_command(gpu_id))[1])
+
+    def check_compute_instance_status_command(self, gpu_id: int = None, gi_id: int = None):
+        cmd = self._command('mig', '-lci', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        if gi_id is not None:
+            cmd.extend(['-gi', str(gi_id)])
+        return cmd
+
+    @classmethod
+    def parse_compute_instance_status(cls, output: str):
+        ci_status_list = list()
+        for line in output.splitlines():
+            match_groups = cls.CI_STATUS_PATTERN.match(line)
+            if match_groups:
+                g_id, gi_id, name, profile_id, ci_id, placement_start, placement_size = match_groups.groups()
+                ci_status_list.append({
+                    'gpu_id': int(g_id), 'gi_id': int(gi_id), 'name': name, 'profile_id': int(profile_id),
+                    'ci_id': int(ci_id), 'placement': {'start': int(placement_start), 'size': int(placement_size)}
+                })
+        return ci_status_list
+
+    def check_compute_instance_status(self, gpu_id: int = None, gi_id: int = None):
+        cmd = self.check_compute_instance_status_command(gpu_id, gi_id)
+        return self.parse_compute_instance_status(self.run(cmd)[1])
+
+    def destroy_gpu_instance_command(self, gpu_id: int = None, gi_ids: str = None):
+        cmd = self._command('mig', '-dgi', privileged=True)
+        if gi_ids is not None:
+            cmd.extend(['-gi', str(gi_ids)])
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    def destroy_gpu_instance(self, gpu_id: int = None, gi_ids: str = None):
+        return self.run(self.destroy_gpu_instance_command(gpu_id, gi_ids))[0]
+
+    def destroy_compute_instance_command(self, gpu_id: int = None, gi_id: str = None, ci_ids: str = None):
+        cmd = self._command('mig', '-dci', privileged=True)
+        if ci_ids is not None:
+            cmd.extend(['-ci', str(ci_ids)])
+        if gi_id is not None:
+            cmd.extend(['-gi', str(gi_id)])
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    def destroy_compute_instance(self, gpu_id: int = None, gi_id: str = None, ci_ids: str = None):
+        return self.run(self.destroy_compute_instance_command(gpu_id, gi_id, ci_ids))[0]
+
+    def list_gpu_instance_profiles_command(self, gpu_id: int = None):
+        cmd = self._command('mig', '-lgip', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    @classmethod
+    def parse_gpu_instance_profiles(cls, output: str):
+        gi_profile_list = list()
+        for line in output.splitlines():
+            match_groups = cls.GI_PROFILE_PATTERN.match(line)
+            if match_groups:
+                g_id, name, profile_id, free, total, memory, p2p, sm, dec, enc = match_groups.groups()
+                gi_profile_list.append({
+                    'gpu_id': int(g_id), 'name': name, 'profile_id': int(profile_id), 'instances_free': int(free),
+                    'instances_total': int(total), 'memory_gib': float(memory), 'p2p': p2p == 'Yes',
+                    'sm': int(sm), 'dec': int(dec), 'enc': int(enc),
+                })
+                continue
+            # the second line of a profile row: CE, JPEG and OFA
+            match_groups = cls.GI_PROFILE_EXTRA_PATTERN.match(line)
+            if match_groups and gi_profile_list and 'ce' not in gi_profile_list[-1]:
+                ce, jpeg, ofa = map(int, match_groups.groups())
+                gi_profile_list[-1].update({'ce': ce, 'jpeg': jpeg, 'ofa': ofa})
+        return gi_profile_list
+
+    def list_gpu_instance_profiles(self, gpu_id: int = None):
+        return self.parse_gpu_instance_profiles(self.run(self.list_gpu_instance_profiles_command(gpu_id))[1])
+
+    def list_gpu_instance_possible_placements_command(self, gpu_id: int = None):
+        cmd = self._command('mig', '-lgipp', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        return cmd
+
+    @classmethod
+    def parse_gpu_instance_possible_placements(cls, output: str):
+        gi_placement_list = list()
+        for line in output.splitlines():
+            match_groups = cls.GI_PLACEMENT_PATTERN.match(line.strip())
+            if match_groups:
+                g_id, profile_id, starts, size = match_groups.groups()
+                gi_placement_list.append({
+                    'gpu_id': int(g_id), 'profile_id': int(profile_id),
+                    'placements': [{'start': int(start), 'size': int(size)} for start in starts.split(',') if start],
+                })
+        return gi_placement_list
+
+    def list_gpu_instance_possible_placements(self, gpu_id: int = None):
+        cmd = self.list_gpu_instance_possible_placements_command(gpu_id)
+        return self.parse_gpu_instance_possible_placements(self.run(cmd)[1])
+
+    def list_compute_instance_profiles_command(self, gpu_id: int = None, gi_id: int = None):
+        cmd = self._command('mig', '-lcip', privileged=True)
+        if gpu_id is not None:
+            cmd.extend(['-i', str(gpu_id)])
+        if gi_id is not None:
+            cmd.extend(['-gi', str(gi_id)])
+        return cmd
+
+    @classmethod
+    def parse_compute_instance_profiles(cls, output: str):
+        ci_profile_list = list()
+        for line in output.splitlines():
+            match_groups = cls.CI_PROFILE_PATTERN.match(line)
+            if match_groups:
+                g_id, gi_id, name, profile_id, default, free, total, sm, dec, enc, ofa = match_groups.groups()
+                ci_profile_list.append({
+                    'gpu_id': int(g_id), 'gi_id': int(gi_id), 'name': name, 'profile_id': int(profile_id),
+                    'default': default == '*', 'instances_free': int(free), 'instances_total': int(total),
+                    'sm': int(sm), 'dec': int(dec), 'enc': int(enc), 'ofa': int(ofa),
+                })
+                continue
+            # the second line of a profile row: CE and JPEG
+            match_groups = cls.CI_PROFILE_EXTRA_PATTERN.match(line)
+            if match_groups and ci_profile_list and 'ce' not in ci_profile_list[-1]:
+                ce, jpeg = map(int, match_groups.groups())
+                ci_profile_list[-1].update({'ce': ce, 'jpeg': jpeg})
+        return ci_profile_list
+
+    def list_compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None):
+        cmd = self.list_compute_instance_profiles_command(gpu_id, gi_id)
+        return self.parse_compute_instance_profiles(self.run(cmd)[1])
+
+    def list_devices_commands(self):
+        """:code:`nvidia-smi -L` for the UUIDs and :code:`nvidia-smi` for the GI / CI IDs of the MIG devices."""
+        return self._command('-L'), self._command()
+
+    @classmethod
+    def parse_devices(cls, device_list_output: str, device_table_output: str):
+        # (gpu_id, mig_device_id) -> (gi_id, ci_id)
+        mig_device_ids = dict()
+        for line in device_table_output.splitlines():
+            match = cls.MIG_DEVICE_TABLE_PATTERN.match(line)
+            if match:
+                g_id, gi_id, ci_id, mig_device_id = map(int, match.groups())
+                mig_device_ids[g_id, mig_device_id] = gi_id, ci_id
+
+        devices = list()
+        for line in device_list_output.splitlines():
+            match = cls.GPU_LIST_PATTERN.match(line)
+            if match:
+                g_id, name, device_uuid = match.groups()
+                devices.append({'gpu_id': int(g_id), 'name': name, 'uuid': device_uuid, 'mig_devices': list()})
+                continue
+            match = cls.MIG_DEVICE_LIST_PATTERN.match(line)
+            if match and devices:
+                name, mig_device_id, device_uuid = match.groups()
+                g_id, mig_device_id = devices[-1]['gpu_id'], int(mig_device_id)
+                gi_id, ci_id = mig_device_ids.get((g_id, mig_device_id), (None, None))
+                devices[-1]['mig_devices'].append({
+                    'gpu_id': g_id, 'mig_device_id': mig_device_id, 'gi_id': gi_id, 'ci_id': ci_id,
+                    'name': name, 'uuid': device_uuid,
+                })
+        return devices
+
+    def list_devices(self):
+        device_list_cmd, device_table_cmd = self.list_devices_commands()
+        return self.parse_devices(self.run(device_list_cmd)[1], self.run(device_table_cmd)[1])
+
+
+class NVMLBackend(NvidiaSMIBackend):
+    """Backend querying GPU devices in-process through NVML. The mutating operations (which require root)
+    and the queries NVML refuses with insufficient permission are delegated to :code:`nvidia-smi`.
+    The GI / CI profile tables are listed by :code:`nvidia-smi` as well, they are static per GPU model and
+    cached by :class:`DeviceInventory`.
+    """
+    name = 'nvml'
+
+    def __init__(self, executable: str = 'nvidia-smi', sudo: bool = True):
+        if pynvml is None:
+            raise ImportError('NVML backend requires `pynvml`. Install it by `pip install nvidia-ml-py`.')
+        super().__init__(executable=executable, sudo=sudo)
+        pynvml.nvmlInit()
+
+    def __del__(self):
+        if pynvml is not None:
+            try:
+                pynvml.nvmlShutdown()
+            except pynvml.NVMLError:
+                pass
+
+    @staticmethod
+    def _decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    def _device_handles(self, gpu_id: int = None):
+        if gpu_id is not None:
+            return [(gpu_id, pynvml.nvmlDeviceGetHandleByIndex(gpu_id))]
+        return [(i, pynvml.nvmlDeviceGetHandleByIndex(i)) for i in range(pynvml.nvmlDeviceGetCount())]
+
+    def _gpu_instance_profiles(self, handle):
+        """Yield the NVML profile info of every GI profile supported by the device."""
+        for profile in range(pynvml.NVML_GPU_INSTANCE_PROFILE_COUNT):
+            try:
+                yield pynvml.nvmlDeviceGetGpuInstanceProfileInfo(handle, profile)
+            except pynvml.NVMLError:
+                # profile not supported by this device
+                continue
+
+    @classmethod
+    def _gpu_instance_profile_name(cls, profile_info):
+        name = cls._decode(getattr(profile_info, 'name', b''))
+        if name:
+            return name
+        return f'MIG {profile_info.sliceCount}g.{math.ceil(profile_info.memorySizeMB / 1024)}gb'
+
+    def _gpu_instances(self, handle):
+        """Yield :code:`(gi_handle, gi_info, profile_name)` of the GPU instances on the device."""
+        for profile_info in self._gpu_instance_profiles(handle):
+            gi_array = (pynvml.c_nvmlGpuInstance_t * profile_info.instanceCount)()
+            count = c_uint()
+            pynvml.nvmlDeviceGetGpuInstances(handle, profile_info.id, gi_array, byref(count))
+            for i in range(count.value):
+                yield gi_array[i], pynvml.nvmlGpuInstanceGetInfo(gi_array[i]), \
+                    self._gpu_instance_profile_name(profile_info)
+
+    def check_mig_status(self, gpu_id: int = None):
+        mig_status_list = list()
+        for _, handle in self._device_handles(gpu_id):
+            try:
+                current_state, pending_state = pynvml.nvmlDeviceGetMigMode(handle)
+            except pynvml.NVMLError_NotSupported:
+                current_state = pending_state = pynvml.NVML_DEVICE_MIG_DISABLE
+            mig_status_list.append((
+                current_state == pynvml.NVML_DEVICE_MIG_ENABLE, pending_state == pynvml.NVML_DEVICE_MIG_ENABLE,
+            ))
+        if gpu_id is not None:
+            return mig_status_list[0]
+        return mig_status_list
+
+    def check_gpu_instance_status(self, gpu_id: int = None):
+        try:
+            gi_status_list = list()
+            for g_id, handle in self._device_handles(gpu_id):
+                for _, gi_info, name in self._gpu_instances(handle):
+                    gi_status_list.append({
+                        'gpu_id': g_id, 'name': name, 'profile_id': gi_info.profileId, 'gi_id': gi_info.id,
+                        'placement': {'start': gi_info.placement.start, 'size': gi_info.placement.size},
+                    })
+            return gi_status_list
+        except pynvml.NVMLError_NoPermission:
+            return super().check_gpu_instance_status(gpu_id)
+
+    def check_compute_instance_status(self, gpu_id: int = None, gi_id: int = None):
+        try:
+            ci_status_list = list()
+            for g_id, handle in self._device_handles(gpu_id):
+                for gi_handle, gi_info, gi_name in self._gpu_instances(handle):
+                    if gi_id is not None and gi_info.id != gi_id:
+                        continue
+                    ci_status_list.extend(self._compute_instances(g_id, gi_handle, gi_info, gi_name))
+            return ci_status_list
+        except pynvml.NVMLError_NoPermission:
+            return super().check_compute_instance_status(gpu_id, gi_id)
+
+    def _compute_instances(self, g_id: int, gi_handle, gi_info, gi_name: str):
+        ci_status_list = list()
+        gi_slice_count = int(gi_name.split()[-1].split('g.')[0])
+        for profile in range(pynvml.NVML_COMPUTE_INSTANCE_PROFILE_COUNT):
+            try:
+                profile_info = pynvml.nvmlGpuInstanceGetComputeInstanceProfileInfo(
+                    gi_handle, profile, pynvml.NVML_COMPUTE_INSTANCE_ENGINE_PROFILE_SHARED,
+                )
+            except pynvml.NVMLError:
+                continue
+            ci_array = (pynvml.c_nvmlComputeInstance_t * profile_info.instanceCount)()
+            count = c_uint()
+            pynvml.nvmlGpuInstanceGetComputeInstances(gi_handle, profile_info.id, ci_array, byref(count))
+            # the CI spanning the whole GI has the same name as the GI
+            if profile_info.sliceCount == gi_slice_count:
+                name = gi_name
+            else:
+                name = f'MIG {profile_info.sliceCount}c.{gi_name.split()[-1]}'
+            for i in range(count.value):
+                ci_info = pynvml.nvmlComputeInstanceGetInfo(ci_array[i])
+                ci_status_list.append({
+                    'gpu_id': g_id, 'gi_id': gi_info.id, 'name': name, 'profile_id': ci_info.profileId,
+                    'ci_id': ci_info.id, 'placement': {'start': ci_info.placement.start, 'size': ci_info.placement.size}
+                })
+        return ci_status_list
+
+    def list_devices(self):
+        devices = list()
+        for g_id, handle in self._device_handles():
+            device = {
+                'gpu_id': g_id, 'name': self._decode(pynvml.nvmlDeviceGetName(handle)),
+                'uuid': self._decode(pynvml.nvmlDeviceGetUUID(handle)), 'mig_devices': list(),
+            }
+            try:
+                current_state, _ = pynvml.nvmlDeviceGetMigMode(handle)
+            except pynvml.NVMLError_NotSupported:
+                current_state = pynvml.NVML_DEVICE_MIG_DISABLE
+            if current_state == pynvml.NVML_DEVICE_MIG_ENABLE:
+                for mig_device_id in range(pynvml.nvmlDeviceGetMaxMigDeviceCount(handle)):
+                    try:
+                        mig_handle = pynvml.nvmlDeviceGetMigDeviceHandleByIndex(handle, mig_device_id)
+                    except pynvml.NVMLError_NotFound:
+                        break
+                    attributes = pynvml.nvmlDeviceGetAttributes(mig_handle)
+                    device['mig_devices'].append({
+                        'gpu_id': g_id, 'mig_device_id': mig_device_id,
+                        'gi_id': pynvml.nvmlDeviceGetGpuInstanceId(mig_handle),
+                        'ci_id': pynvml.nvmlDeviceGetComputeInstanceId(mig_handle),
+                        'name': f'MIG {attributes.gpuInstanceSliceCount}g.'
+                                f'{math.ceil(attributes.memorySizeMB / 1024)}gb',
+                        'uuid': self._decode(pynvml.nvmlDeviceGetUUID(mig_handle)),
+                    })
+            devices.append(device)
+        return devices
+
+
+class SimulatedNvidiaSMIBackend(NvidiaSMIBackend):
+    """:class:`NvidiaSMIBackend` whose commands are executed in-process by a :class:`MIGSimulator` instead of a
+    :code:`nvidia-smi` subprocess, so that the command builders and output parsers run without a GPU.
+
+    Args:
+        simulator (MIGSimulator, optional): The simulated GPUs. Default to :meth:`MIGSimulator.from_env`.
+        executable (str, optional): The :code:`nvidia-smi` executable in the built commands. Default to
+            :code:`nvidia-smi`.
+        sudo (bool, optional): Prefix the privileged commands with :code:`sudo`. Default to `False`.
+    """
+    name = 'sim'
+
+    def __init__(self, simulator: MIGSimulator = None, executable: str = 'nvidia-smi', sudo: bool = False):
+        super().__init__(executable=executable, sudo=sudo)
+        self.simulator = simulator or MIGSimulator.from_env()
+
+    def run(self, cmd: List[str]):
+        with timed_command(cmd) as event:
+            args = cmd[2:] if cmd[0] == 'sudo' else cmd[1:]
+            code, output = self.simulator.execute(args)
+            event['exit_code'] = code
+        return code, output
+
+
+def _synchronized(func):
+    """Serialize the calls of a :class:`FakeBackend` method, so that concurrent configuration is safe. The
+    scripted latency of the method is simulated before, so that the calls on different GPUs overlap.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        latency = self.latency.get(func.__name__, 0.)
+        if latency > 0:
+            time.sleep(latency)
+        with self._lock:
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class FakeBackend(MIGBackend):
+    """In-memory MIG-enabled GPUs for testing, operating on the records of a :class:`MIGSimulator` directly.
+
+    Args:
+        num_gpus (int, optional): Number of simulated GPUs. Default to 1.
+        gpu_name (str, optional): The GPU model name, see :data:`migperf.controller.simulator.GPU_MODELS`.
+            Default to :code:`NVIDIA A100-SXM4-80GB`.
+        mig_enabled (bool, optional): Whether MIG is enabled initially. Default to `True`.
+        latency (dict, optional): Scripted latency in seconds of the state-changing operations, keyed by the
+            method name (e.g. :code:`{'create_gpu_instance': 0.5}`). Default to no latency.
+        simulator (MIGSimulator, optional): The simulated GPUs, overriding :code:`num_gpus`, :code:`gpu_name` and
+            :code:`mig_enabled`.
+
+    Attributes:
+        calls (list of tuple): History of the operations executed on the backend, as :code:`(name, kwargs)`.
+    """
+    name = 'fake'
+
+    # GI profile name -> (profile ID, placement size, possible placement starts) of the default GPU model
+    GI_PROFILES = {
+        p.name: (p.profile_id, p.size, p.starts) for p in get_gpu_model('NVIDIA A100-SXM4-80GB').gi_profiles
+    }
+
+    def __init__(
+            self,
+            num_gpus: int = 1,
+            gpu_name: str = 'NVIDIA A100-SXM4-80GB',
+            mig_enabled: bool = True,
+            latency: Dict[str, float] = None,
+            simulator: MIGSimulator = None,
+    ):
+        self.simulator = simulator or MIGSimulator([gpu_name] * num_gpus, mig_enabled=mig_enabled)
+        self.latency = dict(latency or {})
+        self.calls: List[tuple] = list()
+        self._lock = RLock()
+
+    @property
+    def mig_status(self):
+        """:code:`(current, pending)` MIG mode of every GPU."""
+        return [self.simulator.mig_mode(g_id) for g_id in self.simulator.gpu_ids()]
+
+    def _set_mig(self, gpu_id: Optional[int], enabled: bool):
+        for g_id in self.simulator.gpu_ids(gpu_id):
+            try:
+                self.simulator.set_mig_mode(g_id, enabled)
+            except SimulatorError:
+                return 1
+        return 0
+
+    @_synchronized
+    def enable_mig(self, gpu_id: int = None):
+        self.calls.append(('enable_mig', {'gpu_id': gpu_id}))
+        return self._set_mig(gpu_id, True)
+
+    @_synchronized
+    def disable_mig(self, gpu_id: int = None):
+        self.calls.append(('disable_mig', {'gpu_id': gpu_id}))
+        return self._set_mig(gpu_id, False)
+
+    def check_mig_status(self, gpu_id: int = None):
+        if gpu_id is not None:
+            return self.simulator.mig_mode(gpu_id)
+        return self.mig_status
+
+    @_synchronized
+    def create_gpu_instance(self, gi_profiles: str, gpu_id: int = None, create_ci: bool = False):
+        self.calls.append(
+            ('create_gpu_instance', {'gi_profiles': gi_profiles, 'gpu_id': gpu_id, 'create_ci': create_ci})
+        )
+        gi_status_list = list()
+        for g_id in self.simulator.gpu_ids(gpu_id):
+            for gi_profile in gi_profiles.split(','):
+                profile, _, placement = gi_profile.partition(':')
+                try:
+                    gi_status = self.simulator.create_gpu_instance(g_id, profile, int(placement) if placement else None)
+                    if create_ci:
+                        self.simulator.create_compute_instance(g_id, gi_status['gi_id'])
+                except SimulatorError as e:
+                    raise ValueError(f'Failed to create GPU instance: {e}') from e
+                gi_status_list.append({k: gi_status[k] for k in ('gpu_id', 'name', 'profile_id', 'gi_id')})
+        return gi_status_list
+
+    @_synchronized
+    def create_compute_instance(self, ci_profiles: str = None, gpu_id: int = None, gi_id: str = None):
+        self.calls.append(('create_compute_instance', {'ci_profiles': ci_profiles, 'gpu_id': gpu_id, 'gi_id': gi_id}))
+        ci_status_list = list()
+        for gi_status in self.simulator.gpu_instances(gpu_id, gi_id):
+            for ci_profile in (ci_profiles.split(',') if ci_profiles else [None]):
+                try:
+                    ci_status = self.simulator.create_compute_instance(
+                        gi_status['gpu_id'], gi_status['gi_id'], ci_profile,
+                    )
+                except SimulatorError as e:
+                    raise ValueError(f'Failed to create compute instance: {e}') from e
+                ci_status_list.append({k: ci_status[k] for k in ('gpu_id', 'gi_id', 'name', 'ci_id', 'profile_id')})
+        return ci_status_list
+
+    def check_gpu_instance_status(self, gpu_id: int = None):
+        return self.simulator.gpu_instances(gpu_id)
+
+    def check_compute_instance_status(self, gpu_id: int = None, gi_id: int = None):
+        return self.simulator.compute_instances(gpu_id, gi_id)
+
+    @_synchronized
+    def destroy_gpu_instance(self, gpu_id: int = None, gi_ids: str = None):
+        self.calls.append(('destroy_gpu_instance', {'gpu_id': gpu_id, 'gi_ids': gi_ids}))
+        targets = self.simulator.gpu_instances(gpu_id, gi_ids)
+        return_code = 0 if targets else 1
+        for gi_status in targets:
+            try:
+                # nvidia-smi refuses to destroy GPU instances with compute instances in use
+                self.simulator.destroy_gpu_instance(gi_status['gpu_id'], gi_status['gi_id'])
+            except SimulatorError:
+                return_code = 1
+        return return_code
+
+    @_synchronized
+    def destroy_compute_instance(self, gpu_id: int = None, gi_id: str = None, ci_ids: str = None):
+        self.calls.append(('destroy_compute_instance', {'gpu_id': gpu_id, 'gi_id': gi_id, 'ci_ids': ci_ids}))
+        targets = self.simulator.compute_instances(gpu_id, gi_id, ci_ids)
+        for ci_status in targets:
+            self.simulator.destroy_compute_instance(ci_status['gpu_id'], ci_status['gi_id'], ci_status['ci_id'])
+        return 0 if targets else 1
+
+    def list_gpu_instance_profiles(self, gpu_id: int = None):
+        return self.simulator.gpu_instance_profiles(gpu_id)
+
+    def list_gpu_instance_possible_placements(self, gpu_id: int = None):
+        return self.simulator.gpu_instance_possible_placements(gpu_id)
+
+    def list_compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None):
+        return self.simulator.compute_instance_profiles(gpu_id, gi_id)
+
+    def list_devices(self):
+        return self.simulator.devices()
+
+
+BACKENDS = {
+    NvidiaSMIBackend.name: NvidiaSMIBackend,
+    NVMLBackend.name: NVMLBackend,
+    SimulatedNvidiaSMIBackend.name: SimulatedNvidiaSMIBackend,
+    FakeBackend.name: FakeBackend,
+}
+
+_default_backend = None
+
+
+def get_default_backend():
+    """The backend shared by default. It is selected by the environment variable :code:`MIGPERF_BACKEND`
+    (one of :code:`nvml`, :code:`nvidia-smi`, :code:`sim` and :code:`fake`). If not set, NVML is used when
+    available, otherwise :code:`nvidia-smi`.
+    """
+    global _default_backend
+
+    if _default_backend is None:
+        backend_name = os.environ.get('MIGPERF_BACKEND', None)
+        if backend_name is not None:
+            if backend_name not in BACKENDS:
+                raise ValueError(f'Unknown MIG backend {backend_name}, expected one of {list(BACKENDS)}')
+            _default_backend = BACKENDS[backend_name]()
+        else:
+            try:
+                _default_backend = NVMLBackend()
+            except ImportError:
+                _default_backend = NvidiaSMIBackend()
+            except pynvml.NVMLError:
+                # NVML library or GPU driver not found
+                _default_backend = NvidiaSMIBackend()
+    return _default_backend
+
+
+def set_default_backend(backend: Optional[MIGBackend]):
+    """Replace the default backend. Passing :code:`None` resets it to be re-selected on the next use."""
+    global _default_backend
+    _default_backend = backend
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reconfiguration cost benchmark. Cycle a GPU through all valid MIG layouts and report the latency distribution
+of every layout transition and of every controller operation / command, from the timing events of
+:mod:`migperf.controller.events`.
+
+Examples:
+    Benchmark GPU 0 with nvidia-smi, saving the raw events and the report:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.benchmark -i 0 --backend nvidia-smi --events events.jsonl -o report.json
+
+    Test the harness without hardware, with 0.5s of scripted latency per GI / CI operation:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.benchmark --backend fake --fake-latency 0.5 --max-layouts 20
+
+    Also time disabling and re-enabling MIG mode at the end of every round:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.benchmark --backend fake --fake-latency 0.5 --include-mode-switch
+
+    Benchmark the command builders and output parsers on a simulated H100 (see
+    :mod:`migperf.controller.simulator`):
+
+    .. code-block:: shell
+
+        python -m migperf.controller.benchmark --backend sim --gpu-model H100 --repeats 10
+"""
+import argparse
+import collections
+import json
+import time
+from typing import Dict, List
+
+from migperf.profiler.utils.stats import summarize
+from .backend import BACKENDS, FakeBackend, NvidiaSMIBackend, SimulatedNvidiaSMIBackend
+from .events import EventRecorder
+from .layout import GPUInstanceSpec, MIGLayout, profile_compute_slices
+from .mig_controller import MIGController
+from .planner import ProfilePlacements, plan_placement
+from .simulator import MIGSimulator
+
+# FakeBackend operations given the scripted latency
+FAKE_OPERATIONS = (
+    'enable_mig', 'disable_mig', 'create_gpu_instance', 'create_compute_instance', 'destroy_gpu_instance',
+    'destroy_compute_instance',
+)
+# label of the GPU with MIG mode disabled in the mode switch transitions
+MIG_DISABLED = 'mig-disabled'
+
+
+def enumerate_layouts(profile_placements: Dict[str, ProfilePlacements], maximal_only: bool = False):
+    """All layouts (as multisets of GI profiles) that can be placed on an empty GPU.
+
+    Args:
+        profile_placements (dict): Profile name -> :class:`ProfilePlacements`, see
+            :meth:`MIGController.get_profile_placements`.
+        maximal_only (bool, optional): Only return the layouts to which no more GPU instance can be added.
+            Default to `False`.
+    Returns:
+        list of MIGLayout: Non-empty layouts with unpinned placements, largest GPU instances first.
+    """
+    # largest profiles first, so that the layouts are listed in a stable and readable order
+    names = sorted(
+        profile_placements,
+        key=lambda name: (-max((size for _, size in profile_placements[name].placements), default=0),
+                          -profile_compute_slices(name), name),
+    )
+    names = [name for name in names if profile_placements[name].placements]
+    layouts = list()
+
+    def search(prefix: List[str], first: int):
+        extended = False
+        for i in range(first, len(names)):
+            candidate = prefix + [names[i]]
+            if plan_placement(candidate, profile_placements) is None:
+                continue
+            extended = True
+            search(candidate, i)
+        if prefix and (not maximal_only or not extended):
+            layouts.append(MIGLayout([GPUInstanceSpec(name) for name in prefix]))
+
+    search(list(), 0)
+    layouts.sort(key=lambda layout: [names.index(spec.profile) for spec in layout])
+    return layouts
+
+
+def layout_label(layout: MIGLayout):
+    """Short label of a layout, e.g., :code:`3g.40gb,2g.20gb`, or :code:`empty`."""
+    return ','.join(spec.to_profile_str() for spec in layout) or 'empty'
+
+
+def run_benchmark(mig_controller: MIGController, gpu_id: int, layouts: List[MIGLayout], repeats: int = 1,
+                  recorder: EventRecorder = None, include_mode_switch: bool = False):
+    """Reconcile a GPU through the layouts in order, starting from and ending at an empty GPU, for
+    :code:`repeats` rounds. MIG mode must be enabled on the GPU, whose GPU instances will be destroyed.
+
+    Args:
+        mig_controller (MIGController): The controller of the GPU.
+        gpu_id (int): ID of the GPU.
+        layouts (list of MIGLayout): Layouts to cycle through.
+        repeats (int, optional): Number of rounds. Default to 1.
+        recorder (EventRecorder, optional): Recorder collecting the events, e.g., to also save them to a file.
+            Default to an in-memory recorder.
+        include_mode_switch (bool, optional): End every round by disabling and re-enabling MIG mode on the empty
+            GPU, which are reported as the :code:`empty -> mig-disabled` and :code:`mig-disabled -> empty`
+            transitions. Default to `False`.
+    Returns:
+        list of dict: A record for every transition, contains :code:`round`, :code:`from`, :code:`to`,
+            :code:`duration`, :code:`error` and :code:`events` (the timing events emitted during the transition).
+    """
+    recorder = recorder or EventRecorder()
+    recorder.filter = recorder.filter or (lambda event: event['gpu_id'] in (None, gpu_id))
+    transitions = list()
+
+    def transition(round_: int, from_label: str, to_label: str, step):
+        first_event = len(recorder.events)
+        start = time.perf_counter()
+        error = None
+        try:
+            step()
+        except ValueError as e:
+            error = repr(e)
+        transitions.append({
+            'round': round_, 'from': from_label, 'to': to_label,
+            'duration': time.perf_counter() - start, 'error': error,
+            'events': recorder.events[first_event:],
+        })
+        return error
+
+    def set_mig(enabled: bool):
+        exit_code = mig_controller.enable_mig(gpu_id) if enabled else mig_controller.disable_mig(gpu_id)
+        if exit_code != 0:
+            raise ValueError(f'Failed to {"enable" if enabled else "disable"} MIG on GPU {gpu_id}')
+
+    with recorder:
+        mig_controller.reconcile(gpu_id, MIGLayout())
+        for round_ in range(repeats):
+            current = MIGLayout()
+            for layout in layouts + [MIGLayout()]:
+                error = transition(
+                    round_, layout_label(current), layout_label(layout),
+                    lambda: mig_controller.reconcile(gpu_id, layout),
+                )
+                # start the next transition from a known state
+                current = layout if error is None else mig_controller.snapshot_layout(gpu_id)
+            if include_mode_switch and not current:
+                if transition(round_, 'empty', MIG_DISABLED, lambda: set_mig(False)) is None:
+                    transition(round_, MIG_DISABLED, 'empty', lambda: set_mig(True))
+    return transitions
+
+
+def _command_key(cmd: List[str]):
+    """Group the commands by the executable and the flags, e.g., :code:`nvidia-smi mig -cgi -C`."""
+    if cmd[0] == 'sudo':
+        cmd = cmd[1:]
+    # drop the GPU ID and the flag values (profiles, GI IDs, ...)
+    args = [arg for i, arg in enumerate(cmd[1:]) if i == 0 or arg.startswith('-') and arg != '-i']
+    return ' '.join([cmd[0]] + args)
+
+
+def report(transitions: List[dict]):
+    """Latency distributions of the transitions (by :code:`from -> to`), the controller operations and the
+    executed commands (by name), in seconds.
+    """
+    by_transition, by_operation, by_command = [collections.defaultdict(list) for _ in range(3)]
+    errors = list()
+    for transition in transitions:
+        if transition['error'] is not None:
+            errors.append({k: transition[k] for k in ('round', 'from', 'to', 'error')})
+            continue
+        by_transition[f'{transition["from"]} -> {transition["to"]}'].append(transition['duration'])
+        for event in transition['events']:
+            if event['type'] == 'operation' and event['name'] != 'reconcile':
+                by_operation[event['name']].append(event['duration'])
+            elif event['type'] == 'command':
+                by_command[_command_key(event['command'])].append(event['duration'])
+
+    return {
+        'transition': summarize([t['duration'] for t in transitions if t['error'] is None]),
+        'by_transition': {k: summarize(v) for k, v in by_transition.items()},
+        'by_operation': {k: summarize(v) for k, v in sorted(by_operation.items())},
+        'by_command': {k: summarize(v) for k, v in sorted(by_command.items())},
+        'errors': errors,
+    }
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='MIG reconfiguration cost benchmark')
+    parser.add_argument('-i', '--gpu-id', type=int, default=0, help='GPU ID. Default to 0.')
+    parser.add_argument('--backend', type=str, default='fake', choices=list(BACKENDS),
+                        help='MIG backend. Default to fake, which needs no GPU, as well as sim.')
+    parser.add_argument('--executable', type=str, default='nvidia-smi',
+                        help='nvidia-smi executable of the nvidia-smi backend, e.g., a scripted fake nvidia-smi.')
+    parser.add_argument('--no-sudo', action='store_true', help='Run nvidia-smi without sudo.')
+    parser.add_argument('--gpu-model', type=str, default='A100',
+                        help='Simulated GPU model of the fake and sim backends, e.g., A100, A30 or H100.')
+    parser.add_argument('--fake-latency', type=float, default=0.,
+                        help='Scripted latency in seconds of every GI / CI operation of the fake backend.')
+    parser.add_argument('--max-layouts', type=int, default=None, help='Only benchmark the first N layouts.')
+    parser.add_argument('--maximal-only', action='store_true',
+                        help='Only benchmark the layouts to which no more GPU instance can be added.')
+    parser.add_argument('--include-mode-switch', action='store_true',
+                        help='End every round by disabling and re-enabling MIG mode on the empty GPU.')
+    parser.add_argument('-r', '--repeats', type=int, default=1, help='Number of rounds. Default to 1.')
+    parser.add_argument('--events', type=str, default=None, help='Append the raw timing events to a JSON lines file.')
+    parser.add_argument('-o', '--output', type=str, default=None, help='Save the report to a JSON file.')
+    return parser.parse_args()
+
+
+def get_backend(args):
+    if args.backend == 'fake':
+        return FakeBackend(num_gpus=args.gpu_id + 1, gpu_name=args.gpu_model,
+                           latency={operation: args.fake_latency for operation in FAKE_OPERATIONS})
+    elif args.backend == 'sim':
+        return SimulatedNvidiaSMIBackend(MIGSimulator([args.gpu_model] * (args.gpu_id + 1)))
+    elif args.backend == 'nvidia-smi':
+        return NvidiaSMIBackend(executable=args.executable, sudo=not args.no_sudo)
+    return BACKENDS[args.backend]()
+
+
+def print_report(result: dict):
+    for section in ('by_operation', 'by_command'):
+        if not result[section]:
+            continue
+        print(f'{section[3:]:<40} {"count":>6} {"mean":>9} {"p50":>9} {"p90":>9} {"p99":>9} {"max":>9}')
+        for name, stats in result[section].items():
+            print(f'{name:<40} {stats["count"]:>6} ' + ' '.join(
+                f'{stats[k]:>9.4f}' for k in ('mean', 'p50', 'p90', 'p99', 'max')
+            ))
+        print()
+    stats = result['transition']
+    if stats['count']:
+        print(f'{stats["count"]} transitions, mean {stats["mean"]:.4f}s, p50 {stats["p50"]:.4f}s, '
+              f'p99 {stats["p99"]:.4f}s, max {stats["max"]:.4f}s')
+    for error in result['errors']:
+        print(f'Failed {error["from"]} -> {error["to"]}: {error["error"]}')
+
+
+if __name__ == '__main__':
+    args_ = get_args()
+    mig_controller_ = MIGController(backend=get_backend(args_))
+    if not mig_controller_.check_mig_status(args_.gpu_id)[0]:
+        raise ValueError(f'MIG is not enabled on GPU {args_.gpu_id}')
+    layouts_ = enumerate_layouts(mig_controller_.get_profile_placements(args_.gpu_id), args_.maximal_only)
+    layouts_ = layouts_[:args_.max_layouts]
+    print(f'Benchmarking {len(layouts_)} layouts on GPU {args_.gpu_id} for {args_.repeats} round(s)')
+
+    transitions_ = run_benchmark(
+        mig_controller_, args_.gpu_id, layouts_, args_.repeats, recorder=EventRecorder(args_.events),
+        include_mode_switch=args_.include_mode_switch,
+    )
+    result_ = report(transitions_)
+    print_report(result_)
+    if args_.output:
+        with open(args_.output, 'w') as f:
+            json.dump({'gpu_id': args_.gpu_id, 'backend': args_.backend, 'layouts': list(map(layout_label, layouts_)),
+                       'repeats': args_.repeats, 'include_mode_switch': args_.include_mode_switch, **result_},
+                      f, indent=2)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Timing events of the MIG / MPS operations.
+
+Every :class:`MIGController` / :class:`AsyncMIGController` operation, every MPS operation and every command
+executed by the :code:`nvidia-smi` backend emits an event to the registered hooks. An event is a dict:
+
+- :code:`type`: :code:`operation` (a controller / MPS operation) or :code:`command` (an executed command).
+- :code:`name`: The operation name, or the executable of the command.
+- :code:`gpu_id`: The GPU operated on, :code:`None` for all GPUs or unknown.
+- :code:`arguments`: The arguments of the operation (operation events only).
+- :code:`command`: The command line (command events only).
+- :code:`exit_code`: The exit code of the command, or the integer returned by the operation, otherwise :code:`None`.
+- :code:`error`: :code:`repr` of the exception raised, or :code:`None`.
+- :code:`start_time`: Unix timestamp when the operation started.
+- :code:`duration`: Wall time of the operation in seconds.
+"""
+import contextlib
+import json
+import threading
+import time
+import warnings
+from typing import Callable, List, Optional
+
+_hooks: List[Callable[[dict], None]] = list()
+_hooks_lock = threading.Lock()
+
+
+def add_event_hook(hook: Callable[[dict], None]):
+    """Register a callable receiving every emitted event. The hook is called in the thread running the
+    operation, so it should be cheap and thread-safe.
+    """
+    with _hooks_lock:
+        _hooks.append(hook)
+    return hook
+
+
+def remove_event_hook(hook: Callable[[dict], None]):
+    with _hooks_lock:
+        if hook in _hooks:
+            _hooks.remove(hook)
+
+
+def emit_event(event: dict):
+    for hook in list(_hooks):
+        try:
+            hook(event)
+        except Exception as e:
+            # a broken hook must not break the operation being timed
+            warnings.warn(f'Event hook {hook!r} failed: {e!r}')
+
+
+def _gpu_id_from_command(cmd: List[str]):
+    for flag, value in zip(cmd, cmd[1:]):
+        if flag == '-i' and value.isdigit():
+            return int(value)
+    return None
+
+
+@contextlib.contextmanager
+def timed(event_type: str, name: str, gpu_id: int = None, **fields):
+    """Time the enclosed block and emit an event for it, even if the block raises. The block can set
+    :code:`exit_code` (and other fields) on the yielded event.
+
+    Examples:
+        >>> with timed('command', 'nvidia-smi', command=cmd) as event:
+        ...     event['exit_code'] = subprocess.call(cmd)
+    """
+    event = {
+        'type': event_type, 'name': name, 'gpu_id': gpu_id, 'exit_code': None, 'error': None,
+        'start_time': time.time(), 'duration': None, **fields,
+    }
+    start = time.perf_counter()
+    try:
+        yield event
+    except BaseException as e:
+        event['error'] = repr(e)
+        raise
+    finally:
+        event['duration'] = time.perf_counter() - start
+        if _hooks:
+            emit_event(event)
+
+
+def timed_command(cmd: List[str]):
+    """Time the execution of a command, see :func:`timed`."""
+    return timed('command', cmd[1] if cmd[0] == 'sudo' and len(cmd) > 1 else cmd[0],
+                 gpu_id=_gpu_id_from_command(cmd), command=list(cmd))
+
+
+class EventRecorder(object):
+    """Hook collecting the emitted events in memory, optionally appending them to a JSON lines file.
+
+    Args:
+        path (str, optional): Path of the JSON lines file to append the events to.
+        filter (callable, optional): Only record the events for which :code:`filter(event)` is true.
+
+    Examples:
+        >>> with EventRecorder('events.jsonl') as recorder:
+        ...     MIGController().reconcile(0, '2x3g.40gb')
+        >>> recorder.events
+    """
+
+    def __init__(self, path: str = None, filter: Optional[Callable[[dict], bool]] = None):
+        self.path = path
+        self.filter = filter
+        self.events: List[dict] = list()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __call__(self, event: dict):
+        if self.filter is not None and not self.filter(event):
+            return
+        with self._lock:
+            self.events.append(event)
+            if self._file is not None:
+                self._file.write(json.dumps(event, default=str) + '\n')
+                self._file.flush()
+
+    def start(self):
+        if self.path is not None and self._file is None:
+            self._file = open(self.path, 'a')
+        add_event_hook(self)
+        return self
+
+    def stop(self):
+        remove_event_hook(self)
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cached snapshot of the GPU device topology: GPUs, GPU instances (GI), compute instances (CI) and MIG devices.
+"""
+import functools
+import time
+from threading import RLock
+from typing import Dict, List, Optional
+
+from .backend import MIGBackend, get_default_backend
+
+
+class DeviceInventory(object):
+    """Snapshot of the GPU device topology served from indexed dicts.
+
+    The snapshot consists of two sections, which are loaded lazily on the first lookup:
+    the device listing (GPUs, MIG devices and their UUIDs) and the GI / CI listing. The latter requires
+    privileged commands with the :code:`nvidia-smi` backend, so device lookups never trigger it.
+    Both sections expire after :code:`ttl` seconds, and are dropped by :meth:`invalidate`, which
+    :class:`MIGController` calls after every mutating operation.
+
+    The GI / CI profile tables and the GI possible placements are static for a GPU model, so they are cached
+    per GPU model for the lifetime of the inventory. The cached records leave out the free instance counts,
+    which change with the partition. The GPU models are kept across :meth:`invalidate`, so that serving a cached
+    table does not reload the device listing after every mutation.
+
+    Args:
+        backend (MIGBackend, optional): The backend to query. Default to the shared default backend.
+        ttl (float, optional): Time-to-live of the snapshot in seconds. :code:`None` never expires.
+            Default to 30.
+    """
+
+    def __init__(self, backend: MIGBackend = None, ttl: Optional[float] = 30.):
+        self.backend = backend or get_default_backend()
+        self.ttl = ttl
+        self._lock = RLock()
+        # section name -> (load time, indexes)
+        self._sections: Dict[str, tuple] = dict()
+        # (table name, GPU model, [GI profile ID]) -> records without GPU / GI IDs
+        self._profile_tables: Dict[tuple, List[dict]] = dict()
+        # GPU ID -> GPU model, updated whenever the device listing is loaded
+        self._gpu_models: Dict[int, str] = dict()
+
+    def invalidate(self):
+        """Drop the snapshot. It will be rebuilt on the next lookup."""
+        with self._lock:
+            self._sections.clear()
+
+    def refresh(self):
+        """Rebuild the device listing section of the snapshot immediately."""
+        with self._lock:
+            self.invalidate()
+            self._section('devices')
+
+    def _section(self, name: str):
+        with self._lock:
+            loaded = self._sections.get(name, None)
+            if loaded is not None and (self.ttl is None or time.monotonic() - loaded[0] < self.ttl):
+                return loaded[1]
+            load_time = time.monotonic()
+            if name == 'devices':
+                indexes = self._build_device_indexes(self.backend.list_devices())
+                self._gpu_models.update({gpu_id: gpu['name'] for gpu_id, gpu in indexes['gpu'].items()})
+            else:
+                indexes = self._build_instance_indexes(
+                    self.backend.check_gpu_instance_status(), self.backend.check_compute_instance_status(),
+                )
+            self._sections[name] = (load_time, indexes)
+            return indexes
+
+    @staticmethod
+    def _build_device_indexes(devices: List[dict]):
+        indexes = {'gpu': dict(), 'mig_device': dict(), 'mig_device_by_instance': dict(), 'uuid': dict()}
+        for device in devices:
+            indexes['gpu'][device['gpu_id']] = device
+            indexes['uuid'][device['uuid']] = device
+            for mig_device in device['mig_devices']:
+                indexes['mig_device'][mig_device['gpu_id'], mig_device['mig_device_id']] = mig_device
+                indexes['mig_device_by_instance'][
+                    mig_device['gpu_id'], mig_device['gi_id'], mig_device['ci_id']
+                ] = mig_device
+                indexes['uuid'][mig_device['uuid']] = mig_device
+        return indexes
+
+    @staticmethod
+    def _build_instance_indexes(gi_status_list: List[dict], ci_status_list: List[dict]):
+        indexes = {'gi': dict(), 'gi_by_gpu': dict(), 'ci_by_gi': dict()}
+        for gi_status in gi_status_list:
+            indexes['gi'][gi_status['gpu_id'], gi_status['gi_id']] = gi_status
+            indexes['gi_by_gpu'].setdefault(gi_status['gpu_id'], list()).append(gi_status)
+        for ci_status in ci_status_list:
+            indexes['ci_by_gi'].setdefault((ci_status['gpu_id'], ci_status['gi_id']), list()).append(ci_status)
+        return indexes
+
+    def gpus(self):
+        """List of GPU devices, see :meth:`MIGBackend.list_devices` for the record structure."""
+        return list(self._section('devices')['gpu'].values())
+
+    def get_gpu(self, gpu_id: int):
+        return self._section('devices')['gpu'].get(gpu_id, None)
+
+    def get_mig_device(self, gpu_id: int, mig_device_id: int):
+        return self._section('devices')['mig_device'].get((gpu_id, mig_device_id), None)
+
+    def find_mig_device(self, gpu_id: int, gi_id: int, ci_id: int = 0):
+        """Find the MIG device of a compute instance."""
+        return self._section('devices')['mig_device_by_instance'].get((gpu_id, gi_id, ci_id), None)
+
+    def get_by_uuid(self, device_uuid: str):
+        """Find the GPU or MIG device record by its UUID."""
+        return self._section('devices')['uuid'].get(device_uuid, None)
+
+    def get_device_uuid(self, gpu_id: int, mig_device_id: int = None):
+        """UUID of a GPU, or of a MIG device on the GPU if :code:`mig_device_id` is given."""
+        if mig_device_id is None:
+            device = self.get_gpu(gpu_id)
+        else:
+            device = self.get_mig_device(gpu_id, mig_device_id)
+        return device['uuid'] if device is not None else None
+
+    def gpu_instances(self, gpu_id: int = None):
+        gi_by_gpu = self._section('instances')['gi_by_gpu']
+        if gpu_id is not None:
+            return list(gi_by_gpu.get(gpu_id, list()))
+        return [gi for gi_status_list in gi_by_gpu.values() for gi in gi_status_list]
+
+    def get_gpu_instance(self, gpu_id: int, gi_id: int):
+        return self._section('instances')['gi'].get((gpu_id, gi_id), None)
+
+    def compute_instances(self, gpu_id: int = None, gi_id: int = None):
+        ci_by_gi = self._section('instances')['ci_by_gi']
+        if gpu_id is not None and gi_id is not None:
+            return list(ci_by_gi.get((gpu_id, gi_id), list()))
+        return [
+            ci for (g_id, i_id), ci_status_list in ci_by_gi.items() for ci in ci_status_list
+            if (gpu_id is None or g_id == gpu_id) and (gi_id is None or i_id == gi_id)
+        ]
+
+    def _profile_table(self, key: tuple, loader, ids: dict):
+        with self._lock:
+            table = self._profile_tables.get(key, None)
+            if table is None:
+                table = [
+                    {k: v for k, v in record.items() if k not in ('gpu_id', 'gi_id', 'instances_free')}
+                    for record in loader()
+                ]
+                # an empty table (e.g., MIG not enabled yet) is not cached
+                if table:
+                    self._profile_tables[key] = table
+        return [{**ids, **record} for record in table]
+
+    def _gpu_model(self, gpu_id: int):
+        with self._lock:
+            if gpu_id not in self._gpu_models:
+                self._section('devices')
+            if gpu_id not in self._gpu_models:
+                raise ValueError(f'GPU {gpu_id} not found')
+            return self._gpu_models[gpu_id]
+
+    def _gpu_ids(self, gpu_id: Optional[int]):
+        return [gpu['gpu_id'] for gpu in self.gpus()] if gpu_id is None else [gpu_id]
+
+    def gpu_instance_profiles(self, gpu_id: int = None):
+        """GI profiles supported by the GPUs, see :meth:`MIGBackend.list_gpu_instance_profiles`."""
+        return [
+            record for g_id in self._gpu_ids(gpu_id)
+            for record in self._profile_table(
+                ('gi_profiles', self._gpu_model(g_id)),
+                functools.partial(self.backend.list_gpu_instance_profiles, g_id), {'gpu_id': g_id},
+            )
+        ]
+
+    def gpu_instance_possible_placements(self, gpu_id: int = None):
+        """Possible placements of the GI profiles, see :meth:`MIGBackend.list_gpu_instance_possible_placements`."""
+        return [
+            record for g_id in self._gpu_ids(gpu_id)
+            for record in self._profile_table(
+                ('gi_placements', self._gpu_model(g_id)),
+                functools.partial(self.backend.list_gpu_instance_possible_placements, g_id), {'gpu_id': g_id},
+            )
+        ]
+
+    def compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None):
+        """CI profiles supported by the GPU instances, see :meth:`MIGBackend.list_compute_instance_profiles`.
+        The table is cached per GPU model and GI profile.
+        """
+        ci_profile_list = list()
+        for gi_status in self.gpu_instances(gpu_id):
+            if gi_id is not None and gi_status['gi_id'] != gi_id:
+                continue
+            g_id, i_id = gi_status['gpu_id'], gi_status['gi_id']
+            ci_profile_list.extend(self._profile_table(
+                ('ci_profiles', self._gpu_model(g_id), gi_status['profile_id']),
+                functools.partial(self.backend.list_compute_instance_profiles, g_id, i_id),
+                {'gpu_id': g_id, 'gi_id': i_id},
+            ))
+        return ci_profile_list
+
+
+def get_device_inventory(backend: MIGBackend = None):
+    """The inventory shared by all users of a backend (default to the shared default backend), so that
+    the mutations made by any :class:`MIGController` on the backend invalidate it.
+    """
+    backend = backend or get_default_backend()
+    inventory = getattr(backend, '_device_inventory', None)
+    if inventory is None:
+        inventory = backend._device_inventory = DeviceInventory(backend)
+    return inventory
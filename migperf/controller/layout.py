@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Declarative MIG layout of a GPU, and the diff between a desired layout and the current GI / CI state.
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Union
+
+PROFILE_NAME_PATTERN = re.compile(r'^(?:MIG\s+)?(\d+g\.\d+gb(?:\+me)?)$')
+LAYOUT_ITEM_PATTERN = re.compile(r'^(?:(\d+)\s*x\s*)?([^:]+?)(?::(\d+))?$')
+
+
+def normalize_profile_name(profile: Union[str, int]):
+    """Normalize a GI profile to the short name (e.g., :code:`MIG 1g.10gb` -> :code:`1g.10gb`).
+    Profile IDs (int or digit string) are returned as int.
+    """
+    if isinstance(profile, int):
+        return profile
+    profile = profile.strip()
+    if profile.isdigit():
+        return int(profile)
+    match = PROFILE_NAME_PATTERN.match(profile)
+    if match is None:
+        raise ValueError(f'Unrecognized GPU instance profile: {profile}')
+    return match.group(1)
+
+
+def profile_compute_slices(profile: Union[str, int]):
+    """Number of compute slices of a GI profile, parsed from its name (e.g., :code:`3g.40gb` -> 3).
+    Returns 0 if the profile is given as a profile ID.
+    """
+    profile = normalize_profile_name(profile)
+    if isinstance(profile, int):
+        return 0
+    return int(profile.split('g.', 1)[0])
+
+
+class GPUInstanceSpec(NamedTuple):
+    """Desired GPU instance.
+
+    Attributes:
+        profile (str or int): GI profile name (e.g., :code:`1g.10gb`) or profile ID.
+        placement (int, optional): Placement start index. :code:`None` to let the driver decide.
+        ci_profiles (list of str, optional): Compute instance profiles to create inside the GI.
+            :code:`None` means a single default compute instance spanning the whole GI, and an empty list
+            means no compute instance.
+    """
+    profile: Union[str, int]
+    placement: Optional[int] = None
+    ci_profiles: Optional[tuple] = None
+
+    def matches_profile(self, gi_status: dict):
+        if isinstance(self.profile, int):
+            return self.profile == gi_status['profile_id']
+        return self.profile == normalize_profile_name(gi_status['name'])
+
+    def matches_placement(self, gi_status: dict):
+        if self.placement is None:
+            return True
+        placement = gi_status.get('placement', None)
+        return placement is not None and placement['start'] == self.placement
+
+    def matches_compute_instances(self, gi_status: dict, ci_status_list: List[dict]):
+        ci_names = sorted(ci['name'] for ci in ci_status_list)
+        if self.ci_profiles is None:
+            # the default CI has the same name as its GI
+            return ci_names == [gi_status['name']]
+        return ci_names == sorted(f'MIG {ci_profile}' for ci_profile in self.ci_profiles)
+
+    def to_profile_str(self):
+        if self.placement is None:
+            return str(self.profile)
+        return f'{self.profile}:{self.placement}'
+
+
+class MIGLayout(object):
+    """Desired state of the MIG partition on a single GPU.
+
+    Examples:
+        >>> MIGLayout(['1g.10gb', '1g.10gb', '2g.20gb:4'])
+        >>> MIGLayout.parse('2x2g.20gb,3g.40gb')
+        >>> MIGLayout.from_config([{'gi_profile': '1g.10gb'}, {'gi_profile': '3g.40gb', 'placement': 4}])
+    """
+
+    def __init__(self, gpu_instances: List[Union[str, GPUInstanceSpec]] = None):
+        self.gpu_instances: List[GPUInstanceSpec] = list()
+        for gpu_instance in gpu_instances or list():
+            if isinstance(gpu_instance, str):
+                self.gpu_instances.extend(self._parse_item(gpu_instance))
+            else:
+                self.gpu_instances.append(GPUInstanceSpec(
+                    normalize_profile_name(gpu_instance.profile), gpu_instance.placement,
+                    tuple(gpu_instance.ci_profiles) if gpu_instance.ci_profiles is not None else None,
+                ))
+
+    @staticmethod
+    def _parse_item(item: str):
+        match = LAYOUT_ITEM_PATTERN.match(item.strip())
+        if match is None:
+            raise ValueError(f'Unrecognized MIG layout item: {item}')
+        count, profile, placement = match.groups()
+        count = int(count) if count else 1
+        if placement is not None and count > 1:
+            raise ValueError(f'Placement cannot be specified for repeated profiles: {item}')
+        placement = int(placement) if placement is not None else None
+        return [GPUInstanceSpec(normalize_profile_name(profile), placement)] * count
+
+    @classmethod
+    def parse(cls, layout_str: str):
+        """Parse a layout string, e.g. :code:`4x1g.10gb` or :code:`2g.20gb:0,1g.10gb,1g.10gb`."""
+        return cls([item for item in layout_str.split(',') if item.strip()])
+
+    @classmethod
+    def from_config(cls, mig_devices: List[dict]):
+        """Build a layout from the :code:`devices` section of a GPU configuration."""
+        gpu_instances = list()
+        for mig_device in mig_devices:
+            ci_profiles = mig_device.get('ci_profiles', None)
+            if isinstance(ci_profiles, str):
+                ci_profiles = ci_profiles.split(',')
+            gpu_instances.append(GPUInstanceSpec(
+                mig_device['gi_profile'], mig_device.get('placement', None), ci_profiles,
+            ))
+        return cls(gpu_instances)
+
+    @classmethod
+    def from_status(cls, gi_status_list: List[dict], ci_status_list: List[dict]):
+        """Snapshot the current GI / CI state of a GPU as a layout, with the placement of every GPU instance
+        pinned, so that reconciling to the layout restores the state exactly.
+        """
+        ci_status_by_gi: Dict[int, List[dict]] = dict()
+        for ci_status in ci_status_list:
+            ci_status_by_gi.setdefault(ci_status['gi_id'], list()).append(ci_status)
+
+        gpu_instances = list()
+        for gi_status in sorted(gi_status_list, key=lambda gi: gi['placement']['start']):
+            ci_names = sorted(ci['name'] for ci in ci_status_by_gi.get(gi_status['gi_id'], list()))
+            if ci_names == [gi_status['name']]:
+                ci_profiles = None
+            else:
+                ci_profiles = tuple(name.split()[-1] for name in ci_names)
+            gpu_instances.append(GPUInstanceSpec(
+                normalize_profile_name(gi_status['name']), gi_status['placement']['start'], ci_profiles,
+            ))
+        return cls(gpu_instances)
+
+    def __len__(self):
+        return len(self.gpu_instances)
+
+    def __iter__(self):
+        return iter(self.gpu_instances)
+
+    def __eq__(self, other):
+        if not isinstance(other, MIGLayout):
+            return NotImplemented
+        return sorted(map(repr, self.gpu_instances)) == sorted(map(repr, other.gpu_instances))
+
+    def __repr__(self):
+        return f'MIGLayout({[spec.to_profile_str() for spec in self.gpu_instances]})'
+
+
+class LayoutDiff(object):
+    """Minimal set of operations to bring a GPU from its current state to a desired :class:`MIGLayout`.
+
+    Attributes:
+        keep (list of dict): Status of the GPU instances that already match the layout.
+        reset_compute_instances (list of tuple): :code:`(gi_status, spec)` of kept GPU instances whose
+            compute instances do not match and need to be recreated.
+        destroy (list of dict): Status of the GPU instances to destroy.
+        create (list of GPUInstanceSpec): GPU instances to create.
+    """
+
+    def __init__(self):
+        self.keep: List[dict] = list()
+        self.reset_compute_instances: List[tuple] = list()
+        self.destroy: List[dict] = list()
+        self.create: List[GPUInstanceSpec] = list()
+
+    @property
+    def is_empty(self):
+        return not (self.reset_compute_instances or self.destroy or self.create)
+
+    def __repr__(self):
+        return (
+            f'LayoutDiff(keep={[gi["gi_id"] for gi in self.keep]}, '
+            f'reset_compute_instances={[gi["gi_id"] for gi, _ in self.reset_compute_instances]}, '
+            f'destroy={[gi["gi_id"] for gi in self.destroy]}, '
+            f'create={[spec.to_profile_str() for spec in self.create]})'
+        )
+
+
+def diff_layout(layout: MIGLayout, gi_status_list: List[dict], ci_status_list: List[dict]):
+    """Compute the minimal diff between the current GI / CI state of a GPU and a desired layout.
+
+    GPU instances with a matching profile (and placement, if the layout specifies one) are kept. Kept instances
+    whose compute instances differ only get their compute instances recreated.
+
+    Args:
+        layout (MIGLayout): Desired layout.
+        gi_status_list (list of dict): Current GPU instances, as returned by
+            :meth:`MIGController.check_gpu_instance_status`.
+        ci_status_list (list of dict): Current compute instances, as returned by
+            :meth:`MIGController.check_compute_instance_status`.
+    Returns:
+        LayoutDiff: The operations to apply.
+    """
+    diff = LayoutDiff()
+    ci_status_by_gi: Dict[int, List[dict]] = dict()
+    for ci_status in ci_status_list:
+        ci_status_by_gi.setdefault(ci_status['gi_id'], list()).append(ci_status)
+
+    unmatched_gis = sorted(gi_status_list, key=lambda gi: gi['gi_id'])
+    # match the placement-constrained specs first, so that they are not taken by the unconstrained ones
+    specs = sorted(layout.gpu_instances, key=lambda spec: spec.placement is None)
+    for spec in specs:
+        candidates = [gi for gi in unmatched_gis if spec.matches_profile(gi) and spec.matches_placement(gi)]
+        if not candidates:
+            diff.create.append(spec)
+            continue
+        # prefer the GPU instance whose compute instances already match
+        candidates.sort(
+            key=lambda gi: not spec.matches_compute_instances(gi, ci_status_by_gi.get(gi['gi_id'], list()))
+        )
+        gi_status = candidates[0]
+        unmatched_gis.remove(gi_status)
+        diff.keep.append(gi_status)
+        if not spec.matches_compute_instances(gi_status, ci_status_by_gi.get(gi_status['gi_id'], list())):
+            diff.reset_compute_instances.append((gi_status, spec))
+
+    diff.destroy = unmatched_gis
+    # create large instances first, which reduces the chance of fragmenting the GPU
+    diff.create.sort(key=lambda spec: (spec.placement is None, -profile_compute_slices(spec.profile)))
+    return diff
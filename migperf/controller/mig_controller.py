@@ -7,73 +7,155 @@ MIG controller Python wrapper to create/destroy instances, query status for MIG-
 
 References: https://github.com/nvidia/mig-parted
 """
-import re
-import subprocess
-from typing import List, Union
+import collections
+import contextlib
+import functools
+import inspect
+from typing import List, Optional, Union
+
+from .backend import MIGBackend, get_default_backend
+from .events import timed
+from .inventory import DeviceInventory, get_device_inventory
+from .layout import LayoutDiff, MIGLayout, diff_layout, normalize_profile_name
+from .planner import build_profile_placements, plan_placement
+
+
+def instrumented(func):
+    """Emit an :code:`operation` event timing each call of a :class:`MIGController` method, or of an
+    :class:`AsyncMIGController` coroutine, see :mod:`migperf.controller.events`.
+    """
+    signature = inspect.signature(func)
+
+    def timed_call(self, args, kwargs):
+        arguments = {k: v for k, v in signature.bind(self, *args, **kwargs).arguments.items() if k != 'self'}
+        return timed('operation', func.__name__, gpu_id=arguments.get('gpu_id', None), arguments=arguments)
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with timed_call(self, args, kwargs) as event:
+                result = await func(self, *args, **kwargs)
+                if isinstance(result, int):
+                    event['exit_code'] = result
+            return result
+    else:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with timed_call(self, args, kwargs) as event:
+                result = func(self, *args, **kwargs)
+                if isinstance(result, int):
+                    event['exit_code'] = result
+            return result
+
+    return wrapper
+
+
+def mutating(func):
+    """Mark a :class:`MIGController` method (or an :class:`AsyncMIGController` coroutine) as changing the device
+    state, so that the device inventory is invalidated after it runs (even if it fails halfway), and the call is
+    recorded by the open transactions on the GPU. The calls are timed as well, see :func:`instrumented`.
+    """
+    signature = inspect.signature(func)
+    func = instrumented(func)
+
+    @contextlib.contextmanager
+    def recorded_call(self, args, kwargs):
+        arguments = signature.bind(self, *args, **kwargs).arguments
+        record = {
+            'operation': func.__name__,
+            'arguments': {k: v for k, v in arguments.items() if k != 'self'},
+            'error': None,
+        }
+        for transaction in list(self._transactions):
+            if arguments.get('gpu_id', None) in (None, transaction.gpu_id):
+                transaction.mutations.append(record)
+        try:
+            yield
+        except Exception as e:
+            record['error'] = e
+            raise
+        finally:
+            self.inventory.invalidate()
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with recorded_call(self, args, kwargs):
+                return await func(self, *args, **kwargs)
+    else:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with recorded_call(self, args, kwargs):
+                return func(self, *args, **kwargs)
+
+    return wrapper
+
+
+class MIGTransaction(object):
+    """Journal of a transaction on a GPU, see :meth:`MIGController.transaction`.
+
+    Attributes:
+        gpu_id (int): ID of the GPU.
+        mig_enabled (bool): Whether MIG was enabled on the GPU when the transaction began.
+        snapshot (MIGLayout): The layout of the GPU when the transaction began, with pinned placements.
+        mutations (list of dict): The mutating operations executed on the GPU within the transaction. The
+            dictionary contains: :code:`operation`, :code:`arguments` and :code:`error` (the exception raised,
+            or :code:`None`). Operations executed by other operations (e.g., by :meth:`MIGController.reconcile`)
+            are recorded as well.
+        rolled_back (bool): Whether the GPU has been restored to the snapshot.
+    """
+
+    def __init__(self, gpu_id: int, mig_enabled: bool, snapshot: MIGLayout):
+        self.gpu_id = gpu_id
+        self.mig_enabled = mig_enabled
+        self.snapshot = snapshot
+        self.mutations: List[dict] = list()
+        self.rolled_back = False
+
+    def __repr__(self):
+        return (
+            f'MIGTransaction(gpu_id={self.gpu_id}, snapshot={self.snapshot}, '
+            f'mutations={[record["operation"] for record in self.mutations]}, rolled_back={self.rolled_back})'
+        )
 
 
 class MIGController(object):
-    CREATE_GI_PATTERN = re.compile(r'.+GPU instance ID\s+(\d+).+\s+(\d+).+(MIG\s+\d+g\.\d+gb)\s+\(ID\s+(\d+)')
-    CREATE_CI_PATTERN = re.compile(
-        r'.+compute instance ID\s+(\d+).+\s(\d+).+\s(\d+).+(MIG\s+\d+g\.\d+gb|MIG\s+\d+c\.\d+\.\d+gb)\s+\(ID\s+(\d+)'
-    )
-    GI_STATUS_PATTERN = re.compile(r'\|\s+(\d+)\s+(MIG\s+\d+g\.\d+gb)\s+(\d+)\s+(\d+)\s+(\d+)\:(\d+)')
-    CI_STATUS_PATTERN = re.compile(
-        r'\|\s+(\d+)\s+(\d+)\s+(MIG\s+\d+g\.\d+gb|MIG\s+\d+c\.\d+g\.\d+gb)\s+(\d+)\s+(\d+)\s+(\d+)\:(\d+)'
-    )
+    """MIG controller.
 
-    @classmethod
-    def enable_mig(cls, gpu_id: int = None):
+    Args:
+        backend (MIGBackend, optional): The backend to query and configure the GPU devices. Default to the
+            shared backend given by :func:`get_default_backend` (NVML if available, otherwise :code:`nvidia-smi`).
+        inventory (DeviceInventory, optional): The cached device topology serving the GI / CI status queries.
+            Default to the inventory shared by the users of the backend.
+    """
+
+    def __init__(self, backend: MIGBackend = None, inventory: DeviceInventory = None):
+        self.backend = backend or get_default_backend()
+        self.inventory = inventory or get_device_inventory(self.backend)
+        self._transactions: List[MIGTransaction] = list()
+
+    @mutating
+    def enable_mig(self, gpu_id: int = None):
         """sudo nvidia-smi -i ${gpu_id} -mig 1"""
-        cmd = ['sudo', 'nvidia-smi', '-mig', '1']
-        if gpu_id is not None:
-            # Enable NVIDIA MIG with specific GPU
-            cmd.extend(['-i', str(gpu_id)])
-        # Enable NVIDIA MIG
-        return subprocess.call(cmd)
+        return self.backend.enable_mig(gpu_id)
 
-    @classmethod
-    def check_mig_status(cls, gpu_id: int = None):
+    @instrumented
+    def check_mig_status(self, gpu_id: int = None):
         """Execute command: nvidia-smi --query-gpu=mig.mode.current,mig.mode.pending --format=csv,noheader
 
         Returns:
             A list of tuple, contains all GPU's current MIG status and pending MIG status if `gpu_id` is not specified.
             Or a tuple contains the specified GPU's current MIG status and pending MIG status if `gpu_id` is provided.
         """
-        p = subprocess.Popen(
-            [
-                'nvidia-smi', '--query-gpu=mig.mode.current,mig.mode.pending',
-                '--format=csv,noheader',
-            ],
-            stdout=subprocess.PIPE,
-            encoding='utf-8',
-        )
-        output, _ = p.communicate()
-        # parse output CSV string
-        mig_status_list = list()
-        for line in output.splitlines():
-            current_state, pending_state = line.split(', ')
-            current_state, pending_state = (
-                current_state == 'Enabled'), (pending_state == 'Enabled')
-            mig_status_list.append((current_state, pending_state))
-        # select the intereted GPU ID
-        if gpu_id is not None:
-            return mig_status_list[gpu_id]
-        else:
-            return mig_status_list
+        return self.backend.check_mig_status(gpu_id)
 
-    @classmethod
-    def disable_mig(cls, gpu_id: int = None):
+    @mutating
+    def disable_mig(self, gpu_id: int = None):
         """Execute command: sudo nvidia-smi -i ${gpu_id} -mig 0"""
-        cmd = ['sudo', 'nvidia-smi', '-mig', '0']
-        if gpu_id is not None:
-            # Disable NVIDIA MIG with specified GPU
-            cmd.extend(['-i', str(gpu_id)])
-        # Disable NVIDIA MIG
-        return subprocess.call(cmd)
+        return self.backend.disable_mig(gpu_id)
 
-    @classmethod
-    def create_gpu_instance(cls, gi_profiles: Union[str, List[str]], gpu_id: int = None, create_ci: bool = False):
+    @mutating
+    def create_gpu_instance(self, gi_profiles: Union[str, List[str]], gpu_id: int = None, create_ci: bool = False):
         """Create GPU instance on MIG-enabled GPU device.
         The function is equivalant to executing the command: 
         :code:`sudo nvidia-smi mig -i ${gpu_id} -cgi ${gi_profiles}`
@@ -101,32 +183,12 @@ class MIGController(object):
         if isinstance(gi_profiles, list):
             gi_profiles = ','.join(gi_profiles)
 
-        cmd = ['sudo', 'nvidia-smi', 'mig', '-i', str(gpu_id), '-cgi', gi_profiles]
-        if create_ci:
-            # Also create the corresponding compute Instances (CI)
-            cmd.append('-C')
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf-8')
-        output, _ = p.communicate()
-        # Check if there are something failed
-        if 'Failed' in output or 'No' in output:
-            raise ValueError(
-                f'Failed to create GPU instance when executing the command: {" ".join(cmd)}\n'
-                f'{output}'
-            )
-
-        gi_status_list = list()
-        for line in output.splitlines():
-            match_groups = cls.CREATE_GI_PATTERN.match(line)
-            if match_groups is not None:
-                gi_id, g_id, name, profile_id = match_groups.groups()
-                gi_status_list.append({
-                    'gpu_id': int(g_id), 'name': name, 'profile_id': int(profile_id), 'gi_id': int(gi_id),
-                })
-
-        return gi_status_list
+        return self.backend.create_gpu_instance(gi_profiles, gpu_id=gpu_id, create_ci=create_ci)
 
-    @classmethod
-    def create_compute_instance(cls, ci_profiles: Union[str, List[str]] = None, gpu_id: int = None, gi_id: int = None):
+    @mutating
+    def create_compute_instance(
+            self, ci_profiles: Union[str, List[str]] = None, gpu_id: int = None, gi_id: Union[int, List[int]] = None
+    ):
         """Create compute instance on MIG-enabled GPU device.
         The function is equivalant to executing the command: 
         :code:`sudo nvidia-smi mig -i ${gpu_id} -gi ${gi_id} -cci ${ci_profiles}`
@@ -140,7 +202,7 @@ class MIGController(object):
             gpu_id (int, optional): ID of the specified GPU to create the compute instance.
                 Not specifying :code:`gpu_id` will result in create compute instances on
                 every available GPUs.
-            gi_id (bool, optional): ID of the specified GPU instance to create 
+            gi_id (int or list of int, optional): ID(s) of the specified GPU instance to create
                 the compute instance. Not specifying :code:`gi_id` will result in
                 create compute instances on every avaliable GPU instances.
         Returns:
@@ -152,139 +214,312 @@ class MIGController(object):
         """
         if isinstance(ci_profiles, list):
             ci_profiles = ','.join(ci_profiles)
+        if isinstance(gi_id, list):
+            gi_id = ','.join(map(str, gi_id))
 
-        cmd = ['sudo', 'nvidia-smi', 'mig', '-cci']
-        if gpu_id is not None:
-            cmd.extend(['-i', str(gpu_id)])
-        if gi_id is not None:
-            cmd.extend(['-gi', str(gi_id)])
-        if ci_profiles is not None:
-            cmd.append(ci_profiles)
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, encoding='utf-8')
-        output, _ = p.communicate()
-        # Check if there are something failed
-        if 'Failed' in output or 'No' in output:
-            raise ValueError(
-                f'Failed to create compute instance when executing the command: {" ".join(cmd)}\n'
-                f'{output}'
-            )
-
-        ci_status_list = list()
-        for line in output.splitlines():
-            match_groups = cls.CREATE_CI_PATTERN.match(line)
-            if match_groups is not None:
-                ci_id, g_id, gi_id, name, profile_id = match_groups.groups()
-                ci_status_list.append({
-                    'gpu_id': int(g_id), 'gi_id': int(gi_id), 'name': name, 'ci_id': int(ci_id), 
-                    'profile_id': int(profile_id),
-                })
-    
-        return ci_status_list
+        return self.backend.create_compute_instance(ci_profiles, gpu_id=gpu_id, gi_id=gi_id)
 
-    @classmethod
-    def check_gpu_instance_status(cls, gpu_id: int = None):
+    @instrumented
+    def check_gpu_instance_status(self, gpu_id: int = None):
         """sudo nvidia-smi mig -lgi -i ${gpu_id}
+        The status is served from the device inventory, which is refreshed after any change made by the controller.
         
         Returns: list of dict.
             A list of GPU Instance status. Example: [{'gpu': 0, 'gi_id': 13, 'name': 'MIG 1g.10gb', 
                 'profile_id': 19, 'ci_id': 1, 'placement': {'start': 0, 'size': 1}}]
         """
-        cmd = ['sudo', 'nvidia-smi', 'mig', '-lgi']
-        if gpu_id is not None:
-            cmd.extend(['-i', str(gpu_id)])
-
-        p = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            encoding='utf-8',
-        )
-        output, _ = p.communicate()
-        # parse output CSV string
-        gi_status_list = list()
-        for line in output.splitlines():
-            match_groups = cls.GI_STATUS_PATTERN.match(line)
-            if match_groups:
-                g_id, name, profile_id, gi_id, placement_start, placement_size = match_groups.groups()
-                gi_status_list.append({
-                    'gpu_id': int(g_id), 'name': name, 'profile_id': int(profile_id), 'gi_id': int(gi_id),
-                    'placement': {'start': int(placement_start), 'size': int(placement_size)}
-                })
-        
-        return gi_status_list
-    
-    @classmethod
-    def check_compute_instance_status(cls, gpu_id: int = None, gi_id: int = None):
+        return self.inventory.gpu_instances(gpu_id)
+
+    @instrumented
+    def check_compute_instance_status(self, gpu_id: int = None, gi_id: int = None):
         """sudo nvidia-smi -lci -i ${gpu_id} -gi ${gi_id}
+        The status is served from the device inventory, which is refreshed after any change made by the controller.
         
         Returns: list of dict.
             A list of Compute Instance status. Example: [{'gpu': 0, 'name': 'MIG 1g.10gb', 'profile_id': 19,
                   'gi_id': 11, 'placement': {'start': 4, 'size': 1}}]
         """
-        cmd = ['sudo', 'nvidia-smi', 'mig', '-lci']
-        if gpu_id is not None:
-            cmd.extend(['-i', str(gpu_id)])
-        if gi_id is not None:
-            cmd.extend(['-gi', str(gi_id)])
-
-        p = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            encoding='utf-8',
-        )
-        output, _ = p.communicate()
-        # parse output CSV string
-        ci_status_list = list()
-        for line in output.splitlines():
-            match_groups = cls.CI_STATUS_PATTERN.match(line)
-            if match_groups:
-                g_id, gi_id, name, profile_id, ci_id, placement_start, placement_size = match_groups.groups()
-                ci_status_list.append({
-                    'gpu_id': int(g_id), 'gi_id': int(gi_id), 'name': name, 'profile_id': int(profile_id), 
-                    'ci_id': int(ci_id), 'placement': {'start': int(placement_start), 'size': int(placement_size)}
-                })
-        return ci_status_list
+        return self.inventory.compute_instances(gpu_id, gi_id)
 
-    @classmethod
-    def destroy_gpu_instance(cls, gpu_id: int = None, gi_ids: Union[int, List[int]] = None):
+    @mutating
+    def destroy_gpu_instance(self, gpu_id: int = None, gi_ids: Union[int, List[int]] = None):
         """sudo nvidia-smi mig -dgi -gi ${gi_id} -i ${gpu_id}"""
-        cmd = ['sudo', 'nvidia-smi', 'mig', '-dgi']
         if isinstance(gi_ids, list):
-            gi_ids = ','.join(gi_ids)
-        if gi_ids is not None:
-            cmd.extend(['-gi', str(gi_ids)])
-        if gpu_id is not None:
-            cmd.extend(['-i', str(gpu_id)])
-        return subprocess.call(cmd)
+            gi_ids = ','.join(map(str, gi_ids))
+        return self.backend.destroy_gpu_instance(gpu_id=gpu_id, gi_ids=gi_ids)
 
-    @classmethod
-    def destroy_compute_instance(cls, gpu_id: int = None, gi_id: int = None, ci_ids: Union[int, List[int]] = None):
+    @mutating
+    def destroy_compute_instance(
+            self, gpu_id: int = None, gi_id: Union[int, List[int]] = None, ci_ids: Union[int, List[int]] = None
+    ):
         """sudo nvidia-smi mig -dci -gi ${gi_id} -ci ${ci_ids} -i ${gpu_id}"""
-        cmd = ['sudo', 'nvidia-smi', 'mig', '-dci']
-
         if isinstance(ci_ids, list):
-            ci_ids = ','.join(ci_ids)
-        if ci_ids is not None:
-            cmd.extend(['-ci', str(ci_ids)])
-        if gi_id is not None:
-            cmd.extend(['-gi', str(gi_id)])
-        if gpu_id is not None:
-            cmd.extend(['-i', str(gpu_id)])
-        return subprocess.call(cmd)
-    
-    @classmethod
-    def list_gpu_instance_profiles(cls, gpu_id: int = None):
-        """sudo nvidia-smi -lgip -i ${gpu_id}"""
-        # TODO: list all GPU instance profiles
-        raise NotImplementedError()
-    
+            ci_ids = ','.join(map(str, ci_ids))
+        if isinstance(gi_id, list):
+            gi_id = ','.join(map(str, gi_id))
+        return self.backend.destroy_compute_instance(gpu_id=gpu_id, gi_id=gi_id, ci_ids=ci_ids)
+
+    @instrumented
+    def list_gpu_instance_profiles(self, gpu_id: int = None):
+        """sudo nvidia-smi mig -lgip -i ${gpu_id}
+        The profile table is static for a GPU model, it is cached per GPU model by the device inventory.
+
+        Returns: list of dict.
+            A list of GPU instance profiles. Example: [{'gpu_id': 0, 'name': 'MIG 1g.10gb', 'profile_id': 19,
+                'instances_total': 7, 'memory_gib': 9.5, 'p2p': False, 'sm': 14, 'dec': 0, 'enc': 0, 'ce': 1,
+                'jpeg': 0, 'ofa': 0}]
+        """
+        return self.inventory.gpu_instance_profiles(gpu_id)
+
+    @instrumented
+    def list_gpu_instance_possible_placements(self, gpu_id: int = None):
+        """sudo nvidia-smi mig -lgipp -i ${gpu_id}
+        The placements are static for a GPU model, they are cached per GPU model by the device inventory.
+
+        Returns: list of dict.
+            A list of possible placements of every GPU instance profile. Example: [{'gpu_id': 0, 'profile_id': 9,
+                'placements': [{'start': 0, 'size': 4}, {'start': 4, 'size': 4}]}]
+        """
+        return self.inventory.gpu_instance_possible_placements(gpu_id)
+
+    @instrumented
+    def list_compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None):
+        """sudo nvidia-smi mig -lcip -i ${gpu_id} -gi ${gi_id}
+        The profile table is static for a GPU model and GI profile, it is cached by the device inventory.
+
+        Returns: list of dict.
+            A list of compute instance profiles of every GPU instance. Example: [{'gpu_id': 0, 'gi_id': 1,
+                'name': 'MIG 1c.3g.40gb', 'profile_id': 0, 'default': False, 'instances_total': 3, 'sm': 14,
+                'dec': 2, 'enc': 0, 'ofa': 0, 'ce': 3, 'jpeg': 0}]
+        """
+        return self.inventory.compute_instance_profiles(gpu_id, gi_id)
+
+    def snapshot_layout(self, gpu_id: int):
+        """The current layout of a GPU, with the placement and compute instances of every GPU instance, see
+        :meth:`MIGLayout.from_status`. The GI / CI state is re-read from the backend.
+        """
+        self.inventory.invalidate()
+        return MIGLayout.from_status(
+            self.check_gpu_instance_status(gpu_id=gpu_id), self.check_compute_instance_status(gpu_id=gpu_id),
+        )
+
+    @contextlib.contextmanager
+    def transaction(self, gpu_id: int):
+        """Reconfigure a GPU transactionally. The GI / CI state of the GPU is snapshotted when the transaction
+        begins, and every mutating operation on the GPU made through this controller is recorded. If any
+        exception is raised within the transaction, the GPU is restored to the snapshot (MIG mode, GPU instances
+        with their placements and compute instances) before the exception is propagated.
+
+        Args:
+            gpu_id (int): ID of the GPU.
+        Yields:
+            MIGTransaction: The transaction journal.
+        Raises:
+            ValueError: If the rollback fails. The original exception is chained as the context.
+
+        Examples:
+            >>> mig_controller = MIGController()
+            >>> with mig_controller.transaction(gpu_id=0):
+            ...     mig_controller.destroy_compute_instance(gpu_id=0)
+            ...     mig_controller.destroy_gpu_instance(gpu_id=0)
+            ...     mig_controller.create_gpu_instance(['3g.40gb', '3g.40gb'], gpu_id=0, create_ci=True)
+        """
+        mig_enabled = self.check_mig_status(gpu_id)[0]
+        snapshot = self.snapshot_layout(gpu_id) if mig_enabled else MIGLayout()
+        transaction = MIGTransaction(gpu_id, mig_enabled, snapshot)
+        self._transactions.append(transaction)
+        try:
+            yield transaction
+        except BaseException:
+            self._transactions.remove(transaction)
+            if transaction.mutations:
+                try:
+                    self._rollback(transaction)
+                except Exception as e:
+                    raise ValueError(f'Failed to roll back GPU {gpu_id} to {snapshot}') from e
+                transaction.rolled_back = True
+            raise
+        else:
+            self._transactions.remove(transaction)
+
+    def _rollback(self, transaction: MIGTransaction):
+        gpu_id = transaction.gpu_id
+        mig_enabled = self.check_mig_status(gpu_id)[0]
+        if transaction.mig_enabled:
+            if not mig_enabled and self.enable_mig(gpu_id) != 0:
+                raise ValueError(f'Failed to enable MIG on GPU {gpu_id}')
+            self.reconcile(gpu_id, transaction.snapshot)
+        elif mig_enabled:
+            self.reconcile(gpu_id, MIGLayout())
+            if self.disable_mig(gpu_id) != 0:
+                raise ValueError(f'Failed to disable MIG on GPU {gpu_id}')
+
+    def get_profile_placements(self, gpu_id: int):
+        """Placement rules of the GI profiles supported by a GPU, see :func:`build_profile_placements`."""
+        return build_profile_placements(
+            self.list_gpu_instance_profiles(gpu_id), self.list_gpu_instance_possible_placements(gpu_id),
+        )
+
+    def plan_layout(self, gpu_id: int, layout: Union[MIGLayout, str, List[str]], existing: List[dict] = None):
+        """Assign a placement to every GPU instance of a layout, minimizing the fragmentation of the free slots.
+
+        Args:
+            gpu_id (int): ID of the GPU.
+            layout (MIGLayout, str or list of str): The GPU instances to place.
+            existing (list of dict, optional): Status of the GPU instances kept on the GPU, whose slots are
+                not available. Default to none, i.e., planning for an empty GPU.
+        Returns:
+            PlacementPlan: The assignment of placements. :code:`plan.to_layout()` gives the pinned layout.
+        Raises:
+            ValueError: If the layout cannot be placed on the GPU.
+        """
+        layout = self._to_layout(layout)
+        self.inventory.invalidate()
+        plan = self._plan(self.get_profile_placements(gpu_id), layout, existing or list())
+        if plan is None:
+            raise ValueError(f'{layout} cannot be placed on GPU {gpu_id}')
+        return plan
+
+    @staticmethod
+    def _to_layout(layout: Union[MIGLayout, str, List[str]]):
+        if isinstance(layout, str):
+            return MIGLayout.parse(layout)
+        elif not isinstance(layout, MIGLayout):
+            return MIGLayout(layout)
+        return layout
+
+    @staticmethod
+    def _plan(profile_placements: dict, layout: MIGLayout, existing: List[dict]):
+        occupied = [(gi['placement']['start'], gi['placement']['size']) for gi in existing]
+        profile_counts = collections.Counter(normalize_profile_name(gi['name']) for gi in existing)
+        return plan_placement(list(layout), profile_placements, occupied, profile_counts)
+
+    def _get_profile_placements_or_none(self, gpu_id: int):
+        try:
+            return self.get_profile_placements(gpu_id)
+        except NotImplementedError:
+            # the backend cannot list the placement rules, leave the placement to the driver
+            return None
+
     @classmethod
-    def list_gpu_instance_possible_placements(cls, gpu_id: int = None):
-        """sudo nvidia-smi -lgipp -i ${gpu_id}"""
-        # TODO: list all GPU instance possible placement
-        raise NotImplementedError()
-    
+    def _plan_diff(cls, gpu_id: int, layout: MIGLayout, diff: LayoutDiff, gi_status_list: List[dict],
+                   ci_status_list: List[dict], profile_placements: Optional[dict]):
+        """Pin the placements of the GPU instances to create, so that a layout which cannot be placed is
+        rejected before any change is made. If the new GPU instances do not fit around the kept ones, the whole
+        layout is re-planned, and the kept GPU instances in the way are recreated.
+        """
+        if not diff.create or not profile_placements:
+            return diff
+
+        plan = cls._plan(profile_placements, MIGLayout(diff.create), diff.keep)
+        if plan is not None:
+            diff.create = [spec._replace(placement=start) for spec, start, _ in plan.assignments]
+            return diff
+        plan = cls._plan(profile_placements, layout, list())
+        if plan is None:
+            raise ValueError(f'{layout} cannot be placed on GPU {gpu_id}')
+        return diff_layout(plan.to_layout(), gi_status_list, ci_status_list)
+
+    @instrumented
+    def reconcile(self, gpu_id: int, layout: Union[MIGLayout, str, List[str]], dry_run: bool = False):
+        """Bring the MIG partition of a GPU to the desired layout in one diffed pass.
+
+        The current GI / CI state is re-read from the backend once, GPU instances already matching the layout are
+        kept, and the remaining ones are destroyed / created with batched commands. The GPU instances to create are
+        assigned placements by the placement planner beforehand, so a layout that does not fit is rejected
+        without touching the GPU. The commands are:
+        :code:`sudo nvidia-smi mig -i ${gpu_id} -dci -gi ${gi_ids}`,
+        :code:`sudo nvidia-smi mig -i ${gpu_id} -dgi -gi ${gi_ids}` and
+        :code:`sudo nvidia-smi mig -i ${gpu_id} -cgi ${gi_profiles} -C`.
+        MIG mode is expected to be enabled on the GPU already. Only the destroy / create operations issued are
+        recorded by the open transactions, so a dry run or a rejected layout leaves them untouched.
+
+        Args:
+            gpu_id (int): ID of the GPU to reconfigure.
+            layout (MIGLayout, str or list of str): The desired layout. A string (e.g., :code:`2x2g.20gb`) or a
+                list of GI profiles is parsed into a :class:`MIGLayout`.
+            dry_run (bool, optional): Only compute the diff without applying it. Default to `False`.
+        Returns:
+            dict: The reconciliation result, contains :code:`gpu_id`, :code:`diff` (:class:`LayoutDiff`),
+                :code:`kept` (status of kept GPU instances), :code:`destroyed` (status of destroyed GPU
+                instances) and :code:`created` (status of created GPU instances).
+        Raises:
+            ValueError: If the layout cannot be placed on the GPU, or any of the destroy / create commands fails.
+        """
+        layout = self._to_layout(layout)
+        # the snapshot may be stale if the GPU was reconfigured by another process
+        self.inventory.invalidate()
+        return self._run_steps(self._reconcile_steps(gpu_id, layout, dry_run))
+
+    def _run_steps(self, steps):
+        """Drive a generator of controller calls (see :meth:`_reconcile_steps`), making the calls in turn."""
+        results = None
+        while True:
+            try:
+                calls = steps.send(results)
+            except StopIteration as stop:
+                return stop.value
+            results = [getattr(self, method)(**kwargs) for method, kwargs in calls]
+
     @classmethod
-    def list_compute_instance_profiles(cls, gpu_id: int = None, gi_id: int = None):
-        """sudo nvidia-smi -lcip -i ${gpu_id} -gi ${gi_id}"""
-        # TODO: list all compute instance profiles
-        raise NotImplementedError()
+    def _reconcile_steps(cls, gpu_id: int, layout: MIGLayout, dry_run: bool):
+        """The reconciliation, shared by :class:`MIGController` and :class:`AsyncMIGController`. The generator
+        yields the controller calls to make as a list of :code:`(method name, keyword arguments)`, which may run
+        concurrently, is sent back the list of their results, and returns the result of :meth:`reconcile`.
+        """
+        gi_status_list, ci_status_list = yield [
+            ('check_gpu_instance_status', {'gpu_id': gpu_id}), ('check_compute_instance_status', {'gpu_id': gpu_id}),
+        ]
+        diff = diff_layout(layout, gi_status_list, ci_status_list)
+        profile_placements = None
+        if diff.create:
+            profile_placements, = yield [('_get_profile_placements_or_none', {'gpu_id': gpu_id})]
+        diff = cls._plan_diff(gpu_id, layout, diff, gi_status_list, ci_status_list, profile_placements)
+        result = {'gpu_id': gpu_id, 'diff': diff, 'kept': diff.keep, 'destroyed': diff.destroy, 'created': list()}
+        if dry_run or diff.is_empty:
+            return result
+
+        # 1. destroy compute instances of the GPU instances to be destroyed or reset
+        gi_ids_with_ci = {ci_status['gi_id'] for ci_status in ci_status_list}
+        dci_gi_ids = [gi['gi_id'] for gi in diff.destroy] + [gi['gi_id'] for gi, _ in diff.reset_compute_instances]
+        dci_gi_ids = [gi_id for gi_id in dci_gi_ids if gi_id in gi_ids_with_ci]
+        if dci_gi_ids:
+            exit_code, = yield [('destroy_compute_instance', {'gpu_id': gpu_id, 'gi_id': dci_gi_ids})]
+            if exit_code != 0:
+                raise ValueError(f'Failed to destroy compute instances of GPU instances {dci_gi_ids} on GPU {gpu_id}')
+        # 2. destroy the unmatched GPU instances
+        if diff.destroy:
+            dgi_gi_ids = [gi['gi_id'] for gi in diff.destroy]
+            exit_code, = yield [('destroy_gpu_instance', {'gpu_id': gpu_id, 'gi_ids': dgi_gi_ids})]
+            if exit_code != 0:
+                raise ValueError(f'Failed to destroy GPU instances {dgi_gi_ids} on GPU {gpu_id}')
+        # 3. recreate compute instances of the kept GPU instances
+        yield from cls._create_compute_instance_steps(
+            gpu_id, [(gi['gi_id'], spec) for gi, spec in diff.reset_compute_instances],
+        )
+        # 4. create the missing GPU instances
+        if diff.create:
+            gi_profiles = [spec.to_profile_str() for spec in diff.create]
+            all_default_ci = all(spec.ci_profiles is None for spec in diff.create)
+            created, = yield [
+                ('create_gpu_instance', {'gi_profiles': gi_profiles, 'gpu_id': gpu_id, 'create_ci': all_default_ci}),
+            ]
+            if not all_default_ci:
+                yield from cls._create_compute_instance_steps(
+                    gpu_id, [(gi['gi_id'], spec) for gi, spec in zip(created, diff.create)]
+                )
+            result['created'] = created
+
+        return result
+
+    @staticmethod
+    def _create_compute_instance_steps(gpu_id: int, gi_specs: list):
+        """Create compute instances of a list of :code:`(gi_id, GPUInstanceSpec)`, batching the default ones."""
+        default_ci_gi_ids = [gi_id for gi_id, spec in gi_specs if spec.ci_profiles is None]
+        if default_ci_gi_ids:
+            yield [('create_compute_instance', {'gpu_id': gpu_id, 'gi_id': default_ci_gi_ids})]
+        for gi_id, spec in gi_specs:
+            if spec.ci_profiles:
+                yield [('create_compute_instance', {
+                    'ci_profiles': list(spec.ci_profiles), 'gpu_id': gpu_id, 'gi_id': gi_id,
+                })]
@@ -3,61 +3,473 @@ Author: Li Yuanming
 Email: yuanmingleee@gmail.com
 Date: Dec 09, 2022
 
-MPS Python wrapper to enable and disable MPS.
+MPS Python wrapper to enable and disable MPS, and to partition the GPU among the MPS clients.
+
+The MPS clients share all SMs and the whole device memory by default. To compare MPS with MIG on equal terms, a
+client is limited to the share of a MIG profile (see :func:`mig_profile_share`) either by its environment
+(:func:`mps_client_env`) or through the control daemon (:func:`set_default_active_thread_percentage`,
+:func:`set_active_thread_percentage`, ...). :class:`MPSControlSession` keeps one control connection open to issue
+many commands cheaply.
 """
+import collections
+import math
 import os
+import queue
+import re
 import subprocess
-from typing import TYPE_CHECKING
+import threading
+import time
+import warnings
+from typing import Dict, List, Optional, Union
 
-if TYPE_CHECKING:
-    from typing import List, Union
+from migperf.profiler.utils.stats import summarize
+from .events import timed, timed_command
+from .layout import normalize_profile_name
+from .simulator import get_gpu_model
 
 
-def enable_mps(gpu_ids: Union[int, List[int]] = None):
-    """nvidia-cuda-mps-control -d"""
+def mps_env(gpu_ids: Union[int, List[int]] = None):
+    """Environment of the MPS control daemon, which serves the GPUs :code:`gpu_ids` (default to all GPUs)."""
     env = os.environ.copy()
     # Concatenate CUDA_VISIBLE_DEVICES
     if gpu_ids is not None:
         if isinstance(gpu_ids, int):
             gpu_ids = [gpu_ids]
         env['CUDA_VISIBLE_DEVICES'] = ','.join(map(str, gpu_ids))
+    return env
+
+
+def _mps_gpu_id(gpu_ids: Union[int, List[int]] = None):
+    """GPU ID reported in the timing events, :code:`None` if the operation is on several GPUs."""
+    if isinstance(gpu_ids, int):
+        return gpu_ids
+    if gpu_ids is not None and len(gpu_ids) == 1:
+        return gpu_ids[0]
+    return None
+
+
+def enable_mps(gpu_ids: Union[int, List[int]] = None):
+    """nvidia-cuda-mps-control -d"""
+    env = mps_env(gpu_ids)
+    cmd = ['nvidia-cuda-mps-control', '-d']
 
     # Enable NVIDIA MPS
-    subprocess.call(
-        ['nvidia-cuda-mps-control', '-d'], 
-        stdout=subprocess.DEVNULL,
-        env=env,
-    )
+    with timed('operation', 'enable_mps', gpu_id=_mps_gpu_id(gpu_ids), arguments={'gpu_ids': gpu_ids}), \
+            timed_command(cmd) as event:
+        event['exit_code'] = subprocess.call(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            env=env,
+        )
 
     return True
 
 
 def check_mps_status():
     """pidof nvidia-cuda-mps-control"""
-    return_code = subprocess.call(
-        ['pidof', 'nvidia-cuda-mps-control'],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
+    cmd = ['pidof', 'nvidia-cuda-mps-control']
+    with timed('operation', 'check_mps_status', arguments={}), timed_command(cmd) as event:
+        return_code = event['exit_code'] = subprocess.call(
+            cmd,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
     return return_code == 0
 
 
 def disable_mps(gpu_ids: Union[int, List[int]] = None):
     """echo quit | nvidia-cuda-mps-control"""
-    env = os.environ.copy()
-    # Concatenate CUDA_VISIBLE_DEVICES
-    if gpu_ids is not None:
-        if isinstance(gpu_ids, int):
-            gpu_ids = [gpu_ids]
-        env['CUDA_VISIBLE_DEVICES'] = ','.join(map(str, gpu_ids))
+    env = mps_env(gpu_ids)
+    cmd = ['nvidia-cuda-mps-control']
+
+    with timed('operation', 'disable_mps', gpu_id=_mps_gpu_id(gpu_ids), arguments={'gpu_ids': gpu_ids}), \
+            timed_command(cmd) as event:
+        p = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            env=env,
+        )
+        p.communicate(input=b'quit')
+        event['exit_code'] = p.returncode
 
-    p = subprocess.Popen(    
-        ['nvidia-cuda-mps-control'], 
-        stdin=subprocess.PIPE, 
-        stdout=subprocess.DEVNULL,
-        env=env,
-    )
-    p.communicate(input=b'quit')
-    
     return True
 
+
+def format_pinned_mem_limit(limit: Union[int, str]):
+    """Format a pinned device memory limit, given in MiB or as a string with a unit (e.g., :code:`10G`)."""
+    if isinstance(limit, str):
+        if not re.fullmatch(r'\d+[MG]?', limit):
+            raise ValueError(f'Invalid pinned device memory limit {limit!r}, expected e.g. 512M or 10G')
+        return limit
+    return f'{int(limit)}M'
+
+
+def mps_client_env(
+        active_thread_percentage: Optional[float] = None,
+        pinned_mem_limit: Union[int, str, Dict[int, Union[int, str]]] = None,
+        gpu_ids: Union[int, List[int]] = None,
+):
+    """Environment of an MPS client limited to a share of the GPU.
+
+    Args:
+        active_thread_percentage (float, optional): Percentage of the SMs available to the client, sets
+            :code:`CUDA_MPS_ACTIVE_THREAD_PERCENTAGE`. Default to no limit.
+        pinned_mem_limit (int, str or dict, optional): Device memory the client can allocate, sets
+            :code:`CUDA_MPS_PINNED_DEVICE_MEM_LIMIT`. Either the limit of every visible device (in MiB, or a
+            string with a unit, e.g., :code:`10G`), or a dict of device index -> limit. The device indices are
+            relative to :code:`CUDA_VISIBLE_DEVICES`. Default to no limit.
+        gpu_ids (int or list of int, optional): GPUs visible to the client. Default to all GPUs.
+
+    Returns:
+        dict: A copy of the current environment with the MPS client settings.
+    """
+    env = mps_env(gpu_ids)
+    if active_thread_percentage is not None:
+        if not 0 < active_thread_percentage <= 100:
+            raise ValueError(f'Active thread percentage should be in (0, 100], got {active_thread_percentage}')
+        env['CUDA_MPS_ACTIVE_THREAD_PERCENTAGE'] = f'{active_thread_percentage:g}'
+    if pinned_mem_limit is not None:
+        if not isinstance(pinned_mem_limit, dict):
+            num_devices = 1 if isinstance(gpu_ids, int) else len(gpu_ids) if gpu_ids is not None else 1
+            pinned_mem_limit = {device: pinned_mem_limit for device in range(num_devices)}
+        env['CUDA_MPS_PINNED_DEVICE_MEM_LIMIT'] = ','.join(
+            f'{device}={format_pinned_mem_limit(limit)}' for device, limit in sorted(pinned_mem_limit.items())
+        )
+    return env
+
+
+def mig_profile_share(profile: str, gpu_model: str):
+    """The MPS share matching a MIG GPU instance profile: the fraction of the SMs of the full-GPU profile, rounded
+    up to a percentage, and the memory of the profile.
+
+    Args:
+        profile (str): GI profile name, e.g., :code:`1g.10gb`.
+        gpu_model (str): GPU name (e.g., :code:`NVIDIA A100-SXM4-80GB`) or alias (e.g., :code:`A100`), see
+            :data:`migperf.controller.simulator.GPU_MODELS`.
+
+    Returns:
+        dict: :code:`active_thread_percentage` and :code:`pinned_mem_limit` (in MiB), the keyword arguments of
+            :func:`mps_client_env`.
+
+    Raises:
+        ValueError: If the GPU model is unknown or has no such profile.
+    """
+    model = get_gpu_model(gpu_model)
+    profile = normalize_profile_name(profile)
+    gi_profiles = {gi_profile.name: gi_profile for gi_profile in model.gi_profiles}
+    if profile not in gi_profiles:
+        raise ValueError(f'GPU {model.name} has no profile {profile}, expected one of {list(gi_profiles)}')
+    full_sm = max(gi_profile.sm for gi_profile in model.gi_profiles)
+    return {
+        'active_thread_percentage': min(math.ceil(100 * gi_profiles[profile].sm / full_sm), 100),
+        'pinned_mem_limit': int(gi_profiles[profile].memory_gib * 1024),
+    }
+
+
+def send_mps_command(command: str, gpu_ids: Union[int, List[int]] = None):
+    """echo <command> | nvidia-cuda-mps-control
+
+    Args:
+        command (str): A command of the control daemon, e.g., :code:`get_server_list`.
+        gpu_ids (int or list of int, optional): GPUs served by the control daemon. Default to all GPUs.
+
+    Returns:
+        str: The reply of the control daemon.
+
+    Raises:
+        ValueError: If the control daemon is not running or rejects the command.
+    """
+    env = mps_env(gpu_ids)
+    cmd = ['nvidia-cuda-mps-control']
+
+    with timed_command(cmd) as event:
+        event['command'] = cmd + [command]
+        p = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=env,
+        )
+        output, _ = p.communicate(input=command.encode() + b'\n')
+        event['exit_code'] = p.returncode
+    output = output.decode().strip()
+    if p.returncode != 0 or output.startswith('Error') or 'Invalid' in output:
+        raise ValueError(f'Failed to execute MPS command {command!r}: {output}')
+    return output
+
+
+def get_server_list(gpu_ids: Union[int, List[int]] = None):
+    """echo get_server_list | nvidia-cuda-mps-control
+
+    Returns:
+        list of int: PIDs of the running MPS servers.
+    """
+    with timed('operation', 'get_server_list', gpu_id=_mps_gpu_id(gpu_ids), arguments={'gpu_ids': gpu_ids}):
+        output = send_mps_command('get_server_list', gpu_ids)
+    return [int(pid) for pid in output.split()]
+
+
+def set_default_active_thread_percentage(percentage: float, gpu_ids: Union[int, List[int]] = None):
+    """echo set_default_active_thread_percentage <percentage> | nvidia-cuda-mps-control
+
+    Applies to the MPS servers spawned afterwards, i.e., to the clients of the next server.
+    """
+    with timed('operation', 'set_default_active_thread_percentage', gpu_id=_mps_gpu_id(gpu_ids),
+               arguments={'percentage': percentage, 'gpu_ids': gpu_ids}):
+        send_mps_command(f'set_default_active_thread_percentage {percentage:g}', gpu_ids)
+    return True
+
+
+def set_active_thread_percentage(server_pid: int, percentage: float, gpu_ids: Union[int, List[int]] = None):
+    """echo set_active_thread_percentage <server PID> <percentage> | nvidia-cuda-mps-control
+
+    Applies to the clients connecting to the MPS server afterwards.
+    """
+    with timed('operation', 'set_active_thread_percentage', gpu_id=_mps_gpu_id(gpu_ids),
+               arguments={'server_pid': server_pid, 'percentage': percentage, 'gpu_ids': gpu_ids}):
+        send_mps_command(f'set_active_thread_percentage {server_pid} {percentage:g}', gpu_ids)
+    return True
+
+
+def set_default_device_pinned_mem_limit(
+        device: int, limit: Union[int, str], gpu_ids: Union[int, List[int]] = None,
+):
+    """echo set_default_device_pinned_mem_limit <device> <limit> | nvidia-cuda-mps-control
+
+    Args:
+        device (int): Device index, relative to the GPUs served by the control daemon.
+        limit (int or str): The limit in MiB, or a string with a unit, e.g., :code:`10G`.
+        gpu_ids (int or list of int, optional): GPUs served by the control daemon. Default to all GPUs.
+    """
+    with timed('operation', 'set_default_device_pinned_mem_limit', gpu_id=_mps_gpu_id(gpu_ids),
+               arguments={'device': device, 'limit': limit, 'gpu_ids': gpu_ids}):
+        send_mps_command(f'set_default_device_pinned_mem_limit {device} {format_pinned_mem_limit(limit)}', gpu_ids)
+    return True
+
+
+def set_device_pinned_mem_limit(
+        server_pid: int, device: int, limit: Union[int, str], gpu_ids: Union[int, List[int]] = None,
+):
+    """echo set_device_pinned_mem_limit <server PID> <device> <limit> | nvidia-cuda-mps-control
+
+    See :func:`set_default_device_pinned_mem_limit`.
+    """
+    with timed('operation', 'set_device_pinned_mem_limit', gpu_id=_mps_gpu_id(gpu_ids),
+               arguments={'server_pid': server_pid, 'device': device, 'limit': limit, 'gpu_ids': gpu_ids}):
+        send_mps_command(
+            f'set_device_pinned_mem_limit {server_pid} {device} {format_pinned_mem_limit(limit)}', gpu_ids,
+        )
+    return True
+
+
+class MPSControlSession(object):
+    """A long-lived :code:`nvidia-cuda-mps-control` process in interactive mode, which executes the commands
+    written to its stdin. Compared with the module functions, it saves a fork per command and returns the replies.
+
+    The replies are not delimited: a command replying a single value returns on its first line. Any other command
+    (a list, a :code:`set_*` or :code:`shutdown_server`, which reply nothing unless they fail) is followed by a
+    :data:`PROBE_COMMAND`, and its reply is the lines before the answer to the probe, so that an error is raised by
+    the command causing it. Unexpected lines left over (e.g., after a timed out command) are warned about at the
+    next command.
+
+    Args:
+        gpu_ids (int or list of int, optional): GPUs served by the control daemon. Default to all GPUs.
+        timeout (float, optional): Seconds to wait for each line of a reply. Default to 10.
+
+    Attributes:
+        latencies (dict): Command name -> round-trip latencies in seconds, up to the answer to the probe for the
+            probed commands, see :meth:`latency_stats`.
+
+    Examples:
+        >>> with MPSControlSession(gpu_ids=0) as session:
+        ...     for server_pid in session.get_server_list():
+        ...         session.set_active_thread_percentage(server_pid, 50)
+        ...     session.latency_stats()
+    """
+    # Commands replying a single line, the other get_* commands reply a list of lines
+    SINGLE_LINE_COMMANDS = (
+        'get_default_active_thread_percentage', 'get_active_thread_percentage',
+        'get_default_device_pinned_mem_limit', 'get_device_pinned_mem_limit',
+    )
+    # Command delimiting the replies, it answers a percentage (e.g., 100.0), told apart from the PIDs of the lists
+    PROBE_COMMAND = 'get_default_active_thread_percentage'
+
+    def __init__(self, gpu_ids: Union[int, List[int]] = None, timeout: float = 10.):
+        self.gpu_ids = gpu_ids
+        self.timeout = timeout
+        self.latencies: Dict[str, List[float]] = collections.defaultdict(list)
+        self._lines = queue.Queue()
+        self._lock = threading.Lock()
+        self._process = subprocess.Popen(
+            ['nvidia-cuda-mps-control'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=mps_env(gpu_ids),
+            bufsize=1,
+            encoding='utf-8',
+        )
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self._process.stdout:
+            self._lines.put(line.rstrip('\n'))
+        # end of the replies
+        self._lines.put(None)
+
+    @property
+    def closed(self):
+        return self._process.poll() is not None
+
+    def _next_line(self, timeout: float):
+        """Next reply line, :code:`None` if the session is closed, raises :class:`queue.Empty` on timeout."""
+        line = self._lines.get(timeout=timeout)
+        if line is None:
+            # keep the end mark for the following reads
+            self._lines.put(None)
+        return line
+
+    def _drain(self):
+        lines = list()
+        while True:
+            try:
+                line = self._next_line(timeout=0)
+            except queue.Empty:
+                return lines
+            if line is None:
+                return lines
+            lines.append(line)
+
+    def _write(self, command: str):
+        try:
+            self._process.stdin.write(command + '\n')
+            self._process.stdin.flush()
+        except (BrokenPipeError, ValueError) as e:
+            raise ValueError(f'MPS control session is closed: {e!r}') from e
+
+    def _wait_line(self, command: str):
+        try:
+            return self._next_line(self.timeout)
+        except queue.Empty:
+            raise ValueError(f'MPS command {command!r} timed out after {self.timeout}s')
+
+    @staticmethod
+    def _is_probe_reply(line: str):
+        try:
+            float(line)
+        except ValueError:
+            return False
+        return '.' in line
+
+    def execute(self, command: str):
+        """Execute a control daemon command.
+
+        Args:
+            command (str): The command line, e.g., :code:`get_server_list`.
+
+        Returns:
+            list of str: The reply lines.
+
+        Raises:
+            ValueError: If the session is closed, the command times out or the control daemon rejects it.
+        """
+        name = command.split(maxsplit=1)[0]
+        with self._lock:
+            closed = self.closed
+            if closed:
+                # collect the last replies of the exited process
+                self._reader.join(timeout=self.timeout)
+            stale = self._drain()
+            if stale:
+                warnings.warn(f'Unexpected MPS control replies before {command!r}: {stale}')
+            if closed:
+                raise ValueError(f'MPS control session is closed (exit code {self._process.returncode})')
+
+            lines = list()
+            with timed_command(['nvidia-cuda-mps-control', command]) as event:
+                start = time.perf_counter()
+                self._write(command)
+                if name in self.SINGLE_LINE_COMMANDS:
+                    line = self._wait_line(command)
+                    if line is not None:
+                        lines.append(line)
+                else:
+                    self._write(self.PROBE_COMMAND)
+                    line = self._wait_line(command)
+                    while line is not None and not self._is_probe_reply(line):
+                        lines.append(line)
+                        line = self._wait_line(command)
+                event['exit_code'] = self._process.poll()
+                self.latencies[name].append(time.perf_counter() - start)
+
+                if any(reply.startswith('Error') or 'Invalid' in reply for reply in lines):
+                    raise ValueError(f'Failed to execute MPS command {command!r}: {" ".join(lines)}')
+                if line is None:
+                    raise ValueError(f'MPS control session is closed (exit code {self._process.poll()})')
+        return lines
+
+    def get_server_list(self):
+        """PIDs of the running MPS servers."""
+        return [int(pid) for line in self.execute('get_server_list') for pid in line.split()]
+
+    def get_client_list(self, server_pid: int):
+        """PIDs of the clients of an MPS server."""
+        return [int(pid) for line in self.execute(f'get_client_list {server_pid}') for pid in line.split()]
+
+    def get_default_active_thread_percentage(self):
+        return float(self.execute('get_default_active_thread_percentage')[0])
+
+    def get_active_thread_percentage(self, server_pid: int):
+        return float(self.execute(f'get_active_thread_percentage {server_pid}')[0])
+
+    def set_default_active_thread_percentage(self, percentage: float):
+        """Applies to the MPS servers spawned afterwards."""
+        self.execute(f'set_default_active_thread_percentage {percentage:g}')
+
+    def set_active_thread_percentage(self, server_pid: int, percentage: float):
+        """Applies to the clients connecting to the MPS server afterwards."""
+        self.execute(f'set_active_thread_percentage {server_pid} {percentage:g}')
+
+    def set_default_device_pinned_mem_limit(self, device: int, limit: Union[int, str]):
+        """See :func:`set_default_device_pinned_mem_limit`."""
+        self.execute(f'set_default_device_pinned_mem_limit {device} {format_pinned_mem_limit(limit)}')
+
+    def set_device_pinned_mem_limit(self, server_pid: int, device: int, limit: Union[int, str]):
+        """See :func:`set_default_device_pinned_mem_limit`."""
+        self.execute(f'set_device_pinned_mem_limit {server_pid} {device} {format_pinned_mem_limit(limit)}')
+
+    def shutdown_server(self, server_pid: int, force: bool = False):
+        self.execute(f'shutdown_server {server_pid}' + (' -f' if force else ''))
+
+    def latency_stats(self):
+        """Round-trip latency distribution of every command, see :func:`migperf.profiler.utils.stats.summarize`."""
+        return {name: summarize(latencies) for name, latencies in sorted(self.latencies.items())}
+
+    def close(self, quit: bool = False, timeout: float = None):
+        """End the session, keeping the control daemon running unless :code:`quit` is set.
+
+        Returns:
+            int: The exit code of the control process.
+        """
+        if not self.closed:
+            with self._lock, timed('operation', 'close_mps_control_session', gpu_id=_mps_gpu_id(self.gpu_ids),
+                                   arguments={'quit': quit}) as event:
+                try:
+                    if quit:
+                        self._process.stdin.write('quit\n')
+                    self._process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                event['exit_code'] = self._process.wait(timeout=timeout or self.timeout)
+        self._reader.join(timeout=timeout or self.timeout)
+        self._process.stdout.close()
+        return self._process.returncode
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+GPU instance placement planner. Given the GI profile table and possible placements of a GPU model, assign a
+placement to every requested GPU instance, or prove that no valid assignment exists.
+"""
+import functools
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from .layout import GPUInstanceSpec, MIGLayout, normalize_profile_name
+
+
+class ProfilePlacements(NamedTuple):
+    """Placement rules of a GI profile.
+
+    Attributes:
+        name (str): Short profile name, e.g., :code:`1g.10gb`.
+        profile_id (int): Profile ID.
+        placements (tuple of tuple): Possible placements as :code:`(start, size)`.
+        max_instances (int): Maximum number of instances of the profile on one GPU.
+    """
+    name: str
+    profile_id: int
+    placements: Tuple[Tuple[int, int], ...]
+    max_instances: int
+
+
+class PlacementPlan(NamedTuple):
+    """A valid assignment of placements.
+
+    Attributes:
+        assignments (list of tuple): :code:`(spec, start, size)` for every requested GPU instance, in the
+            order of the request.
+        fragmentation (tuple): Fragmentation score of the free slots left by the plan, lower is better.
+            See :func:`fragmentation_score`.
+    """
+    assignments: List[Tuple[GPUInstanceSpec, int, int]]
+    fragmentation: tuple
+
+    def to_layout(self):
+        """The planned layout, with explicit placement for every GPU instance."""
+        return MIGLayout([spec._replace(placement=start) for spec, start, _ in self.assignments])
+
+
+def build_profile_placements(gi_profiles: List[dict], gi_placements: List[dict]):
+    """Join the records of :meth:`MIGController.list_gpu_instance_profiles` and
+    :meth:`MIGController.list_gpu_instance_possible_placements` of one GPU into the placement rules.
+
+    Returns:
+        dict: Profile name -> :class:`ProfilePlacements`.
+    """
+    placements_by_id = {
+        record['profile_id']: tuple((p['start'], p['size']) for p in record['placements'])
+        for record in gi_placements
+    }
+    profile_placements = dict()
+    for record in gi_profiles:
+        name = normalize_profile_name(record['name'])
+        placements = placements_by_id.get(record['profile_id'], tuple())
+        profile_placements[name] = ProfilePlacements(
+            name, record['profile_id'], placements, record.get('instances_total', len(placements)),
+        )
+    return profile_placements
+
+
+def _slots_mask(start: int, size: int):
+    return ((1 << size) - 1) << start
+
+
+def fragmentation_score(occupied_mask: int, profile_placements: Iterable[ProfilePlacements]):
+    """Score how fragmented the free slots are, lower is better.
+
+    The score is a tuple of 1. the negative size of the largest placement still available, and 2. the negative
+    number of placements still available. That is, a plan keeping room for the largest possible future
+    GPU instance, and then for the most future GPU instances, is preferred.
+    """
+    largest, available = 0, 0
+    for profile in profile_placements:
+        for start, size in profile.placements:
+            if not occupied_mask & _slots_mask(start, size):
+                largest = max(largest, size)
+                available += 1
+    return -largest, -available
+
+
+def plan_placement(
+        specs: List[Union[str, GPUInstanceSpec]],
+        profile_placements: Dict[str, ProfilePlacements],
+        occupied: Iterable[Tuple[int, int]] = (),
+        existing_profile_counts: Dict[str, int] = None,
+) -> Optional[PlacementPlan]:
+    """Find a valid placement for every requested GPU instance that minimizes the fragmentation.
+
+    The search is exhaustive (with memoization over the remaining request and occupied slots), so
+    :code:`None` is returned only if no valid assignment exists.
+
+    Args:
+        specs (list of str or GPUInstanceSpec): Requested GPU instances. A spec with a placement is only
+            assigned to that placement.
+        profile_placements (dict): Profile name -> :class:`ProfilePlacements`, see
+            :func:`build_profile_placements`.
+        occupied (iterable of tuple): :code:`(start, size)` of the slots used by existing GPU instances.
+        existing_profile_counts (dict, optional): Profile name -> number of existing GPU instances, counted
+            towards the maximum number of instances of the profile.
+    Returns:
+        PlacementPlan: The best plan, or :code:`None` if the request cannot be placed.
+    Raises:
+        ValueError: If a requested profile is not supported by the GPU.
+    """
+    specs = MIGLayout(list(specs)).gpu_instances
+    by_id = {profile.profile_id: profile for profile in profile_placements.values()}
+    resolved = list()
+    for spec in specs:
+        profile = by_id.get(spec.profile) if isinstance(spec.profile, int) else profile_placements.get(spec.profile)
+        if profile is None:
+            raise ValueError(f'GPU instance profile {spec.profile} is not supported by the GPU')
+        resolved.append(profile)
+
+    occupied_mask = 0
+    for start, size in occupied:
+        occupied_mask |= _slots_mask(start, size)
+    counts = dict(existing_profile_counts or dict())
+    for profile in resolved:
+        counts[profile.name] = counts.get(profile.name, 0) + 1
+    if any(count > profile_placements[name].max_instances for name, count in counts.items()
+           if name in profile_placements):
+        return None
+
+    # place the largest and the most constrained GPU instances first, identical requests are grouped so
+    # that the memoization collapses their permutations
+    order = sorted(
+        range(len(specs)),
+        key=lambda i: (-max((size for _, size in resolved[i].placements), default=0), resolved[i].name,
+                       specs[i].placement is None, specs[i].placement or 0),
+    )
+    keys = tuple((resolved[i].name, specs[i].placement) for i in order)
+
+    @functools.lru_cache(maxsize=None)
+    def search(index: int, mask: int):
+        """Return (score, starts) of the best plan for keys[index:], or None."""
+        if index == len(keys):
+            return fragmentation_score(mask, profile_placements.values()), tuple()
+        name, fixed_start = keys[index]
+        best = None
+        for start, size in profile_placements[name].placements:
+            if fixed_start is not None and start != fixed_start:
+                continue
+            slots = _slots_mask(start, size)
+            if mask & slots:
+                continue
+            result = search(index + 1, mask | slots)
+            if result is not None and (best is None or result[0] < best[0]):
+                best = result[0], ((start, size),) + result[1]
+        return best
+
+    result = search(0, occupied_mask)
+    search.cache_clear()
+    if result is None:
+        return None
+    score, placed = result
+    assignments: List[Optional[tuple]] = [None] * len(specs)
+    for i, (start, size) in zip(order, placed):
+        assignments[i] = (specs[i], start, size)
+    return PlacementPlan(assignments, score)
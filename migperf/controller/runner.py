@@ -7,16 +7,98 @@ Date: Apr 16, 2023
 
 Run MIG profiling job with configuration YAML file.
 """
+import functools
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+from migperf.profiler.utils.result_cache import ResultCache, device_context, run_key, software_versions
+
+from .inventory import DeviceInventory
+from .layout import MIGLayout
 from .mig_controller import MIGController
-from .mps_controller import enable_mps
+from .mps_controller import enable_mps, mig_profile_share, mps_client_env
+
+# Root directory of the migperf package, from which the profiling scripts are run
+PACKAGE_ROOT = Path(__file__).resolve().parents[2]
+# (type, ml_task) -> profiling script
+JOB_ENTRY_POINTS = {
+    ('train', 'image_classification'): 'migperf/profiler/train/train_cv.py',
+    ('train', 'sequence_classification'): 'migperf/profiler/train/train_nlp.py',
+    ('inference', 'image_classification'): 'migperf/profiler/inference/client/block_inference_cv.py',
+    ('inference', 'sequence_classification'): 'migperf/profiler/inference/client/block_inference_nlp.py',
+}
+# Profiling scripts testing several batch sizes in one process
+MULTI_BATCH_SIZE_ENTRY_POINTS = (
+    'migperf/profiler/inference/client/block_inference_cv.py',
+    'migperf/profiler/inference/client/block_inference_nlp.py',
+)
 
 
-def config_gpu_device(gpu_configs: list):
+def _config_single_gpu(mig_controller: MIGController, gpu_config: dict):
+    """Enable MIG and reconcile the MIG layout of a single GPU in a transaction. Returns the per-GPU summary
+    record.
+    """
+    gpu_id = gpu_config['id']
+    summary = {
+        'gpu_id': gpu_id, 'success': False, 'error': None, 'reconcile': None, 'rolled_back': False, 'duration': 0.,
+    }
+    start_time = time.perf_counter()
+    transaction = None
+    try:
+        if gpu_config['mig']:
+            # The GPU is restored to its prior layout if any step fails
+            with mig_controller.transaction(gpu_id) as transaction:
+                if mig_controller.enable_mig(gpu_id) != 0:
+                    raise ValueError(f'Failed to enable MIG on GPU {gpu_id}')
+                # Only the instances that differ from the desired layout are destroyed / created
+                summary['reconcile'] = mig_controller.reconcile(
+                    gpu_id, MIGLayout.from_config(gpu_config['devices'])
+                )
+        summary['success'] = True
+    except Exception as e:
+        summary['error'] = e
+    summary['rolled_back'] = transaction is not None and transaction.rolled_back
+    summary['duration'] = time.perf_counter() - start_time
+    return summary
+
+
+def config_gpu_device(
+        gpu_configs: list, mig_controller: MIGController = None, max_workers: int = None, raise_on_error: bool = True,
+):
     """
     Configure GPU device with configuration YAML file.
 
+    The GPUs are independent, so they are configured concurrently, one worker thread per GPU. Each GPU is
+    configured in a :meth:`MIGController.transaction`, so a GPU failing halfway is restored to its prior layout
+    instead of being left half-partitioned. A failure on one GPU does not stop the others, the errors are
+    collected into the per-GPU summary.
+
     Args:
         gpu_configs (list): A list of GPU device configuration.
+        mig_controller (MIGController, optional): The MIG controller to use. Default to a controller on the
+            default backend.
+        max_workers (int, optional): Maximum number of GPUs configured at the same time. Default to the number
+            of GPUs in :code:`gpu_configs`.
+        raise_on_error (bool, optional): Raise after all GPUs are processed if any of them failed.
+            Default to `True`.
+
+    Returns:
+        list of dict: The per-GPU summary, in the order of :code:`gpu_configs`. The dictionary contains:
+            :code:`gpu_id`, :code:`success`, :code:`error` (the exception raised, or :code:`None`),
+            :code:`reconcile` (the result of :meth:`MIGController.reconcile`, or :code:`None`),
+            :code:`rolled_back` (whether the GPU was restored to its prior layout after a failure) and
+            :code:`duration` (seconds).
+
+    Raises:
+        ValueError: If :code:`raise_on_error` is set and configuring any of the GPUs fails.
 
     Examples:
         gpu_config example YAML file: example_config.yaml
@@ -28,6 +110,9 @@ def config_gpu_device(gpu_configs: list):
             devices:
               - gi_profile: 1g.10gb
                 task: cv_train
+              - gi_profile: 3g.40gb
+                placement: 4  # optional placement start index
+                ci_profiles: [1c.3g.40gb, 2c.3g.40gb]  # optional, default to one full compute instance
         ```
         >>> import yaml
         >>> gpu_configs = yaml.safe_load('example_config.yaml')['gpus']
@@ -35,26 +120,376 @@ def config_gpu_device(gpu_configs: list):
     """
     # Enable MPS for all required GPUs
     mps_gpu_ids = [gpu_config['id'] for gpu_config in gpu_configs if gpu_config['mps']]
-    enable_mps(mps_gpu_ids)
+    if mps_gpu_ids:
+        enable_mps(mps_gpu_ids)
 
-    # Configure MIG for all required GPUs
+    # Configure MIG for all required GPUs concurrently
     # 1. Enable MIG
     # 2. Configure MIG device
-    mig_controller = MIGController()
-    for gpu_config in gpu_configs:
+    mig_controller = mig_controller or MIGController()
+    if not gpu_configs:
+        return list()
+    with ThreadPoolExecutor(max_workers=max_workers or len(gpu_configs)) as executor:
+        summaries = list(executor.map(functools.partial(_config_single_gpu, mig_controller), gpu_configs))
+
+    failed = [summary for summary in summaries if not summary['success']]
+    if failed and raise_on_error:
+        succeeded_gpu_ids = [summary['gpu_id'] for summary in summaries if summary['success']]
+        errors = '\n'.join(f'  GPU {summary["gpu_id"]}: {summary["error"]!r}' for summary in failed)
+        raise ValueError(
+            f'Failed to configure GPU {[summary["gpu_id"] for summary in failed]} '
+            f'(succeeded: {succeeded_gpu_ids}):\n{errors}'
+        ) from failed[0]['error']
+    return summaries
+
+
+def job_env(gpu_config: dict, device_config: dict, gpu_model: str = None):
+    """Environment of a job on a GPU device.
+
+    A job on an MPS GPU is limited to the SMs and the memory of its target MIG profile (:code:`mps_profile`), so
+    that MPS is compared with MIG on equal terms. The limits can also be given explicitly by
+    :code:`active_thread_percentage` (percentage of the SMs) and :code:`pinned_mem_limit` (in MiB, or a string
+    with a unit, e.g., :code:`10G`), which override the ones of the profile. A job without any of them shares the
+    whole GPU.
+
+    Args:
+        gpu_config (dict): The GPU configuration, see :func:`config_gpu_device`.
+        device_config (dict): The device configuration in :code:`gpu_config['devices']`.
+        gpu_model (str, optional): The GPU name or alias, to look up the share of :code:`mps_profile`.
+            Default to :code:`gpu_config['gpu_model']`.
+
+    Returns:
+        dict: The environment of the job process.
+
+    Examples:
+        ```yaml
+        gpus:
+        - id: 0
+          mig: false
+          mps: true
+          gpu_model: A100
+          devices:
+            - mps_profile: 1g.10gb  # 15% of the SMs and 9728 MiB of memory
+              job: cv_train
+            - mps_profile: 3g.40gb
+              pinned_mem_limit: 20G
+              job: cv_train
+        ```
+    """
+    if not gpu_config['mps']:
+        return os.environ.copy()
+    share = dict()
+    if device_config.get('mps_profile'):
+        gpu_model = gpu_model or gpu_config.get('gpu_model')
+        if gpu_model is None:
+            raise ValueError(f'GPU model of GPU {gpu_config["id"]} is required for MPS profile '
+                             f'{device_config["mps_profile"]}')
+        share.update(mig_profile_share(device_config['mps_profile'], gpu_model))
+    for key in ('active_thread_percentage', 'pinned_mem_limit'):
+        if device_config.get(key) is not None:
+            share[key] = device_config[key]
+    # The job masks out the other GPUs, so the limit is set on its only visible device
+    return mps_client_env(**share)
+
+
+def job_command(job_config: dict):
+    """Command line of a job, without the device arguments.
+
+    A job either runs one of the profiling scripts, selected by :code:`type` (:code:`train` or :code:`inference`)
+    and :code:`ml_task` (:code:`image_classification` or :code:`sequence_classification`), or a custom script
+    given by :code:`entry_point` and :code:`args`. The inference scripts accept a list of batch sizes, tested one
+    after another by the same process, and stop early with :code:`adaptive` (:code:`true`, or the target precisions
+    like :code:`{p99: 0.05}`).
+
+    Raises:
+        ValueError: If there is no profiling script for the job type and ML task.
+    """
+    if job_config.get('entry_point'):
+        return [sys.executable, str(job_config['entry_point']), *map(str, job_config.get('args', list()))]
+
+    task_type, ml_task = job_config.get('type'), job_config.get('ml_task')
+    if (task_type, ml_task) not in JOB_ENTRY_POINTS:
+        raise ValueError(
+            f'Unsupported job {job_config.get("name")}: type {task_type}, ML task {ml_task}, expected one of '
+            f'{list(JOB_ENTRY_POINTS)} or an entry_point'
+        )
+    entry_point = JOB_ENTRY_POINTS[task_type, ml_task]
+    cmd = [sys.executable, str(PACKAGE_ROOT / entry_point)]
+    if isinstance(job_config['batch_size'], (list, tuple)):
+        if entry_point not in MULTI_BATCH_SIZE_ENTRY_POINTS:
+            raise ValueError(f'Job {job_config.get("name")} does not support several batch sizes')
+        cmd += ['-b', *map(str, job_config['batch_size'])]
+    else:
+        cmd.append(f'-b={job_config["batch_size"]}')
+    cmd.append(f'-m={job_config["model"]["name"]}')
+    if task_type == 'train':
+        # python train/train_cv.py -b "${BATCH_SIZE}" -m "${MODEL_NAME}" -n "${max_train_steps}" \
+        #     -i "${GPU_ID}" -mi 0 -dbn "${EXP_SAVE_DIR}/${MIG_PROFILE}"
+        cmd.append(f'-n={job_config["max_train_steps"]}')
+        optimizer = job_config.get('optimizer', dict())
+        if 'lr' in optimizer:
+            cmd.append(f'--lr={optimizer["lr"]}')
+        if 'weight_decay' in optimizer:
+            cmd.append(f'--weight-decay={optimizer["weight_decay"]}')
+        if 'momentum' in optimizer and ml_task == 'image_classification':
+            cmd.append(f'--momentum={optimizer["momentum"]}')
+        if 'num_classes' in job_config.get('dataset', dict()):
+            cmd.append(f'--num_classes={job_config["dataset"]["num_classes"]}')
+    else:
+        # python client/block_inference_cv.py -b "${BATCH_SIZE}" -m "${MODEL_NAME}" -n "${NUM_TEST_BATCHES}" \
+        #     -i "${GPU_ID}" -mi 0 -dbn "${EXP_SAVE_DIR}"
+        cmd.append(f'-n={job_config["num_batches"]}')
+        if 'num_threads' in job_config:
+            cmd.append(f'-t={job_config["num_threads"]}')
+        # stop once the latency statistics converge, num_batches is then the maximum
+        adaptive = job_config.get('adaptive')
+        if adaptive:
+            cmd.append('--adaptive')
+            if isinstance(adaptive, dict):
+                cmd += ['--target', *(f'{statistic}={precision}' for statistic, precision in adaptive.items())]
+    if ml_task == 'sequence_classification' and 'seq_len' in job_config:
+        cmd.append(f'--seq_len={job_config["seq_len"]}')
+    return cmd
+
+
+def assign_devices(gpu_config: dict, inventory: DeviceInventory):
+    """Device of every entry in :code:`gpu_config['devices']`.
+
+    On a MIG GPU, every entry gets the first compute instance of a distinct GPU instance matching its profile
+    (and placement), the same matching as :meth:`MIGController.reconcile`. Otherwise, all entries share the GPU.
+
+    Returns:
+        list of dict: Contains :code:`gpu_id`, :code:`mig_device_id` (:code:`None` for a whole GPU) and
+            :code:`uuid`.
+
+    Raises:
+        ValueError: If the GPU or a matching MIG device is not found.
+    """
+    gpu_id = gpu_config['id']
+    if not gpu_config['mig']:
+        uuid = inventory.get_device_uuid(gpu_id)
+        if uuid is None:
+            raise ValueError(f'GPU {gpu_id} is not found')
+        return [{'gpu_id': gpu_id, 'mig_device_id': None, 'uuid': uuid} for _ in gpu_config['devices']]
+
+    specs = MIGLayout.from_config(gpu_config['devices']).gpu_instances
+    unmatched_gis = sorted(inventory.gpu_instances(gpu_id), key=lambda gi: gi['gi_id'])
+    devices = [None] * len(specs)
+    # match the placement-constrained specs first, so that they are not taken by the unconstrained ones
+    for i in sorted(range(len(specs)), key=lambda i: specs[i].placement is None):
+        candidates = [gi for gi in unmatched_gis if specs[i].matches_profile(gi) and specs[i].matches_placement(gi)]
+        ci_status_list = inventory.compute_instances(gpu_id, candidates[0]['gi_id']) if candidates else list()
+        if not ci_status_list:
+            raise ValueError(f'No MIG device {specs[i].to_profile_str()} on GPU {gpu_id} for device {i}')
+        unmatched_gis.remove(candidates[0])
+        ci_id = min(ci['ci_id'] for ci in ci_status_list)
+        mig_device = inventory.find_mig_device(gpu_id, candidates[0]['gi_id'], ci_id)
+        devices[i] = {'gpu_id': gpu_id, 'mig_device_id': mig_device['mig_device_id'], 'uuid': mig_device['uuid']}
+    return devices
+
+
+def _stream_output(process: subprocess.Popen, log_path: Path, prefix: Optional[str]):
+    with open(log_path, 'w') as f:
+        for line in process.stdout:
+            f.write(line)
+            f.flush()
+            if prefix is not None:
+                print(f'{prefix}{line}', end='', flush=True)
+
+
+def _kill(process: subprocess.Popen):
+    """Terminate the process group of a job, and kill it if it does not exit in time."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        try:
+            process.wait(timeout=5)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+
+
+def _result_files(result_dir: str):
+    """Result files of a directory, with their modification time and size to tell apart the rewritten ones."""
+    files = dict()
+    for result_path in Path(result_dir).glob('*.json'):
+        stat = result_path.stat()
+        files[result_path] = (stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def _run_single_job(launch: dict, stream_logs: bool):
+    """Run a planned job to the end or its timeout. Returns the job summary record."""
+    summary = {
+        **{k: launch[k] for k in ('name', 'job', 'gpu_id', 'mig_device_id', 'uuid', 'command', 'log', 'result_dir')},
+        'exit_code': None, 'timed_out': False, 'duration': 0., 'results': list(), 'result_files': list(),
+        'error': None, 'cached': False,
+    }
+    Path(launch['result_dir']).mkdir(parents=True, exist_ok=True)
+    # the result directory is reused across runs, only the files written by this run are its results
+    stale_files = _result_files(launch['result_dir'])
+    start_time = time.perf_counter()
+    try:
+        # a new session isolates the job, so that its whole process group can be stopped on timeout
+        process = subprocess.Popen(
+            launch['command'], env=launch['env'], cwd=str(PACKAGE_ROOT), stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, encoding='utf-8', errors='replace', start_new_session=True,
+        )
+    except OSError as e:
+        summary['error'] = e
+        return summary
+    reader = threading.Thread(
+        target=_stream_output, args=(process, Path(launch['log']), f'[{launch["name"]}] ' if stream_logs else None),
+        daemon=True,
+    )
+    reader.start()
+    try:
+        summary['exit_code'] = process.wait(timeout=launch['timeout'])
+    except subprocess.TimeoutExpired:
+        summary['timed_out'] = True
+        _kill(process)
+        summary['exit_code'] = process.returncode
+        summary['error'] = ValueError(f'Job {launch["name"]} timed out after {launch["timeout"]}s')
+    reader.join()
+    summary['duration'] = time.perf_counter() - start_time
+
+    if summary['error'] is None and summary['exit_code'] != 0:
+        summary['error'] = ValueError(f'Job {launch["name"]} exited with code {summary["exit_code"]}')
+    result_files = _result_files(launch['result_dir'])
+    for result_path in sorted(path for path, stat in result_files.items() if stale_files.get(path, None) != stat):
+        try:
+            with open(result_path) as f:
+                summary['results'].append(json.load(f))
+        except ValueError as e:
+            summary['error'] = summary['error'] or ValueError(f'Invalid result file {result_path}: {e}')
+        else:
+            summary['result_files'].append(str(result_path))
+    return summary
+
+
+def _restore_cached_job(launch: dict, cache: ResultCache):
+    """Restore the cached results of a planned job into its result directory. Returns the job summary record."""
+    summary = {
+        **{k: launch[k] for k in ('name', 'job', 'gpu_id', 'mig_device_id', 'uuid', 'command', 'log', 'result_dir')},
+        'exit_code': 0, 'timed_out': False, 'duration': 0., 'results': list(), 'result_files': list(),
+        'error': None, 'cached': True,
+    }
+    for result_path in sorted(cache.restore(launch['run_config'], launch['result_dir'])):
+        with open(result_path) as f:
+            summary['results'].append(json.load(f))
+        summary['result_files'].append(str(result_path))
+    return summary
+
+
+def _cache_job(launch: dict, summary: dict, cache: ResultCache):
+    files = {Path(path).name: result for path, result in zip(summary['result_files'], summary['results'])}
+    cache.put(launch['run_config'], files)
+
+
+def plan_jobs(config: dict, inventory: DeviceInventory, output_dir: str = 'results', timeout: float = None):
+    """Resolve every :code:`devices[].job` of the GPU configurations into a launch: the command, the device and
+    the environment of the job process.
+
+    Returns:
+        list of dict: Contains :code:`name` (:code:`${job}-gpu${gpu_id}-${device index}`), :code:`job`,
+            :code:`gpu_id`, :code:`mig_device_id`, :code:`uuid`, :code:`command`, :code:`env`, :code:`timeout`,
+            :code:`log`, :code:`result_dir` and :code:`run_config` (the key of its results in a
+            :class:`ResultCache`).
+
+    Raises:
+        ValueError: If a job is not defined or not supported, or its device is not found.
+    """
+    job_configs = {job_config['name']: job_config for job_config in config['job_configs']}
+    output_dir = Path(output_dir).resolve()
+    launches = list()
+    for gpu_config in config['gpus']:
         gpu_id = gpu_config['id']
-        mig_devices = gpu_config['devices']
-        if gpu_config['mig']:
-            mig_controller.enable_mig(gpu_id)
-            for mig_device in mig_devices:
-                mig_controller.create_gpu_instance(mig_device['gi_profile'], gpu_id=gpu_id, create_ci=True)
+        devices = assign_devices(gpu_config, inventory)
+        for i, (device_config, device) in enumerate(zip(gpu_config['devices'], devices)):
+            if not device_config.get('job'):
+                continue
+            if device_config['job'] not in job_configs:
+                raise ValueError(f'Job {device_config["job"]} of GPU {gpu_id} device {i} is not defined')
+            job_config = job_configs[device_config['job']]
+            name = f'{job_config["name"]}-gpu{gpu_id}-{i}'
+            result_dir = output_dir / name
+
+            command = job_command(job_config)
+            if not job_config.get('entry_point'):
+                command += [f'-i={gpu_id}', f'-dbn={result_dir}']
+                if device['mig_device_id'] is not None:
+                    command.append(f'-mi={device["mig_device_id"]}')
+            gpu = inventory.get_gpu(gpu_id)
+            env = job_env(gpu_config, device_config, gpu['name'] if gpu is not None else None)
+            env['CUDA_DEVICE_ORDER'] = 'PCI_BUS_ID'
+            env['CUDA_VISIBLE_DEVICES'] = device['uuid']
+            env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(PACKAGE_ROOT), env.get('PYTHONPATH')]))
+            env['MIGPERF_RESULT_DIR'] = str(result_dir)
+            # the runner caches the co-located jobs as a whole, a client must not restore its result alone
+            env.pop('MIGPERF_RESULT_CACHE', None)
+            run_config = {
+                'kind': 'job', 'job': {k: v for k, v in job_config.items() if k not in ('name', 'timeout')},
+                **device_context(gpu_id, device['mig_device_id'], inventory, env), 'software': software_versions(),
+            }
+            launches.append({
+                'name': name, 'job': job_config['name'], **device, 'command': command, 'env': env,
+                'timeout': job_config.get('timeout', timeout), 'log': str(output_dir / f'{name}.log'),
+                'result_dir': str(result_dir), 'run_config': run_config,
+            })
+    # the co-located jobs interfere with each other, so they are part of the run configuration of each other
+    colocated = {launch['name']: run_key(launch['run_config']) for launch in launches}
+    for launch in launches:
+        launch['run_config']['colocated'] = sorted(
+            colocated[other['name']] for other in launches
+            if other['gpu_id'] == launch['gpu_id'] and other['name'] != launch['name']
+        )
+    return launches
 
 
-def run_job(config: dict):
+def run_job(
+        config: dict, mig_controller: MIGController = None, output_dir: str = 'results', timeout: float = None,
+        configure: bool = True, stream_logs: bool = True, raise_on_error: bool = True, cache: ResultCache = None,
+):
     """Run MIG profiling jobs on specific MIG devices with configuration YAML file.
 
+    The GPUs are configured by :func:`config_gpu_device`, then every job is mapped to the MIG device created for
+    its :code:`devices[]` entry and all jobs are launched at the same time, so that the co-located jobs interfere
+    as they would in production. Every job runs as a subprocess in its own session with
+    :code:`CUDA_VISIBLE_DEVICES` set to its device UUID and :code:`MIGPERF_RESULT_DIR` to its result directory.
+    Its output is streamed to the console (prefixed with the job name) and to :code:`${output_dir}/${name}.log`,
+    and the result JSONs it saves are gathered once it exits.
+
+    With a result cache, the jobs of a GPU are skipped if all of them have cached results for the same run
+    configuration (the job, its device profile, the sibling layout, the MPS share, the co-located jobs and the
+    software versions). Their results are restored into the result directories instead. The results of a GPU are
+    cached once all of its jobs succeed.
+
     Args:
         config (dict): A dict of MIG profiling job configuration.
+        mig_controller (MIGController, optional): The MIG controller to use. Default to a controller on the
+            default backend.
+        output_dir (str, optional): Directory of the job logs and results. Default to :code:`results`.
+        timeout (float, optional): Seconds after which a job is killed, overridden by the :code:`timeout` of the
+            job configuration. Default to no timeout.
+        configure (bool, optional): Configure the GPUs before running the jobs. Default to `True`.
+        stream_logs (bool, optional): Print the job outputs to the console. Default to `True`.
+        raise_on_error (bool, optional): Raise after all jobs finish if any of them failed or timed out.
+            Default to `True`.
+        cache (ResultCache, optional): Cache of the job results. Default to the cache configured by the
+            environment (see :meth:`ResultCache.from_env`), if any.
+
+    Returns:
+        list of dict: The job summaries, in the order of the devices. The dictionary contains: :code:`name`,
+            :code:`job`, :code:`gpu_id`, :code:`mig_device_id`, :code:`uuid`, :code:`command`, :code:`log`,
+            :code:`result_dir`, :code:`exit_code`, :code:`timed_out`, :code:`duration` (seconds),
+            :code:`results` (the loaded result JSONs), :code:`result_files` (their paths, only the files written
+            by this run), :code:`error` (the exception, or :code:`None`) and :code:`cached` (whether the results
+            are restored from the cache).
+
+    Raises:
+        ValueError: If a job cannot be planned, or if :code:`raise_on_error` is set and any of the jobs failed.
 
     Examples:
         job_config example YAML file: example_config.yaml
@@ -66,6 +501,8 @@ def run_job(config: dict):
           devices:
             - gi_profile: 1g.10gb
               job: cv_train
+            - gi_profile: 3g.40gb
+              job: cv_infer
         job_configs:
             - name: cv_train
               type: train
@@ -84,27 +521,56 @@ def run_job(config: dict):
                 weight_decay: 0.0001
               batch_size: 64
               max_train_steps: 100
+              timeout: 3600  # optional, in seconds
+            - name: cv_infer
+              type: inference
+              ml_task: image_classification
+              model:
+                name: resnet50
+              batch_size: 32
+              num_batches: 1000
         ```
+        >>> import yaml
+        >>> with open('example_config.yaml') as f:
+        ...     run_job(yaml.safe_load(f), output_dir='results')
     """
-    # Parse job execution command from config
-    job_configs = config['job_configs']
-    jobs = dict()
-    for job_config in job_configs:
-        task_type = job_configs['type']
-        ml_task = job_configs['ml_task']
-
-        if task_type == 'train' and ml_task == 'image_classification':
-            # python train/train_cv.py -b "${BATCH_SIZE}" -m "${MODEL_NAME}" -n "${max_train_steps}" \
-            #     -i "${GPU_ID}" -mi 0 -dbn "${EXP_SAVE_DIR}/${MIG_PROFILE}"
-            entry_point = 'migperf/profiler/train/train_cv.py'
-            args = [
-                f'-b={job_config["batch_size"]}',
-                f'-m={job_config["model"]["name"]}',
-                f'-n={job_config["max_train_steps"]}',
-            ]
-            jobs[job_config['name']] = {
-                'entry_point': entry_point,
-                'args': args,
-            }
+    mig_controller = mig_controller or MIGController()
+    cache = cache if cache is not None else ResultCache.from_env()
+    if configure:
+        config_gpu_device(config['gpus'], mig_controller=mig_controller)
+    mig_controller.inventory.invalidate()
+    launches = plan_jobs(config, mig_controller.inventory, output_dir, timeout)
+    if not launches:
+        return list()
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+    # a GPU is skipped only if all of its jobs are cached, as a job run alone is not interfered by its neighbors
+    cached_gpu_ids = set()
+    if cache is not None:
+        gpu_ids = {launch['gpu_id'] for launch in launches}
+        cached_gpu_ids = {
+            gpu_id for gpu_id in gpu_ids
+            if all(cache.get(launch['run_config']) is not None for launch in launches if launch['gpu_id'] == gpu_id)
+        }
+    summaries = {
+        launch['name']: _restore_cached_job(launch, cache) for launch in launches if launch['gpu_id'] in cached_gpu_ids
+    }
+    to_run = [launch for launch in launches if launch['gpu_id'] not in cached_gpu_ids]
+    if to_run:
+        with ThreadPoolExecutor(max_workers=len(to_run)) as executor:
+            for launch, summary in zip(
+                    to_run, executor.map(functools.partial(_run_single_job, stream_logs=stream_logs), to_run)
+            ):
+                summaries[launch['name']] = summary
+        # a job is measured with its neighbors running, so the jobs of a GPU are cached only if all of them succeed
+        failed_gpu_ids = {launch['gpu_id'] for launch in to_run if summaries[launch['name']]['error'] is not None}
+        for launch in to_run:
+            if cache is not None and launch['gpu_id'] not in failed_gpu_ids:
+                _cache_job(launch, summaries[launch['name']], cache)
+    summaries = [summaries[launch['name']] for launch in launches]
 
-    # Run jobs on MIG devices
+    failed = [summary for summary in summaries if summary['error'] is not None]
+    if failed and raise_on_error:
+        errors = '\n'.join(f'  {summary["name"]}: {summary["error"]!r}, see {summary["log"]}' for summary in failed)
+        raise ValueError(f'{len(failed)} of {len(summaries)} jobs failed:\n{errors}') from failed[0]['error']
+    return summaries
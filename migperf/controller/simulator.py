@@ -0,0 +1,887 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stateful simulator of MIG-capable GPUs (A100, A30 and H100) for hardware-free testing.
+
+The simulator follows the profile tables and placement rules of the GPU models, assigns GI / CI IDs, tracks
+the current and pending MIG mode, and renders the same text outputs as :code:`nvidia-smi`. It is exposed as:
+
+- :class:`MIGSimulator`, used in-process by :class:`FakeBackend` (records) and
+  :class:`SimulatedNvidiaSMIBackend` (rendered outputs, parsed by :class:`NvidiaSMIBackend`).
+- A drop-in :code:`nvidia-smi` executable, keeping the state in a JSON file across invocations:
+
+  .. code-block:: shell
+
+      export MIGPERF_SIM_STATE=/tmp/nvidia-smi-sim.json MIGPERF_SIM_GPUS=A100,A30
+      python -m migperf.controller.simulator mig -i 0 -cgi 3g.40gb,3g.40gb -C
+
+  :func:`install_nvidia_smi` writes an :code:`nvidia-smi` shim of this command to a directory to put on
+  :code:`PATH`.
+"""
+import contextlib
+import copy
+import json
+import os
+import stat
+import sys
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from .layout import profile_compute_slices
+
+# nvidia-smi exit codes
+SUCCESS = 0
+ERROR_UNKNOWN = 1
+ERROR_INVALID_ARGUMENT = 2
+ERROR_NOT_SUPPORTED = 3
+ERROR_NOT_FOUND = 6
+
+
+class SimulatorError(ValueError):
+    """A failed simulated operation, carrying the :code:`nvidia-smi` error reason and exit code."""
+
+    def __init__(self, message: str, reason: str, code: int = ERROR_UNKNOWN):
+        super().__init__(f'{message}: {reason}')
+        self.reason = reason
+        self.code = code
+
+
+class GIProfile(NamedTuple):
+    """A GPU instance profile of a GPU model, as listed by :code:`nvidia-smi mig -lgip` and
+    :code:`nvidia-smi mig -lgipp`.
+    """
+    name: str
+    profile_id: int
+    max_instances: int
+    memory_gib: float
+    sm: int
+    dec: int
+    enc: int
+    ce: int
+    jpeg: int
+    ofa: int
+    size: int
+    starts: Tuple[int, ...]
+
+
+class GPUModel(NamedTuple):
+    name: str
+    memory_mib: int
+    gi_profiles: Tuple[GIProfile, ...]
+
+
+def _gpu_model(name: str, memory_mib: int, *gi_profiles: tuple):
+    return GPUModel(name, memory_mib, tuple(GIProfile(*row[:-1], tuple(row[-1])) for row in gi_profiles))
+
+
+# (name, profile ID, max instances, memory GiB, SM, DEC, ENC, CE, JPEG, OFA, placement size, placement starts)
+GPU_MODELS = {model.name: model for model in (
+    _gpu_model(
+        'NVIDIA A100-SXM4-80GB', 81920,
+        ('1g.10gb', 19, 7, 9.50, 14, 0, 0, 1, 0, 0, 1, range(7)),
+        ('1g.10gb+me', 20, 1, 9.50, 14, 1, 0, 1, 1, 1, 1, range(7)),
+        ('1g.20gb', 15, 4, 19.50, 14, 1, 0, 1, 0, 0, 2, (0, 2, 4, 6)),
+        ('2g.20gb', 14, 3, 19.50, 28, 1, 0, 2, 0, 0, 2, (0, 2, 4)),
+        ('3g.40gb', 9, 2, 39.25, 42, 2, 0, 3, 0, 0, 4, (0, 4)),
+        ('4g.40gb', 5, 1, 39.25, 56, 2, 0, 4, 0, 0, 4, (0,)),
+        ('7g.80gb', 0, 1, 79.25, 98, 5, 0, 7, 1, 1, 8, (0,)),
+    ),
+    _gpu_model(
+        'NVIDIA A100-SXM4-40GB', 40960,
+        ('1g.5gb', 19, 7, 4.75, 14, 0, 0, 1, 0, 0, 1, range(7)),
+        ('1g.5gb+me', 20, 1, 4.75, 14, 1, 0, 1, 1, 1, 1, range(7)),
+        ('1g.10gb', 15, 4, 9.62, 14, 1, 0, 1, 0, 0, 2, (0, 2, 4, 6)),
+        ('2g.10gb', 14, 3, 9.62, 28, 1, 0, 2, 0, 0, 2, (0, 2, 4)),
+        ('3g.20gb', 9, 2, 19.62, 42, 2, 0, 3, 0, 0, 4, (0, 4)),
+        ('4g.20gb', 5, 1, 19.62, 56, 2, 0, 4, 0, 0, 4, (0,)),
+        ('7g.40gb', 0, 1, 39.50, 98, 5, 0, 7, 1, 1, 8, (0,)),
+    ),
+    _gpu_model(
+        'NVIDIA A30', 24576,
+        ('1g.6gb', 14, 4, 5.81, 14, 1, 0, 1, 0, 0, 1, (0, 1, 2, 3)),
+        ('1g.6gb+me', 21, 1, 5.81, 14, 1, 0, 1, 1, 1, 1, (0, 1, 2, 3)),
+        ('2g.12gb', 5, 2, 11.69, 28, 2, 0, 2, 0, 0, 2, (0, 2)),
+        ('2g.12gb+me', 6, 1, 11.69, 28, 2, 0, 2, 1, 1, 2, (0, 2)),
+        ('4g.24gb', 0, 1, 23.44, 56, 4, 0, 4, 1, 1, 4, (0,)),
+    ),
+    _gpu_model(
+        'NVIDIA H100 80GB HBM3', 81559,
+        ('1g.10gb', 19, 7, 9.75, 16, 1, 0, 1, 1, 0, 1, range(7)),
+        ('1g.10gb+me', 20, 1, 9.75, 16, 1, 0, 1, 1, 1, 1, range(7)),
+        ('1g.20gb', 15, 4, 19.62, 26, 1, 0, 1, 1, 0, 2, (0, 2, 4, 6)),
+        ('2g.20gb', 14, 3, 19.62, 32, 2, 0, 2, 2, 0, 2, (0, 2, 4)),
+        ('3g.40gb', 9, 2, 39.50, 60, 3, 0, 3, 3, 0, 4, (0, 4)),
+        ('4g.40gb', 5, 1, 39.50, 64, 4, 0, 4, 4, 0, 4, (0,)),
+        ('7g.80gb', 0, 1, 79.25, 132, 7, 0, 8, 7, 1, 8, (0,)),
+    ),
+)}
+GPU_MODEL_ALIASES = {
+    'A100': 'NVIDIA A100-SXM4-80GB',
+    'A100-80GB': 'NVIDIA A100-SXM4-80GB',
+    'A100-40GB': 'NVIDIA A100-SXM4-40GB',
+    'A30': 'NVIDIA A30',
+    'H100': 'NVIDIA H100 80GB HBM3',
+}
+# CI compute slices -> CI profile ID
+CI_PROFILE_IDS = {1: 0, 2: 1, 3: 2, 4: 3, 7: 4}
+
+
+def get_gpu_model(name: str):
+    """Look up a simulated GPU model by its full name (e.g., :code:`NVIDIA A30`) or alias (e.g., :code:`A30`)."""
+    name = GPU_MODEL_ALIASES.get(name, name)
+    if name not in GPU_MODELS:
+        raise ValueError(f'Unknown GPU model {name}, expected one of {list(GPU_MODELS) + list(GPU_MODEL_ALIASES)}')
+    return GPU_MODELS[name]
+
+
+def _ids(ids: Union[str, int, None]):
+    """Parse a comma-separated ID list, :code:`None` matches every ID."""
+    if ids is None:
+        return None
+    return {int(i) for i in str(ids).split(',')}
+
+
+class MIGSimulator(object):
+    """Simulated MIG-capable GPUs.
+
+    The GI / CI status records follow the structure documented in :class:`MIGController`. A GPU instance is
+    assigned the lowest free GI ID (from 1) and the first free placement of its profile, unless a placement is
+    requested. A compute instance is assigned the lowest free CI ID (from 0) and the first free compute slices
+    of its GPU instance.
+
+    Args:
+        gpu_models (list of str, optional): Model name or alias of every GPU. Default to one A100-SXM4-80GB.
+        mig_enabled (bool, optional): Whether MIG is enabled initially. Default to `True`.
+        reset_required (bool, optional): Whether a MIG mode change stays pending until the GPU is reset with
+            :code:`nvidia-smi -r`. Default to `False`, the change is effective immediately.
+    """
+
+    def __init__(self, gpu_models: Sequence[str] = ('A100',), mig_enabled: bool = True, reset_required: bool = False):
+        self.reset_required = reset_required
+        self.gpus: List[dict] = list()
+        for index, model_name in enumerate(gpu_models):
+            name = get_gpu_model(model_name).name
+            self.gpus.append({
+                'name': name,
+                'uuid': f'GPU-{uuid.uuid5(uuid.NAMESPACE_OID, f"migperf-sim-{index}-{name}")}',
+                'bus_id': f'00000000:{0x07 + 0x10 * index:02X}:00.0',
+                'mig_current': mig_enabled, 'mig_pending': mig_enabled,
+                'gpu_instances': list(), 'compute_instances': list(),
+            })
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_env(cls):
+        """A simulator of the GPU models listed in the environment variable :code:`MIGPERF_SIM_GPUS`
+        (comma-separated, default to :code:`A100`).
+        """
+        return cls(os.environ.get('MIGPERF_SIM_GPUS', 'A100').split(','))
+
+    def to_dict(self):
+        return {'reset_required': self.reset_required, 'gpus': copy.deepcopy(self.gpus)}
+
+    @classmethod
+    def from_dict(cls, state: dict):
+        simulator = cls(list(), reset_required=state.get('reset_required', False))
+        simulator.gpus = copy.deepcopy(state['gpus'])
+        return simulator
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    @property
+    def num_gpus(self):
+        return len(self.gpus)
+
+    def model(self, gpu_id: int):
+        return get_gpu_model(self._gpu(gpu_id)['name'])
+
+    def _gpu(self, gpu_id: int):
+        if not 0 <= gpu_id < len(self.gpus):
+            raise SimulatorError(f'Unable to find GPU {gpu_id}', 'Not Found', ERROR_NOT_FOUND)
+        return self.gpus[gpu_id]
+
+    def gpu_ids(self, gpu_id: Optional[int] = None):
+        return range(len(self.gpus)) if gpu_id is None else [gpu_id]
+
+    # MIG mode
+
+    def mig_mode(self, gpu_id: int):
+        """:code:`(current, pending)` MIG mode of a GPU."""
+        gpu = self._gpu(gpu_id)
+        return gpu['mig_current'], gpu['mig_pending']
+
+    def set_mig_mode(self, gpu_id: int, enabled: bool):
+        """Change the MIG mode of a GPU. Returns whether the change is effective without a GPU reset.
+
+        Raises:
+            SimulatorError: If MIG is being disabled while GPU instances exist.
+        """
+        gpu = self._gpu(gpu_id)
+        if not enabled and gpu['gpu_instances']:
+            raise SimulatorError(
+                f'Unable to disable MIG Mode for GPU {gpu["bus_id"]}', 'In use by another client', ERROR_UNKNOWN,
+            )
+        gpu['mig_pending'] = enabled
+        if not self.reset_required:
+            gpu['mig_current'] = enabled
+        return gpu['mig_current'] == enabled
+
+    def reset(self, gpu_id: int):
+        """Reset a GPU, which makes the pending MIG mode effective."""
+        gpu = self._gpu(gpu_id)
+        if gpu['gpu_instances']:
+            raise SimulatorError(f'Unable to reset GPU {gpu["bus_id"]}', 'In use by another client', ERROR_UNKNOWN)
+        gpu['mig_current'] = gpu['mig_pending']
+
+    # GPU instances
+
+    def _resolve_gi_profile(self, gpu_id: int, profile: Union[str, int]):
+        profile = str(profile).strip()
+        if profile.startswith('MIG '):
+            profile = profile[4:].strip()
+        for gi_profile in self.model(gpu_id).gi_profiles:
+            if profile in (gi_profile.name, str(gi_profile.profile_id)):
+                return gi_profile
+        raise SimulatorError(
+            f'Unable to create a GPU instance on GPU {gpu_id:2d} using profile {profile}', 'Invalid Argument',
+            ERROR_INVALID_ARGUMENT,
+        )
+
+    def _occupied_slots(self, gpu_id: int):
+        occupied = set()
+        for gi in self._gpu(gpu_id)['gpu_instances']:
+            occupied.update(range(gi['placement']['start'], gi['placement']['start'] + gi['placement']['size']))
+        return occupied
+
+    def _check_mig_enabled(self, gpu_id: int, message: str):
+        if not self._gpu(gpu_id)['mig_current']:
+            raise SimulatorError(message, 'Not Supported', ERROR_NOT_SUPPORTED)
+
+    def create_gpu_instance(self, gpu_id: int, profile: Union[str, int], start: int = None):
+        """Create a GPU instance of a profile (name or ID), at the placement :code:`start` if given.
+
+        Returns:
+            dict: Status of the created GPU instance.
+        Raises:
+            SimulatorError: If MIG is disabled, the profile is unknown, or there is no room for the profile.
+        """
+        message = f'Unable to create a GPU instance on GPU {gpu_id:2d} using profile {profile}'
+        self._check_mig_enabled(gpu_id, message)
+        gi_profile = self._resolve_gi_profile(gpu_id, profile)
+        gpu = self._gpu(gpu_id)
+
+        num_instances = sum(gi['profile_id'] == gi_profile.profile_id for gi in gpu['gpu_instances'])
+        occupied = self._occupied_slots(gpu_id)
+        starts = gi_profile.starts if start is None else [start]
+        start = next((s for s in starts if s in gi_profile.starts and occupied.isdisjoint(
+            range(s, s + gi_profile.size))), None)
+        if start is None or num_instances >= gi_profile.max_instances:
+            raise SimulatorError(message, 'Insufficient Resources')
+
+        used_ids = {gi['gi_id'] for gi in gpu['gpu_instances']}
+        gi_status = {
+            'gpu_id': gpu_id, 'name': f'MIG {gi_profile.name}', 'profile_id': gi_profile.profile_id,
+            'gi_id': next(i for i in range(1, len(used_ids) + 2) if i not in used_ids),
+            'placement': {'start': start, 'size': gi_profile.size},
+        }
+        gpu['gpu_instances'].append(gi_status)
+        return copy.deepcopy(gi_status)
+
+    def destroy_gpu_instance(self, gpu_id: int, gi_id: int):
+        """Raises:
+            SimulatorError: If the GPU instance is not found, or has compute instances.
+        """
+        gpu = self._gpu(gpu_id)
+        message = f'Unable to destroy GPU instance ID {gi_id:2d} from GPU {gpu_id:2d}'
+        gi_status = self._find_gpu_instance(gpu_id, gi_id, message)
+        if any(ci['gi_id'] == gi_id for ci in gpu['compute_instances']):
+            raise SimulatorError(message, 'In use by another client')
+        gpu['gpu_instances'].remove(gi_status)
+
+    def _find_gpu_instance(self, gpu_id: int, gi_id: int, message: str):
+        for gi_status in self._gpu(gpu_id)['gpu_instances']:
+            if gi_status['gi_id'] == gi_id:
+                return gi_status
+        raise SimulatorError(message, 'Not Found', ERROR_NOT_FOUND)
+
+    def gpu_instances(self, gpu_id: int = None, gi_ids: Union[str, int, None] = None):
+        """Status of the GPU instances, optionally filtered by GPU and (comma-separated) GI IDs."""
+        gi_ids = _ids(gi_ids)
+        return [
+            copy.deepcopy(gi) for g_id in self.gpu_ids(gpu_id) for gi in self._gpu(g_id)['gpu_instances']
+            if gi_ids is None or gi['gi_id'] in gi_ids
+        ]
+
+    # compute instances
+
+    def _gi_profile_of(self, gi_status: dict):
+        return next(p for p in self.model(gi_status['gpu_id']).gi_profiles if p.profile_id == gi_status['profile_id'])
+
+    def _ci_profiles(self, gi_status: dict):
+        """CI profiles of a GPU instance as :code:`(name, profile_id, slices, gi_profile)`."""
+        gi_profile = self._gi_profile_of(gi_status)
+        gi_slices = profile_compute_slices(gi_profile.name)
+        return [
+            (gi_profile.name if slices == gi_slices else f'{slices}c.{gi_profile.name}', profile_id, slices, gi_profile)
+            for slices, profile_id in CI_PROFILE_IDS.items() if slices <= gi_slices
+        ]
+
+    def create_compute_instance(self, gpu_id: int, gi_id: int, profile: Union[str, int, None] = None):
+        """Create a compute instance in a GPU instance, of a CI profile (name or ID, default to the profile
+        spanning the whole GPU instance).
+
+        Returns:
+            dict: Status of the created compute instance.
+        Raises:
+            SimulatorError: If the GPU instance is not found, the profile is unknown, or there are not enough
+                free compute slices.
+        """
+        message = f'Unable to create a compute instance on GPU {gpu_id:2d} GPU instance ID {gi_id:2d}'
+        if profile is not None:
+            message = f'{message} using profile {profile}'
+        gi_status = self._find_gpu_instance(gpu_id, gi_id, message)
+        ci_profiles = self._ci_profiles(gi_status)
+        if profile is None:
+            ci_profile = ci_profiles[-1]
+        else:
+            profile = str(profile).strip()
+            profile = profile[4:].strip() if profile.startswith('MIG ') else profile
+            ci_profile = next((p for p in ci_profiles if profile in (p[0], str(p[1]), f'{p[2]}c.{p[3].name}')), None)
+            if ci_profile is None:
+                raise SimulatorError(message, 'Invalid Argument', ERROR_INVALID_ARGUMENT)
+        name, profile_id, slices, gi_profile = ci_profile
+
+        siblings = [ci for ci in self._gpu(gpu_id)['compute_instances'] if ci['gi_id'] == gi_id]
+        used = set()
+        for ci in siblings:
+            used.update(range(ci['placement']['start'], ci['placement']['start'] + ci['placement']['size']))
+        gi_slices = profile_compute_slices(gi_profile.name)
+        start = next((s for s in range(gi_slices - slices + 1) if used.isdisjoint(range(s, s + slices))), None)
+        if start is None:
+            raise SimulatorError(message, 'Insufficient Resources')
+
+        used_ids = {ci['ci_id'] for ci in siblings}
+        ci_status = {
+            'gpu_id': gpu_id, 'gi_id': gi_id, 'name': f'MIG {name}', 'profile_id': profile_id,
+            'ci_id': next(i for i in range(len(used_ids) + 1) if i not in used_ids),
+            'placement': {'start': start, 'size': slices},
+        }
+        self._gpu(gpu_id)['compute_instances'].append(ci_status)
+        return copy.deepcopy(ci_status)
+
+    def destroy_compute_instance(self, gpu_id: int, gi_id: int, ci_id: int):
+        gpu = self._gpu(gpu_id)
+        for ci_status in gpu['compute_instances']:
+            if ci_status['gi_id'] == gi_id and ci_status['ci_id'] == ci_id:
+                gpu['compute_instances'].remove(ci_status)
+                return
+        raise SimulatorError(
+            f'Unable to destroy compute instance ID {ci_id:2d} from GPU {gpu_id:2d} GPU instance ID {gi_id:2d}',
+            'Not Found', ERROR_NOT_FOUND,
+        )
+
+    def compute_instances(self, gpu_id: int = None, gi_ids: Union[str, int, None] = None,
+                          ci_ids: Union[str, int, None] = None):
+        """Status of the compute instances, optionally filtered by GPU, (comma-separated) GI and CI IDs."""
+        gi_ids, ci_ids = _ids(gi_ids), _ids(ci_ids)
+        return [
+            copy.deepcopy(ci) for g_id in self.gpu_ids(gpu_id) for ci in self._gpu(g_id)['compute_instances']
+            if (gi_ids is None or ci['gi_id'] in gi_ids) and (ci_ids is None or ci['ci_id'] in ci_ids)
+        ]
+
+    # profiles and devices
+
+    def gpu_instance_profiles(self, gpu_id: int = None):
+        """GI profile records of the MIG-enabled GPUs, see :meth:`MIGBackend.list_gpu_instance_profiles`."""
+        gi_profile_list = list()
+        for g_id in self.gpu_ids(gpu_id):
+            if not self._gpu(g_id)['mig_current']:
+                continue
+            gpu_instances = self._gpu(g_id)['gpu_instances']
+            for p in self.model(g_id).gi_profiles:
+                # place the profile first-fit, as many times as possible
+                occupied, free = self._occupied_slots(g_id), 0
+                for start in p.starts:
+                    if occupied.isdisjoint(range(start, start + p.size)):
+                        occupied.update(range(start, start + p.size))
+                        free += 1
+                num_instances = sum(gi['profile_id'] == p.profile_id for gi in gpu_instances)
+                gi_profile_list.append({
+                    'gpu_id': g_id, 'name': f'MIG {p.name}', 'profile_id': p.profile_id,
+                    'instances_free': min(free, p.max_instances - num_instances),
+                    'instances_total': p.max_instances, 'memory_gib': p.memory_gib, 'p2p': False, 'sm': p.sm,
+                    'dec': p.dec, 'enc': p.enc, 'ce': p.ce, 'jpeg': p.jpeg, 'ofa': p.ofa,
+                })
+        return gi_profile_list
+
+    def gpu_instance_possible_placements(self, gpu_id: int = None):
+        return [
+            {'gpu_id': g_id, 'profile_id': p.profile_id,
+             'placements': [{'start': start, 'size': p.size} for start in p.starts]}
+            for g_id in self.gpu_ids(gpu_id) if self._gpu(g_id)['mig_current'] for p in self.model(g_id).gi_profiles
+        ]
+
+    def compute_instance_profiles(self, gpu_id: int = None, gi_ids: Union[str, int, None] = None):
+        ci_profile_list = list()
+        for gi_status in self.gpu_instances(gpu_id, gi_ids):
+            compute_instances = self.compute_instances(gi_status['gpu_id'], gi_status['gi_id'])
+            used = sum(ci['placement']['size'] for ci in compute_instances)
+            for name, profile_id, slices, gi_profile in self._ci_profiles(gi_status):
+                gi_slices = profile_compute_slices(gi_profile.name)
+                ci_profile_list.append({
+                    'gpu_id': gi_status['gpu_id'], 'gi_id': gi_status['gi_id'], 'name': f'MIG {name}',
+                    'profile_id': profile_id, 'default': slices == gi_slices,
+                    'instances_free': (gi_slices - used) // slices, 'instances_total': gi_slices // slices,
+                    'sm': gi_profile.sm * slices // gi_slices, 'dec': gi_profile.dec, 'enc': gi_profile.enc,
+                    'ofa': gi_profile.ofa, 'ce': gi_profile.ce, 'jpeg': gi_profile.jpeg,
+                })
+        return ci_profile_list
+
+    def _mig_device_uuid(self, gpu_id: int, ci_status: dict):
+        name = f'{self._gpu(gpu_id)["uuid"]}-{ci_status["gi_id"]}-{ci_status["ci_id"]}'
+        return f'MIG-{uuid.uuid5(uuid.NAMESPACE_OID, name)}'
+
+    def devices(self):
+        """GPU and MIG device records, see :meth:`MIGBackend.list_devices`. The MIG devices of a GPU are
+        numbered in the order of their GI and CI IDs.
+        """
+        devices = list()
+        for g_id, gpu in enumerate(self.gpus):
+            device = {'gpu_id': g_id, 'name': gpu['name'], 'uuid': gpu['uuid'], 'mig_devices': list()}
+            if gpu['mig_current']:
+                compute_instances = sorted(gpu['compute_instances'], key=lambda ci: (ci['gi_id'], ci['ci_id']))
+                for mig_device_id, ci in enumerate(compute_instances):
+                    device['mig_devices'].append({
+                        'gpu_id': g_id, 'mig_device_id': mig_device_id, 'gi_id': ci['gi_id'], 'ci_id': ci['ci_id'],
+                        'name': ci['name'], 'uuid': self._mig_device_uuid(g_id, ci),
+                    })
+            devices.append(device)
+        return devices
+
+    # nvidia-smi command line
+
+    def execute(self, args: List[str]):
+        """Execute an :code:`nvidia-smi` command line (without the executable) on the simulated GPUs.
+
+        Supported: :code:`nvidia-smi`, :code:`-L`, :code:`--query-gpu=... --format=csv[,noheader]`,
+        :code:`-mig 0|1`, :code:`-r` and :code:`mig` with :code:`-cgi [-C]`, :code:`-cci`, :code:`-dci`,
+        :code:`-dgi`, :code:`-lgi`, :code:`-lci`, :code:`-lgip`, :code:`-lgipp` and :code:`-lcip`, filtered by
+        :code:`-i`, :code:`-gi` and :code:`-ci`.
+
+        Returns:
+            tuple: The exit code and the output.
+        """
+        with self._lock:
+            try:
+                code, lines = self._execute(list(args))
+            except SimulatorError as e:
+                code, lines = e.code, [str(e)]
+            return code, ''.join(f'{line}\n' for line in lines)
+
+    @staticmethod
+    def _parse_args(args: List[str]):
+        options, positional = dict(), list()
+        args = iter(args)
+        for arg in args:
+            if arg.startswith('--') and '=' in arg:
+                key, value = arg.split('=', 1)
+                options[key] = value
+            elif arg in ('-i', '--id', '-gi', '-ci', '-cgi', '-mig', '--multi-instance-gpu'):
+                options[arg] = next(args, None)
+            elif arg.startswith('-'):
+                options[arg] = True
+            else:
+                positional.append(arg)
+        return options, positional
+
+    def _execute(self, args: List[str]):
+        subcommand = args.pop(0) if args and args[0] == 'mig' else None
+        options, positional = self._parse_args(args)
+        gpu_ids = options.pop('-i', options.pop('--id', None))
+        try:
+            gpu_ids = list(self.gpu_ids()) if gpu_ids is None else [int(i) for i in gpu_ids.split(',')]
+        except ValueError:
+            return ERROR_INVALID_ARGUMENT, [f'Invalid GPU ID: {gpu_ids}']
+        for gpu_id in gpu_ids:
+            self._gpu(gpu_id)
+
+        if subcommand == 'mig':
+            return self._execute_mig(options, positional, gpu_ids)
+        if positional:
+            return ERROR_INVALID_ARGUMENT, [f'Invalid combination of input arguments: {" ".join(positional)}']
+        if not options:
+            return SUCCESS, self.render_device_table()
+        if options == {'-L': True}:
+            return SUCCESS, self.render_device_list()
+        if '--query-gpu' in options:
+            return self._query_gpu(options['--query-gpu'], options.get('--format', ''), gpu_ids)
+        mig_mode = options.get('-mig', options.get('--multi-instance-gpu', None))
+        if mig_mode in ('0', '1'):
+            lines = list()
+            for gpu_id in gpu_ids:
+                bus_id = self._gpu(gpu_id)['bus_id']
+                if self.set_mig_mode(gpu_id, mig_mode == '1'):
+                    lines.append(f'{"Enabled" if mig_mode == "1" else "Disabled"} MIG Mode for GPU {bus_id}')
+                else:
+                    lines.append(f'Warning: MIG mode is in pending {"enable" if mig_mode == "1" else "disable"} '
+                                 f'state for GPU {bus_id}: Reset the GPU to make MIG mode effective.')
+            return SUCCESS, lines + ['All done.']
+        if options.get('-r') or options.get('--gpu-reset'):
+            for gpu_id in gpu_ids:
+                self.reset(gpu_id)
+            return SUCCESS, [f'GPU {self._gpu(gpu_id)["bus_id"]} was successfully reset.' for gpu_id in gpu_ids] + [
+                'All done.'
+            ]
+        return ERROR_INVALID_ARGUMENT, ["Invalid combination of input arguments. Please run 'nvidia-smi -h' for help."]
+
+    def _query_gpu(self, fields: str, output_format: str, gpu_ids: List[int]):
+        fields = fields.split(',')
+        values = {
+            'index': lambda g_id, gpu: str(g_id),
+            'name': lambda g_id, gpu: gpu['name'],
+            'uuid': lambda g_id, gpu: gpu['uuid'],
+            'pci.bus_id': lambda g_id, gpu: gpu['bus_id'],
+            'memory.total': lambda g_id, gpu: f'{self.model(g_id).memory_mib} MiB',
+            'mig.mode.current': lambda g_id, gpu: 'Enabled' if gpu['mig_current'] else 'Disabled',
+            'mig.mode.pending': lambda g_id, gpu: 'Enabled' if gpu['mig_pending'] else 'Disabled',
+        }
+        unknown = [field for field in fields if field not in values]
+        if unknown or not output_format.startswith('csv'):
+            return ERROR_INVALID_ARGUMENT, [f'Field "{unknown[0]}" is not a valid field to query.' if unknown else
+                                            'Only the csv format is supported.']
+        lines = [] if 'noheader' in output_format else [', '.join(fields)]
+        for gpu_id in gpu_ids:
+            lines.append(', '.join(values[field](gpu_id, self._gpu(gpu_id)) for field in fields))
+        return SUCCESS, lines
+
+    def _execute_mig(self, options: dict, positional: List[str], gpu_ids: List[int]):
+        gi_ids, ci_ids = options.get('-gi', None), options.get('-ci', None)
+        if options.get('-cgi'):
+            lines = list()
+            for gpu_id in gpu_ids:
+                for gi_profile in options['-cgi'].split(','):
+                    profile, _, start = gi_profile.partition(':')
+                    try:
+                        gi_status = self.create_gpu_instance(gpu_id, profile, int(start) if start else None)
+                    except SimulatorError as e:
+                        return e.code, lines + [str(e), f'Failed to create GPU instances: {e.reason}']
+                    lines.append(
+                        f'Successfully created GPU instance ID {gi_status["gi_id"]:2d} on GPU {gpu_id:2d} using '
+                        f'profile {gi_status["name"]} (ID {gi_status["profile_id"]:2d})'
+                    )
+                    if options.get('-C'):
+                        lines.append(self._render_created_ci(self.create_compute_instance(gpu_id, gi_status['gi_id'])))
+            return SUCCESS, lines
+        if options.get('-cci'):
+            lines = list()
+            ci_profiles = ','.join(positional).split(',') if positional else [None]
+            targets = [gi for gpu_id in gpu_ids for gi in self.gpu_instances(gpu_id, gi_ids)]
+            if not targets:
+                return ERROR_NOT_FOUND, ['Failed to create compute instances: Not Found']
+            for gi_status in targets:
+                for ci_profile in ci_profiles:
+                    try:
+                        ci_status = self.create_compute_instance(gi_status['gpu_id'], gi_status['gi_id'], ci_profile)
+                    except SimulatorError as e:
+                        return e.code, lines + [str(e), f'Failed to create compute instances: {e.reason}']
+                    lines.append(self._render_created_ci(ci_status))
+            return SUCCESS, lines
+        if options.get('-dci'):
+            targets = [ci for gpu_id in gpu_ids for ci in self.compute_instances(gpu_id, gi_ids, ci_ids)]
+            if not targets:
+                return ERROR_NOT_FOUND, ['Failed to destroy compute instances: Not Found']
+            lines = list()
+            for ci in targets:
+                self.destroy_compute_instance(ci['gpu_id'], ci['gi_id'], ci['ci_id'])
+                lines.append(f'Successfully destroyed compute instance ID {ci["ci_id"]:2d} from GPU {ci["gpu_id"]:2d} '
+                             f'GPU instance ID {ci["gi_id"]:2d}')
+            return SUCCESS, lines
+        if options.get('-dgi'):
+            targets = [gi for gpu_id in gpu_ids for gi in self.gpu_instances(gpu_id, gi_ids)]
+            if not targets:
+                return ERROR_NOT_FOUND, ['Failed to destroy GPU instances: Not Found']
+            code, lines = SUCCESS, list()
+            for gi in targets:
+                try:
+                    self.destroy_gpu_instance(gi['gpu_id'], gi['gi_id'])
+                    lines.append(f'Successfully destroyed GPU instance ID {gi["gi_id"]:2d} from GPU {gi["gpu_id"]:2d}')
+                except SimulatorError as e:
+                    code, reason = e.code, e.reason
+                    lines.append(str(e))
+            if code != SUCCESS:
+                lines.append(f'Failed to destroy GPU instances: {reason}')
+            return code, lines
+        if options.get('-lgi'):
+            return self._render_table(self.render_gpu_instances(gpu_ids, gi_ids), 'GPU instances')
+        if options.get('-lci'):
+            return self._render_table(self.render_compute_instances(gpu_ids, gi_ids, ci_ids), 'compute instances')
+        if options.get('-lgip'):
+            return self._render_table(self.render_gpu_instance_profiles(gpu_ids), 'GPU instance profiles')
+        if options.get('-lgipp'):
+            lines = self.render_gpu_instance_possible_placements(gpu_ids)
+            return (SUCCESS, lines) if lines else (ERROR_NOT_FOUND, ['No GPU instance profiles found: Not Found'])
+        if options.get('-lcip'):
+            lines = self.render_compute_instance_profiles(gpu_ids, gi_ids)
+            return self._render_table(lines, 'compute instance profiles')
+        return ERROR_INVALID_ARGUMENT, ["Invalid combination of input arguments. Please run 'nvidia-smi -h' for help."]
+
+    # rendering of the nvidia-smi outputs
+
+    @staticmethod
+    def _render_table(lines: List[str], name: str):
+        if not lines:
+            return ERROR_NOT_FOUND, [f'No {name} found: Not Found']
+        return SUCCESS, lines
+
+    @staticmethod
+    def _render_created_ci(ci_status: dict):
+        return (
+            f'Successfully created compute instance ID {ci_status["ci_id"]:2d} on GPU {ci_status["gpu_id"]:2d} '
+            f'GPU instance ID {ci_status["gi_id"]:2d} using profile {ci_status["name"]} '
+            f'(ID {ci_status["profile_id"]:2d})'
+        )
+
+    def render_gpu_instances(self, gpu_ids: List[int], gi_ids: Union[str, int, None] = None):
+        rows = list()
+        for gpu_id in gpu_ids:
+            for gi in self.gpu_instances(gpu_id, gi_ids):
+                rows.append(f'| {gpu_id:3d}  {gi["name"]:<16}{gi["profile_id"]:>5}{gi["gi_id"]:>10}'
+                            f'{gi["placement"]["start"]:>11}:{gi["placement"]["size"]:<6}|')
+        if not rows:
+            return rows
+        separator = '+' + '-' * 55 + '+'
+        return [
+            separator,
+            '| GPU instances:                                        |',
+            '| GPU   Name             Profile  Instance   Placement  |',
+            '|                          ID       ID       Start:Size |',
+            '|' + '=' * 55 + '|',
+        ] + [line for row in rows for line in (row, separator)]
+
+    def render_compute_instances(self, gpu_ids: List[int], gi_ids: Union[str, int, None] = None,
+                                 ci_ids: Union[str, int, None] = None):
+        rows = list()
+        for gpu_id in gpu_ids:
+            for ci in self.compute_instances(gpu_id, gi_ids, ci_ids):
+                rows.append(f'| {gpu_id:3d}{ci["gi_id"]:>7}       {ci["name"]:<18}{ci["profile_id"]:>4}'
+                            f'{ci["ci_id"]:>10}{ci["placement"]["start"]:>11}:{ci["placement"]["size"]:<6}|')
+        if not rows:
+            return rows
+        separator = '+' + '-' * 68 + '+'
+        return [
+            separator,
+            '| Compute instances:                                                 |',
+            '| GPU     GPU       Name             Profile   Instance   Placement  |',
+            '|       Instance                       ID        ID       Start:Size |',
+            '|         ID                                                         |',
+            '|' + '=' * 68 + '|',
+        ] + [line for row in rows for line in (row, separator)]
+
+    def render_gpu_instance_profiles(self, gpu_ids: List[int]):
+        rows = list()
+        for gpu_id in gpu_ids:
+            for p in self.gpu_instance_profiles(gpu_id):
+                rows.append(
+                    f'| {gpu_id:3d}  {p["name"]:<16}{p["profile_id"]:>3}{p["instances_free"]:>6}/'
+                    f'{p["instances_total"]:<7}{p["memory_gib"]:>7.2f}{"Yes" if p["p2p"] else "No":>10}'
+                    f'{p["sm"]:>7}{p["dec"]:>6}{p["enc"]:>6}   |'
+                )
+                rows.append(f'|{" " * 60}{p["ce"]:>3}{p["jpeg"]:>6}{p["ofa"]:>6}   |')
+        if not rows:
+            return rows
+        separator = '+' + '-' * 77 + '+'
+        lines = [
+            separator,
+            '| GPU instance profiles:                                                      |',
+            '| GPU   Name             ID    Instances   Memory     P2P    SM    DEC   ENC  |',
+            '|                              Free/Total   GiB              CE    JPEG  OFA  |',
+            '|' + '=' * 77 + '|',
+        ]
+        for i in range(0, len(rows), 2):
+            lines.extend(rows[i:i + 2] + [separator])
+        return lines
+
+    def render_gpu_instance_possible_placements(self, gpu_ids: List[int]):
+        lines = list()
+        for gpu_id in gpu_ids:
+            for record in self.gpu_instance_possible_placements(gpu_id):
+                starts = ','.join(str(p['start']) for p in record['placements'])
+                label = 'Placements' if len(record['placements']) > 1 else 'Placement '
+                lines.append(f'GPU {gpu_id:2d} Profile ID {record["profile_id"]:2d} {label}: '
+                             f'{{{starts}}}:{record["placements"][0]["size"]}')
+        return lines
+
+    def render_compute_instance_profiles(self, gpu_ids: List[int], gi_ids: Union[str, int, None] = None):
+        rows = list()
+        for gpu_id in gpu_ids:
+            for p in self.compute_instance_profiles(gpu_id, gi_ids):
+                profile_id = f'{p["profile_id"]}{"*" if p["default"] else ""}'
+                rows.append(
+                    f'| {gpu_id:3d}{p["gi_id"]:>7}       {p["name"]:<20}{profile_id:>3}{p["instances_free"]:>8}/'
+                    f'{p["instances_total"]:<8}{p["sm"]:>7}{p["dec"]:>9}{p["enc"]:>6}{p["ofa"]:>6}   |'
+                )
+                rows.append(f'|{" " * 69}{p["ce"]:>3}{p["jpeg"]:>6}          |')
+        if not rows:
+            return rows
+        separator = '+' + '-' * 86 + '+'
+        lines = [
+            separator,
+            '| Compute instance profiles:                                                           |',
+            '| GPU     GPU       Name             Profile  Instances   Exclusive       Shared       |',
+            '|       Instance                       ID     Free/Total     SM       DEC   ENC   OFA  |',
+            '|         ID                                                          CE    JPEG       |',
+            '|' + '=' * 86 + '|',
+        ]
+        for i in range(0, len(rows), 2):
+            lines.extend(rows[i:i + 2] + [separator])
+        return lines
+
+    def render_device_list(self):
+        """Output of :code:`nvidia-smi -L`."""
+        lines = list()
+        for device in self.devices():
+            lines.append(f'GPU {device["gpu_id"]}: {device["name"]} (UUID: {device["uuid"]})')
+            for mig_device in device['mig_devices']:
+                lines.append(f'  {mig_device["name"]:<16}Device {mig_device["mig_device_id"]:2d}: '
+                             f'(UUID: {mig_device["uuid"]})')
+        return lines
+
+    def render_device_table(self):
+        """Output of :code:`nvidia-smi`: the GPU table and the MIG device table."""
+        separator = '+-------------------------------+----------------------+----------------------+'
+        lines = [
+            '+-----------------------------------------------------------------------------+',
+            '| NVIDIA-SMI 525.85.12    Driver Version: 525.85.12    CUDA Version: 12.0     |',
+            '|-------------------------------+----------------------+----------------------+',
+            '| GPU  Name        Persistence-M| Bus-Id        Disp.A | Volatile Uncorr. ECC |',
+            '| Fan  Temp  Perf  Pwr:Usage/Cap|         Memory-Usage | GPU-Util  Compute M. |',
+            '|                               |                      |               MIG M. |',
+            '|===============================+======================+======================|',
+        ]
+        for g_id, gpu in enumerate(self.gpus):
+            mig = 'Enabled' if gpu['mig_current'] else 'Disabled'
+            lines.extend([
+                f'| {g_id:3d}  {gpu["name"][:18]:<18}  On   | {gpu["bus_id"]} Off |'
+                f'{"On" if gpu["mig_current"] else "0":>21} |',
+                f'| N/A   30C    P0    40W / 400W |{f"0MiB / {self.model(g_id).memory_mib}MiB":>21} |'
+                f'{"N/A" if gpu["mig_current"] else "0%":>8}      Default |',
+                f'|                               |                      |{mig:>21} |',
+                separator,
+            ])
+
+        mig_rows = list()
+        for device in self.devices():
+            g_id = device['gpu_id']
+            gi_profiles = {gi['gi_id']: self._gi_profile_of(gi) for gi in self._gpu(g_id)['gpu_instances']}
+            for mig_device in device['mig_devices']:
+                gi_profile = gi_profiles[mig_device['gi_id']]
+                ci = next(ci for ci in self._gpu(g_id)['compute_instances']
+                          if (ci['gi_id'], ci['ci_id']) == (mig_device['gi_id'], mig_device['ci_id']))
+                sm = gi_profile.sm * ci['placement']['size'] // profile_compute_slices(gi_profile.name)
+                memory = f'0MiB / {int(gi_profile.memory_gib * 1024)}MiB'
+                mig_rows.extend([
+                    f'| {g_id:2d} {mig_device["gi_id"]:4d}{mig_device["ci_id"]:4d}{mig_device["mig_device_id"]:4d}  |'
+                    f'{memory:>21} |{sm:>3}      0 |{gi_profile.ce:>3}{gi_profile.enc:>4}{gi_profile.dec:>5}'
+                    f'{gi_profile.ofa:>5}{gi_profile.jpeg:>5} |',
+                    '|                  |      0MiB / 16383MiB |           |                       |',
+                    '+------------------+----------------------+-----------+-----------------------+',
+                ])
+        if mig_rows:
+            lines.extend([
+                '',
+                '+-----------------------------------------------------------------------------+',
+                '| MIG devices:                                                                |',
+                '+------------------+----------------------+-----------+-----------------------+',
+                '| GPU  GI  CI  MIG |         Memory-Usage |        Vol|         Shared        |',
+                '|      ID  ID  Dev |           BAR1-Usage | SM     Unc| CE  ENC  DEC  OFA  JPG|',
+                '|==================+======================+===========+=======================|',
+            ] + mig_rows)
+        lines.extend([
+            '',
+            '+-----------------------------------------------------------------------------+',
+            '| Processes:                                                                  |',
+            '|  GPU   GI   CI        PID   Type   Process name                  GPU Memory |',
+            '|        ID   ID                                                   Usage      |',
+            '|=============================================================================|',
+            '|  No running processes found                                                 |',
+            '+-----------------------------------------------------------------------------+',
+        ])
+        return lines
+
+
+def default_state_path():
+    """State file of the :code:`nvidia-smi` shim, from the environment variable :code:`MIGPERF_SIM_STATE`."""
+    return os.environ.get('MIGPERF_SIM_STATE', os.path.join(tempfile.gettempdir(), 'migperf-nvidia-smi-sim.json'))
+
+
+@contextlib.contextmanager
+def _locked(path: str):
+    """Serialize the shim invocations sharing a state file."""
+    import fcntl
+
+    with open(f'{path}.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def main(argv: List[str] = None, state_path: str = None):
+    """Entry of the :code:`nvidia-smi` shim. The state is loaded from (and saved back to) :code:`state_path`,
+    default to :func:`default_state_path`. A missing state file is initialized by :meth:`MIGSimulator.from_env`.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    state_path = state_path or default_state_path()
+    with _locked(state_path):
+        simulator = MIGSimulator.load(state_path) if os.path.exists(state_path) else MIGSimulator.from_env()
+        code, output = simulator.execute(argv)
+        simulator.save(state_path)
+    sys.stdout.write(output)
+    return code
+
+
+def install_nvidia_smi(directory: str, state_path: str = None, simulator: MIGSimulator = None):
+    """Write an executable :code:`nvidia-smi` shim of the simulator to a directory, e.g., to prepend to
+    :code:`PATH`. Note that :code:`sudo` usually resets :code:`PATH`, so use the shim without :code:`sudo`
+    (:code:`NvidiaSMIBackend(sudo=False)`), or give its full path as the executable.
+
+    Args:
+        directory (str): Directory to write the shim to, created if missing.
+        state_path (str, optional): State file of the shim. Default to the :code:`MIGPERF_SIM_STATE` environment
+            variable at execution time.
+        simulator (MIGSimulator, optional): Initial state saved to :code:`state_path`.
+    Returns:
+        str: Path to the shim.
+    """
+    if simulator is not None:
+        if state_path is None:
+            raise ValueError('state_path is required to save the initial simulator state')
+        simulator.save(state_path)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, 'nvidia-smi')
+    package_root = str(Path(__file__).resolve().parents[2])
+    with open(path, 'w') as f:
+        f.write(
+            f'#!{sys.executable}\n'
+            f'import sys\n'
+            f'sys.path.insert(0, {package_root!r})\n'
+            f'from migperf.controller.simulator import main\n'
+            f'sys.exit(main(state_path={state_path!r}))\n'
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+if __name__ == '__main__':
+    sys.exit(main())
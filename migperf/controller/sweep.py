@@ -0,0 +1,463 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reconfiguration-aware sweep planner. A sweep expands a parameter grid into runs, groups the runs by the GPU state
+they require (the MIG layout, or MPS), orders the groups to minimize the total reconfiguration cost and runs every
+group with :func:`migperf.controller.runner.run_job`, so that the GPU is repartitioned once per group instead of
+once per run. Inside a group, the runs differing only in the batch size are merged into one job, whose process
+keeps the model loaded across the batch sizes.
+
+A sweep is described in YAML:
+
+.. code-block:: yaml
+
+    gpu_id: 0
+    gpu_model: A100  # optional, for the MPS shares. Default to the detected GPU model
+    job:  # job template, see run_job
+      type: inference
+      ml_task: image_classification
+      num_batches: 1000
+    grid:
+      sharing: [mig, mps]  # MIG instances, or MPS clients limited to the share of the MIG profiles
+      layout: ['7g.80gb', '2x3g.40gb', '4x1g.10gb']  # one co-located client per GPU instance
+      model: [resnet50, vgg16]
+      batch_size: [1, 2, 4, 8, 16, 32, 64]
+
+The axes other than :code:`sharing` and :code:`layout` are set in the job template (:code:`model` sets the model
+name), and are substituted into the :code:`args` of a custom :code:`entry_point` job, e.g., :code:`-r={rate}`.
+
+Examples:
+    Print the plan with the transition costs measured by :mod:`migperf.controller.benchmark`:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.sweep sweep.yaml --costs report.json --dry-run
+
+    Run the sweep:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.sweep sweep.yaml --costs report.json -o results
+"""
+import argparse
+import copy
+import itertools
+import json
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from migperf.profiler.utils.result_cache import CACHE_POLICIES, ResultCache
+
+from .benchmark import layout_label
+from .layout import GPUInstanceSpec, MIGLayout, profile_compute_slices
+from .mig_controller import MIGController
+from .mps_controller import disable_mps
+from .runner import JOB_ENTRY_POINTS, MULTI_BATCH_SIZE_ENTRY_POINTS, run_job
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+SHARING_MODES = ('mig', 'mps')
+# GPU state of the MPS groups: MIG disabled, the layouts only set the MPS shares of the clients
+MPS_STATE = ('mps', None)
+# Estimated seconds of the operations without a benchmark report, per GPU instance for the GI / CI operations
+DEFAULT_OPERATION_COSTS = {
+    'destroy_compute_instance': 1., 'destroy_gpu_instance': 1., 'create_gpu_instance': 2.,
+    'enable_mig': 5., 'disable_mig': 5., 'enable_mps': 1., 'disable_mps': 1.,
+}
+# Above this number of groups, the order is searched greedily instead of exactly
+MAX_EXACT_GROUPS = 10
+
+
+def _parse_label(label: str):
+    return MIGLayout.parse(label) if label != 'empty' else MIGLayout()
+
+
+def canonical_layout(layout):
+    """A layout (string, list of profiles or :class:`MIGLayout`) as a label independent of the profile order,
+    largest GPU instances first, e.g., :code:`3g.40gb,2g.20gb,1g.10gb`. Returns :code:`empty` for no instance.
+    """
+    if isinstance(layout, str):
+        layout = _parse_label(layout)
+    elif not isinstance(layout, MIGLayout):
+        layout = MIGLayout(layout)
+    specs = sorted(layout, key=lambda spec: (-profile_compute_slices(spec.profile), spec.to_profile_str()))
+    return layout_label(MIGLayout(specs))
+
+
+class TransitionCostModel(object):
+    """Cost in seconds of bringing the GPU from one state to another. A state is :code:`('mig', layout label)` or
+    :data:`MPS_STATE`.
+
+    The mean duration measured for a transition (the :code:`by_transition` section of a
+    :mod:`migperf.controller.benchmark` report) is used when available. Otherwise, the cost is estimated from the
+    GPU instances to destroy / create, with the mean duration of the operations measured in the report
+    (:code:`by_operation`), or :data:`DEFAULT_OPERATION_COSTS`.
+
+    Args:
+        report (dict, optional): A benchmark report.
+    """
+
+    def __init__(self, report: dict = None):
+        report = report or dict()
+        self.transitions: Dict[Tuple[str, str], float] = dict()
+        for key, stats in report.get('by_transition', dict()).items():
+            if stats.get('count'):
+                from_label, to_label = key.split(' -> ')
+                self.transitions[canonical_layout(from_label), canonical_layout(to_label)] = stats['mean']
+        self.operation_costs = dict(DEFAULT_OPERATION_COSTS)
+        for name, stats in report.get('by_operation', dict()).items():
+            if stats.get('count'):
+                self.operation_costs[name] = stats['mean']
+
+    @classmethod
+    def from_file(cls, path: str):
+        """Load a benchmark report saved by :code:`python -m migperf.controller.benchmark -o report.json`."""
+        with open(path) as f:
+            return cls(json.load(f))
+
+    def mig_cost(self, from_label: str, to_label: str):
+        """Cost of reconciling between two MIG layouts."""
+        if from_label == to_label:
+            return 0.
+        if (from_label, to_label) in self.transitions:
+            return self.transitions[from_label, to_label]
+        current, desired = _parse_label(from_label), _parse_label(to_label)
+        current, desired = Counter(map(GPUInstanceSpec.to_profile_str, current)), \
+            Counter(map(GPUInstanceSpec.to_profile_str, desired))
+        kept = current & desired
+        num_destroyed, num_created = sum((current - kept).values()), sum((desired - kept).values())
+        return (
+            num_destroyed * (self.operation_costs['destroy_compute_instance'] +
+                             self.operation_costs['destroy_gpu_instance'])
+            + num_created * self.operation_costs['create_gpu_instance']
+        )
+
+    def cost(self, from_state: tuple, to_state: tuple):
+        if from_state == to_state:
+            return 0.
+        if from_state == MPS_STATE:
+            return (self.operation_costs['disable_mps'] + self.operation_costs['enable_mig']
+                    + self.mig_cost('empty', to_state[1]))
+        if to_state == MPS_STATE:
+            return (self.mig_cost(from_state[1], 'empty') + self.operation_costs['disable_mig']
+                    + self.operation_costs['enable_mps'])
+        return self.mig_cost(from_state[1], to_state[1])
+
+
+class SweepGroup(object):
+    """Runs sharing the same GPU state.
+
+    Attributes:
+        sharing (str): :code:`mig` or :code:`mps`.
+        layout (str): Canonical layout label, one client per GPU instance.
+        runs (list of dict): Parameters of the runs.
+        jobs (list of dict): The job configurations running the runs, with merged batch sizes.
+    """
+
+    def __init__(self, sharing: str, layout: str):
+        self.sharing = sharing
+        self.layout = layout
+        self.runs: List[dict] = list()
+        self.jobs: List[dict] = list()
+
+    @property
+    def state(self):
+        return MPS_STATE if self.sharing == 'mps' else ('mig', self.layout)
+
+    @property
+    def name(self):
+        return f'{self.sharing}_{self.layout}'
+
+    def __repr__(self):
+        return f'SweepGroup({self.name}, runs={len(self.runs)}, jobs={len(self.jobs)})'
+
+
+def expand_grid(grid: Dict[str, list]):
+    """All combinations of the grid axes, in the order of the axes, the last axis varying fastest."""
+    axes = {name: values if isinstance(values, (list, tuple)) else [values] for name, values in grid.items()}
+    return [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+
+
+def _supports_multi_batch_size(job_config: dict):
+    if job_config.get('entry_point'):
+        return bool(job_config.get('multi_batch_size', False))
+    return JOB_ENTRY_POINTS.get((job_config.get('type'), job_config.get('ml_task'))) in MULTI_BATCH_SIZE_ENTRY_POINTS
+
+
+def make_job(template: dict, params: dict):
+    """Job configuration of a run: the template with the run parameters (except :code:`sharing` and
+    :code:`layout`) set. The job is named after the parameter values.
+    """
+    job_config = copy.deepcopy(template)
+    values = list()
+    for name, value in params.items():
+        if name in ('sharing', 'layout'):
+            continue
+        if name == 'model':
+            job_config['model'] = {**job_config.get('model', dict()), 'name': value}
+        else:
+            job_config[name] = value
+        if name != 'batch_size':
+            values.append(str(value))
+    if job_config.get('entry_point'):
+        fields = {k: ','.join(map(str, v)) if isinstance(v, list) else v for k, v in params.items()}
+        job_config['args'] = [str(arg).format(**fields) for arg in job_config.get('args', list())]
+    batch_sizes = job_config.get('batch_size')
+    if batch_sizes is not None:
+        values.append('bs' + '-'.join(map(str, batch_sizes if isinstance(batch_sizes, list) else [batch_sizes])))
+    job_config['name'] = '_'.join(values) or 'job'
+    return job_config
+
+
+def group_runs(runs: List[dict], job_template: dict):
+    """Group the runs by sharing mode and layout, and build the jobs of every group. Duplicated runs are dropped,
+    and the runs of a group that differ only in the batch size run in one job if the job supports several batch
+    sizes.
+
+    Raises:
+        ValueError: If a run has an unknown sharing mode or no layout.
+    """
+    groups: Dict[tuple, SweepGroup] = dict()
+    seen = set()
+    for params in runs:
+        sharing = params.get('sharing', 'mig')
+        if sharing not in SHARING_MODES:
+            raise ValueError(f'Unknown sharing mode {sharing}, expected one of {SHARING_MODES}')
+        if not params.get('layout'):
+            raise ValueError(f'Run {params} has no layout')
+        key = sharing, canonical_layout(params['layout'])
+        # the same layout may be listed in different orders
+        run_key = key + tuple((k, repr(v)) for k, v in params.items() if k not in ('sharing', 'layout'))
+        if run_key in seen:
+            continue
+        seen.add(run_key)
+        groups.setdefault(key, SweepGroup(*key)).runs.append(params)
+
+    multi_batch_size = _supports_multi_batch_size(job_template)
+    for group in groups.values():
+        merged: Dict[tuple, dict] = dict()
+        for params in group.runs:
+            if not multi_batch_size or 'batch_size' not in params:
+                group.jobs.append(make_job(job_template, params))
+                continue
+            key = tuple((k, repr(v)) for k, v in params.items() if k not in ('layout', 'batch_size'))
+            if key not in merged:
+                merged[key] = {**params, 'batch_size': list()}
+            merged[key]['batch_size'].append(params['batch_size'])
+        group.jobs.extend(make_job(job_template, params) for params in merged.values())
+    return list(groups.values())
+
+
+def _path_cost(states: List[tuple], cost_model: TransitionCostModel):
+    return sum(cost_model.cost(a, b) for a, b in zip(states, states[1:]))
+
+
+def order_groups(groups: List[SweepGroup], cost_model: TransitionCostModel, start_state: tuple = ('mig', 'empty')):
+    """Order the groups to minimize the total transition cost from :code:`start_state`. The order is exact (by
+    dynamic programming over the subsets of groups) for up to :data:`MAX_EXACT_GROUPS` groups, otherwise it is
+    built by nearest neighbour and improved by reversing segments (2-opt).
+
+    Returns:
+        tuple: The ordered groups and the total cost in seconds.
+    """
+    n = len(groups)
+    if n == 0:
+        return list(), 0.
+    states = [group.state for group in groups]
+    cost = [[cost_model.cost(a, b) for b in states] for a in states]
+    start_cost = [cost_model.cost(start_state, b) for b in states]
+
+    if n <= MAX_EXACT_GROUPS:
+        # best[mask][last]: the cost of visiting the groups in mask, ending at last
+        best = [[float('inf')] * n for _ in range(1 << n)]
+        parent = [[-1] * n for _ in range(1 << n)]
+        for i in range(n):
+            best[1 << i][i] = start_cost[i]
+        for mask in range(1, 1 << n):
+            for last in range(n):
+                if best[mask][last] == float('inf'):
+                    continue
+                for nxt in range(n):
+                    if mask & (1 << nxt):
+                        continue
+                    value = best[mask][last] + cost[last][nxt]
+                    if value < best[mask | (1 << nxt)][nxt]:
+                        best[mask | (1 << nxt)][nxt] = value
+                        parent[mask | (1 << nxt)][nxt] = last
+        mask = (1 << n) - 1
+        last = min(range(n), key=lambda i: best[mask][i])
+        order = list()
+        while last != -1:
+            order.append(last)
+            mask, last = mask ^ (1 << last), parent[mask][last]
+        order.reverse()
+    else:
+        order, remaining, current = list(), set(range(n)), None
+        while remaining:
+            nxt = min(remaining, key=lambda i: (start_cost[i] if current is None else cost[current][i], i))
+            order.append(nxt)
+            remaining.remove(nxt)
+            current = nxt
+
+        def total(o):
+            return start_cost[o[0]] + sum(cost[a][b] for a, b in zip(o, o[1:]))
+
+        improved = True
+        while improved:
+            improved = False
+            for i in range(n - 1):
+                for j in range(i + 1, n):
+                    candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                    if total(candidate) < total(order) - 1e-9:
+                        order, improved = candidate, True
+
+    ordered = [groups[i] for i in order]
+    return ordered, _path_cost([start_state] + [group.state for group in ordered], cost_model)
+
+
+def plan_sweep(spec: dict, cost_model: TransitionCostModel = None, start_layout: Optional[str] = 'empty'):
+    """Expand, group and order the runs of a sweep.
+
+    Args:
+        spec (dict): The sweep specification, see the module documentation.
+        cost_model (TransitionCostModel, optional): Transition costs. Default to the estimated costs.
+        start_layout (str, optional): The current MIG layout of the GPU, :code:`None` if MIG is disabled.
+            Default to an empty MIG-enabled GPU.
+
+    Returns:
+        dict: The plan, contains :code:`groups` (the ordered :class:`SweepGroup`), :code:`num_runs`,
+            :code:`num_jobs` and :code:`cost` (the estimated total reconfiguration cost in seconds).
+    """
+    cost_model = cost_model or TransitionCostModel()
+    runs = expand_grid(spec['grid'])
+    groups = group_runs(runs, spec.get('job', dict()))
+    start_state = ('mig', canonical_layout(start_layout)) if start_layout is not None else MPS_STATE
+    groups, cost = order_groups(groups, cost_model, start_state)
+    return {
+        'groups': groups, 'num_runs': len(runs), 'num_jobs': sum(len(group.jobs) for group in groups), 'cost': cost,
+    }
+
+
+def group_gpu_config(spec: dict, group: SweepGroup, job_name: str):
+    """GPU configuration of a group for :func:`config_gpu_device` / :func:`run_job`, with one device running
+    :code:`job_name` per GPU instance of the layout.
+    """
+    gpu_config = {'id': spec.get('gpu_id', 0), 'mig': group.sharing == 'mig', 'mps': group.sharing == 'mps'}
+    if spec.get('gpu_model'):
+        gpu_config['gpu_model'] = spec['gpu_model']
+    layout = _parse_label(group.layout)
+    if group.sharing == 'mig':
+        gpu_config['devices'] = [
+            {'gi_profile': spec_.profile, 'placement': spec_.placement, 'job': job_name} for spec_ in layout
+        ]
+    else:
+        gpu_config['devices'] = [{'mps_profile': spec_.profile, 'job': job_name} for spec_ in layout]
+    return gpu_config
+
+
+def switch_sharing(mig_controller: MIGController, gpu_id: int, state: tuple, sharing: str):
+    """Switch a GPU in a state (see :attr:`SweepGroup.state`) to a sharing mode: stop the MPS daemon to use MIG,
+    or destroy all GPU instances and disable MIG to use MPS. The partition itself is configured by :func:`run_job`.
+    """
+    if state == MPS_STATE and sharing == 'mig':
+        disable_mps(gpu_id)
+    elif state != MPS_STATE and sharing == 'mps':
+        mig_controller.reconcile(gpu_id, MIGLayout())
+        if mig_controller.disable_mig(gpu_id) != 0:
+            raise ValueError(f'Failed to disable MIG on GPU {gpu_id}')
+
+
+def current_state(mig_controller: MIGController, gpu_id: int):
+    """The state of a GPU, :data:`MPS_STATE` if MIG is disabled."""
+    if not mig_controller.check_mig_status(gpu_id)[0]:
+        return MPS_STATE
+    return 'mig', canonical_layout(mig_controller.snapshot_layout(gpu_id))
+
+
+def run_sweep(
+        spec: dict, mig_controller: MIGController = None, output_dir: str = 'results',
+        cost_model: TransitionCostModel = None, timeout: float = None, stream_logs: bool = True,
+        cache: ResultCache = None,
+):
+    """Run a sweep group by group in the planned order. The GPU is repartitioned when entering a group, and all
+    jobs of the group run on the same partition one after another. With a result cache, a resumed sweep skips the
+    jobs that completed before (see :func:`run_job`).
+
+    Returns:
+        list of dict: For every job, :code:`group`, :code:`job` and :code:`summaries` (see :func:`run_job`), or
+            :code:`error` if the job failed.
+    """
+    mig_controller = mig_controller or MIGController()
+    gpu_id = spec.get('gpu_id', 0)
+    state = current_state(mig_controller, gpu_id)
+    plan = plan_sweep(spec, cost_model, state[1])
+
+    records = list()
+    for group in plan['groups']:
+        switch_sharing(mig_controller, gpu_id, state, group.sharing)
+        for i, job_config in enumerate(group.jobs):
+            config = {'gpus': [group_gpu_config(spec, group, job_config['name'])], 'job_configs': [job_config]}
+            record = {'group': group.name, 'job': job_config['name'], 'summaries': None, 'error': None}
+            try:
+                # the partition is configured by the first job of the group, the others reuse it
+                record['summaries'] = run_job(
+                    config, mig_controller, output_dir=f'{output_dir}/{group.name}/{job_config["name"]}',
+                    timeout=timeout, configure=i == 0, stream_logs=stream_logs, cache=cache,
+                )
+            except ValueError as e:
+                record['error'] = e
+            records.append(record)
+        state = group.state
+    return records
+
+
+def load_sweep(path: str):
+    if yaml is None:
+        raise ImportError('Loading a sweep requires `pyyaml`. Install it by `pip install pyyaml`.')
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def print_plan(plan: dict):
+    print(f'{plan["num_runs"]} runs in {plan["num_jobs"]} jobs and {len(plan["groups"])} GPU states, '
+          f'estimated reconfiguration cost {plan["cost"]:.1f}s')
+    for group in plan['groups']:
+        print(f'  {group.sharing:<4} {group.layout:<40} {len(group.runs):>5} runs {len(group.jobs):>4} jobs')
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Reconfiguration-aware MIG / MPS sweep')
+    parser.add_argument('sweep', type=str, help='Sweep YAML file.')
+    parser.add_argument('--costs', type=str, default=None,
+                        help='Benchmark report with the measured transition costs, see migperf.controller.benchmark.')
+    parser.add_argument('-o', '--output-dir', type=str, default='results',
+                        help='Directory of the job logs and results. Default to results.')
+    parser.add_argument('--timeout', type=float, default=None, help='Seconds after which a job is killed.')
+    parser.add_argument('--cache', type=str, default=None,
+                        help='Result cache directory, so that a resumed sweep skips the completed jobs.')
+    parser.add_argument('--cache-policy', type=str, choices=CACHE_POLICIES, default='use',
+                        help='use: skip the cached jobs, refresh: re-run and overwrite them, off: ignore the cache. '
+                             'Default to use.')
+    parser.add_argument('--cache-max-age', type=float, default=None,
+                        help='Seconds after which a cached result is re-run. Default to no limit.')
+    parser.add_argument('--dry-run', action='store_true', help='Only print the plan.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args_ = get_args()
+    spec_ = load_sweep(args_.sweep)
+    cost_model_ = TransitionCostModel.from_file(args_.costs) if args_.costs else None
+    if args_.dry_run:
+        print_plan(plan_sweep(spec_, cost_model_))
+    else:
+        cache_ = ResultCache(args_.cache, args_.cache_policy, args_.cache_max_age) if args_.cache else None
+        records_ = run_sweep(
+            spec_, output_dir=args_.output_dir, cost_model=cost_model_, timeout=args_.timeout, cache=cache_,
+        )
+        for record_ in records_:
+            if record_['error'] is not None:
+                print(f'Failed {record_["group"]}/{record_["job"]}: {record_["error"]}')
@@ -0,0 +1,452 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multi-node sweep: a coordinator puts the jobs of a sweep into a work queue in a SQLite file on a shared file
+system, and a worker per GPU claims the jobs whose layout the GPU can hold and runs them with
+:func:`migperf.controller.runner.run_job`. No broker is needed.
+
+A worker prefers the jobs that are the cheapest to reach from the current state of its GPU (by the
+:class:`TransitionCostModel`), so that the jobs of a layout are run together on a node. A claimed job is leased
+for :code:`lease_timeout` seconds and the lease is renewed while the job runs. The job of a crashed worker is
+claimed again once its lease expires, up to :code:`max_attempts` times. The result of a worker that lost its lease
+is discarded.
+
+Examples:
+    Submit a sweep (see :mod:`migperf.controller.sweep`):
+
+    .. code-block:: shell
+
+        python -m migperf.controller.work_queue --queue /shared/sweep.db submit sweep.yaml
+
+    Start a worker for GPU 0 and GPU 1 on every node, which exits once the queue is drained:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.work_queue --queue /shared/sweep.db worker -i 0 1 -o /shared/results --exit
+
+    Check the progress:
+
+    .. code-block:: shell
+
+        python -m migperf.controller.work_queue --queue /shared/sweep.db status
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+from migperf.profiler.utils.result_cache import ResultCache
+
+from .backend import BACKENDS, FakeBackend
+from .mig_controller import MIGController
+from .runner import run_job
+from .sweep import (
+    SweepGroup, TransitionCostModel, _parse_label, current_state, group_gpu_config, load_sweep, plan_sweep,
+    switch_sharing,
+)
+
+TASK_STATUSES = ('pending', 'running', 'done', 'failed')
+# Sweep specification keys copied into every task, the grid is already expanded
+TASK_SPEC_KEYS = ('gpu_model',)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sweep TEXT NOT NULL,
+    sharing TEXT NOT NULL,
+    layout TEXT NOT NULL,
+    job TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status);
+"""
+
+
+class WorkQueue(object):
+    """A queue of sweep jobs in a SQLite file, shared by the processes of all nodes.
+
+    Every operation runs in its own connection and transaction, so that a queue is safe to use from several
+    threads and processes. The claims take the database write lock, so that a task is claimed once.
+
+    Args:
+        path (str): The SQLite file, created if missing.
+        lease_timeout (float, optional): Seconds a claimed task is reserved for its worker without renewal.
+            Default to 600.
+        max_attempts (int, optional): Number of claims of a task before it fails, e.g., if it crashes every
+            worker. Default to 3.
+    """
+
+    def __init__(self, path: str, lease_timeout: float = 600., max_attempts: int = 3):
+        self.path = str(path)
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60., isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._connect() as conn:
+            # take the write lock up front, so that two workers never read the same pending task
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    @staticmethod
+    def _to_task(row: sqlite3.Row):
+        task = dict(row)
+        for key in ('payload', 'result'):
+            if task[key] is not None:
+                task[key] = json.loads(task[key])
+        return task
+
+    def put(self, sweep: str, sharing: str, layout: str, job: str, payload: dict):
+        """Add a task. Returns the task ID."""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                'INSERT INTO tasks (sweep, sharing, layout, job, payload, created, updated) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (sweep, sharing, layout, job, json.dumps(payload), now, now),
+            )
+            return cursor.lastrowid
+
+    def claim(self, worker: str, accept: Callable[[dict], bool] = None, cost: Callable[[dict], float] = None):
+        """Claim a pending task, or a running task whose lease expired.
+
+        Args:
+            worker (str): Name of the claiming worker.
+            accept (callable, optional): Whether the worker can run a task. Default to accept all tasks.
+            cost (callable, optional): Cost of a task for the worker, the cheapest task is claimed (the oldest
+                among the cheapest). Default to the oldest task.
+
+        Returns:
+            dict: The claimed task, contains the columns of the :code:`tasks` table, or :code:`None` if there is no
+                task to claim.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            # the tasks of the crashed workers failing too many times are given up
+            conn.execute(
+                "UPDATE tasks SET status = 'failed', error = 'Lease expired', updated = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            rows = conn.execute(
+                "SELECT * FROM tasks WHERE status = 'pending' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY id",
+                (now,),
+            ).fetchall()
+            candidates = [task for task in map(self._to_task, rows) if accept is None or accept(task)]
+            if not candidates:
+                return None
+            task = min(candidates, key=cost) if cost is not None else candidates[0]
+            conn.execute(
+                "UPDATE tasks SET status = 'running', worker = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE id = ?",
+                (worker, now + self.lease_timeout, now, task['id']),
+            )
+        task.update(status='running', worker=worker, lease_expires=now + self.lease_timeout,
+                    attempts=task['attempts'] + 1)
+        return task
+
+    def _finish(self, task_id: int, worker: str, status: str, result: Optional[dict], error: Optional[str]):
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = ?, result = ?, error = ?, lease_expires = NULL, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, json.dumps(result, default=str) if result is not None else None, error, time.time(),
+                 task_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def renew(self, task_id: int, worker: str):
+        """Extend the lease of a running task. Returns whether the worker still holds the lease."""
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated = ? "
+                "WHERE id = ? AND worker = ? AND status = 'running' AND lease_expires >= ?",
+                (now + self.lease_timeout, now, task_id, worker, now),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, task_id: int, worker: str, result: dict):
+        """Commit the result of a task. Returns :code:`False` if the worker lost the task, then the result is
+        discarded.
+        """
+        return self._finish(task_id, worker, 'done', result, None)
+
+    def fail(self, task_id: int, worker: str, error: str, result: dict = None):
+        """Mark a task as failed. Returns :code:`False` if the worker lost the task."""
+        return self._finish(task_id, worker, 'failed', result, error)
+
+    def retry(self, status: str = 'failed'):
+        """Put the tasks of a status back to pending. Returns the number of tasks."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE tasks SET status = 'pending', worker = NULL, lease_expires = NULL, attempts = 0, "
+                "error = NULL, updated = ? WHERE status = ?",
+                (time.time(), status),
+            )
+            return cursor.rowcount
+
+    def tasks(self, status: str = None, sweep: str = None) -> List[dict]:
+        query, params = 'SELECT * FROM tasks WHERE 1 = 1', list()
+        if status is not None:
+            query, params = query + ' AND status = ?', params + [status]
+        if sweep is not None:
+            query, params = query + ' AND sweep = ?', params + [sweep]
+        with self._connect() as conn:
+            return list(map(self._to_task, conn.execute(query + ' ORDER BY id', params).fetchall()))
+
+    def counts(self, sweep: str = None) -> Dict[str, int]:
+        """Number of tasks per status."""
+        query, params = 'SELECT status, COUNT(*) FROM tasks', list()
+        if sweep is not None:
+            query, params = query + ' WHERE sweep = ?', [sweep]
+        with self._connect() as conn:
+            counts = dict(conn.execute(query + ' GROUP BY status', params).fetchall())
+        return {status: counts.get(status, 0) for status in TASK_STATUSES}
+
+
+def submit_sweep(queue: WorkQueue, spec: dict, sweep: str = 'sweep', cost_model: TransitionCostModel = None):
+    """Expand a sweep into one task per job of every group, in the planned order.
+
+    Returns:
+        list of int: The task IDs.
+    """
+    plan = plan_sweep(spec, cost_model)
+    task_spec = {k: spec[k] for k in TASK_SPEC_KEYS if k in spec}
+    return [
+        queue.put(sweep, group.sharing, group.layout, job_config['name'], {'spec': task_spec, 'job': job_config})
+        for group in plan['groups'] for job_config in group.jobs
+    ]
+
+
+class Worker(object):
+    """Claim and run the tasks of a work queue on a GPU.
+
+    Args:
+        queue (WorkQueue): The work queue.
+        mig_controller (MIGController, optional): The controller of the GPU. Default to a controller on the default
+            backend.
+        gpu_id (int, optional): The GPU to run the tasks. Default to 0.
+        output_dir (str, optional): Directory of the job logs and results, as :code:`${output_dir}/${sweep}/
+            ${group}/${job}`. Default to :code:`results`.
+        name (str, optional): Name of the worker. Default to :code:`${hostname}-${pid}-gpu${gpu_id}`.
+        cost_model (TransitionCostModel, optional): Transition costs to choose the next task. Default to the
+            estimated costs.
+        timeout (float, optional): Seconds after which a job is killed. Default to no timeout.
+        cache (ResultCache, optional): See :func:`run_job`.
+        stream_logs (bool, optional): Print the job outputs to the console. Default to `True`.
+    """
+
+    def __init__(
+            self, queue: WorkQueue, mig_controller: MIGController = None, gpu_id: int = 0,
+            output_dir: str = 'results', name: str = None, cost_model: TransitionCostModel = None,
+            timeout: float = None, cache: ResultCache = None, stream_logs: bool = True,
+    ):
+        self.queue = queue
+        self.mig_controller = mig_controller or MIGController()
+        self.gpu_id = gpu_id
+        self.output_dir = output_dir
+        self.name = name or f'{socket.gethostname()}-{os.getpid()}-gpu{gpu_id}'
+        self.cost_model = cost_model or TransitionCostModel()
+        self.timeout = timeout
+        self.cache = cache
+        self.stream_logs = stream_logs
+        self.state = None
+        # (sharing, layout) -> whether the GPU can hold the layout
+        self._feasible = dict()
+
+    def can_run(self, task: dict):
+        key = task['sharing'], task['layout']
+        if key not in self._feasible:
+            try:
+                # the MPS clients take the shares of MIG profiles, which must be profiles of the GPU as well
+                self.mig_controller.plan_layout(self.gpu_id, _parse_label(task['layout']))
+                self._feasible[key] = True
+            except ValueError:
+                self._feasible[key] = False
+        return self._feasible[key]
+
+    def cost(self, task: dict):
+        return self.cost_model.cost(self.state, SweepGroup(task['sharing'], task['layout']).state)
+
+    def _keep_lease(self, task_id: int, done: threading.Event, lost: threading.Event):
+        while not done.wait(self.queue.lease_timeout / 3):
+            if not self.queue.renew(task_id, self.name):
+                lost.set()
+                return
+
+    def run_task(self, task: dict):
+        """Run a claimed task and commit its result. Returns whether the job succeeded."""
+        group = SweepGroup(task['sharing'], task['layout'])
+        job_config = task['payload']['job']
+        spec = {**task['payload']['spec'], 'gpu_id': self.gpu_id}
+        config = {'gpus': [group_gpu_config(spec, group, job_config['name'])], 'job_configs': [job_config]}
+        output_dir = os.path.join(self.output_dir, task['sweep'], group.name, job_config['name'])
+
+        done, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._keep_lease, args=(task['id'], done, lost), daemon=True)
+        heartbeat.start()
+        summaries, error = None, None
+        try:
+            switch_sharing(self.mig_controller, self.gpu_id, self.state, group.sharing)
+            summaries = run_job(
+                config, self.mig_controller, output_dir, timeout=self.timeout, stream_logs=self.stream_logs,
+                raise_on_error=False, cache=self.cache,
+            )
+            failed = [summary for summary in summaries if summary['error'] is not None]
+            if failed:
+                error = f'{len(failed)} of {len(summaries)} jobs failed: {failed[0]["error"]!r}'
+        except ValueError as e:
+            error = repr(e)
+        finally:
+            done.set()
+            heartbeat.join()
+            # the GPU may be left in any state by a failure
+            self.state = current_state(self.mig_controller, self.gpu_id)
+
+        result = {
+            'worker': self.name, 'gpu_id': self.gpu_id, 'output_dir': output_dir,
+            'summaries': [
+                {**summary, 'error': repr(summary['error']) if summary['error'] is not None else None}
+                for summary in summaries or list()
+            ],
+        }
+        if lost.is_set():
+            print(f'[{self.name}] Lost the lease of task {task["id"]}, its result is discarded')
+            return False
+        if error is None:
+            committed = self.queue.complete(task['id'], self.name, result)
+        else:
+            committed = self.queue.fail(task['id'], self.name, error, result)
+        if not committed:
+            print(f'[{self.name}] Lost task {task["id"]}, its result is discarded')
+        return committed and error is None
+
+    def run(self, max_tasks: int = None, exit_when_empty: bool = False, poll_interval: float = 5.):
+        """Claim and run tasks until :code:`max_tasks` are run, or with :code:`exit_when_empty`, until no pending or
+        running task of the queue can run on the GPU.
+
+        Returns:
+            int: The number of tasks run.
+        """
+        self.state = current_state(self.mig_controller, self.gpu_id)
+        num_tasks = 0
+        while max_tasks is None or num_tasks < max_tasks:
+            task = self.queue.claim(self.name, self.can_run, self.cost)
+            if task is None:
+                # the running tasks of the other workers may still be given back on lease expiry
+                unfinished = self.queue.tasks('pending') + self.queue.tasks('running')
+                if exit_when_empty and not any(map(self.can_run, unfinished)):
+                    break
+                time.sleep(poll_interval)
+                continue
+            print(f'[{self.name}] Running task {task["id"]}: {task["sharing"]}_{task["layout"]}/{task["job"]}')
+            self.run_task(task)
+            num_tasks += 1
+        return num_tasks
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Multi-node MIG / MPS sweep with a SQLite work queue')
+    parser.add_argument('--queue', type=str, required=True, help='SQLite file of the work queue.')
+    parser.add_argument('--lease-timeout', type=float, default=600.,
+                        help='Seconds a claimed job is reserved without renewal. Default to 600.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    submit_parser = subparsers.add_parser('submit', help='Submit the jobs of a sweep.')
+    submit_parser.add_argument('sweep', type=str, help='Sweep YAML file.')
+    submit_parser.add_argument('--name', type=str, default=None, help='Sweep name. Default to the file name.')
+    submit_parser.add_argument('--costs', type=str, default=None,
+                               help='Benchmark report with the measured transition costs.')
+
+    worker_parser = subparsers.add_parser('worker', help='Run the jobs of the queue on the GPUs of this node.')
+    worker_parser.add_argument('-i', '--gpu-id', type=int, nargs='+', default=[0],
+                               help='GPU IDs, one worker per GPU. Default to 0.')
+    worker_parser.add_argument('-o', '--output-dir', type=str, default='results',
+                               help='Directory of the job logs and results. Default to results.')
+    worker_parser.add_argument('--costs', type=str, default=None,
+                               help='Benchmark report with the measured transition costs.')
+    worker_parser.add_argument('--timeout', type=float, default=None, help='Seconds after which a job is killed.')
+    worker_parser.add_argument('--backend', type=str, default=None, choices=list(BACKENDS),
+                               help='MIG backend. Default to the default backend.')
+    worker_parser.add_argument('--gpu-model', type=str, default='A100',
+                               help='Simulated GPU model of the fake backend, e.g., A100, A30 or H100.')
+    worker_parser.add_argument('--cache', type=str, default=None, help='Result cache directory.')
+    worker_parser.add_argument('--max-tasks', type=int, default=None, help='Exit after N jobs per GPU.')
+    worker_parser.add_argument('--exit', action='store_true', help='Exit once the queue is drained.')
+    worker_parser.add_argument('--poll-interval', type=float, default=5.,
+                               help='Seconds between two claims on an empty queue. Default to 5.')
+
+    subparsers.add_parser('status', help='Print the number of jobs per status, and the failed jobs.')
+    subparsers.add_parser('retry', help='Put the failed jobs back into the queue.')
+    return parser.parse_args()
+
+
+def get_backend(args):
+    if args.backend is None:
+        return None
+    if args.backend == 'fake':
+        return FakeBackend(num_gpus=max(args.gpu_id) + 1, gpu_name=args.gpu_model)
+    return BACKENDS[args.backend]()
+
+
+if __name__ == '__main__':
+    args_ = get_args()
+    queue_ = WorkQueue(args_.queue, lease_timeout=args_.lease_timeout)
+    if args_.command == 'submit':
+        name_ = args_.name or os.path.splitext(os.path.basename(args_.sweep))[0]
+        cost_model_ = TransitionCostModel.from_file(args_.costs) if args_.costs else None
+        task_ids_ = submit_sweep(queue_, load_sweep(args_.sweep), name_, cost_model_)
+        print(f'Submitted {len(task_ids_)} jobs of sweep {name_}')
+    elif args_.command == 'worker':
+        mig_controller_ = MIGController(backend=get_backend(args_))
+        cost_model_ = TransitionCostModel.from_file(args_.costs) if args_.costs else None
+        cache_ = ResultCache(args_.cache) if args_.cache else None
+        threads_ = [
+            threading.Thread(target=Worker(
+                queue_, mig_controller_, gpu_id_, args_.output_dir, cost_model=cost_model_, timeout=args_.timeout,
+                cache=cache_,
+            ).run, args=(args_.max_tasks, args_.exit, args_.poll_interval))
+            for gpu_id_ in args_.gpu_id
+        ]
+        for thread_ in threads_:
+            thread_.start()
+        for thread_ in threads_:
+            thread_.join()
+    elif args_.command == 'status':
+        print(', '.join(f'{status_}: {count_}' for status_, count_ in queue_.counts().items()))
+        for task_ in queue_.tasks('failed'):
+            print(f'Failed {task_["sweep"]}/{task_["sharing"]}_{task_["layout"]}/{task_["job"]} '
+                  f'on {task_["worker"]}: {task_["error"]}')
+    elif args_.command == 'retry':
+        print(f'{queue_.retry()} failed jobs are put back')
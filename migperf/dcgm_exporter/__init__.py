@@ -5,7 +5,13 @@ Author: Li Yuanming
 Email: yuanmingleee@gmail.com
 Date: Apr 12, 2023
 """
-from metric_collector import DCGMMetricCollector
+from .async_collector import AsyncDCGMMetricCollector
+from .exporter_server import DCGMExporterServer, DCGMRecording, SyntheticDCGMPages
+from .host_collector import HostMetricCollector
+from .metric_collector import DCGMMetricCollector
 
 
-__all__ = ['DCGMMetricCollector']
+__all__ = [
+    'AsyncDCGMMetricCollector', 'DCGMExporterServer', 'DCGMMetricCollector', 'DCGMRecording', 'HostMetricCollector',
+    'SyntheticDCGMPages',
+]
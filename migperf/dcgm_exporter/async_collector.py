@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Scrape several DCGM exporters, e.g., one per node of a multi-node run, concurrently from an asyncio event loop.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Union
+from urllib.parse import urlparse
+
+from migperf.profiler.utils.sink import sink_from_env
+from .metric_collector import DCGMMetricCollector
+
+
+class AsyncDCGMMetricCollector(object):
+    """Scrape N DCGM exporters in parallel on one tick grid, into a store per host.
+
+    Every exporter is scraped by a :class:`DCGMMetricCollector` (a kept-alive session, retries and a parser) in a
+    thread of an executor, awaited by the event loop, so that a slow or dead exporter neither blocks the loop nor
+    delays the scrapes of the other exporters: it only skips its own ticks. The ticks of all exporters are aligned to
+    the same origin, so the samples of the hosts are comparable tick by tick.
+
+    Args:
+        endpoints (str, list of str or dict): The metrics endpoints, or host -> metrics endpoint. The host of an
+            endpoint defaults to the :code:`host:port` of its URL.
+        interval (float, optional): Seconds between two ticks, see :class:`DCGMMetricCollector`.
+        timeout (float or dict, optional): Seconds of the request timeout, or host -> seconds. Default to the
+            interval, at least 1 second.
+        capacity (int, optional): Samples kept per host, see :class:`DCGMMetricCollector`.
+        fields (iterable of str, optional): The metric names to collect, see :class:`DCGMMetricCollector`.
+        retries (int, optional): Retries of a failed scrape within its tick. Default to 1.
+
+    If the environment variable :code:`MIGPERF_METRIC_SINK` is set, the samples of every host are also streamed to
+    its own :code:`dcgm-${host}` sink.
+
+    Examples:
+        In a thread, with the same interface as :class:`DCGMMetricCollector`:
+
+        >>> collector = AsyncDCGMMetricCollector(['http://node0:9400/metrics', 'http://node1:9400/metrics'])
+        >>> collector.start()
+        >>> ...
+        >>> collector.stop()
+        >>> collector.stores['node1:9400'].view(0, 1)
+
+        Or as a task of a running event loop:
+
+        >>> task = asyncio.create_task(collector.run())
+        >>> ...
+        >>> collector.stop()
+        >>> await task
+    """
+
+    def __init__(
+            self, endpoints: Union[str, List[str], Dict[str, str]], interval: float = None,
+            timeout: Union[float, Dict[str, float]] = None, capacity: int = None, fields: Iterable[str] = None,
+            retries: int = 1,
+    ):
+        if isinstance(endpoints, str):
+            endpoints = [endpoints]
+        if not isinstance(endpoints, dict):
+            endpoints = {urlparse(url).netloc: url for url in endpoints}
+        if not endpoints:
+            raise ValueError('No DCGM exporter endpoint to scrape')
+        timeouts = timeout if isinstance(timeout, dict) else {host: timeout for host in endpoints}
+        self.collectors: Dict[str, DCGMMetricCollector] = {
+            host: DCGMMetricCollector(
+                url, interval, timeouts.get(host), capacity, fields, retries,
+                sink_from_env(f'dcgm-{host}'.replace(':', '-')),
+            )
+            for host, url in endpoints.items()
+        }
+        self.interval = next(iter(self.collectors.values())).interval
+
+        self.is_running = False
+        self._stop_requested = False
+        self._stop_event = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def hosts(self):
+        return list(self.collectors)
+
+    @property
+    def stores(self):
+        """Host -> :class:`migperf.dcgm_exporter.sample_store.DCGMSampleStore` of its samples."""
+        return {host: collector.store for host, collector in self.collectors.items()}
+
+    def mark(self, phase: str):
+        """Start a phase on all hosts, see :meth:`DCGMMetricCollector.mark`."""
+        for collector in self.collectors.values():
+            collector.mark(phase)
+
+    async def _run_endpoint(self, collector: DCGMMetricCollector, next_tick: float, executor: ThreadPoolExecutor):
+        loop = asyncio.get_running_loop()
+        while not self._stop_event.is_set():
+            next_tick = await loop.run_in_executor(executor, collector.tick, next_tick)
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), max(next_tick - time.perf_counter(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        """Scrape until :meth:`stop` is called."""
+        self.is_running = True
+        # the event is published before the loop, which :meth:`stop` checks from another thread
+        self._stop_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        if self._stop_requested:
+            self._stop_event.set()
+        executor = ThreadPoolExecutor(max_workers=len(self.collectors), thread_name_prefix='dcgm-scrape')
+        origin = time.perf_counter()
+        try:
+            await asyncio.gather(*(
+                self._run_endpoint(collector, origin, executor) for collector in self.collectors.values()
+            ))
+        finally:
+            executor.shutdown(wait=True)
+            for collector in self.collectors.values():
+                collector._finish()
+            self.is_running = False
+
+    def start(self):
+        """Run the collector in a background thread with its own event loop."""
+        self._stop_requested = False
+        self._stop_event = self._loop = None
+        self._thread = threading.Thread(target=asyncio.run, args=(self.run(),), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop scraping, from any thread. Waits for the background thread of :meth:`start`."""
+        self._stop_requested = True
+        if self._loop is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._stop_event.set)
+            except RuntimeError:
+                # the loop has already finished
+                pass
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        """Host -> statistics of its sampling, see :meth:`DCGMMetricCollector.stats`."""
+        return {host: collector.stats() for host, collector in self.collectors.items()}
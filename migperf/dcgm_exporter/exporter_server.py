@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Stand-in DCGM exporter for GPU-free runs, e.g., to benchmark the collector overhead, the parser throughput and the
+result pipeline of the profiling clients on a CPU-only CI. The server serves the :code:`/metrics` page of:
+
+- :class:`DCGMRecording`: Pages recorded from a real exporter by :func:`record_exporter`, replayed at their
+  recorded times, optionally sped up.
+- :class:`SyntheticDCGMPages`: Plausible pages of the MIG devices of a
+  :class:`migperf.controller.simulator.MIGSimulator`, with a random walk of the load of every device.
+
+.. code-block:: shell
+
+    # on the GPU node
+    python -m migperf.dcgm_exporter.exporter_server record -u http://0.0.0.0:9400/metrics -o dcgm.jsonl -d 600
+    # anywhere
+    python -m migperf.dcgm_exporter.exporter_server serve --replay dcgm.jsonl --speed 2
+    python -m migperf.dcgm_exporter.exporter_server serve --gpus A100 A30 --layouts 2x3g.40gb 4x1g.6gb -p 9401
+"""
+import argparse
+import bisect
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import requests
+
+from migperf.controller.layout import MIGLayout
+from migperf.controller.simulator import MIGSimulator
+from .metric_collector import advance_tick, make_session
+
+# (name, type, help) of the synthetic metrics, in the page order
+SYNTHETIC_FIELDS = (
+    ('DCGM_FI_DEV_GPU_TEMP', 'gauge', 'GPU temperature (in C).'),
+    ('DCGM_FI_DEV_MEMORY_TEMP', 'gauge', 'Memory temperature (in C).'),
+    ('DCGM_FI_DEV_POWER_USAGE', 'gauge', 'Power draw (in W).'),
+    ('DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION', 'counter', 'Total energy consumption since boot (in mJ).'),
+    ('DCGM_FI_DEV_GPU_UTIL', 'gauge', 'GPU utilization (in %).'),
+    ('DCGM_FI_DEV_FB_FREE', 'gauge', 'Framebuffer memory free (in MiB).'),
+    ('DCGM_FI_DEV_FB_USED', 'gauge', 'Framebuffer memory used (in MiB).'),
+    ('DCGM_FI_PROF_GR_ENGINE_ACTIVE', 'gauge', 'Ratio of time the graphics engine is active (in %).'),
+    ('DCGM_FI_PROF_SM_ACTIVE', 'gauge', 'The ratio of cycles an SM has at least 1 warp assigned (in %).'),
+    ('DCGM_FI_PROF_SM_OCCUPANCY', 'gauge', 'The ratio of number of warps resident on an SM (in %).'),
+    ('DCGM_FI_PROF_PIPE_TENSOR_ACTIVE', 'gauge', 'Ratio of cycles the tensor (HMMA) pipe is active (in %).'),
+    ('DCGM_FI_PROF_DRAM_ACTIVE', 'gauge', 'Ratio of cycles the device memory interface is active (in %).'),
+    ('DCGM_FI_PROF_PCIE_TX_BYTES', 'counter', 'The number of bytes of active pcie tx data.'),
+    ('DCGM_FI_PROF_PCIE_RX_BYTES', 'counter', 'The number of bytes of active pcie rx data.'),
+)
+
+# GPU model -> board power limit (W)
+POWER_LIMITS = {
+    'NVIDIA A100-SXM4-80GB': 400., 'NVIDIA A100-SXM4-40GB': 400., 'NVIDIA A30': 165., 'NVIDIA H100 80GB HBM3': 700.,
+}
+
+
+class DCGMRecording(object):
+    """Exporter pages with their Unix timestamps, saved as JSON lines :code:`{"time": ..., "page": ...}`.
+
+    As a page source of :class:`DCGMExporterServer`, the pages are replayed at their recorded offsets from the first
+    page, in a loop.
+
+    Args:
+        pages (list of tuple): :code:`(time, page)` in time order.
+    """
+
+    def __init__(self, pages: Sequence[Tuple[float, str]]):
+        if not pages:
+            raise ValueError('A recording needs at least one page')
+        self.times = [timestamp - pages[0][0] for timestamp, _ in pages]
+        self.pages = [page for _, page in pages]
+        # the last page lasts for the mean period before the loop restarts
+        self.duration = self.times[-1] + (self.times[-1] / (len(self.times) - 1) if len(self.times) > 1 else 1.)
+
+    def __len__(self):
+        return len(self.pages)
+
+    @classmethod
+    def load(cls, path: str):
+        pages = list()
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    pages.append((record['time'], record['page']))
+        return cls(pages)
+
+    def page(self, elapsed: float):
+        """The page recorded :code:`elapsed` seconds after the first one, modulo the recording duration."""
+        return self.pages[bisect.bisect_right(self.times, elapsed % self.duration) - 1]
+
+
+def record_exporter(url: str, path: str, duration: float, interval: float = 1., timeout: float = None):
+    """Record the pages of an exporter to a JSON lines file (appended) every :code:`interval` seconds for
+    :code:`duration` seconds, see :class:`DCGMRecording`. The failed scrapes are skipped.
+
+    Returns:
+        int: The number of recorded pages.
+    """
+    session = make_session()
+    timeout = timeout if timeout is not None else max(interval, 1.)
+    num_pages = 0
+    end = time.perf_counter() + duration
+    next_tick = time.perf_counter()
+    with open(path, 'a') as f:
+        while next_tick < end:
+            try:
+                response = session.get(url, timeout=timeout)
+                response.raise_for_status()
+            except requests.RequestException:
+                pass
+            else:
+                f.write(json.dumps({'time': time.time(), 'page': response.text}) + '\n')
+                num_pages += 1
+            next_tick, _ = advance_tick(next_tick, time.perf_counter(), interval)
+            time.sleep(max(next_tick - time.perf_counter(), 0.))
+    session.close()
+    return num_pages
+
+
+class SyntheticDCGMPages(object):
+    """Pages of the DCGM exporter on simulated GPUs, labelled as the exporter does (:code:`gpu`, :code:`UUID`,
+    :code:`device`, :code:`modelName`, :code:`GPU_I_PROFILE`, :code:`GPU_I_ID` and :code:`Hostname`).
+
+    The load of every MIG device (or of a GPU without MIG) follows a random walk around :code:`load`, from which its
+    activity, memory and PCIe traffic are derived, and the temperature, power and energy of its GPU. The pages follow
+    the current state of the simulator, e.g., after a reconfiguration. Like the exporter, the metrics are refreshed
+    every :code:`refresh_interval` seconds, and the same page is served in between.
+
+    Args:
+        simulator (MIGSimulator, optional): The GPUs and their GPU instances. Default to an A100 without instances.
+        load (float, optional): Mean load of the devices, from 0 to 1. Default to 0.5.
+        refresh_interval (float, optional): Seconds between two refreshes of the metrics. Default to 0.5, the
+            :code:`-c 500` of the exporter.
+        hostname (str, optional): The :code:`Hostname` label. Default to :code:`migperf-sim`.
+        seed (int, optional): Seed of the random walks. Default to 0.
+
+    Examples:
+        >>> pages = SyntheticDCGMPages.from_layouts(['A100', 'A30'], ['2x3g.40gb', '4x1g.6gb'])
+        >>> DCGMTextParser()(pages.page(0.))[1, 1]['DCGM_FI_PROF_SM_ACTIVE']
+    """
+
+    def __init__(
+            self, simulator: MIGSimulator = None, load: float = 0.5, refresh_interval: float = 0.5,
+            hostname: str = 'migperf-sim', seed: int = 0,
+    ):
+        if refresh_interval <= 0:
+            raise ValueError(f'Refresh interval must be positive, got {refresh_interval}')
+        self.simulator = simulator if simulator is not None else MIGSimulator()
+        self.load = load
+        self.refresh_interval = refresh_interval
+        self.hostname = hostname
+        self._rng = np.random.default_rng(seed)
+        # (gpu_id, gpu_instance_id) -> load
+        self._loads: Dict[Tuple[int, Optional[int]], float] = dict()
+        # gpu_id -> counters: energy (mJ), PCIe TX and RX (bytes)
+        self._counters: Dict[int, List[float]] = dict()
+        self._step = -1
+        self._page = ''
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_layouts(cls, gpu_models: Sequence[str], layouts: Sequence[Optional[str]], **kwargs):
+        """Pages of GPUs partitioned by MIG layout strings (see :meth:`MIGLayout.parse`), one per GPU.
+        :code:`None` or :code:`-` leaves MIG disabled on a GPU. The keyword arguments are passed to the constructor.
+        """
+        if len(layouts) > len(gpu_models):
+            raise ValueError(f'Got {len(layouts)} layouts for {len(gpu_models)} GPUs')
+        simulator = MIGSimulator(gpu_models, mig_enabled=False)
+        for gpu_id, layout in enumerate(layouts):
+            if layout is None or layout == '-':
+                continue
+            simulator.set_mig_mode(gpu_id, True)
+            for spec in MIGLayout.parse(layout):
+                simulator.create_gpu_instance(gpu_id, spec.profile, spec.placement)
+        return cls(simulator, **kwargs)
+
+    def _walk(self, device: tuple):
+        last = self._loads.get(device, self.load)
+        load = last + 0.2 * (self.load - last) + self._rng.normal(0., 0.05)
+        self._loads[device] = load = min(max(load, 0.), 1.)
+        return load
+
+    def _devices(self):
+        """:code:`(gpu_id, labels, instances, model name)` of every GPU. The instances are
+        :code:`(gpu_instance_id, labels, memory MiB)` of its MIG devices, or of the whole GPU without MIG.
+        """
+        devices = list()
+        for gpu_id, gpu in enumerate(self.simulator.gpus):
+            model = self.simulator.model(gpu_id)
+            labels = {
+                'gpu': str(gpu_id), 'UUID': gpu['uuid'], 'device': f'nvidia{gpu_id}', 'modelName': model.name,
+            }
+            gpu_labels = {**labels, 'Hostname': self.hostname}
+            instances = list()
+            if gpu['mig_current']:
+                profiles = {profile.profile_id: profile for profile in model.gi_profiles}
+                for gi in sorted(gpu['gpu_instances'], key=lambda gi: gi['gi_id']):
+                    profile = profiles[gi['profile_id']]
+                    instances.append((gi['gi_id'], {
+                        **labels, 'GPU_I_PROFILE': profile.name, 'GPU_I_ID': str(gi['gi_id']),
+                        'Hostname': self.hostname,
+                    }, profile.memory_gib * 1024))
+            else:
+                instances.append((None, gpu_labels, model.memory_mib))
+            devices.append((gpu_id, gpu_labels, instances, model.name))
+        return devices
+
+    def _render(self, dt: float):
+        # field -> lines
+        lines = {name: list() for name, _, _ in SYNTHETIC_FIELDS}
+        for gpu_id, gpu_labels, instances, model_name in self._devices():
+            loads = list()
+            for gpu_instance_id, labels, memory in instances:
+                load = self._walk((gpu_id, gpu_instance_id))
+                loads.append(load)
+                fb_used = int(memory * (0.05 + 0.8 * load))
+                values = {
+                    'DCGM_FI_DEV_FB_FREE': int(memory) - fb_used, 'DCGM_FI_DEV_FB_USED': fb_used,
+                    'DCGM_FI_PROF_GR_ENGINE_ACTIVE': load, 'DCGM_FI_PROF_SM_ACTIVE': 0.95 * load,
+                    'DCGM_FI_PROF_SM_OCCUPANCY': 0.5 * load, 'DCGM_FI_PROF_PIPE_TENSOR_ACTIVE': 0.3 * load,
+                    'DCGM_FI_PROF_DRAM_ACTIVE': 0.6 * load,
+                }
+                label_string = ','.join(f'{name}="{value}"' for name, value in labels.items())
+                for name, value in values.items():
+                    lines[name].append(f'{name}{{{label_string}}} {_format_value(value)}')
+
+            # a GPU without MIG devices idles
+            load = sum(loads) / len(loads) if loads else 0.
+            power_limit = POWER_LIMITS.get(model_name, 300.)
+            power = power_limit * (0.15 + 0.75 * load) + self._rng.normal(0., 0.01 * power_limit)
+            counters = self._counters.setdefault(gpu_id, [0., 0., 0.])
+            counters[0] += power * dt * 1000.
+            # up to about 5 GB/s to and 25 GB/s from the host
+            counters[1] += 5e9 * load * dt
+            counters[2] += 25e9 * load * dt
+            values = {
+                'DCGM_FI_DEV_GPU_TEMP': int(30 + 45 * load), 'DCGM_FI_DEV_MEMORY_TEMP': int(35 + 45 * load),
+                'DCGM_FI_DEV_POWER_USAGE': power, 'DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION': int(counters[0]),
+                'DCGM_FI_DEV_GPU_UTIL': int(100 * load), 'DCGM_FI_PROF_PCIE_TX_BYTES': int(counters[1]),
+                'DCGM_FI_PROF_PCIE_RX_BYTES': int(counters[2]),
+            }
+            label_string = ','.join(f'{name}="{value}"' for name, value in gpu_labels.items())
+            for name, value in values.items():
+                lines[name].append(f'{name}{{{label_string}}} {_format_value(value)}')
+
+        page = list()
+        for name, metric_type, help_message in SYNTHETIC_FIELDS:
+            page.append(f'# HELP {name} {help_message}')
+            page.append(f'# TYPE {name} {metric_type}')
+            page.extend(lines[name])
+        return '\n'.join(page) + '\n'
+
+    def page(self, elapsed: float):
+        """The page :code:`elapsed` seconds after the start. The metrics advance one step per refresh interval, so
+        the pages should be requested in time order.
+        """
+        step = int(elapsed // self.refresh_interval)
+        with self._lock:
+            if step > self._step:
+                # the counters advance over the skipped steps too
+                self._page = self._render((step - self._step) * self.refresh_interval if self._step >= 0 else 0.)
+                self._step = step
+            return self._page
+
+
+def _format_value(value):
+    # as the exporter: integers for the integer fields, 6 decimals for the others
+    return str(value) if isinstance(value, int) else f'{value:.6f}'
+
+
+class _ExporterHandler(BaseHTTPRequestHandler):
+    # keep the connections alive, as the exporter does
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        exporter: DCGMExporterServer = self.server.exporter
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        if exporter.delay:
+            time.sleep(exporter.delay)
+        body = exporter.page().encode()
+        # counted before the response, which may be the last one awaited
+        exporter.num_requests += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class DCGMExporterServer(object):
+    """Serve the pages of a source on :code:`http://{host}:{port}/metrics` from a background thread, in place of
+    the DCGM exporter.
+
+    Args:
+        source (DCGMRecording or SyntheticDCGMPages): The pages, by :code:`page(elapsed)` where :code:`elapsed` is
+            the seconds since the server started.
+        host (str, optional): Address to bind. Default to :code:`127.0.0.1`.
+        port (int, optional): Port to bind, 0 for a free port. Default to 9400, the port of the exporter.
+        speed (float, optional): Speed of the source time, e.g., 2 replays a recording twice as fast. Default to 1.
+        delay (float, optional): Seconds before every response, e.g., to emulate a slow exporter. Default to 0.
+
+    Examples:
+        >>> with DCGMExporterServer(SyntheticDCGMPages.from_layouts(['A30'], ['4g.24gb']), port=0) as server:
+        ...     collector = DCGMMetricCollector(server.url)
+    """
+
+    def __init__(self, source, host: str = '127.0.0.1', port: int = 9400, speed: float = 1., delay: float = 0.):
+        if speed <= 0:
+            raise ValueError(f'Speed must be positive, got {speed}')
+        self.source = source
+        self.speed = speed
+        self.delay = delay
+        self.num_requests = 0
+        self._server = ThreadingHTTPServer((host, port), _ExporterHandler)
+        self._server.daemon_threads = True
+        self._server.exporter = self
+        self._thread = None
+        self._start = time.perf_counter()
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/metrics'
+
+    def page(self):
+        return self.source.page((time.perf_counter() - self._start) * self.speed)
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description='Stand-in DCGM exporter: record, replay or synthesize pages')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='Record the pages of a DCGM exporter.')
+    record_parser.add_argument('-u', '--url', type=str, default='http://0.0.0.0:9400/metrics',
+                               help='Metrics endpoint of the exporter. Default to http://0.0.0.0:9400/metrics.')
+    record_parser.add_argument('-o', '--output', type=str, required=True, help='JSON lines file to append to.')
+    record_parser.add_argument('-d', '--duration', type=float, required=True, help='Seconds to record.')
+    record_parser.add_argument('-i', '--interval', type=float, default=1.,
+                               help='Seconds between two pages. Default to 1.')
+
+    serve_parser = subparsers.add_parser('serve', help='Serve recorded or synthetic pages.')
+    serve_parser.add_argument('--replay', type=str, default=None, help='Recording to replay, in a loop.')
+    serve_parser.add_argument('--gpus', type=str, nargs='+', default=['A100'],
+                              help='Simulated GPU models of the synthetic pages. Default to A100.')
+    serve_parser.add_argument('--layouts', type=str, nargs='*', default=list(),
+                              help='MIG layout of every GPU, e.g., 2x3g.40gb, or - for MIG disabled.')
+    serve_parser.add_argument('--load', type=float, default=0.5, help='Mean load of the synthetic devices.')
+    serve_parser.add_argument('-c', '--refresh-interval', type=float, default=0.5,
+                              help='Seconds between two refreshes of the synthetic metrics. Default to 0.5.')
+    serve_parser.add_argument('--speed', type=float, default=1., help='Speed of the replay. Default to 1.')
+    serve_parser.add_argument('--delay', type=float, default=0., help='Seconds before every response.')
+    serve_parser.add_argument('--host', type=str, default='0.0.0.0', help='Address to bind. Default to 0.0.0.0.')
+    serve_parser.add_argument('-p', '--port', type=int, default=9400, help='Port to bind. Default to 9400.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args_ = get_args()
+    if args_.command == 'record':
+        num_pages_ = record_exporter(args_.url, args_.output, args_.duration, args_.interval)
+        print(f'Recorded {num_pages_} pages to {args_.output}')
+    else:
+        if args_.replay is not None:
+            source_ = DCGMRecording.load(args_.replay)
+        else:
+            source_ = SyntheticDCGMPages.from_layouts(
+                args_.gpus, args_.layouts, load=args_.load, refresh_interval=args_.refresh_interval,
+            )
+        server_ = DCGMExporterServer(source_, args_.host, args_.port, speed=args_.speed, delay=args_.delay).start()
+        print(f'Serving on {server_.url}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            server_.stop()
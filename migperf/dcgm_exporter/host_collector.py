@@ -0,0 +1,308 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Host-side resources sampled alongside the DCGM metrics, to tell a host-bound run (client threads, image decoding,
+data loader workers) from a GPU-bound one. The counters are read with :code:`psutil` if installed, or from
+:code:`/proc` otherwise.
+"""
+import os
+import socket
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from migperf.profiler.utils.sink import ChunkedColumnSink, sink_from_env
+from .metric_collector import SampleCollector
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PROC = '/proc'
+# units of the /proc counters
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Fields aggregated per phase: CPU and memory of the client processes, and the busiest core of the host
+HOST_PHASE_FIELDS = (
+    'cpu_percent', 'cpu_max_percent', 'rss', 'ctx_switches_voluntary', 'ctx_switches_involuntary',
+    'net_bytes_sent', 'net_bytes_recv',
+)
+
+
+class ProcessCounters(object):
+    """Cumulative counters of a process: :code:`cpu_time` (seconds, user and system), :code:`rss` (bytes),
+    :code:`num_threads`, :code:`ctx_switches_voluntary` and :code:`ctx_switches_involuntary` (of its main thread).
+    """
+    __slots__ = ('cpu_time', 'rss', 'num_threads', 'ctx_switches_voluntary', 'ctx_switches_involuntary')
+
+    def __init__(self, cpu_time, rss, num_threads, ctx_switches_voluntary, ctx_switches_involuntary):
+        self.cpu_time = cpu_time
+        self.rss = rss
+        self.num_threads = num_threads
+        self.ctx_switches_voluntary = ctx_switches_voluntary
+        self.ctx_switches_involuntary = ctx_switches_involuntary
+
+
+def _read_file(path: str):
+    with open(path) as f:
+        return f.read()
+
+
+def _children(pid: int) -> List[int]:
+    children = list()
+    for tid in os.listdir(f'{PROC}/{pid}/task'):
+        children.extend(int(child) for child in _read_file(f'{PROC}/{pid}/task/{tid}/children').split())
+    return children
+
+
+def _children_by_scan() -> Dict[int, List[int]]:
+    """Parent -> children of all processes, from their stat, for the kernels without the :code:`children` files."""
+    children = defaultdict(list)
+    for entry in os.listdir(PROC):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = _read_file(f'{PROC}/{entry}/stat')
+        except OSError:
+            continue
+        children[int(stat[stat.rfind(')') + 2:].split()[1])].append(int(entry))
+    return children
+
+
+def process_tree(pid: int) -> List[int]:
+    """The process :code:`pid` and its descendants, e.g., the data loader workers, with the process first."""
+    if psutil is not None:
+        try:
+            return [pid] + [child.pid for child in psutil.Process(pid).children(recursive=True)]
+        except psutil.Error:
+            return [pid]
+    get_children = _children
+    if not os.path.exists(f'{PROC}/{pid}/task/{pid}/children'):
+        get_children = _children_by_scan().__getitem__
+    pids, queue = [pid], [pid]
+    while queue:
+        try:
+            children = get_children(queue.pop())
+        except OSError:
+            # exited meanwhile
+            continue
+        pids.extend(children)
+        queue.extend(children)
+    return pids
+
+
+def read_process(pid: int) -> Optional[ProcessCounters]:
+    """The counters of a process, :code:`None` if it exited."""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            with process.oneshot():
+                cpu_times = process.cpu_times()
+                ctx_switches = process.num_ctx_switches()
+                return ProcessCounters(
+                    cpu_times.user + cpu_times.system, process.memory_info().rss, process.num_threads(),
+                    ctx_switches.voluntary, ctx_switches.involuntary,
+                )
+        except psutil.Error:
+            return None
+    try:
+        stat = _read_file(f'{PROC}/{pid}/stat')
+        status = _read_file(f'{PROC}/{pid}/status')
+    except OSError:
+        return None
+    # the command name in parentheses may contain spaces, the fields after it start at the state (field 3)
+    fields = stat[stat.rfind(')') + 2:].split()
+    ctx_switches = dict()
+    for line in status.splitlines():
+        if 'ctxt_switches' in line:
+            name, value = line.split(':')
+            ctx_switches[name] = int(value)
+    return ProcessCounters(
+        (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, int(fields[21]) * _PAGE_SIZE, int(fields[17]),
+        ctx_switches.get('voluntary_ctxt_switches', 0), ctx_switches.get('nonvoluntary_ctxt_switches', 0),
+    )
+
+
+def read_cpu_times() -> List[Tuple[float, float]]:
+    """The :code:`(busy, total)` seconds of every core since boot."""
+    if psutil is not None:
+        cpu_times = list()
+        for times in psutil.cpu_times(percpu=True):
+            # the guest time is already counted in the user time
+            total = sum(times) - getattr(times, 'guest', 0.) - getattr(times, 'guest_nice', 0.)
+            cpu_times.append((total - times.idle - getattr(times, 'iowait', 0.), total))
+        return cpu_times
+    cpu_times = list()
+    for line in _read_file(f'{PROC}/stat').splitlines():
+        if not line.startswith('cpu') or line.startswith('cpu '):
+            continue
+        # user nice system idle iowait irq softirq steal [guest guest_nice]
+        ticks = [int(value) for value in line.split()[1:9]]
+        total = sum(ticks)
+        cpu_times.append(((total - ticks[3] - ticks[4]) / _CLOCK_TICKS, total / _CLOCK_TICKS))
+    return cpu_times
+
+
+def read_net_bytes() -> Tuple[int, int]:
+    """The :code:`(sent, received)` bytes of all network interfaces but the loopback since boot."""
+    if psutil is not None:
+        counters = [
+            counter for interface, counter in psutil.net_io_counters(pernic=True).items() if interface != 'lo'
+        ]
+        return sum(counter.bytes_sent for counter in counters), sum(counter.bytes_recv for counter in counters)
+    sent = received = 0
+    # the first two lines are the headers
+    for line in _read_file(f'{PROC}/net/dev').splitlines()[2:]:
+        interface, counters = line.split(':', 1)
+        if interface.strip() == 'lo':
+            continue
+        counters = counters.split()
+        received += int(counters[0])
+        sent += int(counters[8])
+    return sent, received
+
+
+def read_memory() -> Tuple[int, int]:
+    """The :code:`(total, available)` bytes of the host memory."""
+    if psutil is not None:
+        memory = psutil.virtual_memory()
+        return memory.total, memory.available
+    meminfo = dict()
+    for line in _read_file(f'{PROC}/meminfo').splitlines():
+        name, value = line.split(':', 1)
+        meminfo[name] = int(value.split()[0]) * 1024
+    return meminfo['MemTotal'], meminfo.get('MemAvailable', meminfo.get('MemFree', 0))
+
+
+class HostMetricCollector(SampleCollector):
+    """Sample the resources of the host and of the profiling client in a background thread every
+    :code:`interval` seconds, with the interface of :class:`migperf.dcgm_exporter.DCGMMetricCollector`: the samples
+    are scheduled on a tick grid, tagged with the phases marked by :meth:`mark`, kept in a
+    :class:`migperf.dcgm_exporter.sample_store.DCGMSampleStore` and optionally streamed to a sink.
+
+    The store has two devices:
+
+    - :code:`('process', None)`: The client process and its descendants (e.g., the data loader workers):
+      :code:`cpu_percent` (100 per busy core), :code:`rss` (bytes), :code:`num_threads`, :code:`num_processes`,
+      and :code:`ctx_switches_voluntary` and :code:`ctx_switches_involuntary` (per second, of the main threads).
+    - :code:`('host', None)`: The whole host: :code:`cpu_percent` (average of the cores), :code:`cpu_max_percent`
+      (the busiest core, e.g., a thread bound by the GIL), :code:`cpu{i}_percent` of every core,
+      :code:`memory_used` (bytes), and :code:`net_bytes_sent` and :code:`net_bytes_recv` (per second).
+
+    The rates are of the period since the previous sample, so the first sample has none.
+
+    Args:
+        pid (int, optional): The process to sample with its descendants. Default to the current process.
+        interval (float, optional): Seconds between two samples. Default to the environment variable
+            :code:`MIGPERF_HOST_INTERVAL`, or 1.
+        capacity (int, optional): Keep only the latest :code:`capacity` samples in memory. Default to the
+            environment variable :code:`MIGPERF_DCGM_CAPACITY`, or the chunk size of the sink, or keep all samples
+            without a sink.
+        sink (ChunkedColumnSink, optional): Also stream the samples to disk, with a column per device field, e.g.,
+            :code:`process/cpu_percent`. Default to a :code:`host` sink if the environment variable
+            :code:`MIGPERF_METRIC_SINK` is set.
+        aggregate_fields (iterable of str, optional): The fields of every device aggregated online over the whole
+            run. Default to :data:`HOST_PHASE_FIELDS`.
+
+    Examples:
+        >>> collector = HostMetricCollector()
+        >>> collector.start()
+        >>> collector.mark('measure')
+        >>> run()
+        >>> collector.stop()
+        >>> collector.store.to_dict('process', mask=collector.phase_mask('measure'))
+        >>> collector.phase_stats('host')['measure']['cpu_max_percent']['max']
+    """
+
+    def __init__(
+            self, pid: int = None, interval: float = None, capacity: int = None, sink: ChunkedColumnSink = None,
+            aggregate_fields: Iterable[str] = HOST_PHASE_FIELDS,
+    ):
+        if psutil is None and not os.path.isdir(PROC):
+            raise ValueError(f'Host metrics require psutil or {PROC}')
+        interval = interval if interval is not None else float(os.environ.get('MIGPERF_HOST_INTERVAL', 1.))
+        if capacity is None and os.environ.get('MIGPERF_DCGM_CAPACITY'):
+            capacity = int(os.environ['MIGPERF_DCGM_CAPACITY'])
+        if sink is None:
+            sink = sink_from_env('host')
+        super().__init__(interval, capacity=capacity, sink=sink, aggregate_fields=aggregate_fields)
+        self.pid = pid if pid is not None else os.getpid()
+        self._process_labels = {'pid': str(self.pid), 'hostname': socket.gethostname()}
+        self._host_labels = {'hostname': socket.gethostname(), 'num_cpus': str(os.cpu_count())}
+        # counters of the previous sample
+        self._last_time = None
+        self._last_processes: Dict[int, ProcessCounters] = dict()
+        self._last_cpu_times = None
+        self._last_net_bytes = None
+
+    def phase_stats(self, device: str = 'process', fields: Iterable[str] = HOST_PHASE_FIELDS):
+        """Aggregates of the metrics of :code:`process` or :code:`host` per phase, see
+        :meth:`migperf.dcgm_exporter.DCGMMetricCollector.phase_stats`.
+        """
+        return self._phase_stats((device, None), fields)
+
+    def sink_prefix(self, device: tuple):
+        """Prefix of the sink columns of a device, i.e., :code:`process` or :code:`host`."""
+        return device[0]
+
+    def _process_rate(self, processes: Dict[int, ProcessCounters], field: str, elapsed: float):
+        # a process started since the previous sample counts from zero, an exited one is left out
+        delta = 0.
+        for pid, counters in processes.items():
+            last = self._last_processes.get(pid)
+            delta += getattr(counters, field) - (getattr(last, field) if last is not None else 0)
+        return delta / elapsed
+
+    def scrape(self):
+        """Read the counters and compute the metrics since the previous sample."""
+        now = time.perf_counter()
+        elapsed = now - self._last_time if self._last_time is not None else None
+        self._last_time = now
+
+        processes = dict()
+        for pid in process_tree(self.pid):
+            counters = read_process(pid)
+            if counters is not None:
+                processes[pid] = counters
+        if self.pid not in processes:
+            self.failed_scrapes += 1
+            return None
+        process_metrics = {
+            'labels': self._process_labels, 'num_processes': len(processes),
+            'rss': sum(counters.rss for counters in processes.values()),
+            'num_threads': sum(counters.num_threads for counters in processes.values()),
+        }
+        if elapsed:
+            process_metrics['cpu_percent'] = self._process_rate(processes, 'cpu_time', elapsed) * 100.
+            for field in ('ctx_switches_voluntary', 'ctx_switches_involuntary'):
+                process_metrics[field] = self._process_rate(processes, field, elapsed)
+        self._last_processes = processes
+
+        host_metrics = {'labels': self._host_labels}
+        total_memory, available_memory = read_memory()
+        host_metrics['memory_used'] = total_memory - available_memory
+        cpu_times, net_bytes = read_cpu_times(), read_net_bytes()
+        if self._last_cpu_times is not None and len(self._last_cpu_times) == len(cpu_times):
+            utilization = list()
+            for (busy, total), (last_busy, last_total) in zip(cpu_times, self._last_cpu_times):
+                utilization.append((busy - last_busy) / (total - last_total) * 100. if total > last_total else 0.)
+            host_metrics['cpu_percent'] = sum(utilization) / len(utilization)
+            host_metrics['cpu_max_percent'] = max(utilization)
+            host_metrics.update({f'cpu{i}_percent': value for i, value in enumerate(utilization)})
+        if self._last_net_bytes is not None and elapsed:
+            host_metrics['net_bytes_sent'] = (net_bytes[0] - self._last_net_bytes[0]) / elapsed
+            host_metrics['net_bytes_recv'] = (net_bytes[1] - self._last_net_bytes[1]) / elapsed
+        self._last_cpu_times, self._last_net_bytes = cpu_times, net_bytes
+        return {('process', None): process_metrics, ('host', None): host_metrics}
+
+
+if __name__ == '__main__':
+    collector = HostMetricCollector()
+    collector.start()
+    time.sleep(3)
+    collector.stop()
+    for device in collector.store.devices():
+        print(device, collector.store.labels(*device), collector.store.view(*device))
+    print(collector.stats())
@@ -5,12 +5,29 @@ Author: Li Yuanming
 Email: yuanmingleee@gmail.com
 Date: Dec 5, 2022
 """
+import os
+import re
 import time
 from collections import defaultdict
-from threading import Thread
+from threading import Event, Thread
+from typing import Iterable, Optional
 
+import numpy as np
 import requests
 from prometheus_client.parser import text_string_to_metric_families
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from migperf.profiler.utils.sink import ChunkedColumnReader, ChunkedColumnSink, sink_from_env
+from migperf.profiler.utils.sketch import AggregatorGroup
+from migperf.profiler.utils.stats import summarize
+from .sample_store import DCGMSampleStore
+
+# Fields aggregated per phase: SM activity, memory bandwidth and power
+PHASE_FIELDS = (
+    'DCGM_FI_PROF_GR_ENGINE_ACTIVE', 'DCGM_FI_PROF_SM_ACTIVE', 'DCGM_FI_PROF_SM_OCCUPANCY', 'DCGM_FI_PROF_DRAM_ACTIVE',
+    'DCGM_FI_DEV_POWER_USAGE',
+)
 
 
 def dcgm_gpu_metric_parser(metrics: str):
@@ -35,30 +52,414 @@ def dcgm_gpu_metric_parser(metrics: str):
     return gpu_metrics_dict
 
 
-class DCGMMetricCollector(object):
-    def __init__(self, dcgm_url='http://0.0.0.0:9400/metrics'):
-        self.dcgm_url = dcgm_url
+class DCGMTextParser(object):
+    """Fast parser of the DCGM exporter page, for high scrape rates. The result is the same as
+    :func:`dcgm_gpu_metric_parser`, restricted to the :code:`fields`.
+
+    Instead of building every metric family, the page is scanned line by line: the comments and the lines of other
+    metrics are skipped by their name, without parsing their labels. A label string is parsed once, and its labels
+    and device are cached for the following scrapes, as the exporter repeats the same label strings on every page.
+    The labels dicts are shared between the samples and must not be modified.
+
+    Args:
+        fields (iterable of str, optional): The metric names to keep, e.g., :code:`DCGM_FI_PROF_GR_ENGINE_ACTIVE`.
+            Default to all metrics.
+        max_cached_labels (int, optional): Size of the label cache, cleared when full. Default to 4096.
+    """
+    LABEL_PATTERN = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+    ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+    def __init__(self, fields: Optional[Iterable[str]] = None, max_cached_labels: int = 4096):
+        self.fields = frozenset(fields) if fields is not None else None
+        self.max_cached_labels = max_cached_labels
+        # label string -> (device, labels)
+        self._label_cache = dict()
+
+    def _parse_labels(self, label_string: str):
+        labels = {
+            name: self.ESCAPE_PATTERN.sub(lambda m: '\n' if m.group(1) == 'n' else m.group(1), value)
+            if '\\' in value else value
+            for name, value in self.LABEL_PATTERN.findall(label_string)
+        }
+        gpu_instance_id = int(labels['GPU_I_ID']) if labels.get('GPU_I_ID', None) else None
+        return (int(labels['gpu']), gpu_instance_id), labels
+
+    def __call__(self, metrics: str):
+        gpu_metrics_dict = dict()
+        fields, label_cache = self.fields, self._label_cache
+        for line in metrics.splitlines():
+            if not line or line[0] == '#':
+                continue
+            brace = line.find('{')
+            if brace < 0:
+                # a metric without labels is not of any device
+                continue
+            name = line[:brace]
+            if fields is not None and name not in fields:
+                continue
+            end = line.rfind('}')
+            label_string = line[brace + 1:end]
+            cached = label_cache.get(label_string)
+            if cached is None:
+                if len(label_cache) >= self.max_cached_labels:
+                    label_cache.clear()
+                cached = label_cache[label_string] = self._parse_labels(label_string)
+            device, labels = cached
+            # the value may be followed by a timestamp
+            value = float(line[end + 1:].split()[0])
+            device_metrics = gpu_metrics_dict.get(device)
+            if device_metrics is None:
+                device_metrics = gpu_metrics_dict[device] = {'labels': labels}
+            device_metrics[name] = value
+        return gpu_metrics_dict
+
+
+def make_session(retries: int = 1):
+    """A :class:`requests.Session` reusing its connections, which retries a failed connection, read or 5xx
+    response :code:`retries` times without backoff, as a late retry is worth less than the next tick.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=Retry(
+        total=retries, backoff_factor=0, status_forcelist=(500, 502, 503, 504), allowed_methods=('GET',),
+        raise_on_status=False,
+    ))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fields_from_env():
+    """The metric names in the comma-separated environment variable :code:`MIGPERF_DCGM_FIELDS`, :code:`None` if
+    unset.
+    """
+    fields = [field.strip() for field in os.environ.get('MIGPERF_DCGM_FIELDS', '').split(',') if field.strip()]
+    return fields or None
+
 
-        self._thread = Thread(target=self.runner)
+def advance_tick(next_tick: float, now: float, interval: float):
+    """The tick after :code:`next_tick` that is in the future of :code:`now`, and the number of ticks skipped to
+    reach it. A scrape that overran resumes on the tick grid instead of scraping back-to-back to catch up.
+    """
+    next_tick += interval
+    if now < next_tick:
+        return next_tick, 0
+    missed = int((now - next_tick) // interval) + 1
+    return next_tick + missed * interval, missed
+
+
+def sampling_stats(store: DCGMSampleStore, interval: float, skipped_ticks: int, failed_scrapes: int):
+    """Statistics of the sampling into a store, see :meth:`DCGMMetricCollector.stats`."""
+    if len(store):
+        scrape_latency, jitter, times = (store.column(field).copy() for field in ('scrape_latency', 'jitter', 'time'))
+    else:
+        scrape_latency = jitter = times = np.empty(0)
+    return {
+        'interval': interval, 'num_samples': len(times), 'dropped_samples': store.num_dropped,
+        'skipped_ticks': skipped_ticks, 'failed_scrapes': failed_scrapes,
+        'scrape_latency': summarize(scrape_latency), 'jitter': summarize(jitter), 'period': summarize(np.diff(times)),
+    }
+
+
+def sink_prefix(device: tuple):
+    """Prefix of the sink columns of a device, e.g., :code:`gpu0/gi3`, or :code:`gpu0` for a whole GPU."""
+    gpu_id, gpu_instance_id = device
+    return f'gpu{gpu_id}' if gpu_instance_id is None else f'gpu{gpu_id}/gi{gpu_instance_id}'
+
+
+def sink_column(device: tuple, field: str):
+    """Column name of a device field in a sink, e.g., :code:`gpu0/gi3/DCGM_FI_PROF_SM_ACTIVE`."""
+    return f'{sink_prefix(device)}/{field}'
+
+
+class SampleCollector(object):
+    """Base of the collectors sampling in a background thread every :code:`interval` seconds, into a
+    :class:`DCGMSampleStore`. A subclass implements :meth:`scrape`, which returns a sample in the parser format:
+    device key -> :code:`{'labels': labels, field: value}`.
+
+    The samples are scheduled at absolute ticks (start + k * interval), and tagged with the phase marked by
+    :meth:`mark`, see :class:`DCGMMetricCollector`.
+
+    Args:
+        interval (float): Seconds between two samples.
+        capacity (int, optional): Keep only the latest :code:`capacity` samples in memory. Default to the chunk
+            size of the sink, whose chunks hold the older samples, or keep all samples without a sink.
+        sink (ChunkedColumnSink, optional): Also stream the samples to disk. Default to no sink.
+        aggregate_fields (iterable of str, optional): The fields of every device aggregated online over the whole
+            run. Default to none.
+    """
+
+    def __init__(
+            self, interval: float, capacity: int = None, sink: ChunkedColumnSink = None,
+            aggregate_fields: Iterable[str] = (),
+    ):
+        if interval <= 0:
+            raise ValueError(f'Sampling interval must be positive, got {interval}')
+        self.interval = interval
+        self._thread = None
+        self._stop_event = Event()
         self.is_running = False
-        self.gpu_metrics_list = list()
+        if capacity is None and sink is not None:
+            # the samples are streamed to the sink, keep the latest chunk in memory
+            capacity = sink.chunk_size
+        self.store = DCGMSampleStore(capacity)
+        self.sink = sink
+        self.aggregate_fields = tuple(aggregate_fields)
+        self.aggregators = AggregatorGroup()
+        self.skipped_ticks = 0
+        self.failed_scrapes = 0
+        self.phase_names = list()
+        self.phases = list()
+        # sink prefix -> labels of the devices written to the sink
+        self._sink_labels = dict()
+        # index of the current phase name, NaN before the first mark
+        self._phase = np.nan
+
+    def mark(self, phase: str):
+        """End the current phase and start the phase :code:`phase` now. A phase may be marked more than once."""
+        now = time.time()
+        self._close_phase(now)
+        if phase not in self.phase_names:
+            self.phase_names.append(phase)
+        self.phases.append({'phase': phase, 'start': now, 'end': None})
+        self._phase = float(self.phase_names.index(phase))
+        if self.sink is not None:
+            self.sink.update_attrs(phase_names=self.phase_names, phases=self.phases)
+
+    def _close_phase(self, end: float):
+        if self.phases and self.phases[-1]['end'] is None:
+            self.phases[-1]['end'] = end
+
+    def phase_mask(self, phase: str):
+        """Boolean mask of the samples of a phase, over the samples of :attr:`store`. The mask is only aligned with
+        the store while no sample is appended, i.e., once the collector is stopped.
+        """
+        if phase not in self.phase_names:
+            raise ValueError(f'Phase {phase} is not marked, marked phases: {self.phase_names}')
+        if not len(self.store):
+            return np.zeros(0, dtype=bool)
+        return self.store.column('phase') == self.phase_names.index(phase)
+
+    def _phase_stats(self, device: tuple, fields: Iterable[str]):
+        now = time.time()
+        if self.store.num_dropped and self.sink is not None:
+            # the ring buffer only holds the latest samples, the whole run is read back from the sink
+            self.sink.flush()
+            reader = ChunkedColumnReader(self.sink.directory)
+            prefix = self.sink_prefix(device)
+            sink_columns = set(reader.columns)
+            phases = reader.column('phase')
+            columns = {
+                field: reader.column(f'{prefix}/{field}') for field in fields if f'{prefix}/{field}' in sink_columns
+            }
+        else:
+            # the phases and the values are read together, as the samples may still be appended
+            sample_columns, columns = self.store.snapshot(*device)
+            phases = sample_columns.get('phase', np.zeros(0))
+        stats = dict()
+        for index, phase in enumerate(self.phase_names):
+            mask = phases == index
+            phase_stats = {
+                'num_samples': int(mask.sum()),
+                'duration': sum(
+                    (period['end'] or now) - period['start'] for period in self.phases if period['phase'] == phase
+                ),
+            }
+            for field in fields:
+                if field in columns:
+                    values = columns[field][mask]
+                    phase_stats[field] = summarize(values[~np.isnan(values)])
+            stats[phase] = phase_stats
+        return stats
+
+    def scrape(self):
+        """Take a sample: device key -> :code:`{'labels': labels, field: value}`, :code:`None` if it failed."""
+        raise NotImplementedError
+
+    def tick(self, scheduled: float):
+        """Scrape once into the store, for the tick scheduled at :code:`scheduled` (:func:`time.perf_counter`).
+        Returns the next tick.
+        """
+        # the ticks are on the monotonic clock, the samples are stamped with the wall clock
+        scrape_start = time.perf_counter()
+        metrics = self.scrape()
+        if metrics is not None:
+            metrics['phase'] = self._phase
+            metrics['time'] = time.time()
+            metrics['scrape_latency'] = time.perf_counter() - scrape_start
+            metrics['jitter'] = scrape_start - scheduled
+            self.store.append(metrics)
+            self._aggregate(metrics)
+            if self.sink is not None:
+                self._write_sink(metrics)
+        next_tick, missed = advance_tick(scheduled, time.perf_counter(), self.interval)
+        self.skipped_ticks += missed
+        return next_tick
+
+    def _aggregate(self, metrics: dict):
+        for key, values in metrics.items():
+            if not isinstance(key, tuple):
+                continue
+            for field in self.aggregate_fields:
+                if field in values:
+                    self.aggregators.add(f'{self.sink_prefix(key)}/{field}', values[field])
+
+    def _write_sink(self, metrics: dict):
+        row = dict()
+        new_devices = False
+        for key, values in metrics.items():
+            if not isinstance(key, tuple):
+                row[key] = values
+                continue
+            prefix = self.sink_prefix(key)
+            if prefix not in self._sink_labels:
+                self._sink_labels[prefix] = values['labels']
+                new_devices = True
+            row.update({f'{prefix}/{field}': value for field, value in values.items() if field != 'labels'})
+        self.sink.append(row)
+        if new_devices:
+            self.sink.update_attrs(labels=self._sink_labels)
+
+    def sink_prefix(self, device: tuple):
+        """Prefix of the sink columns and aggregators of a device, see :func:`sink_prefix`."""
+        return sink_prefix(device)
 
     def runner(self):
-        while self.is_running:
-            metrics = requests.get(self.dcgm_url).text
-            data_collected_time = time.time()
-            metrics = dcgm_gpu_metric_parser(metrics)
-            metrics['time'] = data_collected_time
-            self.gpu_metrics_list.append(metrics)
-            time.sleep(1)
+        next_tick = time.perf_counter()
+        while not self._stop_event.is_set():
+            next_tick = self.tick(next_tick)
+            self._stop_event.wait(next_tick - time.perf_counter())
 
     def start(self):
         self.is_running = True
+        self._stop_event.clear()
+        self._thread = Thread(target=self.runner, daemon=True)
         self._thread.start()
 
     def stop(self):
         self.is_running = False
+        self._stop_event.set()
         self._thread.join()
+        self._finish()
+
+    def _finish(self):
+        """End the last phase and flush the sink, once the sampling is stopped."""
+        self._close_phase(time.time())
+        if self.sink is not None:
+            self.sink.update_attrs(phases=self.phases)
+            self.sink.flush()
+
+    def stats(self):
+        """Statistics of the sampling: :code:`interval`, :code:`num_samples`, :code:`dropped_samples` (by the
+        ring buffer), :code:`skipped_ticks`, :code:`failed_scrapes`, and the distributions (see
+        :func:`migperf.profiler.utils.stats.summarize`) of :code:`scrape_latency`, :code:`jitter` and
+        :code:`period` (seconds between two consecutive samples).
+        """
+        return sampling_stats(self.store, self.interval, self.skipped_ticks, self.failed_scrapes)
+
+
+class DCGMMetricCollector(SampleCollector):
+    """Scrape the DCGM exporter in a background thread every :code:`interval` seconds.
+
+    The scrapes are scheduled at absolute ticks (start + k * interval), so the scrape and parse time does not
+    accumulate into drift. A scrape that takes longer than the interval skips the ticks it overran, which are counted
+    in :code:`skipped_ticks`. Besides the metrics, every sample records :code:`time` (Unix timestamp of the response),
+    :code:`scrape_latency` (seconds of the request and parsing) and :code:`jitter` (seconds between the scheduled
+    tick and the start of the scrape). The connection to the exporter is kept alive between the scrapes.
+
+    The run is split into phases by :meth:`mark`, e.g., :code:`warmup`, :code:`measure` and :code:`teardown`, and
+    every sample is tagged with the phase in which it was received, so that the idle samples around the measurement
+    are left out of its metrics (see :meth:`phase_mask`), and aggregated on their own (see :meth:`phase_stats`).
+
+    Args:
+        dcgm_url (str, optional): The metrics endpoint of the DCGM exporter. Default to the environment variable
+            :code:`MIGPERF_DCGM_URL`, or :code:`http://0.0.0.0:9400/metrics`, e.g., to point the clients to a
+            stand-in exporter (see :mod:`migperf.dcgm_exporter.exporter_server`).
+        interval (float, optional): Seconds between two scrapes. Default to the environment variable
+            :code:`MIGPERF_DCGM_INTERVAL`, or 1. Note that the exporter refreshes its metrics every
+            :code:`-c` milliseconds, which bounds the useful rate.
+        timeout (float, optional): Seconds of the request timeout. Default to the interval, at least 1 second.
+        capacity (int, optional): Keep only the latest :code:`capacity` samples in memory, see
+            :class:`migperf.dcgm_exporter.sample_store.DCGMSampleStore`. Default to the environment variable
+            :code:`MIGPERF_DCGM_CAPACITY`, or the chunk size of the sink, or keep all samples without a sink.
+        fields (iterable of str, optional): The metric names to collect. Default to the comma-separated names in
+            the environment variable :code:`MIGPERF_DCGM_FIELDS`, or all metrics.
+        retries (int, optional): Retries of a failed scrape within its tick, see :func:`make_session`. Default to 1.
+        sink (ChunkedColumnSink, optional): Also stream the samples to disk, with a column per device field (see
+            :func:`sink_column`) and the device labels and phases as attributes. Default to a :code:`dcgm` sink
+            if the environment variable :code:`MIGPERF_METRIC_SINK` is set, see
+            :func:`migperf.profiler.utils.sink.sink_from_env`.
+        aggregate_fields (iterable of str, optional): The fields of every device aggregated online over the whole
+            run, see :attr:`aggregators`. Default to :data:`PHASE_FIELDS`.
+
+    Attributes:
+        store (DCGMSampleStore): The samples, as a column per metric field of every device.
+        aggregators (AggregatorGroup): Online aggregates of the :code:`aggregate_fields` of every device, by their
+            sink column name (see :func:`sink_column`), e.g., to report the progress of a run.
+        phases (list of dict): The marked phases in order, with their :code:`phase` name, :code:`start` and
+            :code:`end` (Unix timestamps, :code:`None` until the next phase or :meth:`stop`).
+
+    Examples:
+        >>> collector = DCGMMetricCollector()
+        >>> collector.start()
+        >>> collector.mark('warmup')
+        >>> warm_up()
+        >>> collector.mark('measure')
+        >>> run()
+        >>> collector.mark('teardown')
+        >>> collector.store.to_dict(0, 1, mask=collector.phase_mask('measure'))
+        >>> collector.phase_stats(0, 1)['measure']['DCGM_FI_PROF_SM_ACTIVE']['mean']
+    """
+
+    def __init__(
+            self, dcgm_url: str = None, interval: float = None, timeout: float = None,
+            capacity: int = None, fields: Iterable[str] = None, retries: int = 1, sink: ChunkedColumnSink = None,
+            aggregate_fields: Iterable[str] = PHASE_FIELDS,
+    ):
+        interval = interval if interval is not None else float(os.environ.get('MIGPERF_DCGM_INTERVAL', 1.))
+        if capacity is None and os.environ.get('MIGPERF_DCGM_CAPACITY'):
+            capacity = int(os.environ['MIGPERF_DCGM_CAPACITY'])
+        if sink is None:
+            sink = sink_from_env('dcgm')
+        super().__init__(interval, capacity=capacity, sink=sink, aggregate_fields=aggregate_fields)
+        self.dcgm_url = dcgm_url or os.environ.get('MIGPERF_DCGM_URL', 'http://0.0.0.0:9400/metrics')
+        self.timeout = timeout if timeout is not None else max(self.interval, 1.)
+        self.parser = DCGMTextParser(fields if fields is not None else fields_from_env())
+        self.session = make_session(retries)
+
+    def phase_stats(self, gpu_id: int, gpu_instance_id: Optional[int] = None, fields: Iterable[str] = PHASE_FIELDS):
+        """Aggregates of the metrics of a device per phase.
+
+        Args:
+            gpu_id (int): GPU ID.
+            gpu_instance_id (int, optional): GPU instance ID. Default to the whole GPU.
+            fields (iterable of str, optional): The metric fields to aggregate, if collected. Default to
+                :data:`PHASE_FIELDS`.
+
+        Returns:
+            dict: Phase name -> :code:`num_samples`, :code:`duration` (seconds, of all the periods of the phase)
+                and field -> distribution of its values (see :func:`migperf.profiler.utils.stats.summarize`).
+        """
+        return self._phase_stats((gpu_id, gpu_instance_id), fields)
+
+    def scrape(self):
+        """Scrape and parse the exporter page, :code:`None` if the scrape failed."""
+        try:
+            response = self.session.get(self.dcgm_url, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.RequestException:
+            self.failed_scrapes += 1
+            return None
+        return self.parser(response.text)
+
+    def _finish(self):
+        """Release the connection, end the last phase and flush the sink, once the scrapes are stopped."""
+        self.session.close()
+        super()._finish()
+
+    @property
+    def gpu_metrics_list(self):
+        """The samples as a list of parsed metrics, the format before :attr:`store`. Prefer :attr:`store`."""
+        return self.store.samples()
 
 
 if __name__ == '__main__':
@@ -66,4 +467,6 @@ if __name__ == '__main__':
     collector.start()
     time.sleep(3)
     collector.stop()
-    print(collector.gpu_metrics_list)
+    for device in collector.store.devices():
+        print(device, collector.store.labels(*device), collector.store.view(*device))
+    print(collector.stats())
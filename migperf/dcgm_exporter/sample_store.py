@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Columnar storage of the DCGM samples. Instead of a dict of dicts per sample, every metric field of every device
+(:code:`(gpu_id, gpu_instance_id)`) is a column in a preallocated numpy array, and the labels of a device are
+stored once. The memory is flat in the number of samples, and the consolidated traces of a device are views of the
+columns.
+"""
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Per-sample fields, not of any device. The phase is an index of the phase names of the collector.
+SAMPLE_FIELDS = ('time', 'scrape_latency', 'jitter', 'phase')
+
+DeviceKey = Tuple[int, Optional[int]]
+
+
+class DCGMSampleStore(object):
+    """Columns of the DCGM samples, growing or in a ring buffer.
+
+    A field missing in a sample, or a device appearing after the first samples, is filled with NaN.
+
+    Args:
+        capacity (int, optional): Keep only the latest :code:`capacity` samples in a ring buffer. Default to keep all
+            samples, doubling the columns when they are full.
+        initial_capacity (int, optional): Initial number of rows of the growing columns. Default to 1024.
+
+    Notes:
+        The ring buffer writes every value twice, at row :code:`i` and :code:`i + capacity`, so that the latest
+        samples are always a contiguous slice: :meth:`column` and :meth:`view` return views without copying.
+        A view may be overwritten by the later samples of a ring buffer, copy it if the collector keeps running.
+    """
+
+    def __init__(self, capacity: int = None, initial_capacity: int = 1024):
+        if capacity is not None and capacity <= 0:
+            raise ValueError(f'Capacity must be positive, got {capacity}')
+        self.capacity = capacity
+        self._rows = capacity if capacity is not None else initial_capacity
+        # device (None for the sample fields) -> field -> column
+        self._columns: Dict[Optional[DeviceKey], Dict[str, np.ndarray]] = {None: dict()}
+        self._labels: Dict[DeviceKey, dict] = dict()
+        self._size = 0
+        self._start = 0
+        # number of samples appended, including the ones dropped by the ring buffer
+        self.num_appended = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def num_dropped(self):
+        return self.num_appended - self._size
+
+    def _new_column(self):
+        return np.full(2 * self._rows if self.capacity is not None else self._rows, np.nan)
+
+    def _grow(self):
+        self._rows *= 2
+        for columns in self._columns.values():
+            for field, column in columns.items():
+                columns[field] = np.concatenate([column, np.full(self._rows - len(column), np.nan)])
+
+    def _write(self, column: np.ndarray, row: int, value: float):
+        column[row] = value
+        if self.capacity is not None:
+            column[row + self.capacity] = value
+
+    def append(self, sample: dict):
+        """Append a sample parsed by :func:`dcgm_gpu_metric_parser`: :code:`(gpu_id, gpu_instance_id)` ->
+        :code:`{'labels': labels, field: value}`, and the :data:`SAMPLE_FIELDS`.
+        """
+        with self._lock:
+            if self.capacity is None:
+                if self._size == self._rows:
+                    self._grow()
+                row = self._size
+                self._size += 1
+            elif self._size < self.capacity:
+                row = self._size
+                self._size += 1
+            else:
+                # overwrite the oldest sample
+                row = self._start
+                self._start = (self._start + 1) % self.capacity
+            self.num_appended += 1
+
+            # the columns not in the sample are written NaN, as the row may hold an overwritten sample
+            written = set()
+            for key, metrics in sample.items():
+                if key in SAMPLE_FIELDS:
+                    device, items = None, ((key, metrics),)
+                else:
+                    device, items = key, metrics.items()
+                    if device not in self._labels:
+                        self._labels[device] = dict(metrics['labels'])
+                        self._columns[device] = dict()
+                columns = self._columns[device]
+                for field, value in items:
+                    if field == 'labels':
+                        continue
+                    if field not in columns:
+                        columns[field] = self._new_column()
+                    self._write(columns[field], row, value)
+                    written.add((device, field))
+            for device, columns in self._columns.items():
+                for field, column in columns.items():
+                    if (device, field) not in written:
+                        self._write(column, row, np.nan)
+
+    def devices(self):
+        """The :code:`(gpu_id, gpu_instance_id)` of the devices, in the order they are first seen."""
+        return list(self._labels)
+
+    def labels(self, gpu_id: int, gpu_instance_id: Optional[int] = None):
+        """The labels of a device, as first scraped, e.g., :code:`modelName` and :code:`GPU_I_PROFILE`."""
+        return dict(self._labels[gpu_id, gpu_instance_id])
+
+    def _slice(self, column: np.ndarray):
+        return column[self._start:self._start + self._size]
+
+    def column(self, field: str, device: DeviceKey = None):
+        """The values of a field in time order, as a view. The sample fields (e.g., :code:`time`) have no device."""
+        with self._lock:
+            return self._slice(self._columns[device][field])
+
+    def view(self, gpu_id: int, gpu_instance_id: Optional[int] = None, mask: np.ndarray = None):
+        """The fields of a device: field -> values in time order, as views. With a boolean :code:`mask` over the
+        samples (e.g., of a phase), the selected values are copied.
+        """
+        with self._lock:
+            columns = self._columns[gpu_id, gpu_instance_id].items()
+            if mask is None:
+                return {field: self._slice(column) for field, column in columns}
+            return {field: self._slice(column)[mask] for field, column in columns}
+
+    def snapshot(self, gpu_id: int, gpu_instance_id: Optional[int] = None):
+        """Copies of the sample fields (e.g., :code:`phase`) and of the fields of a device, taken together, so that
+        a mask built from the former (e.g., of a phase) is aligned with the latter while samples are appended.
+
+        Returns:
+            tuple of dict: The sample fields and the device fields: field -> values in time order.
+        """
+        with self._lock:
+            sample_columns = self._columns.get(None, dict()).items()
+            columns = self._columns[gpu_id, gpu_instance_id].items()
+            return (
+                {field: self._slice(column).copy() for field, column in sample_columns},
+                {field: self._slice(column).copy() for field, column in columns},
+            )
+
+    def to_dict(self, gpu_id: int, gpu_instance_id: Optional[int] = None, mask: np.ndarray = None):
+        """The fields of a device as lists, to save as JSON, with :code:`None` for the missing values. The format of
+        the legacy :code:`consolidate_list_of_dict(samples, depth=2)[gpu_id, gpu_instance_id]`, without the labels.
+        See :meth:`view` for the :code:`mask`.
+        """
+        with self._lock:
+            fields = dict()
+            for field, column in self._columns[gpu_id, gpu_instance_id].items():
+                values = self._slice(column) if mask is None else self._slice(column)[mask]
+                if np.isnan(values).any():
+                    fields[field] = [None if np.isnan(value) else value for value in values.tolist()]
+                else:
+                    fields[field] = values.tolist()
+            return fields
+
+    def samples(self):
+        """The samples in the parser format (a dict per sample), e.g., for the code using the legacy
+        :code:`gpu_metrics_list`. Slow for long runs, prefer :meth:`view`.
+        """
+        with self._lock:
+            columns = {
+                device: {field: self._slice(column).tolist() for field, column in fields.items()}
+                for device, fields in self._columns.items()
+            }
+            samples = list()
+            for i in range(self._size):
+                sample = dict()
+                for device, fields in columns.items():
+                    if device is None:
+                        continue
+                    values = {field: values[i] for field, values in fields.items() if not np.isnan(values[i])}
+                    if values:
+                        sample[device] = {'labels': self._labels[device], **values}
+                sample.update({field: values[i] for field, values in columns[None].items() if not np.isnan(values[i])})
+                samples.append(sample)
+            return samples
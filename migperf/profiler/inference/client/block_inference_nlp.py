@@ -10,40 +10,62 @@ import json
 import os
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from copy import deepcopy
+from copy import copy
 from datetime import datetime
 from pathlib import Path
 
-import numpy as np
 import torch.cuda
 from tqdm import trange
 
-from migperf.dcgm_exporter import DCGMMetricCollector
-from migperf.profiler.utils.misc import consolidate_list_of_dict, get_gpu_device_uuid, get_ids_from_mig_device_id
+from migperf.dcgm_exporter import DCGMMetricCollector, HostMetricCollector
+from migperf.profiler.utils.misc import get_gpu_device_uuid, get_ids_from_mig_device_id
 from migperf.profiler.utils.model_hub import load_pytorch_model
 from migperf.profiler.utils.pipeline_manager import PreProcessor
+from migperf.profiler.utils.result_cache import ResultCache, client_run_config
+from migperf.profiler.utils.sink import sink_from_env
+from migperf.profiler.utils.sketch import AggregatorGroup, progress_from_env
+from migperf.profiler.utils.stats import AdaptiveStopping, flat_summary, parse_targets
 
 TEXT_DATA = 'Material confined likewise it humanity raillery an unpacked as he Three ' \
             'chief merit no if. Now how her edward engage not horses Oh resolution he ' \
             'dissimilar precaution to comparison an Matters engaged between'
 latency_list = list()
+# online aggregates of the running test
+aggregators = AggregatorGroup()
+# adaptive stopping of the running test, None for a fixed number of batches
+stopping = None
+# stream of the latencies to disk for soak tests, None if MIGPERF_METRIC_SINK is unset
+latency_sink = None
 start_time = 0
 finish_time = 0
 
 
 def get_args():
     parser = argparse.ArgumentParser(description='Blocked model inference')
-    parser.add_argument('-b', '--bs', help='frontend batch size', type=int, required=True)
+    parser.add_argument('-b', '--bs', help='frontend batch size. Several batch sizes are tested one after another '
+                        'with the same loaded model.', type=int, nargs='+', required=True)
     parser.add_argument('-m', '--model', type=str, required=True,
                         help='Name of the used models. For example, bert-base-cased.')
     parser.add_argument('-T', '--task', type=str, default='sequence_classification',
                         help='The service name you are testing. Default to image_classification.')
-    parser.add_argument('-n', '--num_batches', type=int, required=True, help='Total number of batches to test.')
+    parser.add_argument('-n', '--num_batches', type=int, required=True,
+                        help='Total number of batches to test per thread, the maximum with --adaptive.')
     parser.add_argument('--data', type=str, default=TEXT_DATA,
                         help=f'The path to your testing image. Default to {TEXT_DATA}')
     parser.add_argument('-t', '--num_threads', type=int, default=1,
                         help='number of threads to run concurrently to profile')
     parser.add_argument('--seq_len', type=int, default=64, help='Sequence length of the text to be tested.')
+    # adaptive measurement
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Stop as soon as the confidence intervals of the latency statistics are narrower than '
+                             'the targets.')
+    parser.add_argument('--target', type=str, nargs='+', default=['mean=0.02', 'p95=0.05', 'p99=0.05'],
+                        help='Target relative half-width of the confidence interval per statistic with --adaptive. '
+                             'Default to mean=0.02 p95=0.05 p99=0.05.')
+    parser.add_argument('--min-num-batches', type=int, default=100,
+                        help='Minimum total number of batches to test with --adaptive. Default to 100.')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the intervals with --adaptive. Default to 0.95.')
     # GPU related arguments
     parser.add_argument(
         '-i', '--gpu-id', type=int, default=0,
@@ -60,6 +82,7 @@ def get_args():
                         help='The suffix of the record saving file name')
     parser.add_argument('--dry-run', action='store_true', help='Dry running the experiment without save result.')
     args = parser.parse_args()
+    args.target = parse_targets(args.target)
     args.device_uuid = get_gpu_device_uuid(args.gpu_id, args.mig_device_id)
     assert args.device_uuid is not None, \
         f'Cannot find device UUID of GPU ID: {args.gpu_id}, MIG Device ID: {args.mig_device_id}'
@@ -82,12 +105,16 @@ def warm_up(args):
 
 def test_block_inference(args):
     """Run inference test"""
-    global start_time, finish_time
+    global start_time, finish_time, stopping
     preporcessor = PreProcessor.get_preprocessor(
         task=args.task, model_name=args.model, padding="max_length", max_length=args.seq_len
     )
     text_tensor = preporcessor([args.data] * args.bs).cuda()
 
+    stopping = AdaptiveStopping(
+        args.target, min(args.min_num_batches, args.num_batches * args.num_threads),
+        args.num_batches * args.num_threads, confidence=args.confidence, keep_samples=latency_sink is None,
+    ) if args.adaptive else None
     start_time = time.time()
     
     results = set()
@@ -103,49 +130,75 @@ def test_block_inference(args):
 
 def sender(tensor, num_batches):
     for _ in trange(num_batches):
+        if stopping is not None and stopping.stopped:
+            break
         start = time.time()
         model(tensor)
         torch.cuda.synchronize()
-        latency_list.append(time.time() - start)
+        latency = time.time() - start
+        aggregators.add('latency', latency)
+        if latency_sink is not None:
+            latency_sink.append({'time': start, 'latency': latency})
+        else:
+            latency_list.append(latency)
+        if stopping is not None:
+            stopping.add(latency)
 
 
 def process_result(args):
-    timing_metric_aggr_result_dict = dict()
-
-    mean = np.mean(latency_list)
-    std = np.std(latency_list)
-    p50 = np.percentile(latency_list, 50)
-    p95 = np.percentile(latency_list, 95)
-    p99 = np.percentile(latency_list, 99)
-
-    timing_metric_aggr_result_dict['latency_mean'] = mean
-    timing_metric_aggr_result_dict['latency_std'] = std
-    timing_metric_aggr_result_dict['latency_p50'] = p50
-    timing_metric_aggr_result_dict['latency_p95'] = p95
-    timing_metric_aggr_result_dict['latency_p99'] = p99
+    num_latencies = aggregators['latency'].stats.count
+    if latency_sink is None:
+        # exact statistics of the raw latencies, the sketches are for the progress reports and merging results
+        timing_metric_aggr_result_dict = flat_summary({'latency': latency_list})
+    else:
+        # the latencies are only in the sink
+        timing_metric_aggr_result_dict = aggregators.flat_summary(['latency'])
 
     # report
     result = {
         'test_time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), 'start_time': start_time,
-        'num_test_batches': args.num_batches, 'batch_size': args.bs, 
+        'num_test_batches': num_latencies // args.num_threads, 'batch_size': args.bs, 
         'num_threads': args.num_threads, 'sequence_length': args.seq_len, 
         'model_name': args.model, 'task': args.task,
-        'qps': args.num_batches * args.bs / (finish_time - start_time),
-        'latency': latency_list,
+        'qps': num_latencies * args.bs / (finish_time - start_time), 'sketches': aggregators.to_dict(),
     }
+    if latency_sink is None:
+        result['latency'] = latency_list
+    else:
+        result['latency_sink'] = str(latency_sink.directory)
+    if stopping is not None:
+        result['convergence'] = stopping.summary()
 
     result.update(timing_metric_aggr_result_dict)
-    gpu_metrics_list = deepcopy(dcgm_metrics_collector.gpu_metrics_list)
-    gpu_metrics_dict = consolidate_list_of_dict(gpu_metrics_list, depth=2)
+    store = dcgm_metrics_collector.store
     # gpu_label_example = {
     #     'gpu': '0', 'UUID': 'GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f', 'device': 'nvidia0',
     #     'modelName': 'NVIDIA A30', 'Hostname': '2e140b568f0c',
     #     'GPU_I_PROFILE': '4g.24gb', 'GPU_I_ID': '0',
     # }
-    gpu_labels: dict = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id].pop('labels')[0]
-    result['metrics'] = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]
-    # patch GPU metrics back
-    gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]['labels'] = [gpu_labels]
+    gpu_labels: dict = store.labels(args.gpu_id, args.gpu_instance_id)
+    if dcgm_metrics_collector.sink is None:
+        # only the samples of the measurement, without the warm-up and the result processing
+        result['metrics'] = store.to_dict(
+            args.gpu_id, args.gpu_instance_id, mask=dcgm_metrics_collector.phase_mask('measure'),
+        )
+    else:
+        # the store only holds the latest samples, all of them are in the sink
+        result['metrics_sink'] = str(dcgm_metrics_collector.sink.directory)
+    result['phase_metrics'] = dcgm_metrics_collector.phase_stats(args.gpu_id, args.gpu_instance_id)
+    result['dcgm_sampling'] = dcgm_metrics_collector.stats()
+    # the host side of the measurement, e.g., the client is host-bound if its CPU saturates
+    if host_metrics_collector.sink is None:
+        host_mask = host_metrics_collector.phase_mask('measure')
+        result['host_metrics'] = {
+            device: host_metrics_collector.store.to_dict(device, mask=host_mask) for device in ('process', 'host')
+        }
+    else:
+        result['host_metrics_sink'] = str(host_metrics_collector.sink.directory)
+    result['host_phase_metrics'] = {
+        device: host_metrics_collector.phase_stats(device) for device in ('process', 'host')
+    }
+    result['host_sampling'] = host_metrics_collector.stats()
 
     # export config
     config = {
@@ -160,9 +213,9 @@ def process_result(args):
     # if MIG is enabled, also obtain sibling GPU instance profile
     if config['mig']['enabled']:
         gpu_instance_profiles = list()
-        for k, v in gpu_metrics_dict.items():
-            if k[0] == args.gpu_id:
-                gpu_instance_profiles.append(v['labels'][0]['GPU_I_PROFILE'])
+        for gpu_id, gpu_instance_id in store.devices():
+            if gpu_id == args.gpu_id:
+                gpu_instance_profiles.append(store.labels(gpu_id, gpu_instance_id)['GPU_I_PROFILE'])
         config['mig']['gpu_instance_profiles'] = gpu_instance_profiles
     result['gpu_model_name'] = config['gpu_static_profile']['modelName']
     result['config'] = config
@@ -174,38 +227,80 @@ if __name__ == '__main__':
     # Mask out other cuda devices
     os.environ['CUDA_DEVICE_ORDER'] = "PCI_BUS_ID"
     os.environ['CUDA_VISIBLE_DEVICES'] = args_.device_uuid
-    dcgm_metrics_collector = DCGMMetricCollector()
 
     print('Testing on:')
     print(f'num of test batches: {args_.num_batches};')
-    print(f'batch size: {args_.bs};', f'model name: {args_.model}')
+    print(f'batch sizes: {args_.bs};', f'model name: {args_.model}')
+
+    # skip the batch sizes measured before, the model is not even loaded if all of them are cached
+    result_cache_ = ResultCache.from_env()
+    if result_cache_ is not None and not args_.dry_run:
+        for batch_size_ in list(args_.bs):
+            if result_cache_.restore(client_run_config(args_, bs=batch_size_), args_.database_name) is not None:
+                print(f'Batch size {batch_size_} result restored from cache {result_cache_.root}')
+                args_.bs.remove(batch_size_)
+        if not args_.bs:
+            exit(0)
 
     print(f'Load {args_.model} model...')
     model = load_pytorch_model(model_name=args_.model).cuda()
-    print('Warming up...')
-    warm_up(args_)
-    print('Testing...')
-    dcgm_metrics_collector.start()
-    test_block_inference(args_)
-    print('Finish')
-    metrics = process_result(args_)
-    dcgm_metrics_collector.stop()
-    # save the experiment records to the database and print to the console.
-    if args_.dry_run:
-        print('Dry running, result will not dumped')
-        exit(0)
-
-    save_json_file_name = Path(
-        args_.database_name) / (
-                                  '_'.join([
-                                      metrics['gpu_model_name'].replace(' ', '-'),
-                                      metrics["model_name"], 
-                                      f'bs{metrics["batch_size"]}',
-                                      f'seq{metrics["sequence_length"]}',
-                                      f'j{metrics["num_threads"]}',
-                                  ]) + f'.json'
-                          )
-    save_json_file_name.parent.mkdir(exist_ok=True, parents=True)
-    with open(save_json_file_name, 'w') as f:
-        json.dump(metrics, f)
-        print(f'result saved successfully as {save_json_file_name}')
+    # keep the model loaded across the batch sizes
+    for batch_size_ in args_.bs:
+        print(f'Batch size {batch_size_}')
+        run_args_ = copy(args_)
+        run_args_.bs = batch_size_
+        latency_list.clear()
+        aggregators = AggregatorGroup()
+        latency_sink = sink_from_env(f'latency-bs{batch_size_}')
+        dcgm_metrics_collector = DCGMMetricCollector()
+        host_metrics_collector = HostMetricCollector()
+        progress = progress_from_env(
+            lambda: {
+                'client': aggregators.summary(), 'dcgm': dcgm_metrics_collector.aggregators.summary(),
+                'host': host_metrics_collector.aggregators.summary(),
+            }
+        )
+        dcgm_metrics_collector.start()
+        host_metrics_collector.start()
+        dcgm_metrics_collector.mark('warmup')
+        host_metrics_collector.mark('warmup')
+        print('Warming up...')
+        warm_up(run_args_)
+        print('Testing...')
+        dcgm_metrics_collector.mark('measure')
+        host_metrics_collector.mark('measure')
+        if progress is not None:
+            progress.start()
+        test_block_inference(run_args_)
+        if progress is not None:
+            progress.stop()
+        dcgm_metrics_collector.mark('teardown')
+        host_metrics_collector.mark('teardown')
+        print('Finish')
+        # stop sampling first, so that the phase masks stay aligned with the stored samples
+        dcgm_metrics_collector.stop()
+        host_metrics_collector.stop()
+        metrics = process_result(run_args_)
+        if latency_sink is not None:
+            latency_sink.close()
+        # save the experiment records to the database and print to the console.
+        if run_args_.dry_run:
+            print('Dry running, result will not dumped')
+            continue
+
+        save_json_file_name = Path(
+            run_args_.database_name) / (
+                                      '_'.join([
+                                          metrics['gpu_model_name'].replace(' ', '-'),
+                                          metrics["model_name"], 
+                                          f'bs{metrics["batch_size"]}',
+                                          f'seq{metrics["sequence_length"]}',
+                                          f'j{metrics["num_threads"]}',
+                                      ]) + f'.json'
+                              )
+        save_json_file_name.parent.mkdir(exist_ok=True, parents=True)
+        with open(save_json_file_name, 'w') as f:
+            json.dump(metrics, f)
+            print(f'result saved successfully as {save_json_file_name}')
+        if result_cache_ is not None:
+            result_cache_.put(client_run_config(run_args_), {save_json_file_name.name: metrics})
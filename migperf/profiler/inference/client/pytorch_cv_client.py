@@ -51,7 +51,6 @@ import json
 import time
 from collections import defaultdict
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 
@@ -59,10 +58,12 @@ import numpy as np
 import requests
 from tqdm import tqdm
 
-from migperf.dcgm_exporter import DCGMMetricCollector
+from migperf.dcgm_exporter import DCGMMetricCollector, HostMetricCollector
 from generator import WorkloadGenerator
-from migperf.profiler.utils.misc import consolidate_list_of_dict
 from migperf.profiler.utils.request import make_restful_request_from_numpy
+from migperf.profiler.utils.sink import sink_from_env
+from migperf.profiler.utils.sketch import AggregatorGroup, progress_from_env
+from migperf.profiler.utils.stats import AdaptiveStopping, flat_summary, parse_targets
 # from utils.logger import Printer
 from migperf.profiler.utils.pipeline_manager import PreProcessor
 
@@ -72,6 +73,12 @@ start_time = 0
 request_num = 0
 
 results = set()
+# online aggregates of the request timings
+aggregators = AggregatorGroup()
+# adaptive stopping of the running test, None for the full testing duration
+stopping = None
+# stream of the latencies to disk for soak tests, None if MIGPERF_METRIC_SINK is unset
+latency_sink = None
 
 send_time_list = []
 
@@ -91,10 +98,22 @@ def get_args():
     parser.add_argument('--report-suffix', type=str, default='',
                         help='Suffix to the database name the record data saved.')
     parser.add_argument('-r', '--rate', help='The arrival rate. Default to 5.', type=float, default=5)
-    parser.add_argument('-t', '--time', help='The testing duration. Default to 30.', type=float, default=30)
+    parser.add_argument('-t', '--time', help='The testing duration, the maximum with --adaptive. Default to 30.',
+                        type=float, default=30)
     parser.add_argument('--data', type=str, default=DATA_PATH,
                         help=f'The path to your testing image. Default to {DATA_PATH}')
     parser.add_argument('-P', '--preprocessing', action='store_true', help='Use client preprocessing.')
+    # adaptive measurement
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Stop sending as soon as the confidence intervals of the latency statistics are narrower '
+                             'than the targets.')
+    parser.add_argument('--target', type=str, nargs='+', default=['mean=0.02', 'p95=0.05', 'p99=0.05'],
+                        help='Target relative half-width of the confidence interval per statistic with --adaptive. '
+                             'Default to mean=0.02 p95=0.05 p99=0.05.')
+    parser.add_argument('--min-requests', type=int, default=100,
+                        help='Minimum number of requests to test with --adaptive. Default to 100.')
+    parser.add_argument('--confidence', type=float, default=0.95,
+                        help='Confidence level of the intervals with --adaptive. Default to 0.95.')
     # GPU related arguments
     parser.add_argument('-i', '--gpu-id', type=int, default=0, help='GPU ID. Default to 0.')
     parser.add_argument(
@@ -103,7 +122,9 @@ def get_args():
     )
     # experiment settings
     parser.add_argument('--dry-run', action='store_true', help='Dry running the experiment without save result.')
-    return parser.parse_args()
+    args = parser.parse_args()
+    args.target = parse_targets(args.target)
+    return args
 
 
 def sender(url, request):
@@ -148,7 +169,7 @@ def send_stress_test_data(args):
     """
     send stress testing data.
     """
-    global start_time, request_num, send_time_list
+    global start_time, request_num, send_time_list, stopping
 
     arrival_rate = args.rate
     duration = args.time
@@ -167,15 +188,45 @@ def send_stress_test_data(args):
     # cut list to a multiple of <BATCH_SIZE>, so that the light-weight system can do full batch prediction
     request_num = len(send_time_list) // args.bs * args.bs
     print(f'Generating {request_num} exadmples')
+    if args.adaptive:
+        stopping = AdaptiveStopping(
+            args.target, min(args.min_requests, request_num), request_num, confidence=args.confidence,
+            keep_samples=latency_sink is None,
+        )
 
     start_time = time.time()
 
+    # the responses streamed to the sink are released from the results, so count the requests on the side
+    num_sent = 0
     with ThreadPoolExecutor(10) as executor:
         for arrive_time in tqdm(send_time_list[:request_num]):
-            results.add(executor.submit(sender, url, request))
+            if stopping is not None and stopping.stopped:
+                # the arrival process is cut, keep a full last batch for the light-weight system
+                request_num = -(-num_sent // args.bs) * args.bs
+                for _ in range(request_num - num_sent):
+                    future = executor.submit(sender, url, request)
+                    results.add(future)
+                    future.add_done_callback(_add_latency)
+                break
+            future = executor.submit(sender, url, request)
+            results.add(future)
+            future.add_done_callback(_add_latency)
+            num_sent += 1
             time.sleep(max(arrive_time + start_time - time.time(), 0))
 
 
+def _add_latency(future):
+    if future.exception() is None:
+        times = future.result()['times']
+        aggregators.add_row(times)
+        if stopping is not None:
+            stopping.add(times['latency'])
+        if latency_sink is not None:
+            latency_sink.append({'time': time.time(), **times})
+            # the timings are in the sink, only the failed requests are kept to be counted
+            results.discard(future)
+
+
 def process_result(args):
     timing_metric_names = [
         'latency', 'client_server_rtt',  # 'batching_time',
@@ -184,7 +235,6 @@ def process_result(args):
     if not args.preprocessing:
         timing_metric_names.append('preprocessing_time')
     timing_metric_raw_result_dict = defaultdict(list)
-    timing_metric_aggr_result_dict = dict()
 
     raw_result = list()
     fail_count = 0
@@ -199,22 +249,17 @@ def process_result(args):
 
     finish_time = time.time()
 
-    for result in raw_result:
-        for metric_name in timing_metric_names:
-            timing_metric_raw_result_dict[metric_name].append(result[metric_name])
-
-    for metric_name, raw_result in timing_metric_raw_result_dict.items():
-        mean = np.mean(raw_result)
-        std = np.std(raw_result)
-        p50 = np.percentile(raw_result, 50)
-        p95 = np.percentile(raw_result, 95)
-        p99 = np.percentile(raw_result, 99)
-
-        timing_metric_aggr_result_dict[metric_name + '_mean'] = mean
-        timing_metric_aggr_result_dict[metric_name + '_std'] = std
-        timing_metric_aggr_result_dict[metric_name + '_p50'] = p50
-        timing_metric_aggr_result_dict[metric_name + '_p95'] = p95
-        timing_metric_aggr_result_dict[metric_name + '_p99'] = p99
+    if latency_sink is None:
+        for result in raw_result:
+            for metric_name in timing_metric_names:
+                timing_metric_raw_result_dict[metric_name].append(result[metric_name])
+        # exact statistics of the raw timings, the sketches are for the progress reports and merging results
+        timing_metric_aggr_result_dict = flat_summary(
+            {metric_name: timing_metric_raw_result_dict[metric_name] for metric_name in timing_metric_names}
+        )
+    else:
+        # the timings are only in the sink
+        timing_metric_aggr_result_dict = aggregators.flat_summary(timing_metric_names)
 
     # report
     print(f'Failing test number: {fail_count}')
@@ -225,20 +270,44 @@ def process_result(args):
         'batch_size': args.bs, 'time_list': send_time_list,
         'model_name': args.model, 'task': args.task,
         'fail_count': fail_count, 'qps': request_num / (finish_time - start_time),
-        'client_preprocessing': args.preprocessing,
+        'client_preprocessing': args.preprocessing, 'sketches': aggregators.to_dict(),
     }
+    if stopping is not None:
+        result['convergence'] = stopping.summary()
+    if latency_sink is not None:
+        result['latency_sink'] = str(latency_sink.directory)
 
     result.update(timing_metric_raw_result_dict)
     result.update(timing_metric_aggr_result_dict)
-    gpu_metrics_list = deepcopy(dcgm_metrics_collector.gpu_metrics_list)
-    gpu_metrics_dict = consolidate_list_of_dict(gpu_metrics_list, depth=2)
+    store = dcgm_metrics_collector.store
     # gpu_label_example = {
     #     'gpu': '0', 'UUID': 'GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f', 'device': 'nvidia0',
     #     'modelName': 'NVIDIA A30', 'Hostname': '2e140b568f0c',
     #     'GPU_I_PROFILE': '4g.24gb', 'GPU_I_ID': '0',
     # }
-    gpu_labels: dict = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id].pop('labels')[0]
-    result['metrics'] = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]
+    gpu_labels: dict = store.labels(args.gpu_id, args.gpu_instance_id)
+    if dcgm_metrics_collector.sink is None:
+        # only the samples of the measurement, without the warm-up and the result processing
+        result['metrics'] = store.to_dict(
+            args.gpu_id, args.gpu_instance_id, mask=dcgm_metrics_collector.phase_mask('measure'),
+        )
+    else:
+        # the store only holds the latest samples, all of them are in the sink
+        result['metrics_sink'] = str(dcgm_metrics_collector.sink.directory)
+    result['phase_metrics'] = dcgm_metrics_collector.phase_stats(args.gpu_id, args.gpu_instance_id)
+    result['dcgm_sampling'] = dcgm_metrics_collector.stats()
+    # the host side of the measurement, e.g., the client is host-bound if its CPU saturates
+    if host_metrics_collector.sink is None:
+        host_mask = host_metrics_collector.phase_mask('measure')
+        result['host_metrics'] = {
+            device: host_metrics_collector.store.to_dict(device, mask=host_mask) for device in ('process', 'host')
+        }
+    else:
+        result['host_metrics_sink'] = str(host_metrics_collector.sink.directory)
+    result['host_phase_metrics'] = {
+        device: host_metrics_collector.phase_stats(device) for device in ('process', 'host')
+    }
+    result['host_sampling'] = host_metrics_collector.stats()
 
     # export config
     config = {
@@ -253,9 +322,9 @@ def process_result(args):
     # if MIG is enabled, also obtain sibling GPU instance profile
     if config['mig']['enabled']:
         gpu_instance_profiles = [config['mig']['gpu_instance_profile']]
-        for k, v in gpu_metrics_dict.items():
-            if k[0] == args.gpu_id and k[1] != args.gpu_instance_id:
-                gpu_instance_profiles.append(v['labels'][0]['GPU_I_PROFILE'])
+        for gpu_id, gpu_instance_id in store.devices():
+            if gpu_id == args.gpu_id and gpu_instance_id != args.gpu_instance_id:
+                gpu_instance_profiles.append(store.labels(gpu_id, gpu_instance_id)['GPU_I_PROFILE'])
         config['mig']['gpu_instance_profiles'] = gpu_instance_profiles
     result['gpu_model_name'] = config['gpu_static_profile']['modelName']
     result['config'] = config
@@ -265,20 +334,43 @@ def process_result(args):
 if __name__ == '__main__':
     args_ = get_args()
     dcgm_metrics_collector = DCGMMetricCollector()
+    host_metrics_collector = HostMetricCollector()
+    latency_sink = sink_from_env('latency')
+    progress = progress_from_env(
+        lambda: {
+            'client': aggregators.summary(), 'dcgm': dcgm_metrics_collector.aggregators.summary(),
+            'host': host_metrics_collector.aggregators.summary(),
+        }
+    )
 
     print('Testing on:')
     print(f'arrival rate: {args_.rate};', f'testing time: {args_.time};')
     print(f'batch size: {args_.bs};', f'model name: {args_.model}')
 
+    dcgm_metrics_collector.start()
+    host_metrics_collector.start()
+    dcgm_metrics_collector.mark('warmup')
+    host_metrics_collector.mark('warmup')
     print('Warming up...')
     warm_up(args_)
     print('Testing...')
-    dcgm_metrics_collector.start()
+    dcgm_metrics_collector.mark('measure')
+    host_metrics_collector.mark('measure')
+    if progress is not None:
+        progress.start()
     send_stress_test_data(args_)
+    if progress is not None:
+        progress.stop()
+    dcgm_metrics_collector.mark('teardown')
+    host_metrics_collector.mark('teardown')
     print('Finish')
 
-    metrics = process_result(args_)
+    # stop sampling first, so that the phase masks stay aligned with the stored samples
     dcgm_metrics_collector.stop()
+    host_metrics_collector.stop()
+    metrics = process_result(args_)
+    if latency_sink is not None:
+        latency_sink.close()
     # save the experiment records to the database and print to the console.
     # TODO: note that you need to change doc_name
     # Printer.add_record_to_database(metrics, db_name='ml_cloud_autoscaler',
@@ -10,24 +10,30 @@ import json
 import os
 import time
 from collections import defaultdict
-from copy import deepcopy
 from datetime import datetime
 from pathlib import Path
 
-import numpy as np
 import torch
 from torch import nn
 from torch.backends import cudnn
 from tqdm.auto import tqdm
 
-from migperf.dcgm_exporter import DCGMMetricCollector
+from migperf.dcgm_exporter import DCGMMetricCollector, HostMetricCollector
 from migperf.profiler.utils.data_hub import load_places365_data, DEFAULT_DATASET_ROOT
-from migperf.profiler.utils.misc import get_ids_from_mig_device_id, get_gpu_device_uuid, consolidate_list_of_dict
+from migperf.profiler.utils.misc import get_ids_from_mig_device_id, get_gpu_device_uuid
 from migperf.profiler.utils.model_hub import load_pytorch_model
+from migperf.profiler.utils.result_cache import ResultCache, client_run_config
+from migperf.profiler.utils.sink import sink_from_env
+from migperf.profiler.utils.sketch import AggregatorGroup, progress_from_env
+from migperf.profiler.utils.stats import flat_summary
 
 DATASET_PATH = str(DEFAULT_DATASET_ROOT / 'places365_standard')
 start_time = 0
 raw_results = list()
+# online aggregates of the step timings
+aggregators = AggregatorGroup()
+# stream of the step timings to disk for soak tests, None if MIGPERF_METRIC_SINK is unset
+step_sink = None
 
 
 def get_args():
@@ -102,12 +108,17 @@ def train_func(args):
         optimizer.step()
         torch.cuda.synchronize()
         step_end_time = backward_time = time.time()
-        raw_results.append({
+        step_times = {
             'step_latency': step_end_time - step_start_time,
             'data_process_time': data_process_time - step_start_time,
             'forward_time': forward_time - data_process_time,
             'backward_time': backward_time - forward_time,
-        })
+        }
+        aggregators.add_row(step_times)
+        if step_sink is not None:
+            step_sink.append({'time': step_end_time, **step_times})
+        else:
+            raw_results.append(step_times)
         step_start_time = step_end_time
 
 
@@ -117,48 +128,63 @@ def process_result(args):
         'forward_time', 'backward_time',
     ]
     timing_metric_raw_result_dict = defaultdict(list)
-    timing_metric_aggr_result_dict = dict()
 
     finish_time = time.time()
 
-    for result in raw_results:
-        for metric_name in timing_metric_names:
-            timing_metric_raw_result_dict[metric_name].append(result[metric_name])
-
-    for metric_name, raw_result in timing_metric_raw_result_dict.items():
-        mean = np.mean(raw_result)
-        std = np.std(raw_result)
-        p50 = np.percentile(raw_result, 50)
-        p95 = np.percentile(raw_result, 95)
-        p99 = np.percentile(raw_result, 99)
-
-        timing_metric_aggr_result_dict[metric_name + '_mean'] = mean
-        timing_metric_aggr_result_dict[metric_name + '_std'] = std
-        timing_metric_aggr_result_dict[metric_name + '_p50'] = p50
-        timing_metric_aggr_result_dict[metric_name + '_p95'] = p95
-        timing_metric_aggr_result_dict[metric_name + '_p99'] = p99
+    if step_sink is None:
+        for result in raw_results:
+            for metric_name in timing_metric_names:
+                timing_metric_raw_result_dict[metric_name].append(result[metric_name])
+        # exact statistics of the raw timings, the sketches are for the progress reports and merging results
+        timing_metric_aggr_result_dict = flat_summary(
+            {metric_name: timing_metric_raw_result_dict[metric_name] for metric_name in timing_metric_names}
+        )
+    else:
+        # the timings are only in the sink
+        timing_metric_aggr_result_dict = aggregators.flat_summary(timing_metric_names)
 
     result = {
         'test_time': datetime.now().strftime('%Y-%m-%d_%H-%M-%S'), 'start_time': start_time,
         'train_steps': args.max_train_steps, 'batch_size': args.bs, 'model_name': args.model,
         'task': args.task, 'learning_rate': args.lr, 'momentum': args.momentum,
-        'weight_decay': args.weight_decay,
+        'weight_decay': args.weight_decay, 'sketches': aggregators.to_dict(),
         'qps': args.max_train_steps * args.bs / (finish_time - start_time),
     }
 
+    if step_sink is not None:
+        result['step_sink'] = str(step_sink.directory)
+
     result.update(timing_metric_aggr_result_dict)
     result.update(timing_metric_raw_result_dict)
-    gpu_metrics_list = deepcopy(dcgm_metrics_collector.gpu_metrics_list)
-    gpu_metrics_dict = consolidate_list_of_dict(gpu_metrics_list, depth=2)
+    store = dcgm_metrics_collector.store
     # gpu_label_example = {
     #     'gpu': '0', 'UUID': 'GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f', 'device': 'nvidia0',
     #     'modelName': 'NVIDIA A30', 'Hostname': '2e140b568f0c',
     #     'GPU_I_PROFILE': '4g.24gb', 'GPU_I_ID': '0',
     # }
-    gpu_labels: dict = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id].pop('labels')[0]
-    result['metrics'] = gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]
-    # patch GPU metrics back
-    gpu_metrics_dict[args.gpu_id, args.gpu_instance_id]['labels'] = [gpu_labels]
+    gpu_labels: dict = store.labels(args.gpu_id, args.gpu_instance_id)
+    if dcgm_metrics_collector.sink is None:
+        # only the samples of the measurement, without the warm-up and the result processing
+        result['metrics'] = store.to_dict(
+            args.gpu_id, args.gpu_instance_id, mask=dcgm_metrics_collector.phase_mask('measure'),
+        )
+    else:
+        # the store only holds the latest samples, all of them are in the sink
+        result['metrics_sink'] = str(dcgm_metrics_collector.sink.directory)
+    result['phase_metrics'] = dcgm_metrics_collector.phase_stats(args.gpu_id, args.gpu_instance_id)
+    result['dcgm_sampling'] = dcgm_metrics_collector.stats()
+    # the host side of the measurement, e.g., the client is host-bound if its CPU saturates
+    if host_metrics_collector.sink is None:
+        host_mask = host_metrics_collector.phase_mask('measure')
+        result['host_metrics'] = {
+            device: host_metrics_collector.store.to_dict(device, mask=host_mask) for device in ('process', 'host')
+        }
+    else:
+        result['host_metrics_sink'] = str(host_metrics_collector.sink.directory)
+    result['host_phase_metrics'] = {
+        device: host_metrics_collector.phase_stats(device) for device in ('process', 'host')
+    }
+    result['host_sampling'] = host_metrics_collector.stats()
 
     # export config
     config = {
@@ -173,9 +199,9 @@ def process_result(args):
     # if MIG is enabled, also obtain sibling GPU instance profile
     if config['mig']['enabled']:
         gpu_instance_profiles = list()
-        for k, v in gpu_metrics_dict.items():
-            if k[0] == args.gpu_id:
-                gpu_instance_profiles.append(v['labels'][0]['GPU_I_PROFILE'])
+        for gpu_id, gpu_instance_id in store.devices():
+            if gpu_id == args.gpu_id:
+                gpu_instance_profiles.append(store.labels(gpu_id, gpu_instance_id)['GPU_I_PROFILE'])
         config['mig']['gpu_instance_profiles'] = gpu_instance_profiles
     result['gpu_model_name'] = config['gpu_static_profile']['modelName']
     result['config'] = config
@@ -189,11 +215,25 @@ if __name__ == '__main__':
     os.environ['CUDA_VISIBLE_DEVICES'] = args_.device_uuid
     cudnn.benchmark = True
     dcgm_metrics_collector = DCGMMetricCollector()
+    host_metrics_collector = HostMetricCollector()
+    step_sink = sink_from_env('step')
+    progress = progress_from_env(
+        lambda: {
+            'client': aggregators.summary(), 'dcgm': dcgm_metrics_collector.aggregators.summary(),
+            'host': host_metrics_collector.aggregators.summary(),
+        }
+    )
 
     print('Testing on:')
     print(f'num of test training steps: {args_.max_train_steps};')
     print(f'batch size: {args_.bs};', f'model name: {args_.model}')
 
+    result_cache_ = ResultCache.from_env()
+    if result_cache_ is not None and not args_.dry_run:
+        if result_cache_.restore(client_run_config(args_), args_.database_name) is not None:
+            print(f'Result restored from cache {result_cache_.root}')
+            exit(0)
+
     print('Prepare dataset...')
     train_dataloader, val_dataloader = load_places365_data(batch_size=args_.bs)
 
@@ -208,14 +248,29 @@ if __name__ == '__main__':
     print('Setup loss function')
     criterion = nn.CrossEntropyLoss().cuda()
 
+    dcgm_metrics_collector.start()
+    host_metrics_collector.start()
+    dcgm_metrics_collector.mark('warmup')
+    host_metrics_collector.mark('warmup')
     print('Warming up...')
     warm_up(args_)
     print('Training...')
-    dcgm_metrics_collector.start()
+    dcgm_metrics_collector.mark('measure')
+    host_metrics_collector.mark('measure')
+    if progress is not None:
+        progress.start()
     train_func(args_)
+    if progress is not None:
+        progress.stop()
+    dcgm_metrics_collector.mark('teardown')
+    host_metrics_collector.mark('teardown')
     print('Finish')
-    metrics = process_result(args_)
+    # stop sampling first, so that the phase masks stay aligned with the stored samples
     dcgm_metrics_collector.stop()
+    host_metrics_collector.stop()
+    metrics = process_result(args_)
+    if step_sink is not None:
+        step_sink.close()
     # save the experiment records to the database and print to the console.
     if args_.dry_run:
         print('Dry running, result will not dumped')
@@ -235,3 +290,5 @@ if __name__ == '__main__':
     with open(save_json_file_name, 'w') as f:
         json.dump(metrics, f)
         print(f'result saved successfully as {save_json_file_name}')
+    if result_cache_ is not None:
+        result_cache_.put(client_run_config(args_), {save_json_file_name.name: metrics})
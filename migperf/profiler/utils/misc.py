@@ -6,8 +6,11 @@ Email: yli056@e.ntu.edu.sg
 Date: 11/3/2020
 """
 import re
-import subprocess
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    # the controller package is only imported by the functions querying the devices
+    from migperf.controller.backend import MIGBackend
 
 
 def camelcase_to_snakecase(camel_str):
@@ -32,52 +35,33 @@ def consolidate_list_of_dict(l: list, depth=-1):
     return d
 
 
-def get_gpu_device_uuid(gpu_id: int, gpu_mig_device_id: Optional[int] = None):
-    """nvidia-smi -L"""
-    p = subprocess.Popen(['nvidia-smi', '-L'], stdout=subprocess.PIPE)
-    output, err = p.communicate()
-    gpu_list_str = output.decode()
+def get_gpu_device_uuid(gpu_id: int, gpu_mig_device_id: Optional[int] = None, backend: 'MIGBackend' = None):
+    """Get the UUID of a GPU, or of a MIG device on the GPU if :code:`gpu_mig_device_id` is given.
+    Equivalent to look up the output of :code:`nvidia-smi -L`.
+    E.g.:
+        GPU 0: NVIDIA A30 (UUID: GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f)
+          MIG 1g.6gb      Device  1: (UUID: MIG-6dd9381e-80bd-5581-9702-563ef12adf3a)
+    The lookup is served from the device inventory shared by the backend.
+
+    Returns:
+        The device UUID, or :code:`None` if the device is not found.
+    """
+    from migperf.controller.inventory import get_device_inventory
 
-    current_gpu_id = None
-    for line in gpu_list_str.splitlines():
-        # check if the line contains the GPU information.
-        # E.g.: GPU 0: NVIDIA A30 (UUID: GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f)
-        match = re.match(r'GPU\s+(\d+)', line)
-        if match:
-            # Found GPU ID line
-            current_gpu_id = int(match.group(1))
-            # start from this line, all information is about this GPU ID
-            if gpu_mig_device_id is None:
-                # Return current GPU UUID
-                return line.split('UUID:')[1].strip().rstrip(')')
-        elif current_gpu_id == gpu_id:
-            # check if the line contains the MIG UUID we cared about
-            # E.g.,   MIG 1g.6gb      Device  1: (UUID: MIG-6dd9381e-80bd-5581-9702-563ef12adf3a)
-            match = re.match(rf'.*Device\s+{gpu_mig_device_id}', line)
-            if match:
-                # Found MIG Device ID line
-                return line.split('UUID:')[1].strip().rstrip(')')
-    # not found
-    return None
+    return get_device_inventory(backend).get_device_uuid(gpu_id, gpu_mig_device_id)
 
 
-def get_ids_from_mig_device_id(gpu_id: int, mig_device_id: int):
-    """nvidia-smi -i ${GPU_ID} |
+def get_ids_from_mig_device_id(gpu_id: int, mig_device_id: int, backend: 'MIGBackend' = None):
+    r"""Look up the GI ID and CI ID of a MIG device. Equivalent to
+    nvidia-smi -i ${GPU_ID} |
       grep -Pzo "\|\s+${GPU_ID}\s+(\d+)\s+(\d+)\s+${MIG_DEVICE_ID}"
 
     Returns:
         A tuple of GPU instance ID (GI ID) and Compute instance ID (CI ID)
     """
-    p = subprocess.Popen(['nvidia-smi', '-i', str(gpu_id)], stdout=subprocess.PIPE)
-    output, err = p.communicate()
-    gpu_list_str = output.decode()
+    from migperf.controller.inventory import get_device_inventory
 
-    for line in gpu_list_str.splitlines():
-        match = re.match(rf'\|\s+{gpu_id}\s+(\d+)\s+(\d+)\s+{mig_device_id}', line)
-        if match:
-            # Found GPU ID line
-            gpu_instance_id = int(match.group(1))
-            compute_instance_id = int(match.group(2))
-            # start from this line, all information is about this GPU ID
-            return gpu_instance_id, compute_instance_id
-    return None, None
+    mig_device = get_device_inventory(backend).get_mig_device(gpu_id, mig_device_id)
+    if mig_device is None:
+        return None, None
+    return mig_device['gi_id'], mig_device['ci_id']
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of the profiling results, so that an interrupted sweep resumes instead of re-measuring.
+
+A result is keyed by the SHA-256 of the canonical JSON of its full run configuration: the client arguments (or the
+job configuration), the GPU model, the MIG profile of the device, the layout of its sibling GPU instances, the MPS
+share and the software versions. Any change to them is a cache miss, e.g., upgrading PyTorch re-measures
+everything. An entry stores the result files of the run, which are restored into the result directory on a hit.
+
+The cache is configured by the environment, so that the runner and the client processes it launches share it:
+
+- :code:`MIGPERF_RESULT_CACHE`: The cache directory. The cache is disabled if unset.
+- :code:`MIGPERF_RESULT_CACHE_POLICY`: :code:`use` (default) reuses the cached results, :code:`refresh` re-runs
+  and overwrites them, :code:`off` neither reads nor writes the cache.
+- :code:`MIGPERF_RESULT_CACHE_MAX_AGE`: Seconds after which an entry is stale and re-run. Default to no limit.
+"""
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+import platform
+import tempfile
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterator, Optional
+
+if TYPE_CHECKING:
+    # the controller package is only imported by the functions querying the devices
+    from migperf.controller.inventory import DeviceInventory
+
+CACHE_POLICIES = ('use', 'refresh', 'off')
+# Packages whose version is part of the run configuration
+VERSIONED_PACKAGES = ('numpy', 'torch', 'torchvision', 'transformers')
+# Client arguments that do not change the result: output settings and IDs that change when the GPU is
+# repartitioned
+VOLATILE_CLIENT_ARGS = (
+    'database_name', 'dry_run', 'device_uuid', 'gpu_id', 'mig_device_id', 'gpu_instance_id', 'compute_instance_id',
+)
+
+
+@functools.lru_cache()
+def software_versions():
+    """Versions of Python and of the :data:`VERSIONED_PACKAGES` (:code:`None` if not installed)."""
+    versions = {'python': platform.python_version()}
+    for package in VERSIONED_PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def device_context(
+        gpu_id: int, mig_device_id: Optional[int] = None, inventory: 'DeviceInventory' = None, env: dict = None,
+):
+    """The device part of a run configuration.
+
+    Args:
+        gpu_id (int): GPU ID.
+        mig_device_id (int, optional): MIG device ID. Default to the whole GPU.
+        inventory (DeviceInventory, optional): Default to the inventory of the default backend.
+        env (dict, optional): Environment of the run. Default to :code:`os.environ`.
+
+    Returns:
+        dict: :code:`gpu_model`, :code:`mig_profile` (of the compute instance, :code:`None` for a whole GPU),
+            :code:`sibling_layout` (sorted GI profiles of the GPU, :code:`None` for a whole GPU) and :code:`mps`
+            (the MPS client limits set in the environment).
+    """
+    from migperf.controller.inventory import get_device_inventory
+    from migperf.controller.layout import normalize_profile_name
+
+    inventory = inventory or get_device_inventory()
+    env = os.environ if env is None else env
+    gpu = inventory.get_gpu(gpu_id)
+    context = {
+        'gpu_model': gpu['name'] if gpu is not None else None, 'mig_profile': None, 'sibling_layout': None,
+        'mps': {
+            name: env[name] for name in ('CUDA_MPS_ACTIVE_THREAD_PERCENTAGE', 'CUDA_MPS_PINNED_DEVICE_MEM_LIMIT')
+            if name in env
+        },
+    }
+    if mig_device_id is not None:
+        mig_device = inventory.get_mig_device(gpu_id, mig_device_id)
+        if mig_device is not None:
+            context['mig_profile'] = mig_device['name'].split()[-1]
+            context['sibling_layout'] = ','.join(sorted(
+                str(normalize_profile_name(gi['name'])) for gi in inventory.gpu_instances(gpu_id)
+            ))
+    return context
+
+
+def client_run_config(args, **overrides):
+    """Run configuration of a profiling client from its parsed arguments, e.g., :code:`bs=8` for one batch size."""
+    client_args = {k: v for k, v in {**vars(args), **overrides}.items() if k not in VOLATILE_CLIENT_ARGS}
+    return {
+        'kind': 'client', 'client_args': client_args,
+        **device_context(args.gpu_id, getattr(args, 'mig_device_id', None)), 'software': software_versions(),
+    }
+
+
+def canonical_json(obj: Any):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str)
+
+
+def run_key(config: dict):
+    """SHA-256 of the canonical JSON of a run configuration."""
+    return hashlib.sha256(canonical_json(config).encode()).hexdigest()
+
+
+class ResultCache(object):
+    """Cache of result files, keyed by run configurations.
+
+    Args:
+        root (str): Cache directory.
+        policy (str, optional): One of :data:`CACHE_POLICIES`. Default to :code:`use`.
+        max_age (float, optional): Seconds after which an entry is stale. Default to no limit.
+
+    Examples:
+        >>> cache = ResultCache('~/.cache/migperf')
+        >>> config = {'model': 'resnet50', 'batch_size': 8, 'gpu_model': 'NVIDIA A30'}
+        >>> if cache.restore(config, 'results') is None:
+        ...     cache.put(config, {'result.json': run(config)})
+    """
+
+    def __init__(self, root: str, policy: str = 'use', max_age: float = None):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f'Unknown cache policy {policy}, expected one of {CACHE_POLICIES}')
+        self.root = Path(root).expanduser()
+        self.policy = policy
+        self.max_age = max_age
+
+    @classmethod
+    def from_env(cls):
+        """The cache configured by the environment, :code:`None` if disabled."""
+        root = os.environ.get('MIGPERF_RESULT_CACHE')
+        if not root:
+            return None
+        max_age = os.environ.get('MIGPERF_RESULT_CACHE_MAX_AGE')
+        return cls(
+            root, os.environ.get('MIGPERF_RESULT_CACHE_POLICY', 'use'), float(max_age) if max_age else None,
+        )
+
+    def env(self):
+        """Environment variables passing the cache to a child process, see :meth:`from_env`."""
+        env = {'MIGPERF_RESULT_CACHE': str(self.root), 'MIGPERF_RESULT_CACHE_POLICY': self.policy}
+        if self.max_age is not None:
+            env['MIGPERF_RESULT_CACHE_MAX_AGE'] = str(self.max_age)
+        return env
+
+    def _path(self, key: str):
+        return self.root / key[:2] / f'{key}.json'
+
+    def _load(self, path: Path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # missing, or partially written by an older version
+            return None
+
+    def get(self, config: dict):
+        """The cache entry of a run configuration, :code:`None` on a miss, a stale entry or if the policy does not
+        read the cache. An entry contains :code:`key`, :code:`config`, :code:`created` (Unix timestamp) and
+        :code:`files` (file name -> JSON content).
+        """
+        if self.policy != 'use':
+            return None
+        entry = self._load(self._path(run_key(config)))
+        if entry is None or entry.get('config') != json.loads(canonical_json(config)):
+            return None
+        if self.max_age is not None and time.time() - entry['created'] > self.max_age:
+            return None
+        return entry
+
+    def put(self, config: dict, files: Dict[str, Any]):
+        """Save the result files (file name -> JSON content) of a run. Returns the key, or :code:`None` if the
+        policy does not write the cache.
+        """
+        if self.policy == 'off':
+            return None
+        key = run_key(config)
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {'key': key, 'config': json.loads(canonical_json(config)), 'created': time.time(), 'files': files}
+        # write to a temporary file first, so that a concurrent reader never sees a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(entry, f, default=str)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return key
+
+    def restore(self, config: dict, directory: str):
+        """Write the cached result files of a run into a directory.
+
+        Returns:
+            list of Path: The restored files, or :code:`None` on a cache miss.
+        """
+        entry = self.get(config)
+        if entry is None:
+            return None
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = list()
+        for file_name, content in entry['files'].items():
+            with open(directory / file_name, 'w') as f:
+                json.dump(content, f)
+            paths.append(directory / file_name)
+        return paths
+
+    def entries(self) -> Iterator[dict]:
+        for path in sorted(self.root.glob('*/*.json')):
+            entry = self._load(path)
+            if entry is not None:
+                yield entry
+
+    def invalidate(self, match: dict = None, older_than: float = None):
+        """Delete the entries whose configuration contains all items of :code:`match` (e.g.,
+        :code:`{'gpu_model': 'NVIDIA A30'}`) and that are older than :code:`older_than` seconds. Without any
+        condition, the whole cache is cleared.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        deleted = 0
+        now = time.time()
+        for entry in list(self.entries()):
+            if match is not None and any(entry['config'].get(k) != v for k, v in match.items()):
+                continue
+            if older_than is not None and now - entry['created'] <= older_than:
+                continue
+            self._path(entry['key']).unlink()
+            deleted += 1
+        return deleted
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Append-only columnar sink of long-running measurements, e.g., the DCGM samples and the request latencies of a soak
+test. The rows are buffered up to a chunk and flushed to disk as a :code:`.npy` file, so that the memory is bounded
+and a crash loses at most the rows of the last chunk.
+
+A sink directory contains:
+
+- :code:`chunk-000000.npy`, ...: The rows of a chunk, as a structured array of float64 columns. A chunk has the
+  columns seen in its rows, so that a column (e.g., a metric of a device) may start in any chunk.
+- :code:`chunks.jsonl`: A line per chunk (:code:`file`, :code:`rows`, :code:`columns`), appended once the chunk
+  file is complete. Only the listed chunks are read, so a chunk left half-written by a crash is ignored.
+- :code:`attrs.json`: Attributes of the run, e.g., the labels of the devices, replaced atomically on update.
+
+The environment variable :code:`MIGPERF_METRIC_SINK` sets the directory under which the profiling clients and the
+DCGM collector create their sinks, see :func:`sink_from_env`.
+"""
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+
+class ChunkedColumnSink(object):
+    """Write rows of float columns to a sink directory in chunks.
+
+    Rows are appended from any thread. A column missing in a row is NaN.
+
+    Args:
+        directory (str): The sink directory, created if missing. The chunks are appended after the existing ones.
+        chunk_size (int, optional): Rows per chunk. Default to 4096.
+        flush_interval (float, optional): Seconds after which the buffered rows are flushed on the next append, even
+            if the chunk is not full. Default to 60.
+
+    Examples:
+        >>> with ChunkedColumnSink('soak/latency') as sink:
+        ...     sink.append({'time': time.time(), 'latency': 0.012})
+        >>> ChunkedColumnReader('soak/latency').column('latency')
+    """
+
+    def __init__(self, directory: str, chunk_size: int = 4096, flush_interval: Optional[float] = 60.):
+        if chunk_size <= 0:
+            raise ValueError(f'Chunk size must be positive, got {chunk_size}')
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.num_chunks = len(_read_index(self.directory))
+        self.num_rows = 0
+
+        # column -> values of the buffered rows
+        self._buffer: Dict[str, List[float]] = dict()
+        self._buffered_rows = 0
+        self._last_flush = time.perf_counter()
+        self._attrs = _read_attrs(self.directory)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def append(self, row: Dict[str, float]):
+        """Append a row: column -> value."""
+        with self._lock:
+            for column, values in self._buffer.items():
+                values.append(row.get(column, math.nan))
+            for column, value in row.items():
+                if column not in self._buffer:
+                    self._buffer[column] = [math.nan] * self._buffered_rows + [value]
+            self._buffered_rows += 1
+            self.num_rows += 1
+            if self._buffered_rows >= self.chunk_size or (
+                    self.flush_interval is not None
+                    and time.perf_counter() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def flush(self):
+        """Write the buffered rows as a chunk."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush = time.perf_counter()
+        if not self._buffered_rows:
+            return
+        columns = list(self._buffer)
+        chunk = np.empty(self._buffered_rows, dtype=[(column, np.float64) for column in columns])
+        for column in columns:
+            chunk[column] = self._buffer[column]
+        file_name = f'chunk-{self.num_chunks:06d}.npy'
+        with open(self.directory / file_name, 'wb') as f:
+            np.save(f, chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        # the chunk is listed once complete
+        with open(self.directory / 'chunks.jsonl', 'a') as f:
+            f.write(json.dumps({'file': file_name, 'rows': self._buffered_rows, 'columns': columns}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.num_chunks += 1
+        # keep the columns, which are likely in the next rows
+        self._buffer = {column: list() for column in columns}
+        self._buffered_rows = 0
+
+    def update_attrs(self, **attrs):
+        """Update the attributes of the run. They must be JSON serializable."""
+        with self._lock:
+            self._attrs.update(attrs)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self._attrs, f)
+                os.replace(tmp_path, self.directory / 'attrs.json')
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+
+    def close(self):
+        self.flush()
+
+
+def _read_index(directory: Path):
+    chunks = list()
+    try:
+        with open(directory / 'chunks.jsonl') as f:
+            for line in f:
+                try:
+                    chunks.append(json.loads(line))
+                except ValueError:
+                    # the last line of a crashed run may be partial
+                    break
+    except FileNotFoundError:
+        pass
+    return chunks
+
+
+def _read_attrs(directory: Path):
+    try:
+        with open(directory / 'attrs.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict()
+
+
+class ChunkedColumnReader(object):
+    """Read a sink directory written by :class:`ChunkedColumnSink`, lazily: the chunks are memory-mapped when read.
+
+    Args:
+        directory (str): The sink directory.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        if not self.directory.is_dir():
+            raise ValueError(f'Sink directory {self.directory} does not exist')
+        self.index = _read_index(self.directory)
+        self.attrs = _read_attrs(self.directory)
+
+    def __len__(self):
+        return sum(chunk['rows'] for chunk in self.index)
+
+    @property
+    def columns(self):
+        """The columns of all chunks, in the order they first appear."""
+        columns = dict()
+        for chunk in self.index:
+            columns.update(dict.fromkeys(chunk['columns']))
+        return list(columns)
+
+    def chunks(self) -> Iterator[np.ndarray]:
+        """The chunks in order, as memory-mapped structured arrays."""
+        for chunk in self.index:
+            yield np.load(self.directory / chunk['file'], mmap_mode='r')
+
+    def iter_column(self, column: str) -> Iterator[np.ndarray]:
+        """The values of a column chunk by chunk, NaN in the chunks without the column."""
+        for info, chunk in zip(self.index, self.chunks()):
+            if column in info['columns']:
+                yield chunk[column]
+            else:
+                yield np.full(info['rows'], np.nan)
+
+    def column(self, column: str):
+        """All values of a column, in a single array."""
+        if not self.index:
+            return np.empty(0)
+        return np.concatenate(list(self.iter_column(column)))
+
+    def to_dict(self, columns: List[str] = None):
+        """Column -> all values, of the :code:`columns` or of all columns."""
+        return {column: self.column(column) for column in (columns or self.columns)}
+
+
+def sink_from_env(name: str, **kwargs):
+    """A sink in a new directory :code:`${MIGPERF_METRIC_SINK}/${name}-${timestamp}-${pid}`, or :code:`None` if
+    :code:`MIGPERF_METRIC_SINK` is unset. The keyword arguments are passed to :class:`ChunkedColumnSink`.
+    """
+    root = os.environ.get('MIGPERF_METRIC_SINK')
+    if not root:
+        return None
+    return ChunkedColumnSink(Path(root) / f'{name}-{datetime.now():%Y%m%d-%H%M%S-%f}-{os.getpid()}', **kwargs)
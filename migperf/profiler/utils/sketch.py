@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Online aggregates of streaming measurements: the exact count, mean, standard deviation, minimum and maximum (by
+Welford's algorithm), and the percentiles within a relative error (by a DDSketch). They are updated per sample in
+O(1), can be read while a run is in progress, and merge exactly across threads, processes and hosts, so that the
+results of parallel load generators combine without their raw samples.
+
+DDSketch (Masson et al., VLDB 2019) counts the values in logarithmic buckets :math:`(\\gamma^{i-1}, \\gamma^i]`, with
+:math:`\\gamma = (1 + \\alpha) / (1 - \\alpha)`: any percentile is within a relative error :math:`\\alpha` of the
+true value, and two sketches of the same :math:`\\alpha` merge by adding their bucket counts.
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, Sequence
+
+# Percentiles of the summaries
+DEFAULT_PERCENTILES = (50, 95, 99)
+
+
+class RunningStats(object):
+    """Count, mean, variance, minimum and maximum of a stream, by Welford's algorithm. Not thread-safe."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.
+        # sum of the squared differences from the mean
+        self.m2 = 0.
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'RunningStats'):
+        """Add the values of another stream, by the parallel algorithm of Chan et al."""
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        """Population standard deviation, as :func:`numpy.std`."""
+        return math.sqrt(self.m2 / self.count) if self.count else math.nan
+
+    def to_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        stats = cls()
+        stats.count, stats.mean, stats.m2, stats.min, stats.max = d['count'], d['mean'], d['m2'], d['min'], d['max']
+        return stats
+
+
+class DDSketch(object):
+    """Mergeable quantile sketch with a relative error guarantee. Not thread-safe.
+
+    Args:
+        relative_accuracy (float, optional): The relative error :math:`\\alpha` of the quantiles. Default to 0.01.
+        max_buckets (int, optional): Maximum number of buckets per sign. Beyond, the lowest buckets are collapsed,
+            which only loses accuracy on the lowest quantiles. Default to 2048, enough for 1% over 8 decades.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, max_buckets: int = 2048):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f'Relative accuracy must be in (0, 1), got {relative_accuracy}')
+        self.relative_accuracy = relative_accuracy
+        self.max_buckets = max_buckets
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        # bucket index -> count, of the positive values and of the absolute negative values
+        self.positive: Dict[int, int] = dict()
+        self.negative: Dict[int, int] = dict()
+        self.zero_count = 0
+        self.count = 0
+
+    def _index(self, value: float):
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, index: int):
+        """The value of a bucket, with a relative error of at most :math:`\\alpha` to the values in the bucket."""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def _collapse(self, buckets: Dict[int, int]):
+        while len(buckets) > self.max_buckets:
+            lowest, second = sorted(buckets)[:2]
+            buckets[second] += buckets.pop(lowest)
+
+    def add(self, value: float):
+        if value > 0:
+            buckets = self.positive
+        elif value < 0:
+            buckets, value = self.negative, -value
+        else:
+            self.zero_count += 1
+            self.count += 1
+            return
+        index = self._index(value)
+        if index in buckets:
+            buckets[index] += 1
+        else:
+            buckets[index] = 1
+            self._collapse(buckets)
+        self.count += 1
+
+    def merge(self, other: 'DDSketch'):
+        if other.gamma != self.gamma:
+            raise ValueError(
+                f'Cannot merge sketches of different relative accuracies: {self.relative_accuracy} and '
+                f'{other.relative_accuracy}'
+            )
+        for buckets, other_buckets in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, count in other_buckets.items():
+                buckets[index] = buckets.get(index, 0) + count
+            self._collapse(buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q: float):
+        """The :code:`q`-quantile (in [0, 1]) with the lower interpolation of :func:`numpy.percentile`, NaN if
+        empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f'Quantile must be in [0, 1], got {q}')
+        if not self.count:
+            return math.nan
+        rank = math.floor(q * (self.count - 1))
+        seen = 0
+        # the negative values from the most negative
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._value(index)
+        seen += self.zero_count
+        if seen > rank:
+            return 0.
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._value(index)
+        return self._value(max(self.positive))
+
+    def to_dict(self):
+        return {
+            'relative_accuracy': self.relative_accuracy, 'max_buckets': self.max_buckets,
+            # JSON keys are strings
+            'positive': {str(k): v for k, v in self.positive.items()},
+            'negative': {str(k): v for k, v in self.negative.items()},
+            'zero_count': self.zero_count, 'count': self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        sketch = cls(d['relative_accuracy'], d['max_buckets'])
+        sketch.positive = {int(k): v for k, v in d['positive'].items()}
+        sketch.negative = {int(k): v for k, v in d['negative'].items()}
+        sketch.zero_count, sketch.count = d['zero_count'], d['count']
+        return sketch
+
+
+class OnlineAggregator(object):
+    """Thread-safe :class:`RunningStats` and :class:`DDSketch` of a stream.
+
+    Args:
+        relative_accuracy (float, optional): See :class:`DDSketch`. Default to 0.01.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.stats = RunningStats()
+        self.sketch = DDSketch(relative_accuracy)
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        if math.isnan(value):
+            return
+        with self._lock:
+            self.stats.add(value)
+            self.sketch.add(value)
+
+    def merge(self, other: 'OnlineAggregator'):
+        # a copy of the other, so that the two locks are never held together
+        other = OnlineAggregator.from_dict(other.to_dict())
+        with self._lock:
+            self.stats.merge(other.stats)
+            self.sketch.merge(other.sketch)
+
+    def summary(self, percentiles: Sequence[float] = DEFAULT_PERCENTILES):
+        """:code:`count`, :code:`mean`, :code:`std`, :code:`min`, :code:`max` and the :code:`p${percentile}`, or
+        only the :code:`count` if empty. The percentiles are clipped to the exact minimum and maximum.
+        """
+        with self._lock:
+            if not self.stats.count:
+                return {'count': 0}
+            summary = {
+                'count': self.stats.count, 'mean': self.stats.mean, 'std': self.stats.std, 'min': self.stats.min,
+                'max': self.stats.max,
+            }
+            for percentile in percentiles:
+                value = self.sketch.quantile(percentile / 100)
+                summary[f'p{percentile:g}'] = min(max(value, self.stats.min), self.stats.max)
+            return summary
+
+    def to_dict(self):
+        with self._lock:
+            return {'stats': self.stats.to_dict(), 'sketch': self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        aggregator = cls(d['sketch']['relative_accuracy'])
+        aggregator.stats = RunningStats.from_dict(d['stats'])
+        aggregator.sketch = DDSketch.from_dict(d['sketch'])
+        return aggregator
+
+
+class AggregatorGroup(object):
+    """Online aggregators of named metrics, e.g., :code:`latency` and :code:`client_server_rtt`.
+
+    Args:
+        relative_accuracy (float, optional): See :class:`DDSketch`. Default to 0.01.
+
+    Examples:
+        >>> aggregators = AggregatorGroup()
+        >>> aggregators.add_row({'latency': 0.012, 'client_server_rtt': 0.002})
+        >>> aggregators.summary()['latency']['p99']
+
+        Merge the results of two load generators:
+
+        >>> merged = AggregatorGroup.from_dict(result_0['sketches'])
+        >>> merged.merge(AggregatorGroup.from_dict(result_1['sketches']))
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.aggregators: Dict[str, OnlineAggregator] = dict()
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name: str):
+        aggregator = self.aggregators.get(name)
+        if aggregator is None:
+            with self._lock:
+                aggregator = self.aggregators.setdefault(name, OnlineAggregator(self.relative_accuracy))
+        return aggregator
+
+    def __contains__(self, name: str):
+        return name in self.aggregators
+
+    def add(self, name: str, value: float):
+        self[name].add(value)
+
+    def add_row(self, row: Dict[str, float]):
+        for name, value in row.items():
+            self[name].add(value)
+
+    def merge(self, other: 'AggregatorGroup'):
+        for name, aggregator in list(other.aggregators.items()):
+            self[name].merge(aggregator)
+
+    def summary(self, percentiles: Sequence[float] = DEFAULT_PERCENTILES):
+        """Metric name -> :meth:`OnlineAggregator.summary`."""
+        return {name: aggregator.summary(percentiles) for name, aggregator in list(self.aggregators.items())}
+
+    def flat_summary(self, names: Iterable[str] = None, percentiles: Sequence[float] = DEFAULT_PERCENTILES):
+        """The summaries as :code:`${name}_mean`, :code:`${name}_std` and :code:`${name}_p${percentile}`, the
+        aggregated metrics of the client results.
+        """
+        flat = dict()
+        for name in (names if names is not None else list(self.aggregators)):
+            summary = self[name].summary(percentiles)
+            flat[f'{name}_mean'] = summary.get('mean', math.nan)
+            flat[f'{name}_std'] = summary.get('std', math.nan)
+            for percentile in percentiles:
+                flat[f'{name}_p{percentile:g}'] = summary.get(f'p{percentile:g}', math.nan)
+        return flat
+
+    def to_dict(self):
+        return {name: aggregator.to_dict() for name, aggregator in list(self.aggregators.items())}
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        group = None
+        for name, aggregator in d.items():
+            aggregator = OnlineAggregator.from_dict(aggregator)
+            if group is None:
+                group = cls(aggregator.sketch.relative_accuracy)
+            group.aggregators[name] = aggregator
+        return group if group is not None else cls()
+
+
+class ProgressReporter(object):
+    """Report snapshots of aggregators every :code:`interval` seconds in a background thread, to watch a run
+    converge live.
+
+    Args:
+        snapshot (callable): Returns the snapshot, e.g., :meth:`AggregatorGroup.summary`.
+        interval (float): Seconds between two reports.
+        callback (callable, optional): Called with every report, a dict of :code:`time` (Unix timestamp) and
+            :code:`snapshot`. Default to print a JSON line to stderr.
+    """
+
+    def __init__(self, snapshot: Callable[[], dict], interval: float, callback: Callable[[dict], None] = None):
+        if interval <= 0:
+            raise ValueError(f'Progress interval must be positive, got {interval}')
+        self.snapshot = snapshot
+        self.interval = interval
+        self.callback = callback or self.print_report
+        self.reports = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def print_report(report: dict):
+        print(json.dumps(report, default=str), file=sys.stderr)
+
+    def report(self):
+        self.callback({'time': time.time(), 'snapshot': self.snapshot()})
+        self.reports += 1
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            self.report()
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the reports, with a last report."""
+        self._stop_event.set()
+        self._thread.join()
+        self.report()
+
+
+def progress_from_env(snapshot: Callable[[], dict]):
+    """A :class:`ProgressReporter` every :code:`MIGPERF_PROGRESS_INTERVAL` seconds, or :code:`None` if unset."""
+    interval = os.environ.get('MIGPERF_PROGRESS_INTERVAL')
+    if not interval:
+        return None
+    return ProgressReporter(snapshot, float(interval))
@@ -0,0 +1,342 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Confidence intervals of latency statistics by batch means, and adaptive stopping of a measurement once they are
+precise enough.
+
+Successive latencies are correlated (e.g., by the GPU clocks and the co-located jobs), so the samples are not
+independent and the textbook interval is too narrow. Batch means splits the samples into :math:`k` contiguous
+batches, whose statistics are nearly independent, and builds a Student-t interval from the :math:`k` batch
+statistics. For a percentile, every batch must be long enough to contain a few tail samples, so a p99 needs many
+more samples than a mean to be estimated.
+"""
+import math
+import threading
+import time
+from statistics import NormalDist
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+
+from .sketch import DEFAULT_PERCENTILES, DDSketch, RunningStats
+
+# statistic -> target relative half-width of its confidence interval
+DEFAULT_TARGETS = {'mean': 0.02, 'p95': 0.05, 'p99': 0.05}
+
+
+def summarize(durations: List[float]):
+    """Latency distribution of a list of durations in seconds."""
+    durations = np.asarray(durations, dtype=float)
+    if not durations.size:
+        return {'count': 0}
+    return {
+        'count': int(durations.size),
+        'mean': float(durations.mean()),
+        'std': float(durations.std()),
+        'min': float(durations.min()),
+        'p50': float(np.percentile(durations, 50)),
+        'p90': float(np.percentile(durations, 90)),
+        'p99': float(np.percentile(durations, 99)),
+        'max': float(durations.max()),
+    }
+
+
+def flat_summary(samples: Dict[str, Sequence[float]], percentiles: Sequence[float] = DEFAULT_PERCENTILES):
+    """Exact statistics of the raw samples of named metrics, as :code:`${name}_mean`, :code:`${name}_std` and
+    :code:`${name}_p${percentile}`, the same keys as :meth:`AggregatorGroup.flat_summary` which estimates them
+    from the sketches when the raw samples are not kept.
+    """
+    flat = dict()
+    for name, values in samples.items():
+        values = np.asarray(values, dtype=float)
+        flat[f'{name}_mean'] = float(values.mean()) if values.size else math.nan
+        flat[f'{name}_std'] = float(values.std()) if values.size else math.nan
+        for percentile in percentiles:
+            flat[f'{name}_p{percentile:g}'] = float(np.percentile(values, percentile)) if values.size else math.nan
+    return flat
+
+
+def t_quantile(p: float, df: int):
+    """Quantile of the Student-t distribution, by the Cornish-Fisher expansion of the normal quantile. The error
+    is below 1e-3 from 5 degrees of freedom.
+    """
+    z = NormalDist().inv_cdf(p)
+    return (
+        z + (z ** 3 + z) / (4 * df) + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+        + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z) / (384 * df ** 3)
+    )
+
+
+def _percentile_of(statistic: str):
+    """The percentile of a statistic name (e.g., :code:`p95` -> 95.), :code:`None` for :code:`mean`."""
+    if statistic == 'mean':
+        return None
+    if statistic.startswith('p'):
+        try:
+            q = float(statistic[1:])
+        except ValueError:
+            q = None
+        if q is not None and 0 < q < 100:
+            return q
+    raise ValueError(f'Unknown statistic {statistic}, expected mean or a percentile like p95')
+
+
+def min_batch_length(statistic: str, min_tail_samples: int = 5):
+    """Minimum length of a batch to estimate a statistic: a batch contains :code:`min_tail_samples` samples
+    beyond the percentile on average.
+    """
+    q = _percentile_of(statistic)
+    if q is None:
+        return 1
+    return math.ceil(min_tail_samples * 100 / min(q, 100 - q))
+
+
+def batch_means_interval(
+        samples: Sequence[float], statistic: str = 'mean', num_batches: int = 10, confidence: float = 0.95,
+        min_tail_samples: int = 5,
+):
+    """Confidence interval of a statistic by batch means.
+
+    Args:
+        samples (sequence of float): The samples in measurement order.
+        statistic (str, optional): :code:`mean`, or a percentile like :code:`p95`. Default to :code:`mean`.
+        num_batches (int, optional): Number of batches. Default to 10.
+        confidence (float, optional): Confidence level of the interval. Default to 0.95.
+        min_tail_samples (int, optional): See :func:`min_batch_length`. Default to 5.
+
+    Returns:
+        tuple of float: The estimate on all samples and the half-width of its interval, or :code:`None` if there
+            are too few samples for the batches.
+    """
+    if num_batches < 2:
+        raise ValueError(f'Batch means requires at least 2 batches, got {num_batches}')
+    samples = np.asarray(samples, dtype=float)
+    batch_length = len(samples) // num_batches
+    if batch_length < min_batch_length(statistic, min_tail_samples):
+        return None
+    q = _percentile_of(statistic)
+    # the leftover samples at the end are only used by the estimate
+    batches = samples[:batch_length * num_batches].reshape(num_batches, batch_length)
+    if q is None:
+        estimate, batch_statistics = samples.mean(), batches.mean(axis=1)
+    else:
+        estimate, batch_statistics = np.percentile(samples, q), np.percentile(batches, q, axis=1)
+    half_width = t_quantile((1 + confidence) / 2, num_batches - 1) * batch_statistics.std(ddof=1) / math.sqrt(
+        num_batches
+    )
+    return float(estimate), float(half_width)
+
+
+class StreamingBatchMeans(object):
+    """Batch means in bounded memory, for the measurements whose samples are not kept (e.g., streamed to a sink).
+
+    The samples are added to contiguous batches of a common length, and every time there are
+    :code:`2 * num_batches` full batches, the adjacent pairs are merged into batches of twice the length. So the
+    intervals are built from between :code:`num_batches` and :code:`2 * num_batches` batches, whose means are exact
+    and whose percentiles are estimated by a :class:`DDSketch` per batch. Not thread-safe.
+
+    Args:
+        num_batches (int, optional): The minimum number of batches of an interval. Default to 10.
+        percentiles (bool, optional): Sketch the batches to estimate the percentiles. Default to `True`.
+        relative_accuracy (float, optional): See :class:`DDSketch`. Default to 0.01.
+    """
+
+    def __init__(self, num_batches: int = 10, percentiles: bool = True, relative_accuracy: float = 0.01):
+        if num_batches < 2:
+            raise ValueError(f'Batch means requires at least 2 batches, got {num_batches}')
+        self.num_batches = num_batches
+        self.relative_accuracy = relative_accuracy if percentiles else None
+        self.batch_length = 1
+        self.stats = RunningStats()
+        self.sketch = DDSketch(relative_accuracy) if percentiles else None
+        # [count, sum, sketch or None] of the batches, the last one may be partial
+        self.batches = list()
+
+    def __len__(self):
+        return self.stats.count
+
+    def add(self, value: float):
+        self.stats.add(value)
+        if self.sketch is not None:
+            self.sketch.add(value)
+        if not self.batches or self.batches[-1][0] == self.batch_length:
+            if len(self.batches) == 2 * self.num_batches:
+                self._merge_pairs()
+            self.batches.append([0, 0., DDSketch(self.relative_accuracy) if self.sketch is not None else None])
+        batch = self.batches[-1]
+        batch[0] += 1
+        batch[1] += value
+        if batch[2] is not None:
+            batch[2].add(value)
+
+    def _merge_pairs(self):
+        merged = list()
+        for first, second in zip(self.batches[::2], self.batches[1::2]):
+            if first[2] is not None:
+                first[2].merge(second[2])
+            merged.append([first[0] + second[0], first[1] + second[1], first[2]])
+        self.batches = merged
+        self.batch_length *= 2
+
+    def interval(self, statistic: str = 'mean', confidence: float = 0.95, min_tail_samples: int = 5):
+        """Confidence interval of a statistic, see :func:`batch_means_interval`.
+
+        Returns:
+            tuple of float: The estimate on all samples and the half-width of its interval, or :code:`None` if there
+                are too few samples for the batches.
+        """
+        q = _percentile_of(statistic)
+        if q is not None and self.sketch is None:
+            raise ValueError(f'The percentiles are not sketched, cannot estimate {statistic}')
+        batches = [batch for batch in self.batches if batch[0] == self.batch_length]
+        if len(batches) < self.num_batches or self.batch_length < min_batch_length(statistic, min_tail_samples):
+            return None
+        if q is None:
+            estimate = self.stats.mean
+            batch_statistics = np.array([total / count for count, total, _ in batches])
+        else:
+            estimate = min(max(self.sketch.quantile(q / 100), self.stats.min), self.stats.max)
+            batch_statistics = np.array([sketch.quantile(q / 100) for _, _, sketch in batches])
+        half_width = t_quantile((1 + confidence) / 2, len(batches) - 1) * batch_statistics.std(ddof=1) / math.sqrt(
+            len(batches)
+        )
+        return float(estimate), float(half_width)
+
+
+class AdaptiveStopping(object):
+    """Decide when a measurement has enough samples: the confidence intervals of all target statistics are
+    narrower than their target relative precision, within :code:`min_samples` and :code:`max_samples`.
+
+    The samples are added from any thread. The intervals are recomputed when the number of samples grows by
+    :code:`check_growth`, so that checking is amortized to O(1) per sample.
+
+    Args:
+        targets (dict, optional): Statistic (:code:`mean` or :code:`p${percentile}`) -> target relative
+            half-width, e.g., 0.05 for an interval of +/- 5%. Default to :data:`DEFAULT_TARGETS`.
+        min_samples (int, optional): Never stop before. Default to 100.
+        max_samples (int, optional): Always stop at. Default to no limit.
+        num_batches (int, optional): See :func:`batch_means_interval`. Default to 10.
+        confidence (float, optional): Confidence level of the intervals. Default to 0.95.
+        check_growth (float, optional): Relative growth of the samples between two checks. Default to 0.05.
+        keep_samples (bool, optional): Keep the samples, to compute the intervals exactly. Otherwise, the memory is
+            bounded by :class:`StreamingBatchMeans`, e.g., when the samples are streamed to a sink. Default to
+            `True`.
+
+    Examples:
+        >>> stopping = AdaptiveStopping({'mean': 0.02, 'p99': 0.05}, max_samples=100000)
+        >>> while not stopping.stopped:
+        ...     stopping.add(measure_once())
+        >>> stopping.summary()['p99']
+        {'estimate': 0.0123, 'half_width': 0.0004, 'relative_half_width': 0.0325, 'converged': True}
+    """
+
+    def __init__(
+            self, targets: Dict[str, float] = None, min_samples: int = 100, max_samples: Optional[int] = None,
+            num_batches: int = 10, confidence: float = 0.95, check_growth: float = 0.05, keep_samples: bool = True,
+    ):
+        self.targets = dict(DEFAULT_TARGETS if targets is None else targets)
+        for statistic, precision in self.targets.items():
+            _percentile_of(statistic)
+            if precision <= 0:
+                raise ValueError(f'Target precision of {statistic} must be positive, got {precision}')
+        if max_samples is not None and max_samples < min_samples:
+            raise ValueError(f'max_samples {max_samples} is smaller than min_samples {min_samples}')
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.num_batches = num_batches
+        self.confidence = confidence
+        self.check_growth = check_growth
+
+        self.samples = list() if keep_samples else None
+        self._batches = None if keep_samples else StreamingBatchMeans(
+            num_batches, percentiles=any(_percentile_of(statistic) is not None for statistic in self.targets),
+        )
+        self.num_samples = 0
+        self.stopped = False
+        self.reason = None
+        self.intervals = dict()
+        self._next_check = max(min_samples, max(map(min_batch_length, self.targets), default=1) * num_batches)
+        self._start_time = time.perf_counter()
+        self._stop_time = None
+        self._lock = threading.Lock()
+
+    def add(self, value: float):
+        """Add a sample. Returns whether the measurement should stop."""
+        with self._lock:
+            if self.stopped:
+                return True
+            if self.samples is not None:
+                self.samples.append(value)
+            else:
+                self._batches.add(value)
+            self.num_samples += 1
+            n = self.num_samples
+            if self.max_samples is not None and n >= self.max_samples:
+                self._update_intervals()
+                self._stop('max_samples')
+            elif n >= self._next_check:
+                self._next_check = n + max(1, int(n * self.check_growth))
+                if self._update_intervals():
+                    self._stop('converged')
+            return self.stopped
+
+    def stop(self, reason: str = 'stopped'):
+        """Stop the measurement externally, e.g., on its time limit."""
+        with self._lock:
+            if not self.stopped:
+                self._update_intervals()
+                self._stop(reason)
+
+    def _stop(self, reason: str):
+        self.stopped = True
+        self.reason = reason
+        self._stop_time = time.perf_counter()
+
+    def _update_intervals(self):
+        """Recompute the intervals of all targets. Returns whether all of them are precise enough."""
+        converged = self.num_samples >= self.min_samples
+        for statistic, precision in self.targets.items():
+            if self.samples is not None:
+                interval = batch_means_interval(self.samples, statistic, self.num_batches, self.confidence)
+            else:
+                interval = self._batches.interval(statistic, self.confidence)
+            if interval is None:
+                self.intervals[statistic] = None
+                converged = False
+                continue
+            estimate, half_width = interval
+            relative = half_width / abs(estimate) if estimate else math.inf
+            self.intervals[statistic] = {
+                'estimate': estimate, 'half_width': half_width, 'relative_half_width': relative,
+                'converged': relative <= precision,
+            }
+            converged = converged and relative <= precision
+        return converged
+
+    def summary(self):
+        """The measurement record: :code:`num_samples`, :code:`duration` (seconds), :code:`stopped`,
+        :code:`reason`, :code:`targets`, :code:`confidence` and the interval of every target statistic (or
+        :code:`None` if there were too few samples).
+        """
+        with self._lock:
+            if not self.stopped:
+                self._update_intervals()
+            return {
+                'num_samples': self.num_samples,
+                'duration': (self._stop_time or time.perf_counter()) - self._start_time,
+                'stopped': self.stopped, 'reason': self.reason, 'targets': self.targets,
+                'confidence': self.confidence, **self.intervals,
+            }
+
+
+def parse_targets(targets: Union[str, Sequence[str]]):
+    """Parse target precisions from command line arguments, e.g., :code:`['mean=0.02', 'p99=0.05']`."""
+    if isinstance(targets, str):
+        targets = targets.split(',')
+    parsed = dict()
+    for target in targets:
+        statistic, sep, precision = target.partition('=')
+        if not sep:
+            raise ValueError(f'Invalid target {target}, expected STATISTIC=PRECISION like p99=0.05')
+        parsed[statistic.strip()] = float(precision)
+    return parsed
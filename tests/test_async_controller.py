@@ -0,0 +1,114 @@
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+from migperf.controller import AsyncMIGController, FakeBackend, MIGController, NvidiaSMIBackend
+from migperf.controller.async_mig_controller import run_command
+from tests.test_backend import GI_STATUS_OUTPUT
+
+# A stand-in nvidia-smi: prints canned outputs, and hangs on `-mig`
+NVIDIA_SMI_SCRIPT = f'''#!{sys.executable}
+import sys, time
+args = sys.argv[1:]
+if args[:2] == ['mig', '-lgi']:
+    print({GI_STATUS_OUTPUT!r})
+elif args[:2] == ['mig', '-lci']:
+    print('')
+elif args[:1] == ['-mig']:
+    time.sleep(30)
+else:
+    print('Enabled, Enabled')
+'''
+
+
+class AsyncMIGControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        executable = os.path.join(self.tmp_dir.name, 'nvidia-smi')
+        with open(executable, 'w') as f:
+            f.write(NVIDIA_SMI_SCRIPT)
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        self.backend = NvidiaSMIBackend(executable=executable, sudo=False)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_same_records_as_sync(self):
+        mig_controller = AsyncMIGController(backend=self.backend)
+
+        async def check():
+            return await asyncio.gather(
+                mig_controller.check_gpu_instance_status(gpu_id=0), mig_controller.check_mig_status(gpu_id=0),
+            )
+
+        gi_status_list, mig_status = asyncio.run(check())
+        self.assertEqual(gi_status_list, MIGController(backend=self.backend).check_gpu_instance_status(gpu_id=0))
+        self.assertEqual(mig_status, (True, True))
+
+    def test_timeout(self):
+        mig_controller = AsyncMIGController(backend=self.backend, timeout=0.2)
+        start_time = time.monotonic()
+        with self.assertRaises(asyncio.TimeoutError):
+            asyncio.run(mig_controller.enable_mig(gpu_id=0))
+        self.assertLess(time.monotonic() - start_time, 5)
+
+    def test_cancel(self):
+        mig_controller = AsyncMIGController(backend=self.backend, timeout=None)
+
+        async def cancel():
+            task = asyncio.ensure_future(mig_controller.enable_mig(gpu_id=0))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await task
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(cancel())
+
+    def test_run_command_input(self):
+        self.assertEqual(
+            asyncio.run(run_command([sys.executable, '-c', 'print(input()[::-1])'], input=b'abc\n')), (0, 'cba\n'),
+        )
+
+
+class AsyncReconcileTest(unittest.TestCase):
+    def test_reconcile_concurrently(self):
+        backend = FakeBackend(num_gpus=2)
+        mig_controller = AsyncMIGController(backend=backend)
+        sync_mig_controller = MIGController(backend=backend)
+        # warm up the shared inventory, which must be invalidated by the async controller
+        self.assertEqual(sync_mig_controller.check_gpu_instance_status(), [])
+
+        async def reconcile():
+            return await asyncio.gather(
+                mig_controller.reconcile(0, '3g.40gb,2x2g.20gb'), mig_controller.reconcile(1, '7g.80gb'),
+            )
+
+        results = asyncio.run(reconcile())
+        self.assertEqual([len(result['created']) for result in results], [3, 1])
+        self.assertEqual(len(sync_mig_controller.check_gpu_instance_status()), 4)
+        self.assertEqual(len(sync_mig_controller.check_compute_instance_status()), 4)
+        with self.assertRaises(ValueError):
+            asyncio.run(mig_controller.reconcile(1, '2x4g.40gb', dry_run=True))
+
+    def test_shared_profile_tables(self):
+        backend = FakeBackend(num_gpus=2)
+        queried_gpu_ids = list()
+        list_gpu_instance_profiles = backend.list_gpu_instance_profiles
+
+        def counting_list_gpu_instance_profiles(gpu_id=None):
+            queried_gpu_ids.append(gpu_id)
+            return list_gpu_instance_profiles(gpu_id)
+
+        backend.list_gpu_instance_profiles = counting_list_gpu_instance_profiles
+        asyncio.run(AsyncMIGController(backend=backend).reconcile(0, '3g.40gb,2x2g.20gb'))
+        # the table cached by the async controller is served to the sync one, for all GPUs of the model
+        MIGController(backend=backend).reconcile(1, '7g.80gb')
+        self.assertEqual(queried_gpu_ids, [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
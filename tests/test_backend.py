@@ -0,0 +1,187 @@
+import unittest
+
+from migperf.controller import FakeBackend, MIGController, NvidiaSMIBackend
+from migperf.profiler.utils.misc import get_gpu_device_uuid, get_ids_from_mig_device_id
+
+DEVICE_LIST_OUTPUT = '''GPU 0: NVIDIA A30 (UUID: GPU-bd8c3d28-4b3e-e4ad-650a-4c5a3692b72f)
+  MIG 2g.12gb     Device  0: (UUID: MIG-a1b2c3d4-80bd-5581-9702-563ef12adf3a)
+  MIG 1g.6gb      Device  1: (UUID: MIG-6dd9381e-80bd-5581-9702-563ef12adf3a)
+GPU 1: NVIDIA A30 (UUID: GPU-0e3c2d1f-4b3e-e4ad-650a-4c5a3692b72f)
+'''
+
+DEVICE_TABLE_OUTPUT = '''+-----------------------------------------------------------------------------+
+| MIG devices:                                                                |
++------------------+----------------------+-----------+-----------------------+
+| GPU  GI  CI  MIG |         Memory-Usage |        Vol|         Shared        |
+|      ID  ID  Dev |           BAR1-Usage | SM     Unc| CE  ENC  DEC  OFA  JPG|
+|==================+======================+===========+=======================|
+|  0    1   0   0  |      6MiB / 11968MiB | 28      0 |  2   0    2    0    0 |
+|                  |      0MiB / 16383MiB |           |                       |
++------------------+----------------------+-----------+-----------------------+
+|  0    5   0   1  |      3MiB /  5952MiB | 14      0 |  1   0    1    0    0 |
+|                  |      0MiB /  8191MiB |           |                       |
++------------------+----------------------+-----------+-----------------------+
+'''
+
+GI_STATUS_OUTPUT = '''+-------------------------------------------------------+
+| GPU instances:                                        |
+| GPU   Name             Profile  Instance   Placement  |
+|                          ID       ID       Start:Size |
+|=======================================================|
+|   0  MIG 2g.12gb         5         1          0:2     |
++-------------------------------------------------------+
+|   0  MIG 1g.6gb         14         5          3:1     |
++-------------------------------------------------------+
+'''
+
+GI_PROFILE_OUTPUT = '''+-----------------------------------------------------------------------------+
+| GPU instance profiles:                                                      |
+| GPU   Name             ID    Instances   Memory     P2P    SM    DEC   ENC  |
+|                              Free/Total   GiB              CE    JPEG  OFA  |
+|=============================================================================|
+|   0  MIG 1g.6gb        14     3/4        5.81       No     14     1     0   |
+|                                                             1     0     0   |
++-----------------------------------------------------------------------------+
+|   0  MIG 1g.6gb+me     21     1/1        5.81       No     14     1     0   |
+|                                                             1     1     1   |
++-----------------------------------------------------------------------------+
+|   0  MIG 2g.12gb        5     1/2        11.69      No     28     2     0   |
+|                                                             2     0     0   |
++-----------------------------------------------------------------------------+
+|   0  MIG 4g.24gb        0     0/1        23.44      No     56     4     0   |
+|                                                             4     1     1   |
++-----------------------------------------------------------------------------+
+'''
+
+GI_PLACEMENT_OUTPUT = '''GPU  0 Profile ID 14 Placements: {0,1,2,3}:1
+GPU  0 Profile ID 21 Placements: {0,1,2,3}:1
+GPU  0 Profile ID  5 Placements: {0,2}:2
+GPU  0 Profile ID  0 Placement : {0}:4
+'''
+
+CI_PROFILE_OUTPUT = '''+--------------------------------------------------------------------------------------+
+| Compute instance profiles:                                                           |
+| GPU     GPU       Name             Profile  Instances   Exclusive       Shared       |
+|       Instance                       ID     Free/Total     SM       DEC   ENC   OFA  |
+|         ID                                                          CE    JPEG       |
+|======================================================================================|
+|   0      1       MIG 1c.2g.12gb       0      0/2           14        2     0     0   |
+|                                                                      2     0          |
++--------------------------------------------------------------------------------------+
+|   0      1       MIG 2g.12gb          1*     0/1           28        2     0     0   |
+|                                                                      2     0          |
++--------------------------------------------------------------------------------------+
+'''
+
+
+class CannedNvidiaSMIBackend(NvidiaSMIBackend):
+    def __init__(self, outputs: dict):
+        super().__init__()
+        self.outputs = outputs
+        self.commands = list()
+
+    def run(self, cmd):
+        self.commands.append(cmd)
+        return 0, self.outputs[tuple(cmd)]
+
+
+class NvidiaSMIBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = CannedNvidiaSMIBackend({
+            ('nvidia-smi', '-L'): DEVICE_LIST_OUTPUT,
+            ('nvidia-smi',): DEVICE_TABLE_OUTPUT,
+            ('sudo', 'nvidia-smi', 'mig', '-lgi'): GI_STATUS_OUTPUT,
+            ('sudo', 'nvidia-smi', 'mig', '-lci'): '',
+            ('nvidia-smi', '--query-gpu=mig.mode.current,mig.mode.pending', '--format=csv,noheader'):
+                'Enabled, Enabled\nDisabled, Enabled\n',
+            ('sudo', 'nvidia-smi', 'mig', '-lgip', '-i', '0'): GI_PROFILE_OUTPUT,
+            ('sudo', 'nvidia-smi', 'mig', '-lgipp', '-i', '0'): GI_PLACEMENT_OUTPUT,
+            ('sudo', 'nvidia-smi', 'mig', '-lcip', '-i', '0', '-gi', '1'): CI_PROFILE_OUTPUT,
+        })
+
+    def test_list_devices(self):
+        devices = self.backend.list_devices()
+        self.assertEqual([device['gpu_id'] for device in devices], [0, 1])
+        self.assertEqual(devices[0]['name'], 'NVIDIA A30')
+        self.assertEqual(devices[0]['mig_devices'][1], {
+            'gpu_id': 0, 'mig_device_id': 1, 'gi_id': 5, 'ci_id': 0, 'name': 'MIG 1g.6gb',
+            'uuid': 'MIG-6dd9381e-80bd-5581-9702-563ef12adf3a',
+        })
+        self.assertEqual(devices[1]['mig_devices'], [])
+
+    def test_device_lookup(self):
+        self.assertEqual(get_gpu_device_uuid(1, backend=self.backend), 'GPU-0e3c2d1f-4b3e-e4ad-650a-4c5a3692b72f')
+        self.assertEqual(get_gpu_device_uuid(0, 0, backend=self.backend), 'MIG-a1b2c3d4-80bd-5581-9702-563ef12adf3a')
+        self.assertIsNone(get_gpu_device_uuid(0, 2, backend=self.backend))
+        self.assertEqual(get_ids_from_mig_device_id(0, 1, backend=self.backend), (5, 0))
+        self.assertEqual(get_ids_from_mig_device_id(1, 0, backend=self.backend), (None, None))
+
+    def test_check_status(self):
+        mig_controller = MIGController(backend=self.backend)
+        self.assertEqual(mig_controller.check_mig_status(), [(True, True), (False, True)])
+        self.assertEqual(mig_controller.check_mig_status(gpu_id=1), (False, True))
+        self.assertEqual(mig_controller.check_gpu_instance_status(gpu_id=0)[1], {
+            'gpu_id': 0, 'name': 'MIG 1g.6gb', 'profile_id': 14, 'gi_id': 5, 'placement': {'start': 3, 'size': 1},
+        })
+
+    def test_list_profiles(self):
+        gi_profiles = self.backend.list_gpu_instance_profiles(gpu_id=0)
+        self.assertEqual([gi_profile['name'] for gi_profile in gi_profiles],
+                         ['MIG 1g.6gb', 'MIG 1g.6gb+me', 'MIG 2g.12gb', 'MIG 4g.24gb'])
+        self.assertEqual(gi_profiles[3], {
+            'gpu_id': 0, 'name': 'MIG 4g.24gb', 'profile_id': 0, 'instances_free': 0, 'instances_total': 1,
+            'memory_gib': 23.44, 'p2p': False, 'sm': 56, 'dec': 4, 'enc': 0, 'ce': 4, 'jpeg': 1, 'ofa': 1,
+        })
+        gi_placements = self.backend.list_gpu_instance_possible_placements(gpu_id=0)
+        self.assertEqual(gi_placements[2], {
+            'gpu_id': 0, 'profile_id': 5, 'placements': [{'start': 0, 'size': 2}, {'start': 2, 'size': 2}],
+        })
+        self.assertEqual(gi_placements[3]['placements'], [{'start': 0, 'size': 4}])
+        ci_profiles = self.backend.list_compute_instance_profiles(gpu_id=0, gi_id=1)
+        self.assertEqual(ci_profiles[1], {
+            'gpu_id': 0, 'gi_id': 1, 'name': 'MIG 2g.12gb', 'profile_id': 1, 'default': True, 'instances_free': 0,
+            'instances_total': 1, 'sm': 28, 'dec': 2, 'enc': 0, 'ofa': 0, 'ce': 2, 'jpeg': 0,
+        })
+
+    def test_reconcile_rejects_infeasible_layout(self):
+        mig_controller = MIGController(backend=self.backend)
+        with self.assertRaises(ValueError):
+            # only one 1g.6gb+me per GPU
+            mig_controller.reconcile(0, '2x1g.6gb+me', dry_run=True)
+        result = mig_controller.reconcile(0, '2g.12gb,1g.6gb,1g.6gb+me', dry_run=True)
+        self.assertEqual([spec.to_profile_str() for spec in result['diff'].create], ['1g.6gb+me:2'])
+
+    def test_command_without_sudo(self):
+        backend = NvidiaSMIBackend(executable='/opt/bin/nvidia-smi', sudo=False)
+        self.assertEqual(backend.destroy_gpu_instance_command(gpu_id=0, gi_ids='1,2'),
+                         ['/opt/bin/nvidia-smi', 'mig', '-dgi', '-gi', '1,2', '-i', '0'])
+
+
+class FakeBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend(num_gpus=2)
+        self.mig_controller = MIGController(backend=self.backend)
+
+    def test_placement(self):
+        self.mig_controller.create_gpu_instance(['3g.40gb', '3g.40gb'], gpu_id=0)
+        with self.assertRaises(ValueError):
+            self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=0)
+        placements = [gi['placement'] for gi in self.mig_controller.check_gpu_instance_status(gpu_id=0)]
+        self.assertEqual(placements, [{'start': 0, 'size': 4}, {'start': 4, 'size': 4}])
+
+    def test_destroy_requires_no_compute_instance(self):
+        self.mig_controller.create_gpu_instance('2g.20gb', gpu_id=1, create_ci=True)
+        self.assertNotEqual(self.mig_controller.destroy_gpu_instance(gpu_id=1), 0)
+        self.assertEqual(self.mig_controller.destroy_compute_instance(gpu_id=1), 0)
+        self.assertEqual(self.mig_controller.destroy_gpu_instance(gpu_id=1), 0)
+        self.assertEqual(self.mig_controller.check_gpu_instance_status(), [])
+
+    def test_mig_devices(self):
+        self.mig_controller.create_gpu_instance('1g.10gb,1g.10gb', gpu_id=0, create_ci=True)
+        uuid = get_gpu_device_uuid(0, 1, backend=self.backend)
+        self.assertTrue(uuid.startswith('MIG-'))
+        self.assertEqual(get_ids_from_mig_device_id(0, 1, backend=self.backend), (2, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
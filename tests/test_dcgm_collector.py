@@ -0,0 +1,316 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from migperf.dcgm_exporter import AsyncDCGMMetricCollector, DCGMMetricCollector
+from migperf.dcgm_exporter.metric_collector import DCGMTextParser, dcgm_gpu_metric_parser
+from migperf.dcgm_exporter.sample_store import DCGMSampleStore
+from migperf.profiler.utils.sink import ChunkedColumnReader, ChunkedColumnSink
+
+# Metrics of a GPU with a MIG device, in the format of the DCGM exporter
+DCGM_METRICS = """# HELP DCGM_FI_DEV_GPU_UTIL GPU utilization (in %).
+# TYPE DCGM_FI_DEV_GPU_UTIL gauge
+DCGM_FI_DEV_GPU_UTIL{gpu="0",UUID="GPU-0",device="nvidia0",modelName="NVIDIA A30",Hostname="host"} 42
+# HELP DCGM_FI_PROF_GR_ENGINE_ACTIVE Ratio of time the graphics engine is active (in %).
+# TYPE DCGM_FI_PROF_GR_ENGINE_ACTIVE gauge
+DCGM_FI_PROF_GR_ENGINE_ACTIVE{gpu="0",UUID="GPU-0",device="nvidia0",modelName="NVIDIA A30",GPU_I_PROFILE="1g.6gb",GPU_I_ID="3",Hostname="host"} 0.5
+"""
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    # keep the connections alive, without delaying the responses, as the exporter does
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0.
+    # fail every n-th request with a 503
+    fail_every = 0
+    requests = 0
+    connections = 0
+
+    def setup(self):
+        super().setup()
+        type(self).connections += 1
+
+    def do_GET(self):
+        type(self).requests += 1
+        time.sleep(self.delay)
+        if self.fail_every and self.requests % self.fail_every == 0:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = DCGM_METRICS.encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_metrics(**handler_attrs):
+    """Serve the metrics on a local port in a background thread. Returns the server and its URL."""
+    handler = type('MetricsHandler', (MetricsHandler,), handler_attrs)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}/metrics'
+
+
+class DCGMMetricCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.server, self.url = serve_metrics()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_parser(self):
+        metrics = dcgm_gpu_metric_parser(DCGM_METRICS)
+        self.assertEqual(metrics[0, None]['DCGM_FI_DEV_GPU_UTIL'], 42)
+        self.assertEqual(metrics[0, 3]['labels']['GPU_I_PROFILE'], '1g.6gb')
+
+    def test_fast_parser(self):
+        parser = DCGMTextParser()
+        self.assertEqual(parser(DCGM_METRICS), dict(dcgm_gpu_metric_parser(DCGM_METRICS)))
+        # the label strings are parsed once
+        self.assertIs(parser(DCGM_METRICS)[0, 3]['labels'], parser(DCGM_METRICS)[0, 3]['labels'])
+
+        parser = DCGMTextParser(['DCGM_FI_PROF_GR_ENGINE_ACTIVE'])
+        self.assertEqual(list(parser(DCGM_METRICS)), [(0, 3)])
+        self.assertNotIn('DCGM_FI_DEV_GPU_UTIL', parser(DCGM_METRICS)[0, 3])
+        # escaped label values and timestamps
+        metrics = parser('DCGM_FI_PROF_GR_ENGINE_ACTIVE{gpu="1",GPU_I_ID="",err="a\\"b}\\\\n"} 0.25 1700000000\n')
+        self.assertEqual(metrics[1, None]['DCGM_FI_PROF_GR_ENGINE_ACTIVE'], 0.25)
+        self.assertEqual(metrics[1, None]['labels']['err'], 'a"b}\\n')
+
+    def test_sampling_rate(self):
+        collector = DCGMMetricCollector(self.url, interval=0.02)
+        collector.start()
+        time.sleep(0.5)
+        collector.stop()
+        stats = collector.stats()
+        # sub-second sampling, without drift: the mean period is the interval
+        self.assertGreaterEqual(stats['num_samples'], 15)
+        self.assertAlmostEqual(stats['period']['mean'], 0.02, delta=0.005)
+        self.assertEqual(stats['failed_scrapes'], 0)
+        self.assertEqual(stats['jitter']['count'], stats['num_samples'])
+        self.assertGreater(stats['scrape_latency']['mean'], 0)
+        self.assertEqual(collector.gpu_metrics_list[0][0, 3]['DCGM_FI_PROF_GR_ENGINE_ACTIVE'], 0.5)
+        self.assertEqual(collector.store.devices(), [(0, None), (0, 3)])
+        self.assertEqual(collector.store.labels(0, 3)['modelName'], 'NVIDIA A30')
+        self.assertEqual(collector.store.to_dict(0, None)['DCGM_FI_DEV_GPU_UTIL'], [42.] * stats['num_samples'])
+        aggregates = collector.aggregators.summary()
+        self.assertEqual(list(aggregates), ['gpu0/gi3/DCGM_FI_PROF_GR_ENGINE_ACTIVE'])
+        self.assertEqual(aggregates['gpu0/gi3/DCGM_FI_PROF_GR_ENGINE_ACTIVE']['count'], stats['num_samples'])
+
+    def test_skipped_ticks(self):
+        self.server.RequestHandlerClass.delay = 0.05
+        collector = DCGMMetricCollector(self.url, interval=0.02)
+        collector.start()
+        time.sleep(0.5)
+        collector.stop()
+        stats = collector.stats()
+        # a 50ms scrape overruns 2 or 3 ticks of 20ms, the scrapes stay on the tick grid
+        self.assertGreaterEqual(stats['skipped_ticks'], 2 * stats['num_samples'] - 2)
+        self.assertAlmostEqual(stats['period']['mean'], 0.06, delta=0.015)
+
+    def test_phases(self):
+        collector = DCGMMetricCollector(self.url, interval=0.02)
+        collector.start()
+        collector.mark('warmup')
+        time.sleep(0.1)
+        collector.mark('measure')
+        time.sleep(0.2)
+        collector.mark('teardown')
+        time.sleep(0.1)
+        collector.stop()
+        self.assertEqual([period['phase'] for period in collector.phases], ['warmup', 'measure', 'teardown'])
+        self.assertEqual(collector.phases[0]['end'], collector.phases[1]['start'])
+        self.assertIsNotNone(collector.phases[-1]['end'])
+
+        masks = [collector.phase_mask(phase) for phase in collector.phase_names]
+        self.assertEqual(sum(mask.sum() for mask in masks), len(collector.store))
+        # the samples of a phase are contiguous
+        self.assertTrue(np.all(np.diff(np.flatnonzero(masks[1])) == 1))
+        measure = collector.store.to_dict(0, 3, mask=masks[1])['DCGM_FI_PROF_GR_ENGINE_ACTIVE']
+        self.assertEqual(len(measure), masks[1].sum())
+
+        stats = collector.phase_stats(0, 3)
+        self.assertEqual(list(stats), ['warmup', 'measure', 'teardown'])
+        self.assertAlmostEqual(stats['measure']['duration'], 0.2, delta=0.05)
+        self.assertGreaterEqual(stats['measure']['num_samples'], 7)
+        self.assertEqual(stats['measure']['DCGM_FI_PROF_GR_ENGINE_ACTIVE']['mean'], 0.5)
+        self.assertNotIn('DCGM_FI_PROF_SM_ACTIVE', stats['measure'])
+        with self.assertRaisesRegex(ValueError, 'not marked'):
+            collector.phase_mask('cooldown')
+
+    def test_sink(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            collector = DCGMMetricCollector(
+                self.url, interval=0.02, capacity=4, sink=ChunkedColumnSink(tmp_dir, chunk_size=3),
+            )
+            collector.start()
+            collector.mark('measure')
+            time.sleep(0.2)
+            collector.stop()
+            # the memory keeps the latest samples, the sink all of them
+            reader = ChunkedColumnReader(tmp_dir)
+            self.assertEqual(len(collector.store), 4)
+            self.assertEqual(len(reader), collector.store.num_appended)
+            self.assertIn('gpu0/gi3/DCGM_FI_PROF_GR_ENGINE_ACTIVE', reader.columns)
+            self.assertTrue(np.all(reader.column('gpu0/DCGM_FI_DEV_GPU_UTIL') == 42))
+            np.testing.assert_array_equal(reader.column('time')[-4:], collector.store.column('time'))
+            self.assertEqual(reader.attrs['labels']['gpu0/gi3']['GPU_I_PROFILE'], '1g.6gb')
+            self.assertEqual(reader.attrs['phase_names'], ['measure'])
+            self.assertIsNotNone(reader.attrs['phases'][0]['end'])
+
+    def test_session(self):
+        self.server.RequestHandlerClass.fail_every = 3
+        collector = DCGMMetricCollector(self.url, interval=0.02, retries=1)
+        collector.start()
+        time.sleep(0.3)
+        collector.stop()
+        # one kept-alive connection, and the 503s are retried within their ticks
+        self.assertEqual(self.server.RequestHandlerClass.connections, 1)
+        self.assertGreaterEqual(self.server.RequestHandlerClass.requests, 3)
+        self.assertEqual(collector.failed_scrapes, 0)
+
+        collector = DCGMMetricCollector(self.url, interval=0.02, retries=0)
+        collector.start()
+        time.sleep(0.3)
+        collector.stop()
+        self.assertGreater(collector.failed_scrapes, 0)
+
+    def test_fields(self):
+        collector = DCGMMetricCollector(self.url, interval=0.02, fields=['DCGM_FI_DEV_GPU_UTIL'])
+        collector.start()
+        time.sleep(0.1)
+        collector.stop()
+        self.assertEqual(collector.store.devices(), [(0, None)])
+
+    def test_failed_scrapes(self):
+        collector = DCGMMetricCollector('http://127.0.0.1:1/metrics', interval=0.01, timeout=0.1)
+        collector.start()
+        time.sleep(0.1)
+        collector.stop()
+        self.assertGreater(collector.failed_scrapes, 0)
+        self.assertEqual(collector.stats()['num_samples'], 0)
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            DCGMMetricCollector(interval=0)
+
+
+class AsyncDCGMMetricCollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.servers = [serve_metrics(), serve_metrics(delay=0.05)]
+        self.endpoints = {'fast': self.servers[0][1], 'slow': self.servers[1][1]}
+
+    def tearDown(self):
+        for server, _ in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_hosts(self):
+        collector = AsyncDCGMMetricCollector(self.endpoints, interval=0.02, timeout={'slow': 1.})
+        collector.start()
+        time.sleep(0.5)
+        collector.stop()
+        stats = collector.stats()
+        self.assertEqual(collector.hosts, ['fast', 'slow'])
+        # the slow exporter only skips its own ticks
+        self.assertGreaterEqual(stats['fast']['num_samples'], 15)
+        self.assertLess(stats['fast']['skipped_ticks'], stats['slow']['skipped_ticks'])
+        self.assertLess(stats['slow']['num_samples'], stats['fast']['num_samples'])
+        for store in collector.stores.values():
+            self.assertEqual(store.to_dict(0, 3)['DCGM_FI_PROF_GR_ENGINE_ACTIVE'][0], 0.5)
+        self.assertEqual(self.servers[0][0].RequestHandlerClass.connections, 1)
+
+    def test_event_loop(self):
+        collector = AsyncDCGMMetricCollector(
+            [self.endpoints['fast'], 'http://127.0.0.1:1/metrics'], interval=0.02, timeout=0.1,
+        )
+
+        async def main():
+            task = asyncio.create_task(collector.run())
+            await asyncio.sleep(0.2)
+            self.assertTrue(collector.is_running)
+            collector.stop()
+            await task
+
+        asyncio.run(main())
+        fast, dead = collector.hosts
+        self.assertEqual(fast, self.endpoints['fast'].split('/')[2])
+        self.assertGreater(len(collector.stores[fast]), 5)
+        self.assertGreater(collector.collectors[dead].failed_scrapes, 0)
+        self.assertFalse(collector.is_running)
+        with self.assertRaisesRegex(ValueError, 'No DCGM exporter'):
+            AsyncDCGMMetricCollector([])
+
+
+def make_sample(i, fields=('util',)):
+    sample = {(0, 1): {'labels': {'GPU_I_PROFILE': '1g.6gb'}, **{field: float(i) for field in fields}}}
+    sample.update({'time': float(i), 'scrape_latency': 0.001, 'jitter': 0.})
+    return sample
+
+
+class DCGMSampleStoreTest(unittest.TestCase):
+    def test_growth(self):
+        store = DCGMSampleStore(initial_capacity=4)
+        for i in range(10):
+            store.append(make_sample(i))
+        self.assertEqual(len(store), 10)
+        self.assertEqual(store.num_dropped, 0)
+        np.testing.assert_array_equal(store.column('util', (0, 1)), np.arange(10.))
+        self.assertEqual(store.labels(0, 1), {'GPU_I_PROFILE': '1g.6gb'})
+
+    def test_ring_buffer(self):
+        store = DCGMSampleStore(capacity=4)
+        for i in range(11):
+            store.append(make_sample(i))
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.num_dropped, 7)
+        self.assertEqual(store.to_dict(0, 1), {'util': [7., 8., 9., 10.]})
+        np.testing.assert_array_equal(store.column('time'), [7., 8., 9., 10.])
+
+    def test_zero_copy(self):
+        store = DCGMSampleStore(capacity=4)
+        for i in range(6):
+            store.append(make_sample(i))
+        view = store.view(0, 1)['util']
+        # the latest samples of the wrapped ring are still a slice of the column
+        self.assertTrue(np.shares_memory(view, store.view(0, 1)['util']))
+        self.assertIsNotNone(view.base)
+
+    def test_snapshot(self):
+        store = DCGMSampleStore(capacity=4)
+        for i in range(6):
+            store.append(make_sample(i))
+        sample_columns, columns = store.snapshot(0, 1)
+        mask = sample_columns['time'] >= 4.
+        # the snapshot is not overwritten by the later samples, the mask stays aligned with the values
+        store.append(make_sample(6))
+        np.testing.assert_array_equal(columns['util'][mask], [4., 5.])
+        self.assertEqual(len(store.column('time')), 4)
+
+    def test_missing_fields(self):
+        store = DCGMSampleStore(capacity=3)
+        store.append(make_sample(0))
+        store.append(make_sample(1, fields=('util', 'power')))
+        # the overwritten row of a field missing in the new sample is cleared
+        store.append(make_sample(2, fields=('power',)))
+        store.append(make_sample(3))
+        self.assertEqual(store.to_dict(0, 1), {'util': [1., None, 3.], 'power': [1., 2., None]})
+        samples = store.samples()
+        self.assertEqual(samples[1][0, 1], {'labels': {'GPU_I_PROFILE': '1g.6gb'}, 'power': 2.})
+        self.assertEqual(samples[2]['time'], 3.)
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            DCGMSampleStore(capacity=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
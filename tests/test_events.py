@@ -0,0 +1,126 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from migperf.controller import FakeBackend, MIGController
+from migperf.controller.benchmark import enumerate_layouts, layout_label, report, run_benchmark
+from migperf.controller.events import EventRecorder, add_event_hook, remove_event_hook, timed
+from tests.test_async_controller import AsyncMIGControllerTest
+
+
+class EventTest(unittest.TestCase):
+    def test_operation_events(self):
+        mig_controller = MIGController(backend=FakeBackend(num_gpus=2))
+        with EventRecorder() as recorder:
+            mig_controller.create_gpu_instance('3g.40gb', gpu_id=1)
+            with self.assertRaises(ValueError):
+                mig_controller.create_gpu_instance('7g.80gb', gpu_id=1)
+            mig_controller.destroy_gpu_instance(gpu_id=0)
+        mig_controller.enable_mig(gpu_id=0)
+
+        self.assertEqual([(event['name'], event['gpu_id']) for event in recorder.events], [
+            ('create_gpu_instance', 1), ('create_gpu_instance', 1), ('destroy_gpu_instance', 0),
+        ])
+        self.assertIsNone(recorder.events[0]['error'])
+        self.assertIn('Insufficient Resources', recorder.events[1]['error'])
+        self.assertEqual(recorder.events[2]['exit_code'], 1)
+        self.assertEqual(recorder.events[0]['arguments']['gi_profiles'], '3g.40gb')
+        self.assertTrue(all(event['duration'] >= 0 for event in recorder.events))
+
+    def test_command_events(self):
+        test = AsyncMIGControllerTest()
+        test.setUp()
+        self.addCleanup(test.tearDown)
+        backend = test.backend
+        with EventRecorder(filter=lambda event: event['type'] == 'command') as recorder:
+            backend.check_gpu_instance_status(gpu_id=0)
+        event, = recorder.events
+        self.assertEqual(event['name'], backend.executable)
+        self.assertEqual(event['command'], backend.check_gpu_instance_status_command(gpu_id=0))
+        self.assertEqual((event['gpu_id'], event['exit_code']), (0, 0))
+
+    def test_broken_hook(self):
+        def hook(_):
+            raise RuntimeError()
+
+        add_event_hook(hook)
+        self.addCleanup(remove_event_hook, hook)
+        with self.assertWarns(UserWarning):
+            with timed('operation', 'noop') as event:
+                event['exit_code'] = 0
+
+    def test_record_to_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'events.jsonl')
+            with EventRecorder(path):
+                MIGController(backend=FakeBackend()).reconcile(0, '2x3g.40gb')
+            with open(path) as f:
+                events = [json.loads(line) for line in f]
+        self.assertEqual(events[-1]['name'], 'reconcile')
+        self.assertIn('create_gpu_instance', [event['name'] for event in events])
+
+    def test_fake_latency(self):
+        backend = FakeBackend(latency={'create_gpu_instance': 0.05})
+        start_time = time.perf_counter()
+        backend.create_gpu_instance('1g.10gb', gpu_id=0)
+        backend.destroy_gpu_instance(gpu_id=0)
+        self.assertGreaterEqual(time.perf_counter() - start_time, 0.05)
+
+
+class BenchmarkTest(unittest.TestCase):
+    def setUp(self):
+        self.mig_controller = MIGController(backend=FakeBackend())
+        self.profile_placements = self.mig_controller.get_profile_placements(0)
+
+    def test_enumerate_layouts(self):
+        layouts = enumerate_layouts(self.profile_placements)
+        labels = list(map(layout_label, layouts))
+        self.assertEqual(len(labels), len(set(labels)))
+        self.assertEqual(labels[0], '7g.80gb')
+        self.assertIn('4g.40gb,3g.40gb', labels)
+        self.assertIn('2g.20gb,1g.20gb,1g.10gb', labels)
+        self.assertIn('1g.10gb', labels)
+        self.assertNotIn('4g.40gb,4g.40gb', labels)
+        self.assertNotIn('3g.40gb,4g.40gb', labels)
+        for layout in layouts:
+            self.mig_controller.plan_layout(0, layout)
+
+        maximal = list(map(layout_label, enumerate_layouts(self.profile_placements, maximal_only=True)))
+        self.assertTrue(set(maximal) < set(labels))
+        self.assertIn('3g.40gb,3g.40gb', maximal)
+        self.assertNotIn('3g.40gb', maximal)
+
+    def test_run_benchmark(self):
+        layouts = enumerate_layouts(self.profile_placements, maximal_only=True)[:5]
+        transitions = run_benchmark(self.mig_controller, 0, layouts, repeats=2)
+        self.assertEqual(len(transitions), 2 * (len(layouts) + 1))
+        self.assertEqual(transitions[0]['from'], 'empty')
+        self.assertEqual(transitions[-1]['to'], 'empty')
+        self.assertTrue(all(transition['error'] is None for transition in transitions))
+
+        result = report(transitions)
+        self.assertEqual(result['transition']['count'], len(transitions))
+        self.assertEqual(result['by_transition']['empty -> 7g.80gb']['count'], 2)
+        self.assertEqual(result['by_operation']['create_gpu_instance']['count'], len(transitions) - 2)
+        self.assertLessEqual(result['by_operation']['create_gpu_instance']['p50'],
+                             result['by_operation']['create_gpu_instance']['max'])
+
+    def test_run_benchmark_mode_switch(self):
+        layouts = enumerate_layouts(self.profile_placements, maximal_only=True)[:2]
+        transitions = run_benchmark(self.mig_controller, 0, layouts, repeats=2, include_mode_switch=True)
+        self.assertEqual(len(transitions), 2 * (len(layouts) + 3))
+        self.assertEqual([(t['from'], t['to']) for t in transitions[-2:]],
+                         [('empty', 'mig-disabled'), ('mig-disabled', 'empty')])
+        self.assertTrue(all(transition['error'] is None for transition in transitions))
+        self.assertTrue(self.mig_controller.check_mig_status(0)[0])
+
+        result = report(transitions)
+        self.assertEqual(result['by_transition']['empty -> mig-disabled']['count'], 2)
+        self.assertEqual(result['by_operation']['disable_mig']['count'], 2)
+        self.assertEqual(result['by_operation']['enable_mig']['count'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
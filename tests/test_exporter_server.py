@@ -0,0 +1,110 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import requests
+
+from migperf.controller.simulator import MIGSimulator
+from migperf.dcgm_exporter import DCGMExporterServer, DCGMMetricCollector, DCGMRecording, SyntheticDCGMPages
+from migperf.dcgm_exporter.exporter_server import record_exporter
+from migperf.dcgm_exporter.metric_collector import DCGMTextParser, dcgm_gpu_metric_parser
+
+
+class SyntheticDCGMPagesTest(unittest.TestCase):
+    def test_layouts(self):
+        pages = SyntheticDCGMPages.from_layouts(['A100', 'A30', 'A100'], ['2x3g.40gb', '4x1g.6gb', '-'])
+        metrics = dcgm_gpu_metric_parser(pages.page(0.))
+        self.assertEqual(
+            set(metrics), {(0, None), (1, None), (2, None), (0, 1), (0, 2), (1, 1), (1, 2), (1, 3), (1, 4)},
+        )
+        self.assertEqual(metrics[1, 3]['labels']['GPU_I_PROFILE'], '1g.6gb')
+        self.assertEqual(metrics[1, 3]['labels']['modelName'], 'NVIDIA A30')
+        # the activity is of the MIG devices, or of the whole GPU without MIG
+        self.assertIn('DCGM_FI_PROF_SM_ACTIVE', metrics[0, 1])
+        self.assertNotIn('DCGM_FI_PROF_SM_ACTIVE', metrics[0, None])
+        self.assertIn('DCGM_FI_PROF_SM_ACTIVE', metrics[2, None])
+        self.assertEqual(metrics[0, 1]['DCGM_FI_DEV_FB_FREE'] + metrics[0, 1]['DCGM_FI_DEV_FB_USED'], 39.25 * 1024)
+        # the fast parser reads the same page
+        self.assertEqual(DCGMTextParser()(pages.page(0.))[1, 3], metrics[1, 3])
+
+        with self.assertRaisesRegex(ValueError, 'layouts'):
+            SyntheticDCGMPages.from_layouts(['A30'], ['4g.24gb', '4g.24gb'])
+
+    def test_refresh(self):
+        pages = SyntheticDCGMPages.from_layouts(['A30'], ['4g.24gb'], refresh_interval=0.5, load=0.8)
+        first = pages.page(0.)
+        self.assertIs(pages.page(0.4), first)
+        parser = DCGMTextParser()
+        energy = list()
+        for step in range(1, 40):
+            metrics = parser(pages.page(step * 0.5))
+            energy.append(metrics[0, None]['DCGM_FI_DEV_TOTAL_ENERGY_CONSUMPTION'])
+            self.assertTrue(0 <= metrics[0, 1]['DCGM_FI_PROF_GR_ENGINE_ACTIVE'] <= 1)
+        self.assertEqual(energy, sorted(energy))
+        # about 0.15 + 0.75 * 0.8 of the A30 power limit
+        self.assertAlmostEqual(metrics[0, None]['DCGM_FI_DEV_POWER_USAGE'], 124, delta=25)
+
+    def test_reconfiguration(self):
+        simulator = MIGSimulator(['A30'])
+        pages = SyntheticDCGMPages(simulator, refresh_interval=1.)
+        self.assertEqual(list(dcgm_gpu_metric_parser(pages.page(0.))), [(0, None)])
+        simulator.create_gpu_instance(0, '2g.12gb')
+        self.assertIn((0, 1), dcgm_gpu_metric_parser(pages.page(1.)))
+
+
+class DCGMExporterServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = DCGMExporterServer(
+            SyntheticDCGMPages.from_layouts(['A100'], ['7x1g.10gb'], refresh_interval=0.05), port=0,
+        ).start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_collector(self):
+        with mock.patch.dict(os.environ, {'MIGPERF_DCGM_URL': self.server.url}):
+            collector = DCGMMetricCollector(interval=0.02)
+        collector.start()
+        collector.mark('measure')
+        time.sleep(0.3)
+        collector.stop()
+        self.assertEqual(collector.stats()['failed_scrapes'], 0)
+        self.assertEqual(len(collector.store.devices()), 8)
+        stats = collector.phase_stats(0, 7)['measure']
+        self.assertGreater(stats['num_samples'], 5)
+        self.assertTrue(0 < stats['DCGM_FI_PROF_SM_ACTIVE']['mean'] < 1)
+        self.assertEqual(self.server.num_requests, len(collector.store))
+
+    def test_not_found(self):
+        self.assertEqual(requests.get(self.server.url.replace('/metrics', '/')).status_code, 404)
+
+    def test_record_replay(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'dcgm.jsonl')
+            num_pages = record_exporter(self.server.url, path, duration=0.5, interval=0.1)
+            recording = DCGMRecording.load(path)
+        self.assertEqual(len(recording), num_pages)
+        self.assertGreaterEqual(num_pages, 4)
+        self.assertAlmostEqual(recording.times[-1], 0.1 * (num_pages - 1), delta=0.05)
+        self.assertIs(recording.page(0.), recording.pages[0])
+        self.assertIs(recording.page(recording.times[1] + 0.01), recording.pages[1])
+        # in a loop
+        self.assertIs(recording.page(recording.duration + 0.01), recording.pages[0])
+
+        with DCGMExporterServer(recording, port=0, speed=2.) as server:
+            pages = [requests.get(server.url).text]
+            time.sleep(recording.times[1] / 2 + 0.01)
+            pages.append(requests.get(server.url).text)
+        self.assertEqual(pages, recording.pages[:2])
+
+    def test_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'at least one page'):
+            DCGMRecording([])
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            DCGMExporterServer(DCGMRecording([(0., '')]), port=0, speed=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from migperf.dcgm_exporter import HostMetricCollector
+from migperf.dcgm_exporter.host_collector import (
+    process_tree, read_cpu_times, read_memory, read_net_bytes, read_process,
+)
+from migperf.profiler.utils.sink import ChunkedColumnReader, ChunkedColumnSink
+
+
+def spin(seconds: float):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+class HostCountersTest(unittest.TestCase):
+    def test_process(self):
+        counters = read_process(os.getpid())
+        self.assertGreater(counters.cpu_time, 0)
+        self.assertGreater(counters.rss, 0)
+        self.assertGreaterEqual(counters.num_threads, 1)
+        self.assertIsNone(read_process(2 ** 22 + 1))
+
+    def test_process_tree(self):
+        child = subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(10)'])
+        try:
+            pids = process_tree(os.getpid())
+            self.assertEqual(pids[0], os.getpid())
+            self.assertIn(child.pid, pids)
+        finally:
+            child.kill()
+            child.wait()
+
+    def test_host(self):
+        cpu_times = read_cpu_times()
+        self.assertEqual(len(cpu_times), os.cpu_count())
+        for busy, total in cpu_times:
+            self.assertLessEqual(busy, total)
+        self.assertTrue(all(value >= 0 for value in read_net_bytes()))
+        total, available = read_memory()
+        self.assertGreater(total, available)
+
+
+class HostMetricCollectorTest(unittest.TestCase):
+    def test_tick(self):
+        collector = HostMetricCollector(interval=0.1)
+        collector.tick(time.perf_counter())
+        spin(0.2)
+        collector.tick(time.perf_counter())
+        self.assertEqual(collector.store.devices(), [('process', None), ('host', None)])
+        self.assertEqual(collector.store.labels('process')['pid'], str(os.getpid()))
+
+        process = collector.store.view('process')
+        # the rates start from the second sample
+        self.assertTrue(np.isnan(process['cpu_percent'][0]))
+        self.assertGreater(process['cpu_percent'][1], 50)
+        self.assertGreater(process['rss'][1], 0)
+        host = collector.store.view('host')
+        self.assertGreater(host['cpu_max_percent'][1], 50)
+        self.assertIn(f'cpu{os.cpu_count() - 1}_percent', host)
+        self.assertGreaterEqual(host['net_bytes_recv'][1], 0)
+        self.assertEqual(collector.aggregators['process/cpu_percent'].stats.count, 1)
+
+    def test_phases(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            collector = HostMetricCollector(interval=0.02, sink=ChunkedColumnSink(tmp_dir))
+            collector.start()
+            collector.mark('warmup')
+            time.sleep(0.1)
+            collector.mark('measure')
+            spin(0.2)
+            collector.stop()
+            stats = collector.phase_stats('process')
+            self.assertEqual(list(stats), ['warmup', 'measure'])
+            self.assertGreater(stats['measure']['cpu_percent']['mean'], stats['warmup']['cpu_percent']['mean'])
+            self.assertIn('cpu_max_percent', collector.phase_stats('host')['measure'])
+            measure = collector.store.to_dict('host', mask=collector.phase_mask('measure'))
+            self.assertEqual(len(measure['memory_used']), stats['measure']['num_samples'])
+            self.assertEqual(collector.stats()['failed_scrapes'], 0)
+
+            reader = ChunkedColumnReader(tmp_dir)
+            self.assertEqual(len(reader), len(collector.store))
+            self.assertIn('process/rss', reader.columns)
+            self.assertEqual(reader.attrs['labels']['host']['num_cpus'], str(os.cpu_count()))
+
+    def test_sink_capacity(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            collector = HostMetricCollector(interval=0.01, sink=ChunkedColumnSink(tmp_dir, chunk_size=4))
+            # the samples beyond the latest chunk are only kept by the sink
+            self.assertEqual(collector.store.capacity, 4)
+            collector.mark('warmup')
+            collector.start()
+            time.sleep(0.1)
+            collector.mark('measure')
+            spin(0.1)
+            collector.stop()
+            self.assertEqual(len(collector.store), 4)
+            self.assertGreater(collector.store.num_dropped, 0)
+            stats = collector.phase_stats('process')
+            self.assertEqual(sum(phase['num_samples'] for phase in stats.values()), collector.store.num_appended)
+            self.assertGreater(stats['warmup']['num_samples'], 4)
+            self.assertEqual(stats['measure']['cpu_percent']['count'], stats['measure']['num_samples'])
+
+    def test_exited_process(self):
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        collector = HostMetricCollector(pid=child.pid, interval=0.1)
+        collector.tick(time.perf_counter())
+        self.assertEqual(len(collector.store), 0)
+        self.assertEqual(collector.failed_scrapes, 1)
+
+    def test_interval(self):
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            HostMetricCollector(interval=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
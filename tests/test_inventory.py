@@ -0,0 +1,80 @@
+import time
+import unittest
+
+from migperf.controller import FakeBackend, MIGController
+from migperf.controller.inventory import DeviceInventory, get_device_inventory
+
+
+class CountingFakeBackend(FakeBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_queries = 0
+        self.num_device_queries = 0
+
+    def list_devices(self):
+        self.num_queries += 1
+        self.num_device_queries += 1
+        return super().list_devices()
+
+    def check_gpu_instance_status(self, gpu_id: int = None):
+        self.num_queries += 1
+        return super().check_gpu_instance_status(gpu_id)
+
+
+class DeviceInventoryTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = CountingFakeBackend(num_gpus=2)
+        self.mig_controller = MIGController(backend=self.backend)
+        self.mig_controller.create_gpu_instance('1g.10gb,2g.20gb', gpu_id=1, create_ci=True)
+        self.inventory = self.mig_controller.inventory
+        self.backend.num_queries = 0
+
+    def test_shared_inventory(self):
+        self.assertIs(get_device_inventory(self.backend), self.inventory)
+        self.assertIsNot(get_device_inventory(FakeBackend()), self.inventory)
+
+    def test_lookups_served_from_snapshot(self):
+        mig_device = self.inventory.get_mig_device(1, 1)
+        self.assertEqual(self.inventory.find_mig_device(1, mig_device['gi_id'], mig_device['ci_id']), mig_device)
+        self.assertIs(self.inventory.get_by_uuid(mig_device['uuid']), mig_device)
+        self.assertEqual(self.inventory.get_device_uuid(0), self.inventory.get_gpu(0)['uuid'])
+        self.assertIsNone(self.inventory.get_mig_device(0, 0))
+        self.assertEqual(len(self.inventory.gpus()), 2)
+        self.assertEqual(self.backend.num_queries, 1)
+
+    def test_invalidate_on_mutation(self):
+        self.assertEqual(len(self.mig_controller.check_gpu_instance_status(gpu_id=1)), 2)
+        self.assertEqual(len(self.mig_controller.check_compute_instance_status(gpu_id=1, gi_id=1)), 1)
+        self.assertEqual(self.backend.num_queries, 1)
+        self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=0, create_ci=True)
+        self.assertEqual(len(self.mig_controller.check_gpu_instance_status()), 3)
+        self.assertIsNotNone(self.inventory.get_mig_device(0, 0))
+        self.assertEqual(self.backend.num_queries, 3)
+
+    def test_invalidate_on_failed_mutation(self):
+        self.inventory.gpu_instances()
+        with self.assertRaises(ValueError):
+            self.mig_controller.create_gpu_instance('7g.80gb', gpu_id=1)
+        self.inventory.gpu_instances()
+        self.assertEqual(self.backend.num_queries, 2)
+
+    def test_profile_tables_across_mutations(self):
+        for layout in ('7g.80gb', '3g.40gb,4g.40gb', '1g.10gb,2g.20gb'):
+            self.mig_controller.reconcile(1, layout)
+        # the GPU model keying the profile tables is loaded once, not after every mutation
+        self.assertEqual(self.backend.num_device_queries, 1)
+        self.inventory.gpus()
+        self.assertEqual(self.backend.num_device_queries, 2)
+
+    def test_ttl(self):
+        inventory = DeviceInventory(self.backend, ttl=0.05)
+        inventory.gpus()
+        inventory.gpus()
+        self.assertEqual(self.backend.num_queries, 1)
+        time.sleep(0.06)
+        inventory.gpus()
+        self.assertEqual(self.backend.num_queries, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,24 @@
+import os
+import shutil
 import unittest
 
-from migperf.controller import MIGController
+from migperf.controller import MIGController, set_default_backend
+from migperf.controller.backend import SimulatedNvidiaSMIBackend
+from migperf.controller.simulator import MIGSimulator
 
 unittest.TestLoader.sortTestMethodsUsing = None
 
 
+def setUpModule():
+    # without a GPU, run against two simulated A100s
+    if 'MIGPERF_BACKEND' not in os.environ and shutil.which('nvidia-smi') is None:
+        set_default_backend(SimulatedNvidiaSMIBackend(MIGSimulator(['A100', 'A100'])))
+
+
+def tearDownModule():
+    set_default_backend(None)
+
+
 class MIGControllerEnableDisableTest(unittest.TestCase):
     mig_controller = None
 
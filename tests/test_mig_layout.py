@@ -0,0 +1,115 @@
+import unittest
+
+from migperf.controller import FakeBackend, MIGController, MIGLayout
+from migperf.controller.layout import diff_layout
+
+
+def _gi(gi_id, name, profile_id, start, size):
+    return {
+        'gpu_id': 0, 'name': f'MIG {name}', 'profile_id': profile_id, 'gi_id': gi_id,
+        'placement': {'start': start, 'size': size},
+    }
+
+
+def _ci(gi_id, name, ci_id=0):
+    return {
+        'gpu_id': 0, 'gi_id': gi_id, 'name': f'MIG {name}', 'profile_id': 0, 'ci_id': ci_id,
+        'placement': {'start': 0, 'size': 1},
+    }
+
+
+class MIGLayoutParseTest(unittest.TestCase):
+    def test_parse_repeated_profiles(self):
+        layout = MIGLayout.parse('2x2g.20gb,MIG 1g.10gb:6')
+        self.assertEqual([spec.to_profile_str() for spec in layout], ['2g.20gb', '2g.20gb', '1g.10gb:6'])
+
+    def test_from_config(self):
+        layout = MIGLayout.from_config([
+            {'gi_profile': '3g.40gb', 'placement': 4, 'ci_profiles': '1c.3g.40gb,2c.3g.40gb'},
+            {'gi_profile': '1g.10gb'},
+        ])
+        self.assertEqual(layout.gpu_instances[0].ci_profiles, ('1c.3g.40gb', '2c.3g.40gb'))
+        self.assertEqual(layout, MIGLayout(['1g.10gb', layout.gpu_instances[0]]))
+
+    def test_invalid_profile(self):
+        with self.assertRaises(ValueError):
+            MIGLayout.parse('2x2g.20gb:0')
+        with self.assertRaises(ValueError):
+            MIGLayout.parse('half')
+
+
+class DiffLayoutTest(unittest.TestCase):
+    def setUp(self):
+        self.gi_status_list = [_gi(7, '1g.10gb', 19, 0, 1), _gi(8, '1g.10gb', 19, 1, 1),
+                               _gi(9, '1g.10gb', 19, 2, 1), _gi(10, '1g.10gb', 19, 3, 1)]
+        self.ci_status_list = [_ci(gi['gi_id'], '1g.10gb') for gi in self.gi_status_list]
+
+    def test_no_change(self):
+        diff = diff_layout(MIGLayout.parse('4x1g.10gb'), self.gi_status_list, self.ci_status_list)
+        self.assertTrue(diff.is_empty)
+        self.assertEqual(len(diff.keep), 4)
+
+    def test_keep_matching_instances(self):
+        diff = diff_layout(MIGLayout.parse('2x1g.10gb,2g.20gb:4'), self.gi_status_list, self.ci_status_list)
+        self.assertEqual([gi['gi_id'] for gi in diff.keep], [7, 8])
+        self.assertEqual([gi['gi_id'] for gi in diff.destroy], [9, 10])
+        self.assertEqual([spec.to_profile_str() for spec in diff.create], ['2g.20gb:4'])
+
+    def test_placement_constraint(self):
+        diff = diff_layout(MIGLayout.parse('1g.10gb:3,1g.10gb'), self.gi_status_list, self.ci_status_list)
+        self.assertEqual(sorted(gi['gi_id'] for gi in diff.keep), [7, 10])
+
+    def test_reset_compute_instances(self):
+        ci_status_list = self.ci_status_list[1:]
+        diff = diff_layout(MIGLayout.parse('4x1g.10gb'), self.gi_status_list, ci_status_list)
+        self.assertEqual([gi['gi_id'] for gi, _ in diff.reset_compute_instances], [7])
+        self.assertFalse(diff.destroy or diff.create)
+
+    def test_create_large_instances_first(self):
+        diff = diff_layout(MIGLayout.parse('1g.10gb,3g.40gb,2g.20gb'), list(), list())
+        self.assertEqual([spec.to_profile_str() for spec in diff.create], ['3g.40gb', '2g.20gb', '1g.10gb'])
+
+
+class MIGControllerReconcileTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.mig_controller = MIGController(backend=self.backend)
+        self.mig_controller.create_gpu_instance('1g.10gb,1g.10gb,1g.10gb', gpu_id=0, create_ci=True)
+        self.backend.calls.clear()
+
+    def test_batched_commands(self):
+        result = self.mig_controller.reconcile(0, '1g.10gb,2x2g.20gb')
+        self.assertEqual(self.backend.calls, [
+            ('destroy_compute_instance', {'gpu_id': 0, 'gi_id': '2,3', 'ci_ids': None}),
+            ('destroy_gpu_instance', {'gpu_id': 0, 'gi_ids': '2,3'}),
+            ('create_gpu_instance', {'gi_profiles': '2g.20gb:2,2g.20gb:4', 'gpu_id': 0, 'create_ci': True}),
+        ])
+        self.assertEqual([gi['gi_id'] for gi in result['kept']], [1])
+        self.assertEqual(
+            sorted(gi['name'] for gi in self.mig_controller.check_gpu_instance_status(gpu_id=0)),
+            ['MIG 1g.10gb', 'MIG 2g.20gb', 'MIG 2g.20gb'],
+        )
+
+    def test_noop(self):
+        result = self.mig_controller.reconcile(0, MIGLayout.parse('3x1g.10gb'))
+        self.assertTrue(result['diff'].is_empty)
+        self.assertEqual(self.backend.calls, [])
+
+    def test_custom_compute_instances(self):
+        layout = MIGLayout.from_config([{'gi_profile': '3g.40gb', 'ci_profiles': ['1c.3g.40gb', '2c.3g.40gb']}])
+        self.mig_controller.reconcile(0, layout)
+        ci_names = sorted(ci['name'] for ci in self.mig_controller.check_compute_instance_status(gpu_id=0))
+        self.assertEqual(ci_names, ['MIG 1c.3g.40gb', 'MIG 2c.3g.40gb'])
+        self.assertTrue(self.mig_controller.reconcile(0, layout, dry_run=True)['diff'].is_empty)
+
+    def test_external_change(self):
+        self.mig_controller.check_gpu_instance_status(gpu_id=0)
+        # reconfigured behind the controller, within the time-to-live of the cached snapshot
+        self.backend.destroy_compute_instance(gpu_id=0, gi_id=3)
+        self.backend.destroy_gpu_instance(gpu_id=0, gi_ids=3)
+        result = self.mig_controller.reconcile(0, '3x1g.10gb', dry_run=True)
+        self.assertEqual([spec.profile for spec in result['diff'].create], ['1g.10gb'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import stat
+import tempfile
+import unittest
+
+from migperf.controller.events import EventRecorder
+from migperf.controller.mps_controller import (
+    MPSControlSession, get_server_list, mig_profile_share, mps_client_env, send_mps_command,
+    set_active_thread_percentage, set_default_device_pinned_mem_limit,
+)
+
+# Stand-in control daemon in interactive mode: logs the commands, replies to the get_* commands and rejects
+# unknown commands
+MPS_CONTROL_SCRIPT = '''#!/bin/sh
+while read -r command; do
+  echo "$command" >> "{log}"
+  case "$command" in
+    get_server_list) echo 1234; echo 5678 ;;
+    get_client_list*) ;;
+    get_*active_thread_percentage*) echo 42.5 ;;
+    set_*9999*) echo "Error: no MPS server 9999" ;;
+    set_*|shutdown_server*) ;;
+    quit) exit 0 ;;
+    *) echo "Invalid command"; exit 1 ;;
+  esac
+done
+'''
+
+
+class MPSShareTest(unittest.TestCase):
+    def test_mig_profile_share(self):
+        self.assertEqual(mig_profile_share('1g.10gb', 'A100'),
+                         {'active_thread_percentage': 15, 'pinned_mem_limit': 9728})
+        self.assertEqual(mig_profile_share('MIG 7g.80gb', 'NVIDIA A100-SXM4-80GB')['active_thread_percentage'], 100)
+        self.assertEqual(mig_profile_share('2g.12gb', 'A30')['active_thread_percentage'], 50)
+        with self.assertRaisesRegex(ValueError, 'no profile'):
+            mig_profile_share('1g.10gb', 'A30')
+
+    def test_client_env(self):
+        env = mps_client_env(**mig_profile_share('3g.40gb', 'A100'))
+        self.assertEqual(env['CUDA_MPS_ACTIVE_THREAD_PERCENTAGE'], '43')
+        self.assertEqual(env['CUDA_MPS_PINNED_DEVICE_MEM_LIMIT'], '0=40192M')
+        env = mps_client_env(pinned_mem_limit='10G', gpu_ids=[2, 3])
+        self.assertEqual((env['CUDA_VISIBLE_DEVICES'], env['CUDA_MPS_PINNED_DEVICE_MEM_LIMIT']), ('2,3', '0=10G,1=10G'))
+        self.assertNotIn('CUDA_MPS_ACTIVE_THREAD_PERCENTAGE', env)
+        with self.assertRaises(ValueError):
+            mps_client_env(active_thread_percentage=0)
+        with self.assertRaises(ValueError):
+            mps_client_env(pinned_mem_limit='10GB')
+
+
+class MPSControlTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log = os.path.join(self.tmp_dir.name, 'commands.log')
+        executable = os.path.join(self.tmp_dir.name, 'nvidia-cuda-mps-control')
+        with open(executable, 'w') as f:
+            f.write(MPS_CONTROL_SCRIPT.format(log=self.log))
+        os.chmod(executable, os.stat(executable).st_mode | stat.S_IEXEC)
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.tmp_dir.name + os.pathsep + self.path
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        self.tmp_dir.cleanup()
+
+    def test_commands(self):
+        with EventRecorder() as recorder:
+            pids = get_server_list()
+            set_active_thread_percentage(pids[0], 42.5, gpu_ids=0)
+            set_default_device_pinned_mem_limit(0, 9728)
+        self.assertEqual(pids, [1234, 5678])
+        with open(self.log) as f:
+            self.assertEqual(f.read().splitlines(), [
+                'get_server_list', 'set_active_thread_percentage 1234 42.5',
+                'set_default_device_pinned_mem_limit 0 9728M',
+            ])
+        operation_events = [event for event in recorder.events if event['type'] == 'operation']
+        self.assertEqual([event['name'] for event in operation_events], [
+            'get_server_list', 'set_active_thread_percentage', 'set_default_device_pinned_mem_limit',
+        ])
+        self.assertEqual(operation_events[1]['gpu_id'], 0)
+
+    def test_invalid_command(self):
+        with self.assertRaisesRegex(ValueError, 'Invalid command'):
+            send_mps_command('unknown_command')
+
+    def test_session(self):
+        with MPSControlSession(gpu_ids=0, timeout=5) as session:
+            pids = session.get_server_list()
+            for pid in pids:
+                session.set_active_thread_percentage(pid, 50)
+                session.set_device_pinned_mem_limit(pid, 0, '10G')
+            self.assertEqual(session.get_active_thread_percentage(pids[0]), 42.5)
+            self.assertEqual(session.get_client_list(pids[0]), [])
+            stats = session.latency_stats()
+        self.assertTrue(session.closed)
+        self.assertEqual(pids, [1234, 5678])
+        self.assertEqual(stats['set_active_thread_percentage']['count'], 2)
+        probe = MPSControlSession.PROBE_COMMAND
+        with open(self.log) as f:
+            self.assertEqual(f.read().splitlines()[:6], [
+                'get_server_list', probe, 'set_active_thread_percentage 1234 50', probe,
+                'set_device_pinned_mem_limit 1234 0 10G', probe,
+            ])
+        with self.assertRaisesRegex(ValueError, 'closed'):
+            session.get_server_list()
+
+    def test_session_error(self):
+        with MPSControlSession(timeout=5) as session:
+            # the error is raised by the command causing it, the session goes on
+            with self.assertRaisesRegex(ValueError, 'no MPS server 9999'):
+                session.set_active_thread_percentage(9999, 50)
+            self.assertEqual(session.get_server_list(), [1234, 5678])
+
+        session = MPSControlSession(timeout=5)
+        self.addCleanup(session.close)
+        with self.assertRaisesRegex(ValueError, 'Invalid command'):
+            session.execute('unknown_command')
+        session._process.wait()
+        with self.assertRaisesRegex(ValueError, 'closed'):
+            session.get_server_list()
+        self.assertEqual(session.close(), 1)
+
+        with MPSControlSession() as session:
+            session.close(quit=True)
+        with open(self.log) as f:
+            self.assertEqual(f.read().splitlines()[-1], 'quit')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+
+from migperf.controller import FakeBackend, MIGController, MIGLayout, plan_placement
+from migperf.controller.planner import build_profile_placements
+
+
+class CountingFakeBackend(FakeBackend):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.num_queries = 0
+
+    def list_gpu_instance_profiles(self, gpu_id: int = None):
+        self.num_queries += 1
+        return super().list_gpu_instance_profiles(gpu_id)
+
+    def list_gpu_instance_possible_placements(self, gpu_id: int = None):
+        self.num_queries += 1
+        return super().list_gpu_instance_possible_placements(gpu_id)
+
+    def list_compute_instance_profiles(self, gpu_id: int = None, gi_id: int = None):
+        self.num_queries += 1
+        return super().list_compute_instance_profiles(gpu_id, gi_id)
+
+
+class PlanPlacementTest(unittest.TestCase):
+    def setUp(self):
+        self.mig_controller = MIGController(backend=FakeBackend())
+        self.profile_placements = self.mig_controller.get_profile_placements(0)
+
+    def test_valid_assignment(self):
+        plan = plan_placement(['3g.40gb', '2g.20gb', '1g.10gb', '1g.10gb'], self.profile_placements)
+        placements = [(spec.profile, start, size) for spec, start, size in plan.assignments]
+        self.assertEqual([size for _, _, size in placements], [4, 2, 1, 1])
+        # no overlapping slots
+        slots = [slot for _, start, size in placements for slot in range(start, start + size)]
+        self.assertEqual(len(slots), len(set(slots)))
+
+    def test_infeasible(self):
+        self.assertIsNone(plan_placement(['4g.40gb', '4g.40gb'], self.profile_placements))
+        self.assertIsNone(plan_placement(['3g.40gb'], self.profile_placements, occupied=[(2, 2), (4, 2)]))
+        self.assertIsNone(plan_placement(['7x1g.10gb', '1g.10gb'], self.profile_placements))
+        with self.assertRaises(ValueError):
+            plan_placement(['1g.5gb'], self.profile_placements)
+
+    def test_first_fit_is_not_enough(self):
+        # first-fit places 1g.10gb at 0, which leaves no room for 3 x 2g.20gb
+        plan = plan_placement(['1g.10gb', '2g.20gb', '2g.20gb', '2g.20gb'], self.profile_placements)
+        self.assertEqual(plan.assignments[0][1], 6)
+
+    def test_minimize_fragmentation(self):
+        # 1g.10gb next to the other one keeps room for a 3g.40gb
+        plan = plan_placement(['1g.10gb'], self.profile_placements, occupied=[(0, 1)])
+        self.assertEqual(plan.assignments[0][1:], (1, 1))
+        self.assertEqual(plan.fragmentation[0], -4)
+
+    def test_fixed_placement(self):
+        plan = plan_placement(['2g.20gb:4', '2g.20gb'], self.profile_placements)
+        self.assertEqual([start for _, start, _ in plan.assignments], [4, 0])
+        self.assertEqual(plan.to_layout(), MIGLayout.parse('2g.20gb:4,2g.20gb:0'))
+
+    def test_build_profile_placements(self):
+        profile_placements = build_profile_placements(
+            [{'name': 'MIG 3g.40gb', 'profile_id': 9, 'instances_total': 2}],
+            [{'profile_id': 9, 'placements': [{'start': 0, 'size': 4}, {'start': 4, 'size': 4}]}],
+        )
+        self.assertEqual(profile_placements['3g.40gb'].placements, ((0, 4), (4, 4)))
+        self.assertEqual(plan_placement(['9', '9'], profile_placements).fragmentation, (0, 0))
+
+
+class ReconcilePlanTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.mig_controller = MIGController(backend=self.backend)
+
+    def test_reject_before_mutation(self):
+        self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=0, create_ci=True)
+        self.backend.calls.clear()
+        with self.assertRaises(ValueError):
+            self.mig_controller.reconcile(0, '1g.10gb,7g.80gb', dry_run=True)
+        with self.assertRaises(ValueError):
+            self.mig_controller.reconcile(0, '2x4g.40gb')
+        self.assertEqual(self.backend.calls, [])
+
+    def test_replan_around_kept_instances(self):
+        # the kept 1g.10gb at 0 blocks the requested 3 x 2g.20gb, so it is moved
+        self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=0, create_ci=True)
+        self.mig_controller.reconcile(0, '1g.10gb,3x2g.20gb')
+        placements = sorted(
+            (gi['name'], gi['placement']['start']) for gi in self.mig_controller.check_gpu_instance_status(0)
+        )
+        self.assertEqual(placements, [('MIG 1g.10gb', 6), ('MIG 2g.20gb', 0), ('MIG 2g.20gb', 2), ('MIG 2g.20gb', 4)])
+
+    def test_profile_tables_cached(self):
+        backend = CountingFakeBackend(num_gpus=2)
+        mig_controller = MIGController(backend=backend)
+        mig_controller.create_gpu_instance('3g.40gb', gpu_id=0, create_ci=True)
+        profiles = mig_controller.list_gpu_instance_profiles()
+        self.assertEqual(len(profiles), 2 * len(FakeBackend.GI_PROFILES))
+        self.assertEqual(profiles[-1]['gpu_id'], 1)
+        self.assertNotIn('instances_free', profiles[0])
+        mig_controller.list_gpu_instance_profiles(0)
+        mig_controller.list_gpu_instance_possible_placements()
+        self.assertEqual(backend.num_queries, 2)
+
+        ci_profiles = mig_controller.list_compute_instance_profiles(0, gi_id=1)
+        self.assertEqual([(p['name'], p['default']) for p in ci_profiles],
+                         [('MIG 1c.3g.40gb', False), ('MIG 2c.3g.40gb', False), ('MIG 3g.40gb', True)])
+        mig_controller.create_gpu_instance('3g.40gb', gpu_id=0)
+        self.assertEqual(len(mig_controller.list_compute_instance_profiles(0)), 6)
+        self.assertEqual(backend.num_queries, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from migperf.controller import FakeBackend, MIGController
+from migperf.controller.inventory import DeviceInventory
+from migperf.profiler.utils.result_cache import ResultCache, client_run_config, device_context, run_key
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, 'cache')
+        self.config = {'client_args': {'bs': 8, 'model': 'resnet50'}, 'gpu_model': 'NVIDIA A100-SXM4-80GB'}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_put_and_restore(self):
+        cache = ResultCache(self.root)
+        self.assertIsNone(cache.get(self.config))
+        key = cache.put(self.config, {'result.json': {'qps': 10.5}})
+        # the key does not depend on the order of the items
+        reordered = {'gpu_model': 'NVIDIA A100-SXM4-80GB', 'client_args': {'model': 'resnet50', 'bs': 8}}
+        self.assertEqual(key, run_key(reordered))
+        self.assertEqual(cache.get(self.config)['files'], {'result.json': {'qps': 10.5}})
+        self.assertIsNone(cache.get({**self.config, 'gpu_model': 'NVIDIA A30'}))
+
+        paths = cache.restore(self.config, os.path.join(self.tmp_dir.name, 'results'))
+        self.assertEqual([path.name for path in paths], ['result.json'])
+        with open(paths[0]) as f:
+            self.assertEqual(json.load(f), {'qps': 10.5})
+        self.assertIsNone(cache.restore({}, self.tmp_dir.name))
+
+    def test_policies(self):
+        ResultCache(self.root).put(self.config, {'result.json': 1})
+        self.assertIsNone(ResultCache(self.root, 'refresh').get(self.config))
+        ResultCache(self.root, 'refresh').put(self.config, {'result.json': 2})
+        self.assertIsNone(ResultCache(self.root, 'off').put(self.config, {'result.json': 3}))
+        self.assertEqual(ResultCache(self.root).get(self.config)['files'], {'result.json': 2})
+        self.assertIsNone(ResultCache(self.root, max_age=0.).get(self.config))
+        with self.assertRaisesRegex(ValueError, 'Unknown cache policy'):
+            ResultCache(self.root, 'always')
+
+        with mock.patch.dict(os.environ, {'MIGPERF_RESULT_CACHE': self.root, 'MIGPERF_RESULT_CACHE_MAX_AGE': '60'}):
+            cache = ResultCache.from_env()
+            self.assertEqual((cache.policy, cache.max_age), ('use', 60.))
+            self.assertEqual(cache.env()['MIGPERF_RESULT_CACHE'], self.root)
+        with mock.patch.dict(os.environ, {'MIGPERF_RESULT_CACHE': ''}):
+            self.assertIsNone(ResultCache.from_env())
+
+    def test_invalidate(self):
+        cache = ResultCache(self.root)
+        for gpu_model in ('NVIDIA A30', 'NVIDIA A100-SXM4-80GB', 'NVIDIA H100 80GB HBM3'):
+            cache.put({**self.config, 'gpu_model': gpu_model}, {'result.json': gpu_model})
+        self.assertEqual(cache.invalidate(match={'gpu_model': 'NVIDIA A30'}), 1)
+        self.assertEqual(cache.invalidate(older_than=60.), 0)
+        time.sleep(0.01)
+        self.assertEqual(cache.invalidate(older_than=0.), 2)
+        self.assertEqual(list(cache.entries()), [])
+
+
+class RunConfigTest(unittest.TestCase):
+    def test_device_context(self):
+        backend = FakeBackend(num_gpus=2)
+        MIGController(backend=backend).reconcile(0, '3g.40gb,2x1g.10gb')
+        inventory = DeviceInventory(backend)
+        context = device_context(0, 1, inventory, env={'CUDA_MPS_ACTIVE_THREAD_PERCENTAGE': '15'})
+        self.assertEqual(context['mig_profile'], '1g.10gb')
+        self.assertEqual(context['sibling_layout'], '1g.10gb,1g.10gb,3g.40gb')
+        self.assertEqual(context['mps'], {'CUDA_MPS_ACTIVE_THREAD_PERCENTAGE': '15'})
+        self.assertEqual(context['gpu_model'], backend.list_devices()[0]['name'])
+        self.assertEqual(device_context(1, None, inventory, env={})['sibling_layout'], None)
+
+    def test_client_run_config(self):
+        args = argparse.Namespace(bs=[1, 2], model='resnet50', gpu_id=0, mig_device_id=None, database_name='a',
+                                  device_uuid='GPU-0', dry_run=False)
+        with mock.patch('migperf.profiler.utils.result_cache.device_context', return_value={'gpu_model': 'A30'}):
+            config = client_run_config(args, bs=2)
+            args.database_name = 'b'
+            self.assertEqual(run_key(config), run_key(client_run_config(args, bs=2)))
+        self.assertEqual(config['client_args'], {'bs': 2, 'model': 'resnet50'})
+        self.assertEqual(config['gpu_model'], 'A30')
+
+    def test_lazy_controller_import(self):
+        # the clients import the utilities without loading the controller package
+        code = (
+            'import sys, migperf.profiler.utils.misc, migperf.profiler.utils.result_cache; '
+            'print(any(name.startswith("migperf.controller") for name in sys.modules))'
+        )
+        output = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, encoding='utf-8', check=True)
+        self.assertEqual(output.stdout.strip(), 'False')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+from migperf.controller import FakeBackend, MIGController
+from migperf.controller.runner import config_gpu_device, job_command, job_env, run_job
+from migperf.profiler.utils.result_cache import ResultCache
+
+# Stand-in profiling job: reports its device and arguments as a result JSON, or sleeps
+JOB_SCRIPT = """import json, os, sys, time
+print('running on', os.environ['CUDA_VISIBLE_DEVICES'])
+if sys.argv[1:] == ['sleep']:
+    time.sleep(60)
+with open(os.path.join(os.environ['MIGPERF_RESULT_DIR'], 'result.json'), 'w') as f:
+    json.dump({'device': os.environ['CUDA_VISIBLE_DEVICES'], 'args': sys.argv[1:]}, f)
+sys.exit(int(sys.argv[1]) if sys.argv[1:] and sys.argv[1].isdigit() else 0)
+"""
+
+
+class BarrierFakeBackend(FakeBackend):
+    """Blocks :code:`enable_mig` until all GPUs are being configured at the same time."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.barrier = threading.Barrier(len(self.mig_status), timeout=5)
+
+    def enable_mig(self, gpu_id: int = None):
+        self.barrier.wait()
+        return super().enable_mig(gpu_id)
+
+
+def gpu_config(gpu_id: int, *gi_profiles):
+    return {'id': gpu_id, 'mig': True, 'mps': False, 'devices': [{'gi_profile': p} for p in gi_profiles]}
+
+
+class ConfigGPUDeviceTest(unittest.TestCase):
+    def test_concurrent(self):
+        backend = BarrierFakeBackend(num_gpus=4, mig_enabled=False)
+        mig_controller = MIGController(backend=backend)
+        summaries = config_gpu_device(
+            [gpu_config(gpu_id, '3g.40gb', '2g.20gb', '2g.20gb') for gpu_id in range(4)], mig_controller=mig_controller,
+        )
+        self.assertEqual([summary['gpu_id'] for summary in summaries], [0, 1, 2, 3])
+        self.assertTrue(all(summary['success'] for summary in summaries))
+        for gpu_id in range(4):
+            self.assertEqual(len(mig_controller.check_gpu_instance_status(gpu_id)), 3)
+
+    def test_collect_errors(self):
+        mig_controller = MIGController(backend=FakeBackend(num_gpus=3))
+        gpu_configs = [gpu_config(0, '7g.80gb'), gpu_config(1, '4g.40gb', '4g.40gb'), gpu_config(2, '1g.10gb')]
+        summaries = config_gpu_device(gpu_configs, mig_controller=mig_controller, raise_on_error=False)
+        self.assertEqual([summary['success'] for summary in summaries], [True, False, True])
+        self.assertIsInstance(summaries[1]['error'], ValueError)
+        self.assertIsNone(summaries[1]['reconcile'])
+        self.assertEqual(len(mig_controller.check_gpu_instance_status(2)), 1)
+
+        with self.assertRaisesRegex(ValueError, r'GPU \[1\] \(succeeded: \[0, 2\]\)'):
+            config_gpu_device(gpu_configs, mig_controller=mig_controller)
+
+    def test_mig_disabled(self):
+        mig_controller = MIGController(backend=FakeBackend())
+        config = gpu_config(0, '1g.10gb')
+        config['mig'] = False
+        summaries = config_gpu_device([config], mig_controller=mig_controller)
+        self.assertTrue(summaries[0]['success'])
+        self.assertEqual(mig_controller.backend.calls, [])
+
+
+class JobEnvTest(unittest.TestCase):
+    def test_mps_share(self):
+        config = {'id': 0, 'mig': False, 'mps': True, 'gpu_model': 'A100'}
+        env = job_env(config, {'mps_profile': '2g.20gb', 'pinned_mem_limit': '16G', 'job': 'cv_train'})
+        self.assertEqual(env['CUDA_MPS_ACTIVE_THREAD_PERCENTAGE'], '29')
+        self.assertEqual(env['CUDA_MPS_PINNED_DEVICE_MEM_LIMIT'], '0=16G')
+        env = job_env(config, {'mps_profile': '4g.24gb'}, gpu_model='A30')
+        self.assertEqual(env['CUDA_MPS_PINNED_DEVICE_MEM_LIMIT'], '0=24002M')
+
+        env = job_env({**config, 'mps': False}, {'mps_profile': '2g.20gb'})
+        self.assertNotIn('CUDA_MPS_ACTIVE_THREAD_PERCENTAGE', env)
+        with self.assertRaisesRegex(ValueError, 'GPU model'):
+            job_env({**config, 'gpu_model': None}, {'mps_profile': '2g.20gb'})
+
+
+class RunJobTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.entry_point = os.path.join(self.tmp_dir.name, 'job.py')
+        with open(self.entry_point, 'w') as f:
+            f.write(JOB_SCRIPT)
+        self.output_dir = os.path.join(self.tmp_dir.name, 'results')
+        self.mig_controller = MIGController(backend=FakeBackend(num_gpus=2))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def job(self, name: str, *args, **kwargs):
+        return {'name': name, 'entry_point': self.entry_point, 'args': list(args), **kwargs}
+
+    def test_run_job(self):
+        config = {
+            'gpus': [
+                {'id': 0, 'mig': True, 'mps': False, 'devices': [
+                    {'gi_profile': '1g.10gb', 'job': 'a'}, {'gi_profile': '3g.40gb', 'placement': 4, 'job': 'b'},
+                    {'gi_profile': '1g.10gb', 'job': 'a'}, {'gi_profile': '2g.20gb'},
+                ]},
+                {'id': 1, 'mig': False, 'mps': False, 'devices': [{'job': 'b'}]},
+            ],
+            'job_configs': [self.job('a'), self.job('b', '--batch-size', 32)],
+        }
+        summaries = run_job(config, self.mig_controller, output_dir=self.output_dir, stream_logs=False)
+        self.assertEqual([summary['name'] for summary in summaries], ['a-gpu0-0', 'b-gpu0-1', 'a-gpu0-2', 'b-gpu1-0'])
+        self.assertTrue(all(summary['error'] is None and summary['exit_code'] == 0 for summary in summaries))
+
+        devices = self.mig_controller.backend.list_devices()
+        mig_devices = {d['uuid']: d for d in devices[0]['mig_devices']}
+        self.assertEqual(len({summary['uuid'] for summary in summaries[:3]}), 3)
+        for summary in summaries[:3]:
+            self.assertEqual(summary['results'], [{'device': summary['uuid'], 'args': summary['command'][2:]}])
+            self.assertEqual(mig_devices[summary['uuid']]['mig_device_id'], summary['mig_device_id'])
+        gi = self.mig_controller.inventory.get_gpu_instance(0, mig_devices[summaries[1]['uuid']]['gi_id'])
+        self.assertEqual((gi['name'], gi['placement']['start']), ('MIG 3g.40gb', 4))
+        self.assertEqual(summaries[3]['results'][0], {'device': devices[1]['uuid'], 'args': ['--batch-size', '32']})
+        with open(summaries[3]['log']) as f:
+            self.assertEqual(f.read(), f'running on {devices[1]["uuid"]}\n')
+
+    def test_stale_results(self):
+        config = {
+            'gpus': [{'id': 0, 'mig': True, 'mps': False, 'devices': [{'gi_profile': '7g.80gb', 'job': 'a'}]}],
+            'job_configs': [self.job('a')],
+        }
+        result_dir = os.path.join(self.output_dir, 'a-gpu0-0')
+        os.makedirs(result_dir)
+        with open(os.path.join(result_dir, 'old.json'), 'w') as f:
+            f.write('{"stale": true}')
+        cache = ResultCache(os.path.join(self.tmp_dir.name, 'cache'))
+        summary, = run_job(config, self.mig_controller, self.output_dir, stream_logs=False, cache=cache)
+        self.assertEqual(summary['result_files'], [os.path.join(result_dir, 'result.json')])
+        self.assertEqual(summary['results'], [{'device': summary['uuid'], 'args': []}])
+        entry, = cache.entries()
+        self.assertEqual(list(entry['files']), ['result.json'])
+
+        # a result file rewritten by the next run is collected again
+        config['job_configs'][0]['args'] = ['--other']
+        summary, = run_job(config, self.mig_controller, self.output_dir, stream_logs=False)
+        self.assertEqual(summary['results'], [{'device': summary['uuid'], 'args': ['--other']}])
+
+    def test_failure_and_timeout(self):
+        config = {
+            'gpus': [{'id': 0, 'mig': True, 'mps': False, 'devices': [
+                {'gi_profile': '1g.10gb', 'job': 'ok'}, {'gi_profile': '1g.10gb', 'job': 'fail'},
+                {'gi_profile': '1g.10gb', 'job': 'hang'},
+            ]}],
+            'job_configs': [self.job('ok'), self.job('fail', 3), self.job('hang', 'sleep', timeout=0.5)],
+        }
+        summaries = run_job(config, self.mig_controller, self.output_dir, stream_logs=False, raise_on_error=False)
+        self.assertEqual([summary['exit_code'] for summary in summaries[:2]], [0, 3])
+        self.assertTrue(summaries[2]['timed_out'])
+        self.assertLess(summaries[2]['duration'], 30)
+        self.assertEqual([summary['error'] is None for summary in summaries], [True, False, False])
+
+        with self.assertRaisesRegex(ValueError, '2 of 3 jobs failed'):
+            run_job(config, self.mig_controller, self.output_dir, configure=False, stream_logs=False)
+
+    def test_result_cache(self):
+        config = {
+            'gpus': [
+                {'id': 0, 'mig': True, 'mps': False, 'devices': [
+                    {'gi_profile': '1g.10gb', 'job': 'a'}, {'gi_profile': '3g.40gb', 'job': 'b'},
+                ]},
+                {'id': 1, 'mig': True, 'mps': False, 'devices': [{'gi_profile': '7g.80gb', 'job': 'a'}]},
+            ],
+            'job_configs': [self.job('a'), self.job('b', 'fail')],
+        }
+        cache = ResultCache(os.path.join(self.tmp_dir.name, 'cache'))
+        summaries = run_job(config, self.mig_controller, self.output_dir, stream_logs=False, cache=cache)
+        self.assertEqual([summary['cached'] for summary in summaries], [False] * 3)
+        self.assertEqual(len(list(cache.entries())), 3)
+
+        # a resumed run does not launch any job
+        os.rename(self.entry_point, self.entry_point + '.bak')
+        summaries_ = run_job(config, self.mig_controller, self.output_dir, stream_logs=False, cache=cache)
+        self.assertEqual([summary['cached'] for summary in summaries_], [True] * 3)
+        self.assertEqual([summary['results'] for summary in summaries_], [summary['results'] for summary in summaries])
+
+        # changing a job re-runs all co-located jobs of its GPU
+        os.rename(self.entry_point + '.bak', self.entry_point)
+        config['job_configs'][1]['args'] = ['other']
+        summaries = run_job(config, self.mig_controller, self.output_dir, stream_logs=False, cache=cache)
+        self.assertEqual([summary['cached'] for summary in summaries], [False, False, True])
+        self.assertEqual(len(list(cache.entries())), 5)
+
+        # the jobs co-located with a failed job are not cached
+        config['job_configs'][0]['args'] = [3]
+        run_job(config, self.mig_controller, self.output_dir, stream_logs=False, raise_on_error=False, cache=cache)
+        self.assertEqual(len(list(cache.entries())), 5)
+
+    def test_plan_errors(self):
+        config = {
+            'gpus': [{'id': 0, 'mig': True, 'mps': False, 'devices': [{'gi_profile': '1g.10gb', 'job': 'missing'}]}],
+            'job_configs': [],
+        }
+        with self.assertRaisesRegex(ValueError, 'not defined'):
+            run_job(config, self.mig_controller, self.output_dir)
+        with self.assertRaisesRegex(ValueError, 'No MIG device 2g.20gb'):
+            config['gpus'][0]['devices'] = [{'gi_profile': '2g.20gb', 'job': 'missing'}]
+            run_job(config, self.mig_controller, self.output_dir, configure=False)
+
+    def test_job_command(self):
+        cmd = job_command({
+            'name': 'nlp_train', 'type': 'train', 'ml_task': 'sequence_classification', 'batch_size': 8,
+            'model': {'name': 'bert-base-cased'}, 'optimizer': {'lr': 0.01, 'momentum': 0.9}, 'max_train_steps': 10,
+            'seq_len': 128,
+        })
+        self.assertEqual(cmd[0], sys.executable)
+        self.assertTrue(cmd[1].endswith('train_nlp.py') and os.path.exists(cmd[1]))
+        self.assertEqual(cmd[2:], ['-b=8', '-m=bert-base-cased', '-n=10', '--lr=0.01', '--seq_len=128'])
+        cmd = job_command({
+            'name': 'cv_infer', 'type': 'inference', 'ml_task': 'image_classification', 'batch_size': [1, 8],
+            'model': {'name': 'resnet50'}, 'num_batches': 10000, 'adaptive': {'mean': 0.02, 'p99': 0.05},
+        })
+        self.assertEqual(cmd[2:], ['-b', '1', '8', '-m=resnet50', '-n=10000', '--adaptive', '--target', 'mean=0.02',
+                                   'p99=0.05'])
+        with self.assertRaisesRegex(ValueError, 'Unsupported job'):
+            job_command({'name': 'detect', 'type': 'train', 'ml_task': 'object_detection'})
+
+
+if __name__ == '__main__':
+    unittest.main()
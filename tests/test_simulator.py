@@ -0,0 +1,99 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+from migperf.controller import FakeBackend, MIGController, MIGLayout, NvidiaSMIBackend
+from migperf.controller.backend import SimulatedNvidiaSMIBackend
+from migperf.controller.simulator import GPU_MODELS, MIGSimulator, install_nvidia_smi
+from migperf.profiler.utils.misc import get_gpu_device_uuid, get_ids_from_mig_device_id
+
+
+class SimulatorParsingTest(unittest.TestCase):
+    """The rendered nvidia-smi outputs are parsed back to the simulator records."""
+
+    def test_profile_tables(self):
+        simulator = MIGSimulator(list(GPU_MODELS))
+        backend = SimulatedNvidiaSMIBackend(simulator)
+        for gpu_id, model in enumerate(GPU_MODELS.values()):
+            # a GPU instance of every size, to list every CI profile
+            for gi_profile in model.gi_profiles[::-1]:
+                if simulator.gpu_instance_profiles(gpu_id)[model.gi_profiles.index(gi_profile)]['instances_free']:
+                    simulator.create_gpu_instance(gpu_id, gi_profile.name)
+            self.assertEqual(backend.list_gpu_instance_profiles(gpu_id), simulator.gpu_instance_profiles(gpu_id))
+            self.assertEqual(backend.list_gpu_instance_possible_placements(gpu_id),
+                             simulator.gpu_instance_possible_placements(gpu_id))
+            self.assertEqual(backend.list_compute_instance_profiles(gpu_id),
+                             simulator.compute_instance_profiles(gpu_id))
+
+    def test_status_and_devices(self):
+        simulator = MIGSimulator(['A30', 'H100'])
+        backend = SimulatedNvidiaSMIBackend(simulator)
+        mig_controller = MIGController(backend=backend)
+        mig_controller.reconcile(0, MIGLayout.from_config([
+            {'gi_profile': '2g.12gb', 'ci_profiles': ['1c.2g.12gb', '1c.2g.12gb']}, {'gi_profile': '1g.6gb+me'},
+        ]))
+        mig_controller.reconcile(1, '3g.40gb,2x1g.20gb')
+        self.assertEqual(backend.check_gpu_instance_status(), simulator.gpu_instances())
+        self.assertEqual(backend.check_compute_instance_status(), simulator.compute_instances())
+        self.assertEqual(backend.list_devices(), simulator.devices())
+        self.assertEqual(len(backend.list_devices()[0]['mig_devices']), 3)
+        self.assertEqual(get_ids_from_mig_device_id(1, 2, backend=backend), (3, 0))
+
+        with self.assertRaisesRegex(ValueError, 'Insufficient Resources'):
+            mig_controller.create_gpu_instance('7g.80gb', gpu_id=1)
+        self.assertNotEqual(mig_controller.destroy_gpu_instance(gpu_id=1), 0)
+        self.assertEqual(len(mig_controller.check_gpu_instance_status(gpu_id=1)), 3)
+
+    def test_same_as_fake_backend(self):
+        fake_backend = FakeBackend(num_gpus=2)
+        backend = SimulatedNvidiaSMIBackend(MIGSimulator(['A100', 'A100']))
+        for b in (fake_backend, backend):
+            mig_controller = MIGController(backend=b)
+            mig_controller.reconcile(0, '4g.40gb,2g.20gb,1g.10gb')
+            mig_controller.reconcile(1, '3g.40gb,1g.10gb+me')
+            mig_controller.reconcile(0, '4g.40gb,3x1g.10gb')
+        self.assertEqual(backend.check_gpu_instance_status(), fake_backend.check_gpu_instance_status())
+        self.assertEqual(backend.check_compute_instance_status(), fake_backend.check_compute_instance_status())
+        self.assertEqual(backend.list_devices(), fake_backend.list_devices())
+
+    def test_mig_mode_pending(self):
+        simulator = MIGSimulator(['A100'], mig_enabled=False, reset_required=True)
+        backend = SimulatedNvidiaSMIBackend(simulator)
+        self.assertEqual(backend.enable_mig(gpu_id=0), 0)
+        self.assertEqual(backend.check_mig_status(gpu_id=0), (False, True))
+        with self.assertRaises(ValueError):
+            backend.create_gpu_instance('1g.10gb', gpu_id=0)
+        self.assertEqual(backend.run(['nvidia-smi', '-r', '-i', '0'])[0], 0)
+        self.assertEqual(backend.check_mig_status(gpu_id=0), (True, True))
+
+
+class NvidiaSMIShimTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmp_dir.name, 'state.json')
+        # the directory of the shim is created
+        self.executable = install_nvidia_smi(
+            os.path.join(self.tmp_dir.name, 'bin'), self.state_path, MIGSimulator(['A30', 'A30']),
+        )
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_state_across_processes(self):
+        MIGController(backend=NvidiaSMIBackend(executable=self.executable, sudo=False)).reconcile(1, '2x2g.12gb')
+        # a new backend (and device inventory) sees the state left by the previous commands
+        backend = NvidiaSMIBackend(executable=self.executable, sudo=False)
+        self.assertEqual([gi['name'] for gi in backend.check_gpu_instance_status(gpu_id=1)], ['MIG 2g.12gb'] * 2)
+        self.assertEqual(get_gpu_device_uuid(1, 1, backend=backend), MIGSimulator.load(self.state_path).devices()[1][
+            'mig_devices'][1]['uuid'])
+
+        output = subprocess.run(
+            [self.executable, 'mig', '-i', '1', '-cgi', '4g.24gb'], stdout=subprocess.PIPE, encoding='utf-8',
+        )
+        self.assertNotEqual(output.returncode, 0)
+        self.assertIn('Failed to create GPU instances', output.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from migperf.profiler.utils.sink import ChunkedColumnReader, ChunkedColumnSink, sink_from_env
+
+
+class ChunkedColumnSinkTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, 'run')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chunks(self):
+        with ChunkedColumnSink(self.directory, chunk_size=4) as sink:
+            for i in range(10):
+                row = {'time': float(i), 'latency': i / 100}
+                if i >= 6:
+                    # a column starting in the middle of a chunk
+                    row['power'] = 100. + i
+                sink.append(row)
+            # the full chunks are on disk, the last rows are buffered
+            self.assertEqual(len(ChunkedColumnReader(self.directory)), 8)
+            sink.update_attrs(labels={'gpu0': {'modelName': 'NVIDIA A30'}})
+
+        reader = ChunkedColumnReader(self.directory)
+        self.assertEqual(len(reader), 10)
+        self.assertEqual(len(list(reader.chunks())), 3)
+        self.assertEqual(reader.columns, ['time', 'latency', 'power'])
+        np.testing.assert_array_equal(reader.column('time'), np.arange(10.))
+        np.testing.assert_array_equal(reader.column('power'), [np.nan] * 6 + [106., 107., 108., 109.])
+        self.assertEqual(reader.attrs['labels']['gpu0']['modelName'], 'NVIDIA A30')
+        # the chunks are memory-mapped
+        self.assertIsInstance(next(reader.chunks()), np.memmap)
+
+    def test_append_after_crash(self):
+        sink = ChunkedColumnSink(self.directory, chunk_size=2)
+        for i in range(5):
+            sink.append({'time': float(i)})
+        # a crash while listing a chunk leaves a partial line, and an unlisted chunk file
+        with open(os.path.join(self.directory, 'chunks.jsonl'), 'a') as f:
+            f.write('{"file": "chunk-0000')
+        self.assertEqual(len(ChunkedColumnReader(self.directory)), 4)
+
+        with open(os.path.join(self.directory, 'chunks.jsonl')) as f:
+            lines = f.read().splitlines()
+        with open(os.path.join(self.directory, 'chunks.jsonl'), 'w') as f:
+            f.write('\n'.join(lines[:-1]) + '\n')
+        with ChunkedColumnSink(self.directory, chunk_size=2) as sink:
+            sink.append({'time': 10.})
+        np.testing.assert_array_equal(ChunkedColumnReader(self.directory).column('time'), [0., 1., 2., 3., 10.])
+
+    def test_flush_interval(self):
+        sink = ChunkedColumnSink(self.directory, chunk_size=1000, flush_interval=0)
+        sink.append({'latency': 0.01})
+        self.assertEqual(len(ChunkedColumnReader(self.directory)), 1)
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            ChunkedColumnSink(self.directory, chunk_size=0)
+        with self.assertRaisesRegex(ValueError, 'does not exist'):
+            ChunkedColumnReader(os.path.join(self.tmp_dir.name, 'missing'))
+
+    def test_sink_from_env(self):
+        with mock.patch.dict(os.environ, {'MIGPERF_METRIC_SINK': ''}):
+            self.assertIsNone(sink_from_env('latency'))
+        with mock.patch.dict(os.environ, {'MIGPERF_METRIC_SINK': self.tmp_dir.name}):
+            sink = sink_from_env('latency', chunk_size=8)
+        self.assertTrue(sink.directory.name.startswith('latency-'))
+        self.assertEqual(sink.chunk_size, 8)
+        sink.update_attrs(batch_size=1)
+        with open(sink.directory / 'attrs.json') as f:
+            self.assertEqual(json.load(f), {'batch_size': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
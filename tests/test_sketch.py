@@ -0,0 +1,116 @@
+import io
+import json
+import threading
+import unittest
+from contextlib import redirect_stderr
+
+import numpy as np
+
+from migperf.profiler.utils.sketch import (
+    AggregatorGroup, DDSketch, OnlineAggregator, ProgressReporter, RunningStats,
+)
+
+
+class RunningStatsTest(unittest.TestCase):
+    def test_merge(self):
+        values = np.random.default_rng(0).lognormal(-4, 0.5, 1000)
+        stats, left, right = RunningStats(), RunningStats(), RunningStats()
+        for i, value in enumerate(values):
+            stats.add(value)
+            (left if i < 300 else right).add(value)
+        left.merge(right)
+        for merged in (stats, left, RunningStats.from_dict(json.loads(json.dumps(left.to_dict())))):
+            self.assertEqual(merged.count, 1000)
+            self.assertAlmostEqual(merged.mean, values.mean(), places=12)
+            self.assertAlmostEqual(merged.std, values.std(), places=12)
+            self.assertEqual((merged.min, merged.max), (values.min(), values.max()))
+
+
+class DDSketchTest(unittest.TestCase):
+    def test_relative_accuracy(self):
+        values = np.random.default_rng(0).lognormal(-4, 1, 20000)
+        sketch = DDSketch(0.01)
+        for value in values:
+            sketch.add(value)
+        for q in (0.01, 0.5, 0.9, 0.99, 0.999):
+            expected = np.percentile(values, q * 100, method='lower')
+            self.assertLess(abs(sketch.quantile(q) - expected) / expected, 0.01)
+
+    def test_signs_and_merge(self):
+        values = np.concatenate([np.linspace(-5, 5, 101), np.zeros(10)])
+        sketches = [DDSketch(0.02), DDSketch(0.02)]
+        for i, value in enumerate(values):
+            sketches[i % 2].add(value)
+        sketches[0].merge(DDSketch.from_dict(json.loads(json.dumps(sketches[1].to_dict()))))
+        sketch = sketches[0]
+        self.assertEqual(sketch.count, len(values))
+        self.assertAlmostEqual(sketch.quantile(0), -5, delta=0.1)
+        self.assertEqual(sketch.quantile(0.5), 0.)
+        self.assertAlmostEqual(sketch.quantile(1), 5, delta=0.1)
+        with self.assertRaisesRegex(ValueError, 'different relative accuracies'):
+            sketch.merge(DDSketch(0.01))
+        with self.assertRaisesRegex(ValueError, 'must be in'):
+            sketch.quantile(1.5)
+
+    def test_collapse(self):
+        sketch = DDSketch(0.01, max_buckets=10)
+        for value in np.geomspace(1e-3, 1e3, 1000):
+            sketch.add(value)
+        self.assertEqual(len(sketch.positive), 10)
+        # the highest quantiles keep their accuracy
+        self.assertAlmostEqual(sketch.quantile(1), 1e3, delta=10)
+
+
+class AggregatorGroupTest(unittest.TestCase):
+    def test_threads_and_merge(self):
+        values = np.random.default_rng(1).lognormal(-4, 0.5, 8000)
+        group = AggregatorGroup()
+        threads = [
+            threading.Thread(target=lambda chunk: [group.add('latency', v) for v in chunk], args=(chunk,))
+            for chunk in np.split(values, 4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        summary = group.summary()['latency']
+        self.assertEqual(summary['count'], 8000)
+        self.assertAlmostEqual(summary['mean'], values.mean(), places=10)
+        self.assertLess(abs(summary['p99'] - np.percentile(values, 99)) / np.percentile(values, 99), 0.02)
+
+        # two load generators, merged from their results
+        first, second = AggregatorGroup(), AggregatorGroup()
+        for value in values[:5000]:
+            first.add_row({'latency': value, 'rtt': float('nan')})
+        for value in values[5000:]:
+            second.add('latency', value)
+        merged = AggregatorGroup.from_dict(json.loads(json.dumps(first.to_dict())))
+        merged.merge(AggregatorGroup.from_dict(second.to_dict()))
+        merged_summary = merged.summary()['latency']
+        for key in ('count', 'min', 'max', 'p50', 'p95', 'p99'):
+            self.assertEqual(merged_summary[key], summary[key])
+        self.assertAlmostEqual(merged_summary['mean'], summary['mean'], places=12)
+        self.assertEqual(merged.summary()['rtt'], {'count': 0})
+        flat = merged.flat_summary(['latency'])
+        self.assertEqual(list(flat), ['latency_mean', 'latency_std', 'latency_p50', 'latency_p95', 'latency_p99'])
+
+    def test_progress(self):
+        aggregator = OnlineAggregator()
+        reports = list()
+        reporter = ProgressReporter(lambda: aggregator.summary(), 0.02, reports.append)
+        reporter.start()
+        for i in range(1, 101):
+            aggregator.add(i / 1000)
+        reporter.stop()
+        self.assertEqual(reports[-1]['snapshot']['count'], 100)
+        self.assertEqual(reporter.reports, len(reports))
+
+        with redirect_stderr(io.StringIO()) as stderr:
+            ProgressReporter(lambda: {'count': 1}, 1).report()
+        self.assertEqual(json.loads(stderr.getvalue())['snapshot'], {'count': 1})
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            ProgressReporter(dict, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
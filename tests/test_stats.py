@@ -0,0 +1,135 @@
+import threading
+import unittest
+
+import numpy as np
+
+from migperf.profiler.utils.sketch import AggregatorGroup
+from migperf.profiler.utils.stats import (
+    AdaptiveStopping, StreamingBatchMeans, batch_means_interval, flat_summary, min_batch_length, parse_targets,
+    t_quantile,
+)
+
+
+def ar1_latencies(n: int, rho: float, sigma: float, seed: int = 0):
+    """Correlated latencies around 10ms: a log-normal AR(1) process."""
+    rng = np.random.default_rng(seed)
+    noise = rng.normal(0, sigma, n)
+    x = np.empty(n)
+    x[0] = noise[0]
+    for i in range(1, n):
+        x[i] = rho * x[i - 1] + noise[i]
+    return 0.01 * np.exp(x)
+
+
+class BatchMeansTest(unittest.TestCase):
+    def test_t_quantile(self):
+        for df, expected in ((5, 2.571), (9, 2.262), (29, 2.045), (1000, 1.962)):
+            self.assertAlmostEqual(t_quantile(0.975, df), expected, places=2)
+
+    def test_interval(self):
+        self.assertEqual((min_batch_length('mean'), min_batch_length('p95'), min_batch_length('p99')), (1, 100, 500))
+        self.assertIsNone(batch_means_interval(np.ones(4999), 'p99'))
+        with self.assertRaisesRegex(ValueError, 'Unknown statistic'):
+            batch_means_interval(np.ones(100), 'max')
+
+        # the interval covers the true mean in about 95% of the runs, though the samples are correlated
+        true_mean = 0.01 * np.exp(0.2 ** 2 / (1 - 0.8 ** 2) / 2)
+        covered = 0
+        for seed in range(100):
+            estimate, half_width = batch_means_interval(ar1_latencies(4000, 0.8, 0.2, seed), 'mean')
+            covered += abs(estimate - true_mean) <= half_width
+        self.assertGreaterEqual(covered, 85)
+
+    def test_adaptive_stopping(self):
+        def run(samples, **kwargs):
+            stopping = AdaptiveStopping(**kwargs)
+            for value in samples:
+                if stopping.add(value):
+                    break
+            return stopping.summary()
+
+        stable = run(ar1_latencies(100000, 0.5, 0.05), max_samples=100000)
+        noisy = run(ar1_latencies(100000, 0.9, 0.3), max_samples=100000)
+        self.assertEqual(stable['reason'], 'converged')
+        # p99 needs 10 batches of 500 samples
+        self.assertEqual(stable['num_samples'], 5000)
+        self.assertTrue(all(stable[statistic]['converged'] for statistic in ('mean', 'p95', 'p99')))
+        self.assertGreater(noisy['num_samples'], stable['num_samples'])
+
+        capped = run(ar1_latencies(1000, 0.9, 0.3), targets={'mean': 0.001}, max_samples=1000)
+        self.assertEqual((capped['reason'], capped['num_samples']), ('max_samples', 1000))
+        self.assertFalse(capped['mean']['converged'])
+        self.assertIsNone(run(np.ones(200), max_samples=200)['p99'])
+
+    def test_streaming_batch_means(self):
+        samples = ar1_latencies(20000, 0.5, 0.1)
+        batch_means = StreamingBatchMeans(num_batches=10)
+        for i, value in enumerate(samples):
+            batch_means.add(value)
+            self.assertLessEqual(len(batch_means.batches), 20)
+        self.assertEqual((len(batch_means), batch_means.batch_length), (20000, 1024))
+        estimate, half_width = batch_means.interval('mean')
+        self.assertAlmostEqual(estimate, np.mean(samples), places=12)
+        self.assertAlmostEqual(half_width, batch_means_interval(samples, 'mean')[1], delta=0.5 * half_width)
+        estimate, half_width = batch_means.interval('p99')
+        self.assertAlmostEqual(estimate, np.percentile(samples, 99), delta=0.01 * estimate)
+        self.assertAlmostEqual(half_width, batch_means_interval(samples, 'p99')[1], delta=0.5 * half_width)
+
+        self.assertIsNone(StreamingBatchMeans().interval('mean'))
+        with self.assertRaisesRegex(ValueError, 'not sketched'):
+            StreamingBatchMeans(percentiles=False).interval('p99')
+
+    def test_adaptive_stopping_without_samples(self):
+        stopping = AdaptiveStopping(max_samples=100000, keep_samples=False)
+        for value in ar1_latencies(100000, 0.5, 0.05):
+            if stopping.add(value):
+                break
+        summary = stopping.summary()
+        self.assertIsNone(stopping.samples)
+        self.assertEqual(summary['reason'], 'converged')
+        # p99 needs 10 batches of 512 samples, from the check after 5000 samples
+        self.assertEqual(summary['num_samples'], 5250)
+        self.assertTrue(all(summary[statistic]['converged'] for statistic in ('mean', 'p95', 'p99')))
+
+    def test_concurrent_add(self):
+        stopping = AdaptiveStopping({'mean': 0.01}, min_samples=1000, max_samples=10000)
+        samples = ar1_latencies(4000, 0.5, 0.1)
+
+        def sender(values):
+            for value in values:
+                if stopping.add(value):
+                    return
+
+        threads = [threading.Thread(target=sender, args=(samples[i::4],)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(stopping.stopped)
+        self.assertGreaterEqual(stopping.summary()['num_samples'], 1000)
+
+    def test_parse_targets(self):
+        self.assertEqual(parse_targets(['mean=0.02', 'p99.9=0.1']), {'mean': 0.02, 'p99.9': 0.1})
+        self.assertEqual(parse_targets('mean=0.02,p95=0.05'), {'mean': 0.02, 'p95': 0.05})
+        with self.assertRaisesRegex(ValueError, 'Invalid target'):
+            parse_targets(['p99'])
+        with self.assertRaisesRegex(ValueError, 'must be positive'):
+            AdaptiveStopping({'p99': 0})
+
+    def test_flat_summary(self):
+        latencies = ar1_latencies(10000, 0.5, 0.3)
+        flat = flat_summary({'latency': latencies, 'rtt': []})
+        self.assertEqual(flat['latency_p99'], np.percentile(latencies, 99))
+        self.assertEqual(flat['latency_std'], np.std(latencies))
+        self.assertTrue(np.isnan(flat['rtt_mean']))
+
+        # the sketches estimate the same statistics within their relative accuracy
+        aggregators = AggregatorGroup()
+        for latency in latencies:
+            aggregators.add('latency', latency)
+        for key, estimate in aggregators.flat_summary(['latency']).items():
+            self.assertAlmostEqual(estimate, flat[key], delta=0.02 * flat[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
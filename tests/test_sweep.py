@@ -0,0 +1,119 @@
+import itertools
+import os
+import tempfile
+import unittest
+
+from migperf.controller import FakeBackend, MIGController
+from migperf.controller.sweep import (
+    MPS_STATE, SweepGroup, TransitionCostModel, canonical_layout, expand_grid, group_runs, order_groups, plan_sweep,
+    run_sweep,
+)
+from tests.test_runner import JOB_SCRIPT
+
+
+class SweepPlanTest(unittest.TestCase):
+    def test_group_runs(self):
+        runs = expand_grid({
+            'sharing': ['mig', 'mps'], 'layout': ['4x1g.10gb', '1g.10gb,3g.40gb'], 'model': ['resnet50', 'vgg16'],
+            'batch_size': [1, 2, 4],
+        })
+        self.assertEqual(len(runs), 24)
+        self.assertEqual(runs[1], {'sharing': 'mig', 'layout': '4x1g.10gb', 'model': 'resnet50', 'batch_size': 2})
+
+        template = {'type': 'inference', 'ml_task': 'image_classification', 'num_batches': 100}
+        groups = group_runs(runs, template)
+        self.assertEqual([group.name for group in groups], [
+            'mig_1g.10gb,1g.10gb,1g.10gb,1g.10gb', 'mig_3g.40gb,1g.10gb', 'mps_1g.10gb,1g.10gb,1g.10gb,1g.10gb',
+            'mps_3g.40gb,1g.10gb',
+        ])
+        # one process per model, testing all batch sizes
+        self.assertEqual([job['name'] for job in groups[0].jobs], ['resnet50_bs1-2-4', 'vgg16_bs1-2-4'])
+        self.assertEqual(groups[0].jobs[0]['batch_size'], [1, 2, 4])
+        self.assertEqual(groups[0].jobs[1]['model'], {'name': 'vgg16'})
+        self.assertEqual(template, {'type': 'inference', 'ml_task': 'image_classification', 'num_batches': 100})
+
+        # the training scripts take a single batch size
+        groups = group_runs(runs, {'type': 'train', 'ml_task': 'image_classification', 'max_train_steps': 10})
+        self.assertEqual(len(groups[0].jobs), 6)
+        with self.assertRaisesRegex(ValueError, 'sharing mode'):
+            group_runs([{'sharing': 'time-slicing', 'layout': '7g.80gb'}], template)
+
+    def test_cost_model(self):
+        cost_model = TransitionCostModel()
+        self.assertEqual(cost_model.cost(('mig', '3g.40gb,1g.10gb'), ('mig', '3g.40gb,2g.20gb')), 4.)
+        self.assertEqual(cost_model.cost(('mig', 'empty'), MPS_STATE), 6.)
+        self.assertEqual(cost_model.cost(MPS_STATE, MPS_STATE), 0.)
+
+        cost_model = TransitionCostModel({
+            'by_transition': {'1g.10gb,3g.40gb -> 3g.40gb,2g.20gb': {'count': 3, 'mean': 0.5}},
+            'by_operation': {'create_gpu_instance': {'count': 3, 'mean': 10.}},
+        })
+        self.assertEqual(cost_model.cost(('mig', '3g.40gb,1g.10gb'), ('mig', '3g.40gb,2g.20gb')), 0.5)
+        self.assertEqual(cost_model.cost(('mig', 'empty'), ('mig', '7g.80gb')), 10.)
+
+    def test_order_groups(self):
+        layouts = ['7g.80gb', '4g.40gb', '4g.40gb,3g.40gb', '3g.40gb', '3g.40gb,3g.40gb', '2g.20gb,1g.10gb']
+        groups = [SweepGroup('mig', canonical_layout(layout)) for layout in layouts] + [SweepGroup('mps', 'empty')]
+        cost_model = TransitionCostModel()
+        ordered, cost = order_groups(groups, cost_model)
+        self.assertEqual(sorted(map(repr, ordered)), sorted(map(repr, groups)))
+
+        def path_cost(order):
+            states = [('mig', 'empty')] + [group.state for group in order]
+            return sum(cost_model.cost(a, b) for a, b in zip(states, states[1:]))
+
+        self.assertAlmostEqual(cost, path_cost(ordered))
+        self.assertAlmostEqual(cost, min(map(path_cost, itertools.permutations(groups))))
+        # the layouts one GPU instance apart are next to each other
+        self.assertIn({'4g.40gb', '4g.40gb,3g.40gb'}, [{a.layout, b.layout} for a, b in zip(ordered, ordered[1:])])
+
+        # greedy search on many groups is no worse than the given order
+        many = [SweepGroup('mig', canonical_layout(f'{n}x1g.10gb')) for n in range(1, 8)]
+        many += [SweepGroup('mig', canonical_layout(f'3g.40gb,{n}x1g.10gb')) for n in range(1, 4)]
+        many += [SweepGroup('mig', '7g.80gb'), SweepGroup('mps', 'empty')]
+        ordered, cost = order_groups(many, cost_model)
+        self.assertEqual(len(ordered), len(many))
+        self.assertLessEqual(cost, path_cost(many))
+
+    def test_plan_sweep(self):
+        plan = plan_sweep({
+            'job': {'type': 'inference', 'ml_task': 'image_classification', 'num_batches': 100},
+            'grid': {'layout': ['7g.80gb', '2x3g.40gb', '3g.40gb'], 'model': ['resnet50'], 'batch_size': [1, 8]},
+        }, start_layout='3g.40gb,3g.40gb')
+        self.assertEqual([group.layout for group in plan['groups']], ['3g.40gb,3g.40gb', '3g.40gb', '7g.80gb'])
+        self.assertEqual((plan['num_runs'], plan['num_jobs'], plan['cost']), (6, 3, 6.))
+
+
+class RunSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.entry_point = os.path.join(self.tmp_dir.name, 'job.py')
+        with open(self.entry_point, 'w') as f:
+            f.write(JOB_SCRIPT)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run_sweep(self):
+        backend = FakeBackend()
+        spec = {
+            'gpu_id': 0,
+            'job': {'entry_point': self.entry_point, 'args': ['--batch-size={batch_size}'], 'multi_batch_size': True},
+            'grid': {'layout': ['2x1g.10gb', '7g.80gb', '1g.10gb,1g.10gb'], 'rate': [10, 20], 'batch_size': [1, 2]},
+        }
+        records = run_sweep(spec, MIGController(backend=backend), os.path.join(self.tmp_dir.name, 'results'),
+                            stream_logs=False)
+        # the duplicated layouts are run once, the smaller reconfiguration first
+        self.assertEqual([(record['group'], record['job']) for record in records], [
+            ('mig_7g.80gb', '10_bs1-2'), ('mig_7g.80gb', '20_bs1-2'),
+            ('mig_1g.10gb,1g.10gb', '10_bs1-2'), ('mig_1g.10gb,1g.10gb', '20_bs1-2'),
+        ])
+        self.assertTrue(all(record['error'] is None for record in records))
+        self.assertEqual(len(records[2]['summaries']), 2)
+        self.assertEqual(records[2]['summaries'][0]['results'][0]['args'], ['--batch-size=1,2'])
+        # the GPU is partitioned once per layout
+        self.assertEqual([call[0] for call in backend.calls].count('create_gpu_instance'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
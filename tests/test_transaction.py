@@ -0,0 +1,104 @@
+import unittest
+
+from migperf.controller import FakeBackend, MIGController, MIGLayout
+from migperf.controller.runner import config_gpu_device
+
+
+class FailingFakeBackend(FakeBackend):
+    """Fails the n-th :code:`create_gpu_instance` call."""
+
+    def __init__(self, *args, fail_at: int = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fail_at = fail_at
+        self.num_creates = 0
+
+    def create_gpu_instance(self, gi_profiles: str, gpu_id: int = None, create_ci: bool = False):
+        self.num_creates += 1
+        if self.num_creates == self.fail_at:
+            raise ValueError('Failed to create GPU instance: injected failure')
+        return super().create_gpu_instance(gi_profiles, gpu_id, create_ci)
+
+
+class TransactionTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = FailingFakeBackend(num_gpus=2)
+        self.mig_controller = MIGController(backend=self.backend)
+        self.mig_controller.reconcile(0, MIGLayout.from_config([
+            {'gi_profile': '3g.40gb', 'placement': 4, 'ci_profiles': ['1c.3g.40gb', '2c.3g.40gb']},
+            {'gi_profile': '1g.10gb', 'placement': 1},
+        ]))
+        self.mig_controller.create_gpu_instance('2g.20gb', gpu_id=0)
+        self.before = self.mig_controller.snapshot_layout(0)
+
+    def test_snapshot(self):
+        self.assertEqual(self.before, MIGLayout.from_config([
+            {'gi_profile': '3g.40gb', 'placement': 4, 'ci_profiles': ['1c.3g.40gb', '2c.3g.40gb']},
+            {'gi_profile': '1g.10gb', 'placement': 1},
+            {'gi_profile': '2g.20gb', 'placement': 2, 'ci_profiles': []},
+        ]))
+
+    def test_rollback(self):
+        self.backend.fail_at = self.backend.num_creates + 3
+        with self.assertRaisesRegex(ValueError, 'injected failure'):
+            with self.mig_controller.transaction(0) as transaction:
+                self.mig_controller.destroy_compute_instance(gpu_id=0)
+                self.mig_controller.destroy_gpu_instance(gpu_id=0)
+                for _ in range(5):
+                    self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=0, create_ci=True)
+        self.assertTrue(transaction.rolled_back)
+        self.assertEqual([record['operation'] for record in transaction.mutations],
+                         ['destroy_compute_instance', 'destroy_gpu_instance'] + ['create_gpu_instance'] * 3)
+        self.assertIsInstance(transaction.mutations[-1]['error'], ValueError)
+        self.assertEqual(self.mig_controller.snapshot_layout(0), self.before)
+
+    def test_rollback_mig_mode(self):
+        self.backend.disable_mig(gpu_id=1)
+        with self.assertRaises(RuntimeError):
+            with self.mig_controller.transaction(1):
+                self.mig_controller.enable_mig(gpu_id=1)
+                self.mig_controller.create_gpu_instance('7g.80gb', gpu_id=1)
+                raise RuntimeError()
+        self.assertEqual(self.mig_controller.check_mig_status(gpu_id=1), (False, False))
+        self.assertEqual(self.mig_controller.check_gpu_instance_status(gpu_id=1), [])
+
+    def test_no_rollback(self):
+        with self.mig_controller.transaction(0) as transaction:
+            self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=0)
+        self.assertFalse(transaction.rolled_back)
+        self.assertEqual(len(self.mig_controller.check_gpu_instance_status(0)), 4)
+
+        # the failure happens before any change, so the rollback changes nothing
+        # and the operation on the other GPU is not recorded
+        self.backend.calls.clear()
+        with self.assertRaises(ValueError):
+            with self.mig_controller.transaction(0) as transaction:
+                self.mig_controller.create_gpu_instance('1g.10gb', gpu_id=1)
+                self.mig_controller.reconcile(0, '7g.80gb,1g.10gb')
+        self.assertEqual(transaction.mutations, [])
+        self.assertEqual([call[0] for call in self.backend.calls], ['create_gpu_instance'])
+
+    def test_dry_run(self):
+        with self.mig_controller.transaction(0) as transaction:
+            result = self.mig_controller.reconcile(0, '7g.80gb', dry_run=True)
+        self.assertEqual(len(result['destroyed']), 3)
+        self.assertEqual(transaction.mutations, [])
+
+        with self.mig_controller.transaction(0) as transaction:
+            self.mig_controller.reconcile(0, '3g.40gb,1g.10gb,1g.10gb')
+        self.assertEqual([record['operation'] for record in transaction.mutations],
+                         ['destroy_compute_instance', 'destroy_gpu_instance', 'create_compute_instance',
+                          'create_gpu_instance'])
+
+    def test_config_gpu_device_rollback(self):
+        self.backend.fail_at = self.backend.num_creates + 1
+        summaries = config_gpu_device(
+            [{'id': 0, 'mig': True, 'mps': False, 'devices': [{'gi_profile': '7g.80gb'}]}],
+            mig_controller=self.mig_controller, raise_on_error=False,
+        )
+        self.assertFalse(summaries[0]['success'])
+        self.assertTrue(summaries[0]['rolled_back'])
+        self.assertEqual(self.mig_controller.snapshot_layout(0), self.before)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from migperf.controller import FakeBackend, MIGController
+from migperf.controller.runner import PACKAGE_ROOT
+from migperf.controller.work_queue import WorkQueue, Worker, submit_sweep
+from tests.test_runner import JOB_SCRIPT
+
+
+class WorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.queue = WorkQueue(os.path.join(self.tmp_dir.name, 'queue.db'), lease_timeout=60.)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_claim_and_lease(self):
+        task_ids = [self.queue.put('s', 'mig', layout, 'job', {}) for layout in ('7g.80gb', '3g.40gb', '1g.10gb')]
+        # the cheapest accepted task is claimed
+        task = self.queue.claim('w1', accept=lambda t: t['layout'] != '3g.40gb', cost=lambda t: -t['id'])
+        self.assertEqual((task['id'], task['status'], task['attempts']), (task_ids[2], 'running', 1))
+        task = self.queue.claim('w2')
+        self.assertEqual(task['id'], task_ids[0])
+        self.assertEqual(self.queue.claim('w3', accept=lambda t: t['layout'] != '3g.40gb'), None)
+
+        self.assertTrue(self.queue.complete(task_ids[2], 'w1', {'ok': True}))
+        self.assertFalse(self.queue.complete(task_ids[0], 'w1', {'ok': True}))
+        self.assertTrue(self.queue.fail(task_ids[0], 'w2', 'boom'))
+        self.assertEqual(self.queue.counts(), {'pending': 1, 'running': 0, 'done': 1, 'failed': 1})
+        self.assertEqual(self.queue.tasks('done')[0]['result'], {'ok': True})
+        self.assertEqual(self.queue.retry(), 1)
+        self.assertEqual(self.queue.counts()['pending'], 2)
+
+    def test_lease_expiry(self):
+        queue = WorkQueue(self.queue.path, lease_timeout=0.1, max_attempts=2)
+        task_id = queue.put('s', 'mig', '7g.80gb', 'job', {})
+        self.assertEqual(queue.claim('crashed')['id'], task_id)
+        self.assertIsNone(queue.claim('w2'))
+        time.sleep(0.15)
+        # the task of a crashed worker is taken over, and the crashed worker cannot commit any more
+        self.assertFalse(queue.renew(task_id, 'crashed'))
+        task = queue.claim('w2')
+        self.assertEqual((task['worker'], task['attempts']), ('w2', 2))
+        self.assertTrue(queue.renew(task_id, 'w2'))
+        self.assertFalse(queue.complete(task_id, 'crashed', {}))
+
+        time.sleep(0.15)
+        self.assertIsNone(queue.claim('w3'))
+        self.assertEqual(queue.tasks()[0]['status'], 'failed')
+        self.assertEqual(queue.tasks()[0]['error'], 'Lease expired')
+
+
+class WorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.entry_point = os.path.join(self.tmp_dir.name, 'job.py')
+        with open(self.entry_point, 'w') as f:
+            f.write(JOB_SCRIPT)
+        self.queue = WorkQueue(os.path.join(self.tmp_dir.name, 'queue.db'))
+        self.output_dir = os.path.join(self.tmp_dir.name, 'results')
+        self.spec = {
+            'job': {'entry_point': self.entry_point, 'args': ['--rate={rate}']},
+            'grid': {'layout': ['7g.80gb', '2x1g.10gb', '2x2g.12gb'], 'rate': [10, 20, 30]},
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_worker(self):
+        submit_sweep(self.queue, self.spec, 'test')
+        self.assertEqual(self.queue.counts()['pending'], 9)
+        backend = FakeBackend()
+        worker = Worker(self.queue, MIGController(backend=backend), output_dir=self.output_dir, stream_logs=False)
+        self.assertEqual(worker.run(exit_when_empty=True), 6)
+        # the A30 layouts do not fit on an A100
+        self.assertEqual(self.queue.counts(), {'pending': 3, 'running': 0, 'done': 6, 'failed': 0})
+        self.assertEqual({task['layout'] for task in self.queue.tasks('pending')}, {'2g.12gb,2g.12gb'})
+        # the jobs of a layout are run one after another, the GPU is partitioned once per layout
+        self.assertEqual([call[0] for call in backend.calls].count('create_gpu_instance'), 2)
+
+        results = self.queue.tasks('done')
+        summaries = results[0]['result']['summaries']
+        self.assertEqual(summaries[0]['results'][0]['args'], [f'--rate={results[0]["job"]}'])
+        self.assertTrue(os.path.exists(summaries[0]['log']))
+
+    def test_worker_processes(self):
+        submit_sweep(self.queue, self.spec, 'test')
+        workers = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'migperf.controller.work_queue', '--queue', self.queue.path, 'worker',
+                 '--backend', 'fake', '--gpu-model', gpu_model, '-o', self.output_dir, '--exit',
+                 '--poll-interval', '0.1'],
+                cwd=str(PACKAGE_ROOT), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+            for gpu_model in ('A100', 'A100', 'A30')
+        ]
+        for worker in workers:
+            _, stderr = worker.communicate(timeout=120)
+            self.assertEqual(worker.returncode, 0, stderr)
+        self.assertEqual(self.queue.counts(), {'pending': 0, 'running': 0, 'done': 9, 'failed': 0})
+        tasks = self.queue.tasks()
+        self.assertEqual({task['worker'].split('-')[-1] for task in tasks}, {'gpu0'})
+        # only the A30 worker runs the A30 layout
+        a30_workers = {task['worker'] for task in tasks if task['layout'] == '2g.12gb,2g.12gb'}
+        self.assertEqual(len(a30_workers), 1)
+        self.assertTrue(a30_workers.isdisjoint(task['worker'] for task in tasks if task['layout'] != '2g.12gb,2g.12gb'))
+
+
+if __name__ == '__main__':
+    unittest.main()